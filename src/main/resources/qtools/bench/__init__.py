@@ -0,0 +1,26 @@
+"""
+Micro-benchmarks for QTools computational hot paths.
+
+These are not part of the test suite; each module can be run directly
+(python -m qtools.bench.<module>) and prints timings of the optimized
+implementation against the implementation it replaces.
+"""
+import timeit
+
+def best_time(func, repeat=3, number=1):
+    """
+    Return the best per-call wall time of func, in seconds.
+    """
+    timer = timeit.Timer(func)
+    return min(timer.repeat(repeat=repeat, number=number))/number
+
+def report(label, baseline, optimized, repeat=3, number=1):
+    """
+    Time the baseline and optimized callables and print a comparison
+    line.  Returns the (baseline, optimized) best times.
+    """
+    base_time = best_time(baseline, repeat=repeat, number=number)
+    opt_time = best_time(optimized, repeat=repeat, number=number)
+    speedup = base_time/opt_time if opt_time > 0 else float('inf')
+    print "%-40s baseline %10.5fs  optimized %10.5fs  (%.1fx)" % (label, base_time, opt_time, speedup)
+    return base_time, opt_time
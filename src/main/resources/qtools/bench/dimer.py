@@ -0,0 +1,43 @@
+"""
+Benchmark pool primer-dimer scoring against pairwise maximal_binding_seq
+over synthetic multiplex panels.
+"""
+import random
+
+from qtools.bench import report
+from qtools.lib.bio import maximal_binding_seq
+from qtools.lib.dimer import pool_maximal_binding
+
+def random_oligo(rand, min_len=18, max_len=30):
+    return ''.join([rand.choice('ACGT') for i in range(rand.randint(min_len, max_len))])
+
+def multiplex_panel(assays, seed=0):
+    """
+    Make a panel of (forward, reverse, probe) oligos for the specified
+    number of assays.
+    """
+    rand = random.Random(seed)
+    return [random_oligo(rand) for i in range(3*assays)]
+
+def pairwise(oligos):
+    results = []
+    for o1 in oligos:
+        row = []
+        for o2 in oligos:
+            try:
+                row.append(maximal_binding_seq(o1, o2))
+            except IndexError:
+                row.append(None)
+        results.append(row)
+    return results
+
+def main():
+    for assays in (4, 12, 32, 96):
+        panel = multiplex_panel(assays)
+        assert pairwise(panel) == pool_maximal_binding(panel)
+        report("%d-plex panel (%d oligos)" % (assays, len(panel)),
+               lambda: pairwise(panel),
+               lambda: pool_maximal_binding(panel))
+
+if __name__ == '__main__':
+    main()
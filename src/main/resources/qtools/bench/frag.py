@@ -0,0 +1,71 @@
+"""
+Benchmark the batched fragmentation estimate against the per-step
+gcAB grid search it replaced, over a synthetic 96-well plate.
+"""
+import numpy as np
+
+from qtools.bench import report
+from qtools.lib.nstats.frag import FRAG_GRID_STEPS, prob_of_frag_batch, _frag_rank_deficient, _frag_intervals
+
+def step_search_prob_of_frag(fampos_vicneg, fampos_vicpos, famneg_vicneg, famneg_vicpos, total_events):
+    """
+    The original prob_of_frag: one 2x2 error evaluation per grid step.
+    """
+    if _frag_rank_deficient(fampos_vicneg, fampos_vicpos, famneg_vicneg, famneg_vicpos):
+        return None
+
+    H = np.array([[fampos_vicneg*1., fampos_vicpos*1.],
+                  [famneg_vicneg*1., famneg_vicpos*1.]])
+    estN = np.sum(H.flatten())
+    i_p = H/estN
+    i_cAorAB = -np.log(1 - (i_p[0,1] + i_p[1,1]))
+    i_cBorAB = -np.log(1 - (i_p[0,0] + i_p[0,1]))
+    maxVal = min(i_cAorAB, i_cBorAB)
+    delta = maxVal/float(FRAG_GRID_STEPS)
+
+    errArr = []
+    gcABArr = []
+    gp = np.zeros((2, 2))
+    for gcAB in np.arange(0, maxVal, delta):
+        gpA = 1 - np.exp(-(i_cAorAB - gcAB))
+        gpB = 1 - np.exp(-(i_cBorAB - gcAB))
+        gpAB = 1 - np.exp(-gcAB)
+        gp[1,0] = (1 - gpA) * (1 - gpB) * (1 - gpAB)
+        gp[1,1] = gpA * (1 - gpB) * (1 - gpAB)
+        gp[0,0] = (1 - gpA) * gpB * (1 - gpAB)
+        gp[0,1] = 1 - gp[1,0] - gp[1,1] - gp[0,0]
+        errArr.append(np.sqrt(np.sum((H.flatten() - (gp*estN).flatten())**2)))
+        gcABArr.append(gcAB)
+
+    estAB = gcABArr[np.argmin(errArr)]
+    return _frag_intervals(estN, i_cAorAB, i_cBorAB, estAB, total_events)
+
+def synthetic_plate(wells=96, seed=0):
+    """
+    Make cluster counts for a plate of linked-template wells at a range
+    of concentrations.
+    """
+    rand = np.random.RandomState(seed)
+    counts = []
+    for i in range(wells):
+        events = rand.randint(8000, 16000)
+        lam_a, lam_b, lam_ab = rand.uniform(0.01, 1.5, 3)
+        a = rand.poisson(lam_a, events) > 0
+        b = rand.poisson(lam_b, events) > 0
+        ab = rand.poisson(lam_ab, events) > 0
+        fam, vic = a | ab, b | ab
+        counts.append((int(np.sum(fam & ~vic)), int(np.sum(fam & vic)),
+                       int(np.sum(~fam & ~vic)), int(np.sum(~fam & vic))))
+    return counts
+
+def main():
+    for wells in (96, 384):
+        counts = synthetic_plate(wells)
+        events = [sum(c) for c in counts]
+        baseline = lambda: [step_search_prob_of_frag(*(c+(e,))) for c, e in zip(counts, events)]
+        optimized = lambda: prob_of_frag_batch(counts, events)
+        assert repr(baseline()) == repr(optimized())
+        report("%d-well plate fragmentation" % wells, baseline, optimized)
+
+if __name__ == '__main__':
+    main()
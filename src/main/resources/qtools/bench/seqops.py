@@ -0,0 +1,46 @@
+"""
+Benchmark the translate-table sequence primitives against the original
+regex-callback helpers from qtools.lib.bio, on megabase inputs.
+"""
+import random, re
+
+from qtools.bench import report
+from qtools.lib import seqops
+
+# the original qtools.lib.bio implementations, kept as the baseline
+COMPLIMENTS = {'A': 'T', 'T': 'A', 'C': 'G', 'G': 'C', 'U': 'A',
+               'a': 't', 't': 'a', 'c': 'g', 'g': 'c', 'u': 'a', '?': '?'}
+BASE_RE = re.compile(r'[ATCGU\?atcgux]')
+CG_CONTENT_RE = re.compile(r'[CG]')
+
+def regex_complement(sequence):
+    return re.sub(BASE_RE, lambda m: COMPLIMENTS[m.group(0)], sequence.upper())
+
+def regex_reverse_complement(sequence):
+    return regex_complement(sequence[::-1])
+
+def regex_gc_content(seq):
+    upseq = seq.strip().upper()
+    return float(len(CG_CONTENT_RE.findall(upseq)))/len(upseq)
+
+def random_sequence(length, seed=0):
+    rand = random.Random(seed)
+    return ''.join([rand.choice('ACGT') for i in xrange(length)])
+
+def main():
+    for length in (1000, 100000, 1000000, 5000000):
+        seq = random_sequence(length)
+        assert regex_reverse_complement(seq) == seqops.reverse_complement(seq)
+        report("reverse_complement %d bp" % length,
+               lambda: regex_reverse_complement(seq),
+               lambda: seqops.reverse_complement(seq))
+        report("gc_content %d bp" % length,
+               lambda: regex_gc_content(seq),
+               lambda: seqops.gc_content(seq))
+        arr = seqops.as_bytes(seq)
+        report("reverse_complement_array %d bp" % length,
+               lambda: regex_reverse_complement(seq),
+               lambda: seqops.reverse_complement_array(arr))
+
+if __name__ == '__main__':
+    main()
@@ -5,8 +5,11 @@ from qtools.lib.platescan import scan_plates, trigger_plate_rescan
 from qtools.lib.platesetup import generate_daily_setups, generate_custom_setup
 from qtools.lib.storage import QLBImageSource, QLBPlateSource, QLStorageSource
 from qtools.lib.qlb_factory import get_plate
-from qtools.lib.dropletgen import DGLogSource, read_dg_log
-from qtools.model import Session, QLBPlate, QLBWellChannel, Plate, PlateTemplate, PlateSetup, DropletGenerator, DropletGeneratorRun, Box2
+from qtools.lib.dropletgen import DGLogSource, DGLogIndex
+from qtools.lib.statsrollup import backfill_run_stats
+from qtools.lib.carryover import update_carryover
+from qtools.lib.spc import western_electric_violations, describe_violations, MIN_BASELINE_POINTS
+from qtools.model import Session, QLBPlate, QLBWellChannel, Plate, PlateTemplate, PlateSetup, DropletGenerator, DropletGeneratorRun, Box2, ControlLimitBaseline
 from qtools.model.sequence import SequenceGroup
 
 from sqlalchemy import desc, and_, func
@@ -36,6 +39,70 @@ class UpdatePlatesCommand(QToolsCommand):
         scan_plates(source, image_source)
 
 
+class BackfillRunStatsCommand(QToolsCommand):
+    """
+    Rebuilds the plate and reader/day run statistics rollups
+    read by the stats pages from the scanned wells.  Run once
+    to count plates scanned before the rollups existed;
+    update-plates keeps them up to date after that.
+    """
+    summary = "Rebuilds the reader utilization statistics rollups."
+    usage = "paster --plugin=qtools backfill-run-stats [config]"
+
+    def command(self):
+        self.load_wsgi_app()
+        num_plates = backfill_run_stats()
+        Session.commit()
+        print "Rolled up run statistics for %s plates" % num_plates
+
+
+class AnalyzeCarryoverCommand(QToolsCommand):
+    """
+    Records the carryover wells (NTC and empty wells run
+    after high-concentration wells) run on each reader since
+    the last time this was run.  The first run analyzes
+    the entire history.
+    """
+    summary = "Finds carryover wells in the reader run history."
+    usage = "paster --plugin=qtools analyze-carryover [config]"
+
+    def command(self):
+        self.load_wsgi_app()
+        box2_ids = [box2.id for box2 in Session.query(Box2).filter(Box2.fileroot != 'archive')]
+        found = update_carryover(box2_ids)
+        Session.commit()
+        print "Recorded %s carryover wells" % found
+
+
+class UpdateControlLimitsCommand(QToolsCommand):
+    """
+    Merges the plates run since the last update into the
+    control limit baseline of every QC chart that has been
+    drawn, and reports the new points that violate a
+    Western Electric rule against the limits as they were
+    before the update.
+    """
+    summary = "Updates QC chart control limits with new plates."
+    usage = "paster --plugin=qtools update-control-limits [config]"
+
+    def command(self):
+        self.load_wsgi_app()
+        from qtools.lib.trendquery import update_chart_baseline
+
+        for baseline in Session.query(ControlLimitBaseline).order_by(ControlLimitBaseline.id).all():
+            center, sigma = baseline.mean, baseline.std
+            enough_points = baseline.num_points >= MIN_BASELINE_POINTS
+            points = update_chart_baseline(baseline)
+            Session.commit()
+            if not (points and enough_points):
+                continue
+
+            violations = western_electric_violations([tup[0] for tup in points], center, sigma)
+            for (stat, dt, id, name, DR), flags in zip(points, violations):
+                if flags:
+                    print "%s: %s %s (%s): %s" % (baseline.metric, name, stat, dt, ', '.join(describe_violations(flags)))
+
+
 @WarnBeforeRunning("You probably don't want to do this.  Read the docs before running.")
 class LinkQLBPlatesCommand(QToolsCommand):
     """
@@ -273,22 +340,11 @@ class ReadDropletGeneratorLogsCommand(QToolsCommand):
         top_folders = app.config['qlb.top_dg_folders']
         source = DGLogSource(root, top_folders)
 
-        min_file_dict = dict(Session.query(DropletGeneratorRun.dirname,
-                                      func.max(DropletGeneratorRun.basename).label('last_file')).\
-                                group_by(DropletGeneratorRun.dirname).all())
-        
         min_file_prefix = '2011-03-21'
 
         dgs = Session.query(DropletGenerator).all()
         dg_ids = [dg.id for dg in dgs]
 
-        for dirname, basename in source.path_iter(min_file_name=min_file_prefix, min_file_dict=min_file_dict):
-            print dirname, basename
-            dg_run = read_dg_log(source.full_path(dirname, basename))
-            if not dg_run:
-                continue
-            dg_run.dirname = dirname
-            dg_run.basename = basename
-            if dg_run.droplet_generator_id in dg_ids:
-                Session.add(dg_run)
-                Session.commit()
+        index = DGLogIndex(source, Session, droplet_generator_ids=dg_ids)
+        read = index.update(min_file_name=min_file_prefix)
+        print "Read %s droplet generator logs" % read
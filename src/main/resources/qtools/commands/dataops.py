@@ -13,6 +13,7 @@ from . import QToolsCommand, WarnBeforeRunning
 
 from qtools.lib.webservice.neb import read_neb_enzyme_price_list, read_neb_buffer_list, NEBEnzymeSource
 from qtools.lib.webservice.ucsc import get_rebase_records
+from qtools.lib.ispcr import build_genome_index
 
 @WarnBeforeRunning("This will reset live database state by deleting plate tags.")
 class ResetPlateTagsCommand(QToolsCommand):
@@ -715,3 +716,21 @@ class BulkLoadAssayCommand(QToolsCommand):
 
     def __assay_sequence(self, toks):
         return toks[1].upper()
+
+
+class BuildGenomeIndexCommand(QToolsCommand):
+    """
+    Builds the local genome index used for sequence lookups in place of
+    UCSC (see qtools.lib.ispcr).  Point qtools.genome_index at the index
+    directory once it is built; running web and worker processes pick up
+    a rebuilt index on restart.
+    """
+    summary = "Indexes a genome FASTA for local in-silico PCR."
+    usage = "paster --plugin=qtools build-genome-index [fasta path] [index dir] [config]"
+    min_args = 2
+
+    def command(self):
+        fasta_path = self.args[0]
+        index_dir = self.args[1]
+        chromosomes = build_genome_index(fasta_path, index_dir)
+        print "Indexed %s chromosomes into %s." % (len(chromosomes), index_dir)
@@ -1,3 +1,5 @@
+import os
+
 from pyqlb.nstats.peaks import cluster_1d
 from pyqlb.nstats.well import well_channel_automatic_classification, accepted_peaks
 from pyqlb.objects import QLWell
@@ -284,7 +286,29 @@ class BackfillNTCPositivesCommand(BackfillAllPlateMetricCommand):
                 DEFAULT_NTC_POSITIVE_CALCULATOR.compute(qlwell, qwc, wcm)
         Session.commit()
 
-     
+
+class ScreenAmplitudeDriftCommand(BackfillAllPlateMetricCommand):
+    """
+    Screens every stored plate for FAM amplitude drift over the run,
+    or multimodal amplitudes in either half of the run.  The drift of
+    all the wells on a plate is computed in one batch; flagged wells
+    are printed as tab-separated lines.
+    """
+    summary = "Screens all plates for FAM amplitude drift."
+    usage = "paster --plugin=qtools screen-amplitude-drift [start plate id] [config]"
+
+    def process_plate(self, qlplate, plate_metric):
+        from qtools.lib.nstats.fam_drift import plate_fam_drift
+        from qtools.lib.nstats.drift import drift_flags
+
+        names, records = plate_fam_drift(qlplate)
+        for name, record, flagged in zip(names, records, drift_flags(records)):
+            if flagged:
+                print "DRIFT\t%s\t%s\t%.4f\t%.1f\t%.1f\t%s\t%s" % (plate_metric.plate_id, name, record['drift'],
+                                                             record['first_mean'], record['second_mean'],
+                                                             record['first_peaks'], record['second_peaks'])
+
+
 class BackfillNewDropletClusterMetricsCommand(BackfillAllPlateMetricCommand):
     """
     Backfills New Cluster Metrics in all plates
@@ -571,3 +595,30 @@ class BackfillAnalysisGroupClustersCommand(QToolsCommand):
                 print image_path
                 fig.savefig(image_path, format='png', dpi=72)
                 plt_cleanup(fig)
+
+@WarnBeforeRunning("This will read every plate without galaxy tiles, which can be a time-consuming operation.")
+class BackfillGalaxyTilesCommand(QToolsCommand):
+    summary = "Writes the galaxy histogram tiles of plates scanned before tiles were stored."
+    usage = "paster --plugin=qtools backfill-galaxy-tiles [config]"
+
+    def command(self):
+        from qtools.lib.galaxytile import tile_path, write_plate_tiles
+        app = self.load_wsgi_app()
+
+        image_source = QLBImageSource(app.config['qlb.image_store'])
+        storage = QLStorageSource(app.config)
+
+        plates = Session.query(Plate).filter(Plate.qlbplate.has())\
+                                     .options(joinedload(Plate.qlbplate)).all()
+        for plate in plates:
+            wells = plate.qlbplate.wells
+            if not wells or all([os.path.isfile(image_source.get_path(tile_path(plate.qlbplate.id, w.well_name))) for w in wells]):
+                continue
+
+            plate_path = storage.plate_path(plate)
+            qlplate = get_plate(plate_path)
+            if not qlplate:
+                print "Could not read plate: %s" % plate.name
+                continue
+            print "Writing galaxy tiles for %s" % plate.name
+            write_plate_tiles(image_source, plate.qlbplate.id, qlplate)
@@ -1,10 +1,14 @@
 import sys
 
+from sqlalchemy import and_
+from sqlalchemy.engine.reflection import Inspector
+
 from qtools.components.manager import create_manager
 from qtools.constants.job import *
+from qtools.lib.intervals import range_bin
 from qtools.messages.sequence import *
 from qtools.model import Assay, Session
-from qtools.model.sequence import Sequence, SequenceGroup, SequenceGroupComponent
+from qtools.model.sequence import Sequence, SequenceGroup, SequenceGroupComponent, AmpliconSequenceCache, Transcript
 from qtools.model.sequence.util import sequence_group_unlink_sequences
 
 from . import QToolsCommand, DoNotRun, WarnBeforeRunning
@@ -218,3 +222,54 @@ class UpdateAssayTMDGCommand(QToolsCommand):
                         p.tm = tm_calc.tm_probe(p.sequence.sequence, mgb=False)
                         p.dg = dg_calc.delta_g(p.sequence.sequence)
             Session.commit()
+
+class BackfillGenomicBinsCommand(QToolsCommand):
+    """
+    Adds the bin columns of amplicon_sequence_cache and transcript where
+    they are missing, then fills them in.  Run this before deploying the
+    code that maps the columns; the DDL it issues is:
+
+    ALTER TABLE amplicon_sequence_cache ADD COLUMN bin INTEGER NULL;
+    CREATE INDEX ix_amplicon_sequence_cache_bin ON amplicon_sequence_cache (bin);
+    ALTER TABLE transcript ADD COLUMN bin INTEGER NULL;
+    CREATE INDEX ix_transcript_bin ON transcript (bin);
+
+    Running it again only bins the rows left unbinned.
+    """
+    summary = "Adds and fills in the UCSC bins of cached amplicons and transcripts."
+    usage = "paster --plugin=qtools backfill-genomic-bins [config]"
+
+    # rows binned per commit
+    batch_size = 1000
+
+    def command(self):
+        app = self.load_wsgi_app()
+        for model in (AmpliconSequenceCache, Transcript):
+            self.__add_bin_column(model.__table__)
+            binned = 0
+            last_id = 0
+            while True:
+                records = Session.query(model).filter(and_(model.id > last_id,
+                                                           model.bin == None,
+                                                           model.start_pos != None,
+                                                           model.end_pos != None))\
+                                              .order_by(model.id).limit(self.batch_size).all()
+                if not records:
+                    break
+                for record in records:
+                    record.bin = range_bin(record.start_pos, record.end_pos)
+                last_id = records[-1].id
+                binned += len(records)
+                Session.commit()
+            print "Binned %s %s records." % (binned, model.__tablename__)
+
+    def __add_bin_column(self, table):
+        engine = Session.bind
+        columns = [column['name'] for column in Inspector.from_engine(engine).get_columns(table.name)]
+        if 'bin' in columns:
+            return
+        engine.execute('ALTER TABLE %s ADD COLUMN bin INTEGER NULL' % table.name)
+        for index in table.indexes:
+            if [column.name for column in index.columns] == ['bin']:
+                index.create(engine)
+        print "Added %s.bin." % table.name
@@ -1,4 +1,12 @@
 # TODO add more metric-related constants here
 
 NTC_FAM_POSITIVE_THRESHOLD = 5000
-NTC_VIC_POSITIVE_THRESHOLD = 3000
\ No newline at end of file
+NTC_VIC_POSITIVE_THRESHOLD = 3000
+
+# the sample names of wells that should have no fluorescence; positives
+# in them are carryover from the wells run before them.
+CARRYOVER_EMPTY_SAMPLE_NAMES = ('Stealth', 'Stealth well', 'stealth')
+
+# the sample names of no-template control wells; the reader carryover
+# analysis counts positives in these, as well as in the empty wells.
+CARRYOVER_NTC_SAMPLE_NAMES = ('NTC', 'ntc')
@@ -13,6 +13,7 @@ from qtools.lib.base import BaseController, render
 from qtools.lib.bio import reverse_complement
 from qtools.lib.dbservice.ucsc import HG19Source
 from qtools.lib.deltag import dg_assay, dg_seq, dg_pcr_sequence
+from qtools.lib.ispcr import configured_sequence_source
 from qtools.lib.tm import tm_assay, tm_probe, tm_pcr_sequence
 from qtools.lib.validators import PrimerSequence, Chromosome, SNPName, Strand, DNASequence
 from qtools.lib.validators import KeyValidator, UniqueKeyValidator, IntKeyValidator, NullableStringBool
@@ -302,7 +303,7 @@ class AssayController(BaseController):
         # avoids double lookup if lookup has already been done
         if self.form_result['sequences']:
             # add 1000-padding sequence and snps to each.
-            seq_source = UCSCSequenceSource()
+            seq_source = self._get_sequence_source()
             snp_source = HG19Source()
         
             for seq in self.form_result['sequences']:
@@ -421,7 +422,7 @@ class AssayController(BaseController):
         if not assay:
             abort(404)
         
-        seq_source = UCSCSequenceSource()
+        seq_source = self._get_sequence_source()
         snp_source = HG19Source()
         sequences = assayutil.sequences_snps_for_assay(config, assay, seq_source, snp_source, 1000, 1000)
         
@@ -444,7 +445,7 @@ class AssayController(BaseController):
     @restrict('POST')
     @validate(schema=PrimerSequenceForm(), form='primer')
     def process_primer(self):
-        source = UCSCSequenceSource()
+        source = self._get_sequence_source()
         left_padding = 1000
         right_padding = 1000
         sequences = source.sequences_for_primers(self.form_result['primer_fwd'],
@@ -482,7 +483,7 @@ class AssayController(BaseController):
     @restrict('POST')
     @validate(schema=LocationSequenceForm(), form='location')
     def process_location(self):
-        source = UCSCSequenceSource()
+        source = self._get_sequence_source()
         left_padding = 1000
         right_padding = 1000
         sequence = source.sequence_around_loc(self.form_result['chromosome'],
@@ -516,7 +517,7 @@ class AssayController(BaseController):
     @validate(schema=SNPSequenceForm(), form='snp')
     def process_snp(self):
         snp_source = HG19Source()
-        seq_source = UCSCSequenceSource()
+        seq_source = self._get_sequence_source()
         left_padding = 1000
         right_padding = 1000
         snps = snp_source.snps_by_rsid(self.form_result['snp_rsid'])
@@ -667,6 +668,13 @@ class AssayController(BaseController):
         snps = snp_source.snps_in_range(chrom, start, end)
         return snps
     
+    def _get_sequence_source(self):
+        """
+        Use the local genome for sequence lookups if its index is
+        configured (qtools.genome_index); otherwise, go to UCSC.
+        """
+        return configured_sequence_source(config, UCSCSequenceSource)
+    
     def __add_sequence_primer_display_attrs(self, seq, **kwargs):
         assay = kwargs.get('assay', None)
         if assay:
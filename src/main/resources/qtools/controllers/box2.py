@@ -7,16 +7,16 @@ from pylons.decorators import validate, jsonify
 from pylons.decorators.rest import restrict
 
 from sqlalchemy.orm import aliased, contains_eager, joinedload_all
-from sqlalchemy import and_, func
 
 from qtools.model import Session, QLBWell, QLBFile, QLBPlate, Plate, Project, Experiment, Assay, Person, WellTag, Box2, Box2File
 
 from qtools.lib.base import BaseController, render
 from qtools.lib.decorators import deprecated_action
-from qtools.lib.queryform import QueryForm, ColumnValidator, CompareValidator, SortByValidator, full_column_name
+from qtools.lib.queryform import QueryForm, ColumnValidator, CompareValidator, SortByValidator
 from qtools.lib.storage import QLStorageSource
 from qtools.lib.validators import IntKeyValidator, FileUploadFilter
 from qtools.lib.upload import upload_basename
+from qtools.lib.wellsearch import search_criteria, windowed_results, directory_ordered_well_query, group_by_directory, distinct_values
 
 import qtools.lib.helpers as h
 import qtools.lib.fields as fl
@@ -174,37 +174,13 @@ class Box2Controller(BaseController):
     @validate(QLBPlateForm(), form='plates', post_only=False, on_get=True, variable_decode=True)
     def plate_query(self):
         # simple AND case
-        labels = []
-        for idx, cond in enumerate(self.form_result['conditions']):
-            labels.append(cond['field'].label("condition%s" % idx))
-        
-        conditions = and_(*[getattr(cond['field'], cond['compare'])(cond['value']) for cond in self.form_result['conditions']])
-        labels = []
-        label_names = []
-        for idx, cond in enumerate(self.form_result['conditions']):
-            field_name = 'field%s' % idx
-            labels.append(cond['field'].label(field_name))
-            label_names.append(QLBPlateForm.col_display_names.get(full_column_name(cond['field']), cond['field'].name))
-        
-        if self.form_result['order_by'].name not in [cond['field'].name for cond in self.form_result['conditions']]:
-            order_by = self.form_result['order_by']
-            field_name = 'field%s' % len(label_names)
-            labels.append(order_by.label(field_name))
-            label_names.append(QLBPlateForm.col_display_names.get(full_column_name(order_by), order_by.name))
-        
-        for col in self.form_result['return_fields']:
-            field_name = 'field%s' % len(label_names)
-            labels.append(col.label(field_name))
-            label_names.append(QLBPlateForm.col_display_names.get(full_column_name(col), col.name))
+        conditions, labels, label_names = search_criteria(self.form_result, QLBPlateForm.col_display_names)
                 
-        if self.form_result['order_by_direction'] == "desc":
-            sort_column = self.form_result['order_by'].desc()
-        else:
-            sort_column = self.form_result['order_by']
-        
-        c.plates = Session.query(QLBPlate, *labels).join(QLBFile).outerjoin(Plate, Project, Experiment, Assay, Person).filter(conditions) \
-                                                 .order_by(sort_column) \
-                                                 .options(contains_eager(QLBPlate.file))
+        descending = self.form_result['order_by_direction'] == "desc"
+        c.plates = windowed_results(Session.query(QLBPlate, *labels).join(QLBFile).outerjoin(Plate, Project, Experiment, Assay, Person).filter(conditions) \
+                                                                    .options(contains_eager(QLBPlate.file),
+                                                                             contains_eager(QLBPlate.plate)),
+                                    [(self.form_result['order_by'], descending), (QLBPlate.id, False)])
         c.grouped_results = False
         
         # TODO: support and, or
@@ -265,58 +241,20 @@ class Box2Controller(BaseController):
     @validate(QLBWellForm(), post_only=False, on_get=True, form='wells', variable_decode=True)
     def well_query(self):
         # simple AND case
-        labels = []
-        for idx, cond in enumerate(self.form_result['conditions']):
-            labels.append(cond['field'].label("condition%s" % idx))
-        
-        conditions = and_(*[getattr(cond['field'], cond['compare'])(cond['value']) for cond in self.form_result['conditions']])
-        labels = []
-        label_names = []
-        for idx, cond in enumerate(self.form_result['conditions']):
-            field_name = 'field%s' % idx
-            labels.append(cond['field'].label(field_name))
-            label_names.append(QLBWellForm.col_display_names.get(full_column_name(cond['field']), cond['field'].name))
-        
-        if self.form_result['order_by'].name not in [cond['field'].name for cond in self.form_result['conditions']]:
-            order_by = self.form_result['order_by']
-            field_name = 'field%s' % len(label_names)
-            labels.append(order_by.label(field_name))
-            label_names.append(QLBWellForm.col_display_names.get(full_column_name(order_by), order_by.name))
-        
-        for col in self.form_result['return_fields']:
-            field_name = 'field%s' % len(label_names)
-            labels.append(col.label(field_name))
-            label_names.append(QLBWellForm.col_display_names.get(full_column_name(col), col.name))
-                
+        conditions, labels, label_names = search_criteria(self.form_result, QLBWellForm.col_display_names)
         
         if self.form_result['group_by_directory']:
-            field_name = 'field%s' % len(label_names)
-            if self.form_result['order_by_direction'] == 'desc':
-                order_by_dir = "desc"
-                sort_column = func.max(self.form_result['order_by'])
-            else:
-                order_by_dir = "asc"
-                sort_column = func.min(self.form_result['order_by'])
-            
-            labels.append(sort_column.label('group_col'))
-            
-            well_extremes = Session.query(QLBWell, *labels).join(QLBFile).filter(conditions) \
-                                                           .group_by('qlbfile_dirname') \
-                                                           .order_by('group_col %s' % order_by_dir) \
-                                                           .options(contains_eager(QLBWell.file))
-            
-            c.wells = self.__well_dirname_iterator(well_extremes, Session.query(QLBWell, *labels[:-1]).join(QLBFile), conditions)
-            
+            well_query, ordering = directory_ordered_well_query(Session.query(QLBWell, *labels).join(QLBFile),
+                                                                conditions,
+                                                                self.form_result['order_by'],
+                                                                descending=self.form_result['order_by_direction'] == 'desc')
+            c.well_groups = group_by_directory(windowed_results(well_query.options(contains_eager(QLBWell.file)), ordering))
             c.grouped_results = True
         else:
-            if self.form_result['order_by_direction'] == "desc":
-                sort_column = self.form_result['order_by'].desc()
-            else:
-                sort_column = self.form_result['order_by']
-                
-            c.wells = Session.query(QLBWell, *labels).join(QLBFile).filter(conditions) \
-                                                     .order_by(sort_column) \
-                                                     .options(contains_eager(QLBWell.file))
+            descending = self.form_result['order_by_direction'] == "desc"
+            c.wells = windowed_results(Session.query(QLBWell, *labels).join(QLBFile).filter(conditions) \
+                                                                       .options(contains_eager(QLBWell.file)),
+                                       [(self.form_result['order_by'], descending), (QLBWell.id, False)])
             c.grouped_results = False
         
         
@@ -330,8 +268,6 @@ class Box2Controller(BaseController):
     
     @validate(QLBPlateDistinctForm(), post_only=False, on_get=True, variable_decode=False)
     def plate_distinct(self):
-        values = Session.query(self.form_result['column']).distinct()
-        
         field = None
         # special values
         if self.form_result['column'] == Plate.thermal_cycler:
@@ -345,7 +281,7 @@ class Box2Controller(BaseController):
             )
         else:
             c.form = h.LiteralForm(
-                option = {self.form_result['field_name']: sorted([(tup[0], str(tup[0])) for tup in values if tup[0] is not None])}
+                option = {self.form_result['field_name']: [(value, str(value)) for value in distinct_values(self.form_result['column'])]}
             )
         c.field_name = self.form_result['field_name']
         
@@ -353,26 +289,13 @@ class Box2Controller(BaseController):
     
     @validate(QLBWellDistinctForm(), post_only=False, on_get=True, variable_decode=False)
     def well_distinct(self):
-        values = Session.query(self.form_result['column']).distinct()
-        
         c.form = h.LiteralForm(
-            option = {self.form_result['field_name']: sorted([(tup[0], str(tup[0])) for tup in values if tup[0] is not None])}
+            option = {self.form_result['field_name']: [(value, str(value)) for value in distinct_values(self.form_result['column'])]}
         )
         c.field_name = self.form_result['field_name']
         
         return render('/box2/select.html')
     
-    def __well_dirname_iterator(self, wells, base_query, conditions):
-        for value_tuple in wells:
-            well = value_tuple[0]
-            
-            group_conditions = and_(conditions, QLBFile.dirname == well.file.dirname)
-            well_group = base_query.filter(group_conditions) \
-                                   .order_by('well_name') \
-                                   .options(contains_eager(QLBWell.file))
-            for group_well in well_group:
-                yield group_well
-
     def __setup_robocopy_context(self):
         c.box2_field = fl.box2_field()
 
@@ -2,9 +2,11 @@ import logging, operator
 
 from pylons import request, response, session, tmpl_context as c, url
 from pylons.controllers.util import abort, redirect
+from pylons.decorators import jsonify
 
 from qtools.lib.collection import groupinto
 from qtools.lib.base import BaseController, render
+from qtools.lib.dropletgen import dg_run_event_trace
 from qtools.model import DropletGeneratorRun, DropletGenerator, Session, QLBWell, WellMetric, PlateMetric, QLBPlate, Plate
 
 from sqlalchemy import and_
@@ -70,6 +72,22 @@ class DgController(BaseController):
         #raise Exception, c.runs
         return render('/product/dg/runs.html')
              
+    @jsonify
+    def events(self, id=None):
+        """
+        The time series events of a droplet generator run, from the
+        indexed log (see the process-dg-logs command).
+        """
+        dg_run = Session.query(DropletGeneratorRun).get(id)
+        if not dg_run:
+            abort(404)
+        return {'run_number': dg_run.run_number,
+                'droplet_generator_id': dg_run.droplet_generator_id,
+                'events': [{'sequence': sequence,
+                            'label': label,
+                            'values': [value1, value2, value3]}
+                                for sequence, label, value1, value2, value3 in dg_run_event_trace(Session, dg_run.id)]}
+             
     def run(self, dg_id=None, run_id=None):
         reprocess_config_id = request.params.get('rp_id', None)
         if reprocess_config_id:
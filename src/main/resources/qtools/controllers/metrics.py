@@ -12,8 +12,9 @@ from qtools.lib.fields import beta_type_field, box2_field, checkbox_field, perso
 from qtools.lib import helpers as h
 from qtools.lib.compare import *
 from qtools.lib.metrics.spec import AnalysisGroupMetrics, DRCertificationMetrics, PlateDRCertificationMetrics, SinglePlateMetrics
+from qtools.lib.metrics.compare import analysis_group_comparison
 from qtools.lib.validators import MetricPattern, IntKeyValidator
-from qtools.model import Session, AnalysisGroup, Plate, PlateMetric, WellMetric, WellChannelMetric, ReprocessConfig
+from qtools.model import Session, AnalysisGroup, Plate, PlateMetric, WellMetric, WellChannelMetric, ReprocessConfig, QLBWell
 from qtools.model import Box2, DropletGenerator, PlateType, Person
 from qtools.model.batchplate import ManufacturingPlate # such that backref will work (unforeseen consequence of breaking up qtools.model)
 from sqlalchemy.orm import joinedload_all
@@ -887,10 +888,7 @@ class MetricsController(BaseController):
             c.right_config_id = right_alg.id
             c.right_config_name = right_alg.name
         
-        kwargs = self.__get_analysis_group_form_kwargs()
         self.__setup_metric_compare_form_context()
-        original_metrics = AnalysisGroupMetrics(c.group.id, reprocess_config_id=self.form_result['left_config_id'], **kwargs)
-        test_metrics = AnalysisGroupMetrics(c.group.id, reprocess_config_id=self.form_result['right_config_id'], **kwargs)
         
         if self.form_result['minmax_number']:
             c.divider_row = self.form_result['minmax_number']
@@ -898,30 +896,60 @@ class MetricsController(BaseController):
             c.divider_row = None
         metric_type, attr = self.form_result['metric']
         if metric_type == 'plate':
-            return self.__plate_compare_algs(original_metrics, test_metrics, attr)
+            return self.__plate_compare_algs(attr)
         elif metric_type == 'well':
-            return self.__well_compare_algs(original_metrics, test_metrics, attr)
+            return self.__well_compare_algs(attr)
         elif metric_type == 'channel':
-            return self.__channel_compare_algs(original_metrics, test_metrics, attr, self.form_result['channel_num'])
+            return self.__channel_compare_algs(attr, self.form_result['channel_num'])
     
-    def __filter_compare_results(self, results):
-        filtered = results
+    def __get_analysis_group_compare_kwargs(self):
+        """
+        The SQL equivalent of __get_analysis_group_form_kwargs, for
+        analysis_group_comparison.
+        """
+        plate_criteria = []
+        well_criteria = []
+        if self.form_result['dr_id']:
+            plate_criteria.append(Plate.box2_id == self.form_result['dr_id'])
+        if self.form_result['pt_id']:
+            plate_criteria.append(Plate.plate_type_id == self.form_result['pt_id'])
+        if self.form_result['operator_id']:
+            plate_criteria.append(Plate.operator_id == self.form_result['operator_id'])
+        if self.form_result['dg_id']:
+            well_criteria.append(QLBWell.droplet_generator_id == self.form_result['dg_id'])
+        if self.form_result['channel']:
+            well_criteria.append(QLBWell.consumable_channel_num == self.form_result['channel'])
+        
+        kwargs = dict(left_config_id=self.form_result['left_config_id'],
+                      right_config_id=self.form_result['right_config_id'],
+                      plate_criteria=plate_criteria,
+                      well_criteria=well_criteria,
+                      gated_filter=self.form_result['gated_filter'])
+        if self.form_result['pattern']:
+            kwargs['well_name_filter'] = PATTERN_FILTERS[self.form_result['pattern']]
+        return kwargs
+    
+    def __filter_compare_results(self, values):
+        """
+        Return the indices of the (sorted) compare values to display.
+        """
+        filtered = np.arange(len(values))
         if self.form_result['minmax_number']:
             minmax = self.form_result['minmax_number']
-            if minmax*2 < len(results):
-                filtered = results[:minmax] + results[-minmax:]
+            if minmax*2 < len(values):
+                filtered = np.concatenate((filtered[:minmax], filtered[-minmax:]))
         
         if self.form_result['min_range']:
-            filtered = [f for f in filtered if f[1] >= self.form_result['min_range']]
+            filtered = filtered[values[filtered] >= self.form_result['min_range']]
         if self.form_result['max_range']:
-            filtered = [f for f in filtered if f[1] <= self.form_result['max_range']]
+            filtered = filtered[values[filtered] <= self.form_result['max_range']]
         if self.form_result['exclude_nodiff']:
-            filtered = [f for f in filtered if f[1]]
+            filtered = filtered[values[filtered] != 0]
         
         return filtered
     
-    def __setup_metric_compare_stats_context(self, results):
-        if results is None or len(results) == 0:
+    def __setup_metric_compare_stats_context(self, values):
+        if values is None or len(values) == 0:
             c.stats_mean = 0
             c.stats_median = 0
             c.stats_stdev = 0
@@ -929,9 +957,9 @@ class MetricsController(BaseController):
             c.stats_min = 0
             return
         
-        numbers = [r[1] for r in results]
+        numbers = values
         if self.form_result['cmp_method'] == COMPARE_PCT_DELTA:
-            numbers = [n*100 for n in numbers]
+            numbers = numbers*100
         c.stats_mean = np.mean(numbers)
         c.stats_median = np.median(numbers)
         c.stats_stdev = np.std(numbers)
@@ -952,12 +980,12 @@ class MetricsController(BaseController):
                 continue
             c.additional_field_hierarchy[len(parents)-1].append((parents[-1], getattr(col, 'doc', f)))
     
-    def __histogram_compare_results(self, results, bins=310):
-        if results is None or len(results) == 0:
+    def __histogram_compare_results(self, values, bins=310):
+        if values is None or len(values) == 0:
             c.zero_bin = 0
             c.hist = []
             return
-        hist = np.histogram([r[1] for r in results], 310)
+        hist = np.histogram(values, 310)
         c.hist = hist[0]
         bounds = hist[1]
         has_zero = np.extract(bounds < 0, np.arange(len(bounds)))
@@ -966,95 +994,45 @@ class MetricsController(BaseController):
         else:
             c.zero_bin = 0
 
-    def __plate_compare_algs(self, original_metrics, test_metrics, attr):
-        # ensure matching
-        original_plate_metrics = original_metrics.all_plate_metrics
-        test_plate_metrics = test_metrics.all_plate_metrics
-        
-        original_plate_metrics_dict = dict([(pm.plate_id, pm) for pm in original_plate_metrics])
-        test_plate_metrics_dict = dict([(pm.plate_id, pm) for pm in test_plate_metrics])
-        plate_metrics = []
-        for k, o in original_plate_metrics_dict.items():
-            t = test_plate_metrics_dict.get(k, None)
-            if t:
-                plate_metrics.append((o, t))
-        
-        col = PlateMetric.__mapper__.columns.get(attr, None)
+    def __setup_compare_results_context(self, metric_type, metric_class, attr, channel_num=0):
+        """
+        Compare the left and right metrics of the group on attr, and set up
+        the results, histogram and stats.
+        """
+        col = metric_class.__mapper__.columns.get(attr, None)
         if col is None or not getattr(col, 'doc', None):
             abort(404)
         
-        compare_func = COMPARE_FUNC_MAP[self.form_result['cmp_method']](attr)
         c.cmp_display = COMPARE_FUNC_DISPLAY_MAP[self.form_result['cmp_method']]
-        
         c.attr = attr
-        c.attr_name = PlateMetric.__mapper__.columns[attr].doc
+        c.attr_name = col.doc
 
-        results = sorted([(oldnew, compare_func(oldnew)) for oldnew in plate_metrics], key=operator.itemgetter(1))
-        self.__histogram_compare_results(results)
-        c.results = self.__filter_compare_results(results)
-        self.__setup_metric_compare_stats_context(results)
+        comparison = analysis_group_comparison(c.group.id, metric_type, [attr], channel_num=channel_num,
+                                               **self.__get_analysis_group_compare_kwargs())
+        values = comparison.compare(COMPARE_FUNC_MAP[self.form_result['cmp_method']], attr)
+        order = np.argsort(values, kind='mergesort')
+        values = values[order]
+
+        self.__histogram_compare_results(values)
+        shown = self.__filter_compare_results(values)
+        c.results = zip(comparison.pairs(order[shown]), values[shown].tolist())
+        self.__setup_metric_compare_stats_context(values)
+
+    def __plate_compare_algs(self, attr):
+        self.__setup_compare_results_context('plate', PlateMetric, attr)
         self.__setup_additional_compare_fields_context(PlateMetric.__mapper__)
         return render('/metrics/compare/plate_metric.html')
     
-    def __well_compare_algs(self, original_metrics, test_metrics, attr):
-        # ensure matching
-        original_well_metrics = original_metrics.all_well_metrics
-        test_well_metrics = test_metrics.all_well_metrics
-        original_well_metrics_dict = dict([(wm.well_id, wm) for wm in original_well_metrics])
-        test_well_metrics_dict = dict([(wm.well_id, wm) for wm in test_well_metrics])
-        well_metrics = []
-        for k, o in original_well_metrics_dict.items():
-            t = test_well_metrics_dict.get(k, None)
-            if t:
-                well_metrics.append((o, t))
-        
-        col = WellMetric.__mapper__.columns.get(attr, None)
-        if col is None or not getattr(col, 'doc', None):
-            abort(404)
-        
-        compare_func = COMPARE_FUNC_MAP[self.form_result['cmp_method']](attr)
-        c.cmp_display = COMPARE_FUNC_DISPLAY_MAP[self.form_result['cmp_method']]
-        
-        c.attr = attr
-        c.attr_name = WellMetric.__mapper__.columns[attr].doc
-
-        # TODO limit by number or max/min range
-        results = sorted([(oldnew, compare_func(oldnew)) for oldnew in well_metrics], key=operator.itemgetter(1))
-        self.__histogram_compare_results(results)
-        c.results = self.__filter_compare_results(results)
-        self.__setup_metric_compare_stats_context(results)
+    def __well_compare_algs(self, attr):
+        self.__setup_compare_results_context('well', WellMetric, attr)
         self.__setup_additional_compare_fields_context(WellMetric.__mapper__, PlateMetric.__mapper__)
         return render('/metrics/compare/well_metric.html')
 
-    def __channel_compare_algs(self, original_metrics, test_metrics, attr, channel):
+    def __channel_compare_algs(self, attr, channel):
         c.channel = channel
         c.channel_name = 'VIC' if channel == 1 else 'FAM'
 
-        original_well_metrics = original_metrics.all_well_metrics
-        test_well_metrics = test_metrics.all_well_metrics
-        original_channel_metrics_dict = dict([(wm.well_channel_metrics[channel].well_channel_id, wm.well_channel_metrics[channel]) for wm in original_well_metrics])
-        test_channel_metrics_dict = dict([(wm.well_channel_metrics[channel].well_channel_id, wm.well_channel_metrics[channel]) for wm in test_well_metrics])
-        channel_metrics = []
-        for k, o in original_channel_metrics_dict.items():
-            t = test_channel_metrics_dict.get(k, None)
-            if t:
-                channel_metrics.append((o, t))
-        
-        col = WellChannelMetric.__mapper__.columns.get(attr, None)
-        if col is None or not getattr(col, 'doc', None):
-            abort(404)
-        
-        compare_func = COMPARE_FUNC_MAP[self.form_result['cmp_method']](attr)
-        c.cmp_display = COMPARE_FUNC_DISPLAY_MAP[self.form_result['cmp_method']]
-        
-        c.attr = attr
-        c.attr_name = WellChannelMetric.__mapper__.columns[attr].doc
-
-        # TODO limit by number or max/min range
-        results = sorted([(oldnew, compare_func(oldnew)) for oldnew in channel_metrics], key=operator.itemgetter(1))
-        self.__histogram_compare_results(results)
-        c.results = self.__filter_compare_results(results)
-        self.__setup_metric_compare_stats_context(results)
+        self.__setup_compare_results_context('channel', WellChannelMetric, attr, channel_num=channel)
         self.__setup_additional_compare_fields_context(WellChannelMetric.__mapper__, WellMetric.__mapper__, PlateMetric.__mapper__)
         return render('/metrics/compare/channel_metric.html')
 
@@ -1,11 +1,10 @@
-import logging, StringIO, gc
+import logging, os, StringIO
 
-from pylons import request, response, session, tmpl_context as c, url, config
+from pylons import request, response, session, tmpl_context as c, url, config, app_globals
 from pylons.controllers.util import abort
 
 from qtools.lib.beta import *
 from qtools.lib.storage import QLStorageSource
-from qtools.lib.qlb_factory import get_well
 from qtools.lib.base import BaseController
 from qtools.model import QLBWell, Session, DropletGenerator
 
@@ -14,8 +13,8 @@ log = logging.getLogger(__name__)
 deps_loaded = False
 try:
     import numpy as np
-    import numpy.fft.fftpack
-    from qtools.lib.nstats import fft
+    from qtools.lib.rawtrace import config_trace_source
+    from qtools.lib.spectrum import WellSpectrumSource, SPECTRUM_MAX_FREQ
     import matplotlib
     matplotlib.use('Agg')
     import matplotlib.pyplot as plt
@@ -24,6 +23,7 @@ except ImportError, e:
     pass
 
 FFT_DOWNSAMPLE = 23
+SPECTRUM_CACHE_EXPIRE = 24*60*60
 
 class NplotController(BaseController):
 
@@ -46,66 +46,31 @@ class NplotController(BaseController):
             
         storage = QLStorageSource(config)
         path = storage.qlbwell_path(well)
-        wellobj = get_well(path)
-        
-        fam_samples = wellobj.samples[:,0][::FFT_DOWNSAMPLE].astype('float')
-        vic_samples = wellobj.samples[:,1][::FFT_DOWNSAMPLE].astype('float')
-
-        # normalize to 0->1
-        fam_samples /= np.max(fam_samples)
-        vic_samples /= np.max(vic_samples)
-
-        Sf = np.fft.fft(fam_samples)
-        numpy.fft.fftpack._fft_cache = {}
-        ff = np.fft.fftfreq(len(Sf), d=FFT_DOWNSAMPLE/wellobj.data_acquisition_params.sample_rate)
-
-        # only consider positive half of frequency domain, normalize by num of samples
-        Yf = abs(Sf[0:len(ff)/2])/len(fam_samples)
-
-        # make X-axis in terms of Hz
-        Wf = int((len(ff)/2)/max(ff)) # group by 1 Hz
-
-        Sv = np.fft.fft(vic_samples)
-        numpy.fft.fftpack._fft_cache = {}
-        fv = np.fft.fftfreq(len(Sv), d=FFT_DOWNSAMPLE/wellobj.data_acquisition_params.sample_rate)
-        Yv = abs(Sv[0:len(fv)/2])/len(vic_samples)
-        Wv = int((len(fv)/2)/max(fv)) # group by 1 Hz
-
-        # find peaks
-        fam_peak_indices = fft.find_peak_indices(Yf, Wf*2) # group by 2Hz
-        vic_peak_indices = fft.find_peak_indices(Yv, Wv*2) # group by 2Hz
-
-        ftops = ff.take(fam_peak_indices)[0:10]
-        vtops = fv.take(vic_peak_indices)[0:10]
+        # file-backed, so the spectra are shared between workers rather
+        # than held in each process
+        spectra = WellSpectrumSource(cache=app_globals.cache.get_cache('well_spectrum', type='file',
+                                                                        data_dir=os.path.join(config['cache_dir'], 'spectrum'),
+                                                                        expire=SPECTRUM_CACHE_EXPIRE),
+                                     downsample=FFT_DOWNSAMPLE,
+                                     window_source=config_trace_source(config).sample_windows)
+        spectrum = spectra.spectrum(path)
 
         fig = plt.figure()
         fig.set_figwidth(8)
         fig.set_figheight(6)
-        plt.subplot(211)
-
-        plt.title('FAM Channel FFT (0-150Hz)')
-        plt.plot(ff[0:len(ff)/2], Yf)
-        plt.axis([-10, 150, -0.002, 0.04])
-        plt.text(70, 0.03, "Top Peaks (2 Hz windows):", weight='bold')
-        for i, val in enumerate(ftops):
-            plt.text(70 if i < 5 else 90, 0.027-(0.003*(i % 5)), "%.2f" % val, size=10)
 
-        # todo render text func?
-        
-        
-        plt.subplot(212)
-        plt.title('VIC Channel FFT (0-150Hz)')
-        plt.plot(fv[0:len(fv)/2], Yv)
-        plt.axis([-10, 150, -0.002, 0.04])
-        plt.text(70, 0.03, "Top Peaks (2 Hz windows):", weight='bold')
-        for i, val in enumerate(vtops):
-            plt.text(70 if i < 5 else 90, 0.027-(0.003*(i % 5)), "%.2f" % val, size=10)
+        for idx, (title, channel) in enumerate(zip(('FAM Channel FFT (0-150Hz)', 'VIC Channel FFT (0-150Hz)'),
+                                                   spectrum.channels)):
+            plt.subplot(211+idx)
+            plt.title(title)
+            plt.plot(channel.freqs, channel.amplitudes)
+            plt.axis([-10, SPECTRUM_MAX_FREQ, -0.002, 0.04])
+            plt.text(70, 0.03, "Top Peaks (2 Hz windows):", weight='bold')
+            for i, val in enumerate(channel.peaks):
+                plt.text(70 if i < 5 else 90, 0.027-(0.003*(i % 5)), "%.2f" % val, size=10)
 
-        # fft leaves cache-- not good for threaded server
         imgdata = self.__render(fig)
         cleanup(fig)
-        del fig, wellobj, fam_samples, vic_samples, Sf, ff, Yf, Wf, Sv, fv, Yv, Wv, ftops, vtops
-        gc.collect()
         return imgdata
 
     
@@ -29,6 +29,8 @@ from qtools.lib.plate import make_plate_name
 from qtools.lib.platescan import scan_plate, trigger_plate_rescan
 from qtools.lib.well import width_gate_sigma
 from qtools.lib.qlb import cnv_ratio_numeric
+from qtools.lib.replicates import ReplicateMetricTable
+from qtools.lib.statsrollup import update_plate_run_stats, remove_plate_run_stats
 from qtools.lib.storage import QLStorageSource, QLPReprocessedFileSource, QLBPlateSource, QLBImageSource
 from qtools.lib.stringutils import militarize, camelize
 from qtools.lib.upload import save_plate_from_upload_request, get_create_plate_box
@@ -785,6 +787,8 @@ class PlateController(BaseController):
             abort(404)
     
         self.__set_plate_attrs(plate)
+        # operator may have changed
+        update_plate_run_stats(plate.qlbplate)
         Session.commit()
         session['flash'] = 'Plate updated.'
         session.save()
@@ -983,8 +987,8 @@ class PlateController(BaseController):
     @validate(schema=MIPCNVForm(), form='mip_cnv')
     @block_contractor_internal_plates
     def mip_cnv_compute(self, id=None, *args, **kwargs):
-        from qtools.lib.nstats.mip import process_replicate
-        from qtools.lib.qlb_factory import get_plate
+        from qtools.lib.nstats.mip import process_replicates
+        from qtools.lib.peakstore import config_peak_store
 
         if id is None:
             abort(404)
@@ -1003,7 +1007,7 @@ class PlateController(BaseController):
             source = QLPReprocessedFileSource(config['qlb.reprocess_root'], c.reprocess_config)
             path = source.full_path(c.analysis_group, c.plate)
         
-        qlplate = get_plate(path)
+        qlplate = config_peak_store(config).plate(path)
         ignored_wells = [k.strip().upper() for k in self.form_result['ignore_wells'].split(',')]
 
         # this is a little janky, but it'll work for now -- ideally,
@@ -1017,12 +1021,13 @@ class PlateController(BaseController):
             if len(repl_dict) > 0:
                 replicates[repl] = repl_dict
         
-        replicate_stats = []
-        for sample, wells in sorted(replicates.items(), key=lambda tup: sorted(tup[1].keys())[0]):
-            replicate_stats.append((sample, len(wells), process_replicate(wells,
-                                                     self.form_result['fam_fpr']/1000.0,
-                                                     self.form_result['vic_fpr']/1000.0,
-                                                     self.form_result['reference_channel'])))
+        sorted_replicates = sorted(replicates.items(), key=lambda tup: sorted(tup[1].keys())[0])
+        stats = process_replicates([wells for sample, wells in sorted_replicates],
+                                   self.form_result['fam_fpr']/1000.0,
+                                   self.form_result['vic_fpr']/1000.0,
+                                   self.form_result['reference_channel'])
+        replicate_stats = [(sample, len(wells), replicate_stats) \
+                           for (sample, wells), replicate_stats in zip(sorted_replicates, stats)]
 
 
         c.reference_channel = 'FAM' if self.form_result['reference_channel'] == 0 else 'VIC'
@@ -1104,29 +1109,16 @@ class PlateController(BaseController):
         response = self._replicate_base(id)
         return h.render_bootstrap_form(response, defaults=self.form_result)
 
-    def __replicate_statistics(self, replicate_well_names, ignored_wells, well_metric_cols, channel_metric_cols, channel=None):
-        import numpy as np
-
+    def __replicate_statistics(self, replicate_groups, ignored_wells, well_metric_cols, channel_metric_cols, channel=None):
+        """
+        Return [well count, [(mean, std) per column]] for each list of
+        well names in replicate_groups.
+        """
         if not hasattr(c, 'well_metric_dict'):
-            return []
-
-        ok_wells = [wn for wn in replicate_well_names if wn not in ignored_wells]
-        row = [len(ok_wells)]
-        stats = []
-        well_metrics = [c.well_metric_dict[wn] for wn in ok_wells]
-        for name, col in well_metric_cols:
-            percent_attr = getattr(col, 'info', {}).get('percent', False)
-            multiplier = 100 if percent_attr else 1
-            vals = [(getattr(wm, name) or 0)*multiplier for wm in well_metrics]
-            stats.append((np.mean(vals), np.std(vals)))
-        channel_metrics = [wcm for wm in well_metrics for wcm in wm.well_channel_metrics if wcm.channel_num == channel]
-        for name, col in channel_metric_cols:
-            percent_attr = getattr(col, 'info', {}).get('percent', False)
-            multiplier = 100 if percent_attr else 1
-            vals = [(getattr(wcm, name) or 0)*multiplier for wcm in channel_metrics]
-            stats.append((np.mean(vals), np.std(vals)))
-        row.append(stats)
-        return row
+            return [[] for group in replicate_groups]
+
+        table = ReplicateMetricTable(c.well_metric_dict.values(), well_metric_cols, channel_metric_cols, channel)
+        return table.replicate_rows(replicate_groups, ignored_wells)
 
 
     @help_at('features/replicate_tools.html')
@@ -1147,12 +1139,11 @@ class PlateController(BaseController):
         ignored_wells = self.__get_ignored_wells()
         well_metric_cols, channel_metric_cols = self.__get_metric_cols()
 
-        replicate_data = []
-
-        for name, well_names in sorted(replicate_well_names.items()):
-            stats = self.__replicate_statistics(well_names, ignored_wells, well_metric_cols, channel_metric_cols, self.form_result['channel'])
-            stats.insert(0, name)
-            replicate_data.append(stats)
+        replicate_groups = sorted(replicate_well_names.items())
+        replicate_stats = self.__replicate_statistics([well_names for name, well_names in replicate_groups],
+                                                      ignored_wells, well_metric_cols, channel_metric_cols,
+                                                      self.form_result['channel'])
+        replicate_data = [[name]+stats for (name, well_names), stats in zip(replicate_groups, replicate_stats)]
 
         c.well_metric_cols = [col.doc for name, col in well_metric_cols]
         c.channel_metric_cols = [col.doc for name, col in channel_metric_cols]
@@ -1220,17 +1211,15 @@ class PlateController(BaseController):
         if control_key in experiment_keys:
             experiment_keys.remove(control_key)
 
-        control_well_names = [w.well_name for w in replicate_wells[control_key]]
-        control_stats = self.__replicate_statistics(control_well_names, ignored_wells,
-                                                    well_metric_cols, channel_metric_cols,
-                                                    self.form_result['channel'])
+        # control first, then each experiment
+        group_stats = self.__replicate_statistics([[w.well_name for w in replicate_wells[key]] \
+                                                   for key in [control_key]+experiment_keys],
+                                                  ignored_wells, well_metric_cols, channel_metric_cols,
+                                                  self.form_result['channel'])
+        control_stats = group_stats[0]
 
         experiment_stats = dict()
-        for ek in experiment_keys:
-            ex_well_names = [w.well_name for w in replicate_wells[ek]]
-            replicate_stats = self.__replicate_statistics(ex_well_names, ignored_wells,
-                                                          well_metric_cols, channel_metric_cols,
-                                                          self.form_result['channel'])
+        for ek, replicate_stats in zip(experiment_keys, group_stats[1:]):
             replicate_diff_stats = [replicate_stats[0], []]
             for exp, control in zip(replicate_stats[1], control_stats[1]):
                 replicate_diff_stats[1].append((exp[0], exp[1], ((exp[0]/control[0])-1)*100 if control[0] != 0 else float('nan')))
@@ -1252,7 +1241,7 @@ class PlateController(BaseController):
     def frag(self, id=None, *args, **kwargs):
         from qtools.lib.nstats import frag
         from pyqlb.nstats.well import accepted_peaks, well_cluster_peaks
-        from qtools.lib.qlb_factory import get_plate
+        from qtools.lib.peakstore import config_peak_store
 
         if id is None:
             abort(404)
@@ -1268,9 +1257,12 @@ class PlateController(BaseController):
             source = QLPReprocessedFileSource(config['qlb.reprocess_root'], c.reprocess_config)
             path = source.full_path(c.analysis_group, c.plate)
         
-        qlplate = get_plate(path)
+        qlplate = config_peak_store(config).plate(path)
 
         c.frag_stats = []
+        frag_wells = []
+        frag_counts = []
+        frag_events = []
         for well_name, well in sorted(qlplate.analyzed_wells.items()):
             if not (well.channels[0].statistics.threshold or \
                    well.channels[1].statistics.threshold):
@@ -1280,12 +1272,14 @@ class PlateController(BaseController):
             #if len(clusters['negative_peaks']['negative_peaks']) == 0:
             #    continue
 
-            data = frag.prob_of_frag(len(clusters['positive_peaks']['negative_peaks']),
-                                     len(clusters['positive_peaks']['positive_peaks']),
-                                     len(clusters['negative_peaks']['negative_peaks']),
-                                     len(clusters['negative_peaks']['positive_peaks']),
-                                     len(accepted_peaks(well)))
-            
+            frag_wells.append((well_name, well))
+            frag_counts.append((len(clusters['positive_peaks']['negative_peaks']),
+                                len(clusters['positive_peaks']['positive_peaks']),
+                                len(clusters['negative_peaks']['negative_peaks']),
+                                len(clusters['negative_peaks']['positive_peaks'])))
+            frag_events.append(len(accepted_peaks(well)))
+
+        for (well_name, well), data in zip(frag_wells, frag.prob_of_frag_batch(frag_counts, frag_events)):
             if not data:
                 continue
             else:
@@ -1346,7 +1340,7 @@ class PlateController(BaseController):
     @validate(schema=AmplitudeCSVForm(), form='grid')
     @block_contractor_internal_plates
     def amplitude_csv(self, id=None, *args, **kwargs):
-        from qtools.lib.qlb_factory import get_plate
+        from qtools.lib.peakstore import config_peak_store
         from pyqlb.nstats.peaks import fam_amplitudes, vic_amplitudes
         from pyqlb.nstats.well import accepted_peaks
         from pyqlb.factory import peak_dtype
@@ -1366,7 +1360,7 @@ class PlateController(BaseController):
             source = QLPReprocessedFileSource(config['qlb.reprocess_root'], c.reprocess_config)
             path = source.full_path(c.analysis_group, c.plate)
         
-        qlplate = get_plate(path)
+        qlplate = config_peak_store(config).plate(path)
 
         with_well_names = request.params.get('with_well_names', None)
 
@@ -1871,12 +1865,12 @@ class PlateController(BaseController):
 
         :param id: The id of the plate.
         """
-        from qtools.lib.qlb_factory import get_plate
+        from qtools.lib.peakstore import config_peak_store
         self.__setup_db_context(int(id))
         self.__setup_reprocess_context(c.plate)
         path = self.__plate_path()
 
-        plate = get_plate(path)
+        plate = config_peak_store(config).plate(path)
         return plate
     
     
@@ -1890,6 +1884,8 @@ class PlateController(BaseController):
         if plate is None:
             abort(404)
         
+        if plate.qlbplate:
+            remove_plate_run_stats(plate.qlbplate)
         Session.delete(plate)
         Session.commit()
         session['flash'] = 'Plate deleted.'
@@ -1901,17 +1897,67 @@ class PlateController(BaseController):
     def galaxy(self, id=None, *args, **kwargs):
         from qtools.lib.mplot import multi_galaxy, cleanup, render as plt_render
 
-        plate = self.__qlplate_from_plate_version_form(id)
-        wells = plate.analyzed_wells.values()
         channel_idx = int(request.params.get("channel", 0))
-
+        self.__setup_db_context(int(id))
+        self.__setup_reprocess_context(c.plate)
         title = 'Galaxy Plate - %s, %s' % (c.plate.name, 'VIC' if channel_idx == 1 else 'FAM')
-        fig = multi_galaxy(title, wells, channel=channel_idx, draw_threshold=True, draw_width_gates=True)
+
+        # draw from the galaxy tiles written at scan time, if there are tiles
+        # for all the wells; otherwise read the plate
+        histogram = self.__galaxy_tile_histogram(channel_idx)
+        if histogram is not None:
+            channels = [w.channels[channel_idx] for w in c.plate.qlbplate.wells if len(w.channels) > channel_idx]
+            fig = multi_galaxy(title, [], channel=channel_idx, draw_threshold=True, draw_width_gates=True,
+                               histogram=histogram,
+                               custom_thresholds=[ch.quantitation_threshold for ch in channels if ch.quantitation_threshold],
+                               custom_width_gates=[(ch.min_width_gating, ch.max_width_gating) for ch in channels])
+        else:
+            plate = self.__qlplate_from_plate_version_form(id)
+            wells = plate.analyzed_wells.values()
+            fig = multi_galaxy(title, wells, channel=channel_idx, draw_threshold=True, draw_width_gates=True)
         response.content_type = 'image/png'
         imgdata = plt_render(fig, dpi=72)
         cleanup(fig)
         return imgdata
     
+    @jsonify
+    @validate(schema=PlateVersionForm(), post_only=False, on_get=True)
+    @block_contractor_internal_plates
+    def galaxy_data(self, id=None, *args, **kwargs):
+        """
+        Return the plate galaxy as a JSON density grid, for drawing in the
+        browser (see qtools.lib.plotdata).
+        """
+        import numpy as np
+        from qtools.lib.galaxytile import wells_galaxy_histogram, GALAXY_HEIGHT, GALAXY_WIDTH
+        from qtools.lib.plotdata import galaxy_grid_data
+
+        channel_idx = int(request.params.get("channel", 0))
+        self.__setup_db_context(int(id))
+        self.__setup_reprocess_context(c.plate)
+
+        histogram = self.__galaxy_tile_histogram(channel_idx)
+        if histogram is None:
+            plate = self.__qlplate_from_plate_version_form(id)
+            histogram = wells_galaxy_histogram(plate.analyzed_wells.values(), channel_idx)
+            if histogram is None:
+                histogram = np.zeros((GALAXY_HEIGHT, GALAXY_WIDTH))
+        return galaxy_grid_data(histogram, plot='galaxy', title=c.plate.name, channel=channel_idx)
+    
+    def __galaxy_tile_histogram(self, channel_idx, **kwargs):
+        """
+        Returns the sum of the galaxy tiles of the wells of the current
+        plate, or None if the plate is reprocessed or any tile is missing.
+        """
+        from qtools.lib.galaxytile import composite_galaxy_histogram
+        if c.reprocess_config or not c.plate.qlbplate:
+            return None
+        
+        image_source = QLBImageSource(config['qlb.image_store'])
+        qlbplate = c.plate.qlbplate
+        return composite_galaxy_histogram(image_source, [(qlbplate.id, w.well_name) for w in qlbplate.wells],
+                                          channel_idx, **kwargs)
+    
     @validate(schema=PlateVersionForm(), post_only=False, on_get=True)
     @block_contractor_internal_plates
     def carryover(self, id=None, *args, **kwargs):
@@ -1933,8 +1979,10 @@ class PlateController(BaseController):
             carryover_computer.contamination_carryover_peaks(plate)
         
         title = 'Carryover - %s, %s (%sw)' % (c.plate.name, 'VIC' if channel_idx == 1 else 'FAM', num_wells)
+        histogram = self.__galaxy_tile_histogram(channel_idx, all_peaks=False, quality_gate=quality_gate)
         fig = galaxy_carryover(title, wells, all_contamination, gated_contamination, carryover,
-                               channel=channel_idx, draw_threshold=True, draw_width_gates=True, quality_gate=quality_gate)
+                               channel=channel_idx, draw_threshold=True, draw_width_gates=True, quality_gate=quality_gate,
+                               histogram=histogram)
         response.content_type = 'image/png'
         imgdata = plt_render(fig, dpi=72)
         cleanup(fig)
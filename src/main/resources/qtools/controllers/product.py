@@ -3,13 +3,14 @@ from unidecode import unidecode
 
 from pylons import request, response, session, tmpl_context as c, url, config
 from pylons.controllers.util import abort, redirect, forward
-from pylons.decorators import validate
+from pylons.decorators import validate, jsonify
 from pylons.decorators.rest import restrict
 from paste.fileapp import FileApp
 
 import qtools.lib.helpers as h
 import qtools.lib.fields as fl
 from qtools.lib.base import BaseController, render
+from qtools.lib.carryover import carryover_trend, carryover_outliers
 from qtools.lib.decorators import help_at
 from qtools.lib.storage import QSAlgorithmSource
 from qtools.lib.upload import save_plate_from_upload_request
@@ -280,6 +281,33 @@ class ProductController(BaseController):
 
         return render('/product/carryover_results.html')
 
+    @jsonify
+    def carryover_history(self, id=None):
+        """
+        The daily carryover and the carryover outlier wells of a reader,
+        from the carryover records (see the analyze-carryover command).
+        """
+        box2 = Session.query(Box2).get(id)
+        if not box2:
+            abort(404)
+
+        trend = carryover_trend(box2.id)
+        outliers = carryover_outliers(box2.id)
+        return {'reader': box2.name,
+                'trend': [{'day': day.strftime('%Y-%m-%d'),
+                           'wells': wells,
+                           'positives': positives,
+                           'events': events} for day, wells, positives, events in trend],
+                'outliers': [{'plate_id': record.plate_id,
+                              'plate': record.plate.name if record.plate else None,
+                              'well': record.well.well_name,
+                              'source_well': record.source_well.well_name,
+                              'source_concentration': record.source_concentration,
+                              'distance': record.distance,
+                              'run_time': record.host_datetime.strftime('%Y-%m-%d %H:%M:%S'),
+                              'positives': record.positives,
+                              'events': record.events} for record in outliers]}
+
     def __setup_batch_fields(self):
         c.people = fl.person_field()
         c.dg_method = dg_method_field()
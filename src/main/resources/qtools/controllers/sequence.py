@@ -11,6 +11,7 @@ from qtools.controllers import populate_multiform_context
 
 from qtools.lib.base import BaseController, render
 from qtools.lib.collection import groupinto, AttrDict
+from qtools.lib.intervals import overlap_criterion
 from qtools.lib.decorators import session_validate, session_validate_flow, session_clear_startswith, multi_validate, flash_if_form_errors
 import qtools.lib.helpers as h
 import qtools.lib.helpers.sequence as seqh
@@ -22,6 +23,7 @@ from qtools.messages.sequence import *
 
 from qtools.model import Person, Session, QLBWellChannel, QLBWell, QLBPlate, Plate
 from qtools.model.sequence import Sequence, SequenceGroup, SequenceGroupComponent, SequenceGroupTag, Amplicon, AmpliconSequenceCache, SequenceGroupCondition
+from qtools.model.sequence.interaction import compute_oligo_interactions, sequence_group_interactions
 from qtools.model.sequence.pcr import pcr_sequences_snps_for_group, transcript_sequences_snps_for_group
 from qtools.model.sequence.util import sequence_group_unlink_sequences, active_sequence_group_query
 
@@ -300,7 +302,8 @@ class SequenceController(BaseController):
     def __frontload_sequence_group_list_query(self, query):
         query = query.options(joinedload_all(SequenceGroup.owner),
                               joinedload_all(SequenceGroup.tags),
-                              joinedload_all(SequenceGroup.conditions))
+                              joinedload_all(SequenceGroup.conditions),
+                              joinedload_all(SequenceGroup.probes))
         return query
 
     def __form_to_list_query(self, form):
@@ -336,8 +339,10 @@ class SequenceController(BaseController):
         location = form['location']
         query = active_sequence_group_query().join(Amplicon, AmpliconSequenceCache)\
                                             .filter(and_(AmpliconSequenceCache.chromosome == form['chromosome'],
-                                                    or_(AmpliconSequenceCache.start_pos.between(location-10000, location+10000),
-                                                        AmpliconSequenceCache.end_pos.between(location-10000, location+10000))))\
+                                                         overlap_criterion(AmpliconSequenceCache.bin,
+                                                                           AmpliconSequenceCache.start_pos,
+                                                                           AmpliconSequenceCache.end_pos,
+                                                                           location-within, location+within)))\
                                             .distinct()
         query = self.__frontload_sequence_group_list_query(query.order_by(SequenceGroup.name))
         return query
@@ -348,6 +353,7 @@ class SequenceController(BaseController):
         query = active_sequence_group_query().order_by(SequenceGroup.name)
         query = self.__frontload_sequence_group_list_query(query)
         c.groups = query.all()
+        c.oligo_interactions = sequence_group_interactions(c.groups)
         c.tab    = 'list'
         response = render('/sequence/list.html')
         return h.render_bootstrap_form(response)
@@ -357,6 +363,7 @@ class SequenceController(BaseController):
         # TODO pagination
         self.__setup_list_context()
         c.groups = self.__form_to_list_query(self.form_result).all()
+        c.oligo_interactions = sequence_group_interactions(c.groups)
         c.tab    = 'list'
         response = render('/sequence/list.html')
         # TODO: need to do from_python?
@@ -367,6 +374,7 @@ class SequenceController(BaseController):
         # TODO pagination
         self.__setup_list_context()
         c.groups = self.__form_to_search_query(self.form_result).all()
+        c.oligo_interactions = sequence_group_interactions(c.groups)
         c.tab    = 'search'
         response = render('/sequence/list.html')
         # TODO: need to do from_python?
@@ -377,6 +385,7 @@ class SequenceController(BaseController):
         query = active_sequence_group_query().filter_by(approved_for_release=True).order_by(SequenceGroup.name)
         query = self.__frontload_sequence_group_list_query(query)
         c.groups = query.all()
+        c.oligo_interactions = sequence_group_interactions(c.groups)
         c.tab    = 'list'
         response = render('/sequence/approved_list.html')
         return h.render_bootstrap_form(response)
@@ -385,6 +394,7 @@ class SequenceController(BaseController):
         self.__setup_list_context()
         c.tab = 'locate'
         c.groups = []
+        c.oligo_interactions = dict()
         return render('/sequence/list.html')
 
     @validate(schema=AssayLocationForm(), form='_list_locate_base', post_only=False, on_get=True, error_formatters=h.tw_bootstrap_error_formatters)
@@ -392,6 +402,7 @@ class SequenceController(BaseController):
         # TODO pagination
         self.__setup_list_context()
         c.groups = self.__form_to_locate_query(self.form_result).all()
+        c.oligo_interactions = sequence_group_interactions(c.groups)
         c.tab    = 'locate'
         response = render('/sequence/list.html')
         # TODO: need to do from_python?
@@ -605,6 +616,16 @@ class SequenceController(BaseController):
         c.status = dict(SequenceGroup.status_display_options()).get(session[flow]['status'], h.literal('&nbsp;'))
         c.chemistry_type = dict(SequenceGroup.chemistry_type_display_options()).get(session[flow]['chemistry'], h.literal('&nbsp;'))
 
+        if c.show_primer_table:
+            oligos = []
+            for role, collection in ((SequenceGroupComponent.FORWARD_PRIMER, 'forward_primers'),
+                                     (SequenceGroupComponent.REVERSE_PRIMER, 'reverse_primers'),
+                                     (SequenceGroupComponent.PROBE, 'probes')):
+                oligos.extend([((collection, idx), role, oligo.get('sequence', None))
+                                   for idx, oligo in enumerate(session[flow].get(collection, None) or [])])
+            max_overlap = compute_oligo_interactions([oligos])[0].max_overlap
+            c.max_oligo_overlap = max_overlap[1] if max_overlap else None
+
         if c.show_location_table:
             c.chromosome      = session[flow]['chromosome']
             c.location        = session[flow]['location']
@@ -908,6 +929,7 @@ class SequenceController(BaseController):
         c.tab = 'validation'
         c.display_mode = 'transcript' if c.sequence_group.type == SequenceGroup.ASSAY_TYPE_GEX else 'amplicon'
         c.snp_mode = c.sequence_group.type == SequenceGroup.ASSAY_TYPE_SNP
+        c.oligo_interactions = c.sequence_group.oligo_interactions
 
         c.sequences = []
         c.transcripts = []
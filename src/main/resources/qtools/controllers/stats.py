@@ -9,7 +9,7 @@ from qtools.lib.base import BaseController, render
 from qtools.lib.wowo import wowo
 from qtools.lib.helpers import week_bounds, midnight, second_before_midnight
 
-from qtools.model import Session, QLBPlate, QLBWell, Project, Person, Plate, Box2, Experiment
+from qtools.model import Session, QLBPlate, QLBWell, Project, Person, Plate, Box2, Experiment, PlateRunStats, ReaderDayStats
 
 from sqlalchemy import and_
 from sqlalchemy.sql import func
@@ -20,72 +20,74 @@ log = logging.getLogger(__name__)
 
 def plate_events_for_range(start, end):
     plate_query = QLBPlate.filter_by_host_datetime(Session.query(QLBPlate,
-                                                                 func.sum(QLBWell.event_count).label('total_count')).
-                                                           join(QLBWell).\
+                                                                 PlateRunStats.events.label('total_count')).
+                                                           join(QLBPlate.run_stats).\
                                                            join(QLBPlate.plate).\
                                                            join(Plate.box2).\
-                                                           filter(and_(QLBPlate.plate_id != None,
-                                                                       QLBWell.file_id != None)),
-                                                   start, end).group_by(QLBWell.plate_id)
+                                                           filter(PlateRunStats.wells > 0),
+                                                   start, end)
     return plate_query.all()
 
+def day_events_for_range(start, end):
+    """
+    Return a list of (day, total_count) for the days in the specified
+    range, from the reader/day rollups.
+    """
+    day_query = Session.query(ReaderDayStats.day,
+                              func.sum(ReaderDayStats.events).label('total_count')).\
+                        filter(and_(ReaderDayStats.box2_id != None,
+                                    ReaderDayStats.day >= start.date(),
+                                    ReaderDayStats.day <= end.date())).\
+                        group_by(ReaderDayStats.day)
+    return day_query.all()
+
 def time_events(start, end):
-    plate_query = QLBPlate.filter_by_host_datetime(Session.query(QLBPlate,
-                                                                 func.sum(QLBWell.event_count).label('total_count')).
-                                                           join(QLBWell).\
-                                                           join(QLBPlate.plate).\
-                                                           join(Plate.box2).\
-                                                           filter(and_(QLBPlate.plate_id != None,
-                                                                       QLBWell.file_id != None)),
-                                                    start, end)
+    plate_query = Session.query(func.sum(PlateRunStats.events)).\
+                          join(PlateRunStats.box2).\
+                          filter(and_(PlateRunStats.host_datetime >= start,
+                                      PlateRunStats.host_datetime <= end))
     
     if wowo('contractor'):
         plate_query = plate_query.filter(Box2.prod_query())
-    return sum([total_count or 0 for plate, total_count in plate_query.all()])
+    return int(plate_query.scalar() or 0)
 
 def total_events():
-    plate_query = Session.query(QLBPlate,
-                                func.sum(QLBWell.event_count).label('total_count')).\
-                                join(QLBWell).\
-                                join(QLBPlate.plate).\
-                                join(Plate.box2).\
-                                filter(and_(QLBPlate.plate_id != None, QLBWell.file_id != None)).\
-                                group_by(QLBWell.plate_id)
+    # from the per-plate stats, not the day rollups: plates without a
+    # host datetime have no day, but still count toward the total
+    plate_query = Session.query(func.sum(PlateRunStats.events)).\
+                          join(PlateRunStats.box2)
     if wowo('contractor'):
         plate_query = plate_query.filter(Box2.prod_query())
-    return sum([total_count or 0 for plate, total_count in plate_query.all()])
+    return int(plate_query.scalar() or 0)
 
 
 def plate_runtimes_for_box_range(start, end):
     plate_query = QLBPlate.filter_by_host_datetime(Session.query(QLBPlate,
-                                                                 func.min(QLBWell.host_datetime).label('start_time'),
-                                                                 func.max(QLBWell.host_datetime).label('end_time')).
-                                                           join(QLBWell).\
+                                                                 PlateRunStats.start_time.label('start_time'),
+                                                                 PlateRunStats.end_time.label('end_time')).
+                                                           join(QLBPlate.run_stats).\
                                                            join(QLBPlate.plate).\
                                                            join(Plate.box2).\
-                                                           filter(and_(QLBPlate.plate_id != None,
-                                                                       QLBWell.file_id != None)),
-                                                   start, end).group_by(QLBWell.plate_id).options(joinedload_all('plate.box2', innerjoin=True),
-                                                                                                  joinedload_all('plate.operator'))
+                                                           filter(and_(PlateRunStats.start_time != None,
+                                                                       PlateRunStats.end_time != None)),
+                                                   start, end).options(joinedload_all('plate.box2', innerjoin=True),
+                                                                       joinedload_all('plate.operator'))
     if wowo('contractor'):
         plate_query = plate_query.filter(Box2.prod_query())
-    runtimes = plate_query.all()
-    # TODO: engineer quick fix for this
-    return [runtime for runtime in runtimes if runtime.start_time and runtime.end_time]
+    return plate_query.all()
 
 
 def plate_runtimes_for_operator_range(start, end):
     plate_query = QLBPlate.filter_by_host_datetime(Session.query(QLBPlate,
-                                                                 func.count(QLBWell).label('wells'),
-                                                                 func.sum(func.if_(QLBWell.event_count >= 1000, 1, 0)).label('data_wells'),
-                                                                 func.sum(QLBWell.event_count).label('data_well_events')).
-                                                           join(QLBWell).\
+                                                                 PlateRunStats.wells.label('wells'),
+                                                                 PlateRunStats.data_wells.label('data_wells'),
+                                                                 PlateRunStats.events.label('data_well_events')).
+                                                           join(QLBPlate.run_stats).\
                                                            join(QLBPlate.plate).\
                                                            join(Plate.box2).\
-                                                           filter(and_(QLBPlate.plate_id != None,
-                                                                       QLBWell.file_id != None)),
-                                                   start, end).group_by(QLBWell.plate_id).options(joinedload_all('plate.box2', innerjoin=True),
-                                                                                                  joinedload_all('plate.operator'))
+                                                           filter(PlateRunStats.wells > 0),
+                                                   start, end).options(joinedload_all('plate.box2', innerjoin=True),
+                                                                       joinedload_all('plate.operator'))
     if wowo('contractor'):
         plate_query = plate_query.filter(Box2.prod_query())
     return plate_query.all()
@@ -112,12 +114,12 @@ class StatsController(BaseController):
 
     def index(self):
         
+        weeks = [week_bounds(-1*i) for i in range(5)]
+        day_events = day_events_for_range(weeks[-1][0], weeks[0][1])
         events_by_week = []
-        for i in range(5):
-            weeks_ago = -1*i
-            plates = plate_events_for_week(weeks_ago)
-            droplet_sum = sum([num_events or 0 for plate, num_events in plates])
-            week_begin, week_end = week_bounds(weeks_ago)
+        for week_begin, week_end in weeks:
+            droplet_sum = sum([num_events or 0 for day, num_events in day_events \
+                               if week_begin.date() <= day <= week_end.date()])
             events_by_week.append((week_begin, week_end, droplet_sum))
         
         c.events_by_week = events_by_week
@@ -219,11 +219,11 @@ class WellController(BaseController):
         return render('/well/view.html')
     
     def __qlwell_from_threshold_form(self, id):
-        from qtools.lib.qlb_factory import get_plate
+        from qtools.lib.peakstore import config_peak_store
 
         self.__setup_db_context(int(id))
         path = self.__plate_path()
-        plate = get_plate(path)
+        plate = config_peak_store(config).plate(path)
 
         qlwell = plate.analyzed_wells.get(c.well.well_name, None)
         if not qlwell:
@@ -494,6 +494,51 @@ class WellController(BaseController):
         cleanup(fig)
         return imgdata
     
+    @jsonify
+    @validate(schema=ThresholdForm(), post_only=False, on_get=True)
+    @block_contractor_internal_wells
+    def plot_data(self, id=None, *args, **kwargs):
+        """
+        Return the data behind a well plot as JSON, for drawing in the
+        browser (see qtools.lib.plotdata).  The plot parameter picks the
+        plot: amphist, amptime, width, galaxy, cluster2d or temporal.
+        """
+        import qtools.lib.plotdata as pd
+        from qtools.lib.nstats.peaks import accepted_peaks, above_min_amplitude_peaks
+        from pyqlb.nstats.well import well_static_width_gates
+
+        plot = request.params.get('plot', None)
+        if plot not in ('amphist', 'amptime', 'width', 'galaxy', 'cluster2d', 'temporal'):
+            abort(404)
+
+        qlwell = self.__qlwell_from_threshold_form(id)
+        self.__set_threshold_context(qlwell)
+        channel = int(request.params.get('channel', 0))
+        threshold = c.vic_threshold if channel == 1 else c.fam_threshold
+
+        if plot == 'amphist':
+            data = pd.amphist_data(accepted_peaks(qlwell), channel, threshold)
+        elif plot == 'amptime':
+            data = pd.amptime_data(qlwell.peaks, channel, threshold)
+        elif plot == 'width':
+            data = pd.width_data(qlwell.peaks, qlwell.channels[0].statistics.min_width_gate,
+                                 qlwell.channels[0].statistics.max_width_gate)
+        elif plot == 'galaxy':
+            min_width_gate, max_width_gate = well_static_width_gates(qlwell)
+            data = pd.galaxy_data(above_min_amplitude_peaks(qlwell), channel, threshold, min_width_gate, max_width_gate)
+        elif plot == 'cluster2d':
+            max_amplitudes = [self.form_result['max_fam_amplitude'], self.form_result['max_vic_amplitude']]
+            data = pd.cluster2d_data(accepted_peaks(qlwell), (c.fam_threshold, c.vic_threshold),
+                                     (-2000,-2000,max_amplitudes[1],max_amplitudes[0]),
+                                     use_manual_clusters=not well_channel_automatic_classification(qlwell))
+        else:
+            data = pd.temporal_data(qlwell.peaks, channel, qlwell.channels[channel].statistics.min_width_gate,
+                                    qlwell.channels[channel].statistics.max_width_gate)
+
+        data['plot'] = plot
+        data['title'] = '%s - %s' % (c.well.plate.plate.name, c.well.well_name)
+        return data
+    
     @validate(schema=ThresholdForm(), post_only=False, on_get=True)
     @block_contractor_internal_wells
     def galaxy_disperse(self, id=None, *args, **kwargs):
@@ -748,15 +793,14 @@ class WellController(BaseController):
     def svilen(self, id=None, *args, **kwargs):
         from pyqlb.nstats.well import accepted_peaks
         from pyqlb.nstats.peaks import cluster_2d, peak_times, fam_widths
-        from pyqlb.factory import QLNumpyObjectFactory
         from qtools.lib.mplot import svilen, cleanup, render as plt_render
+        from qtools.lib.rawtrace import config_trace_source
 
         qlwell = self.__qlwell_from_threshold_form(id)
         self.__set_threshold_context(qlwell)
         well_path = self.__well_path()
-        # oh shit
-        factory = QLNumpyObjectFactory()
-        raw_well = factory.parse_well(well_path)
+        # only the droplet windows are read from the raw trace
+        trace = config_trace_source(config).trace(well_path)
 
         crap, crap, gold, crap = cluster_2d(accepted_peaks(qlwell), c.fam_threshold,
                                             c.vic_threshold)
@@ -774,7 +818,7 @@ class WellController(BaseController):
             title = "%s (truncated at first 100)" % title
 
         
-        fig = svilen(title, raw_well.samples, ranges, widths)
+        fig = svilen(title, trace.windows(ranges), ranges, widths)
         response.content_type = 'image/png'
         imgdata = plt_render(fig, dpi=72)
         cleanup(fig)
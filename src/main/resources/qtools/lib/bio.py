@@ -3,22 +3,7 @@ Basic biological/sequence methods, operations, and classes.
 """
 import re, operator
 
-# there might be a way to make this quicker with encoding and
-# bit shifting, but that's really premature optimization.
-COMPLIMENTS = {'A': 'T',
-               'T': 'A',
-               'C': 'G',
-               'G': 'C',
-               'U': 'A',
-               'a': 't',
-               't': 'a',
-               'c': 'g',
-               'g': 'c',
-               'u': 'a',
-               '?': '?'}
-               
-BASE_RE = re.compile(r'[ATCGU\?atcgux]')
-CG_CONTENT_RE = re.compile(r'[CG]')
+from qtools.lib import seqops
 
 def antiparallel(sequence):
     """
@@ -61,9 +46,9 @@ def complement(sequence):
     if not sequence:
         return sequence
     
-    upseq = sequence.upper()
-    # is there a better way to do this?  match object seems heavy
-    return re.sub(BASE_RE, lambda m: COMPLIMENTS[m.group(0)], upseq)
+    return seqops.translate(sequence.upper(),
+                            seqops.UNAMBIGUOUS_COMPLEMENT_TABLE,
+                            seqops.UNAMBIGUOUS_COMPLEMENT_UNICODE_TABLE)
 
 REGEXP_SUB_MAP = {'R': '[AG]',
                   'Y': '[CT]',
@@ -106,9 +91,7 @@ def gc_content(seq):
 
     Strips out trailing and leading spaces, just in case.
     """
-    upseq = seq.strip().upper()
-    instances = CG_CONTENT_RE.findall(upseq)
-    return float(len(instances))/len(upseq)
+    return seqops.gc_content(seq)
 
 def maximal_binding_seq(oligo1, oligo2):
     """
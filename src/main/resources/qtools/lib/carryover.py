@@ -0,0 +1,299 @@
+"""
+Carryover analysis over the run history of each reader.
+
+An empty well -- an NTC well (CARRYOVER_NTC_SAMPLE_NAMES), or one of
+the wells that CarryoverPlateMetric measures carryover in
+(CARRYOVER_EMPTY_SAMPLE_NAMES) -- is counted as a carryover well when
+the most recent non-empty well run before it on the same reader --
+on the same plate or on an earlier one -- was a high-concentration
+well.  The positives found in carryover wells are persisted as
+CarryoverWell records, so that per-reader trends and outliers are
+queries over those records instead of a pass over every plate.
+
+The wells of each reader are read in run order, in windows of
+CARRYOVER_BATCH_SIZE wells, and the source well of every empty well in
+a window is found with array operations rather than plate by plate.
+How far each reader has been read is recorded as a CarryoverWatermark,
+so that update_carryover only reads the wells run since.
+"""
+from collections import defaultdict
+
+import numpy as np
+
+from sqlalchemy import and_, or_, desc
+from sqlalchemy.orm import joinedload_all
+
+from qtools.constants.metrics import CARRYOVER_EMPTY_SAMPLE_NAMES, CARRYOVER_NTC_SAMPLE_NAMES
+from qtools.model import Session, Plate, QLBPlate, QLBWell, QLBWellChannel, CarryoverWell, CarryoverWatermark
+
+# copies/uL at or above which a well counts as a carryover source.
+HIGH_CONCENTRATION = 1000
+
+# the sample names of the wells that can be carryover wells.
+EMPTY_SAMPLE_NAMES = CARRYOVER_EMPTY_SAMPLE_NAMES+CARRYOVER_NTC_SAMPLE_NAMES
+
+# wells read (and held in memory) at a time.
+CARRYOVER_BATCH_SIZE = 5000
+
+# carryover wells with more positives than the reader median plus this many
+# (scaled) median absolute deviations are outliers...
+OUTLIER_MADS = 3.0
+
+# ...provided they have at least this many positives.
+OUTLIER_MIN_POSITIVES = 3
+
+# scales the median absolute deviation to a standard deviation estimate.
+MAD_SCALE = 1.4826
+
+def carryover_well_query(channel_num=0):
+    """
+    Query for (well_id, sample_name, host_datetime, event_count,
+    concentration, positive_peaks, plate_id, box2_id) of the analyzed
+    wells on readers, for the specified channel.
+    """
+    return Session.query(QLBWell.id,
+                         QLBWell.sample_name,
+                         QLBWell.host_datetime,
+                         QLBWell.event_count,
+                         QLBWellChannel.concentration,
+                         QLBWellChannel.positive_peaks,
+                         Plate.id,
+                         Plate.box2_id).\
+                   join(QLBWell.channels).\
+                   join(QLBWell.plate).\
+                   join(QLBPlate.plate).\
+                   filter(and_(QLBWellChannel.channel_num == channel_num,
+                               QLBWell.file_id != None,
+                               QLBWell.host_datetime != None,
+                               Plate.box2_id != None))
+
+def find_carryover(box2_ids, is_empty, concentrations, high_concentration=HIGH_CONCENTRATION):
+    """
+    Find the carryover wells in a sequence of wells sorted by reader and
+    run order.
+
+    :param box2_ids: The reader of each well.
+    :param is_empty: Whether each well is an empty well.
+    :param concentrations: The concentration of each well (NaN if unknown).
+    :param high_concentration: The minimum concentration of a source well.
+    :return: (carryover well indices, source well indices, distances), where
+             distance is the number of wells run since the source well.
+    """
+    box2_ids = np.asarray(box2_ids)
+    is_empty = np.asarray(is_empty, dtype=bool)
+    concentrations = np.nan_to_num(np.asarray(concentrations, dtype=float))
+    if len(is_empty) == 0:
+        empty = np.zeros(0, dtype=int)
+        return empty, empty, empty
+
+    order = np.arange(len(is_empty))
+    # most recent non-empty well at or before each well
+    last_source = np.maximum.accumulate(np.where(is_empty, -1, order))
+    # the first well of each well's reader
+    reader_starts = np.concatenate(([0], np.flatnonzero(box2_ids[1:] != box2_ids[:-1])+1))
+    well_reader_start = reader_starts[np.searchsorted(reader_starts, order, side='right')-1]
+
+    carryover = is_empty & (last_source >= well_reader_start)
+    carryover[carryover] = concentrations[last_source[carryover]] >= high_concentration
+    indices = np.flatnonzero(carryover)
+    sources = last_source[indices]
+    return indices, sources, indices-sources
+
+def _is_empty(row):
+    return row[1] in EMPTY_SAMPLE_NAMES
+
+def _after(row):
+    # wells run after the specified well row, in (host_datetime, id) order
+    return or_(QLBWell.host_datetime > row[2],
+               and_(QLBWell.host_datetime == row[2], QLBWell.id > row[0]))
+
+def _wells_since_source(box2_id, before, channel_num):
+    """
+    Return the rows of the last non-empty well run on a reader before
+    the specified time, and of the (empty) wells run after it, so that
+    the wells analyzed from that time on get their sources and distances.
+    """
+    source = carryover_well_query(channel_num).\
+                 filter(and_(Plate.box2_id == box2_id,
+                             QLBWell.host_datetime < before,
+                             or_(QLBWell.sample_name == None,
+                                 ~QLBWell.sample_name.in_(EMPTY_SAMPLE_NAMES)))).\
+                 order_by(desc(QLBWell.host_datetime), desc(QLBWell.id)).first()
+    if not source:
+        return []
+    return [source]+carryover_well_query(channel_num).\
+                        filter(and_(Plate.box2_id == box2_id,
+                                    QLBWell.host_datetime < before,
+                                    _after(source))).\
+                        order_by(QLBWell.host_datetime, QLBWell.id).all()
+
+def analyze_reader_carryover(box2_id, since=None, channel_num=0, high_concentration=HIGH_CONCENTRATION,
+                             batch_size=CARRYOVER_BATCH_SIZE):
+    """
+    Find the carryover wells on a reader and replace their CarryoverWell
+    records, reading the wells in windows of batch_size.  If since is
+    specified, only wells run since then are analyzed; the last non-empty
+    well before then is still used as a source.  Records how far the
+    reader was read in its CarryoverWatermark.  The caller is responsible
+    for committing.
+
+    Returns the number of carryover wells found.
+    """
+    delete_query = Session.query(CarryoverWell).filter(and_(CarryoverWell.channel_num == channel_num,
+                                                            CarryoverWell.box2_id == box2_id))
+    if since is not None:
+        delete_query = delete_query.filter(CarryoverWell.host_datetime >= since)
+    delete_query.delete(synchronize_session=False)
+
+    # wells before the window, carried for their sources and distances
+    carried = _wells_since_source(box2_id, since, channel_num) if since is not None else []
+    last = None
+    found = 0
+    while True:
+        query = carryover_well_query(channel_num).filter(Plate.box2_id == box2_id)
+        if last is not None:
+            query = query.filter(_after(last))
+        elif since is not None:
+            query = query.filter(QLBWell.host_datetime >= since)
+        rows = query.order_by(QLBWell.host_datetime, QLBWell.id).limit(batch_size).all()
+        if not rows:
+            break
+
+        batch = carried+rows
+        well_ids, sample_names, host_datetimes, event_counts, concentrations, positives, plate_ids, readers = zip(*batch)
+        indices, sources, distances = find_carryover(readers,
+                                                     [_is_empty(row) for row in batch],
+                                                     [conc if conc is not None else np.nan for conc in concentrations],
+                                                     high_concentration=high_concentration)
+        records = [dict(well_id=well_ids[idx],
+                        source_well_id=well_ids[src],
+                        box2_id=box2_id,
+                        plate_id=plate_ids[idx],
+                        channel_num=channel_num,
+                        host_datetime=host_datetimes[idx],
+                        source_concentration=concentrations[src],
+                        distance=int(dist),
+                        positives=positives[idx] or 0,
+                        events=event_counts[idx] or 0)
+                   for idx, src, dist in zip(indices, sources, distances) if idx >= len(carried)]
+        if records:
+            Session.execute(CarryoverWell.__table__.insert(), records)
+        found += len(records)
+
+        # carry the last non-empty well, and the empty wells after it
+        sources = [idx for idx, row in enumerate(batch) if not _is_empty(row)]
+        carried = batch[sources[-1]:] if sources else []
+        last = rows[-1]
+        if len(rows) < batch_size:
+            break
+
+    if last is not None:
+        watermark = Session.query(CarryoverWatermark).filter_by(box2_id=box2_id, channel_num=channel_num).first()
+        if watermark is None:
+            watermark = CarryoverWatermark(box2_id=box2_id, channel_num=channel_num)
+            Session.add(watermark)
+        watermark.analyzed_through = last[2]
+    return found
+
+def analyze_carryover(box2_ids=None, since=None, channel_num=0, high_concentration=HIGH_CONCENTRATION):
+    """
+    Find the carryover wells on the specified readers (all, if None)
+    and replace their CarryoverWell records; see analyze_reader_carryover.
+    The caller is responsible for committing.
+
+    Returns the number of carryover wells found.
+    """
+    if box2_ids is None:
+        box2_ids = [box2_id for (box2_id,) in Session.query(Plate.box2_id).filter(Plate.box2_id != None).distinct()]
+    found = 0
+    for box2_id in box2_ids:
+        found += analyze_reader_carryover(box2_id, since=since, channel_num=channel_num,
+                                          high_concentration=high_concentration)
+    return found
+
+def update_carryover(box2_ids, channel_num=0, high_concentration=HIGH_CONCENTRATION):
+    """
+    Analyze the wells run on the readers since they were last analyzed
+    (their CarryoverWatermark); readers that were never analyzed are
+    analyzed in full.  The caller is responsible for committing.
+
+    Returns the number of carryover wells found.
+    """
+    watermarks = dict(Session.query(CarryoverWatermark.box2_id,
+                                    CarryoverWatermark.analyzed_through).\
+                              filter(and_(CarryoverWatermark.channel_num == channel_num,
+                                          CarryoverWatermark.box2_id.in_(box2_ids))).all()) if box2_ids else dict()
+
+    found = 0
+    for box2_id in box2_ids:
+        # the last analyzed wells are reread, in case more wells were
+        # run in the same second
+        found += analyze_reader_carryover(box2_id, since=watermarks.get(box2_id), channel_num=channel_num,
+                                          high_concentration=high_concentration)
+    return found
+
+def _carryover_filter(query, box2_id, start, end, channel_num, max_distance):
+    query = query.filter(CarryoverWell.channel_num == channel_num)
+    if box2_id is not None:
+        query = query.filter(CarryoverWell.box2_id == box2_id)
+    if start is not None:
+        query = query.filter(CarryoverWell.host_datetime >= start)
+    if end is not None:
+        query = query.filter(CarryoverWell.host_datetime <= end)
+    if max_distance is not None:
+        query = query.filter(CarryoverWell.distance <= max_distance)
+    return query
+
+def carryover_trend(box2_id, start=None, end=None, channel_num=0, max_distance=1):
+    """
+    Return the daily carryover on a reader, as a list of
+    (day, carryover wells, positives, events) tuples in day order.
+
+    :param max_distance: Only count empty wells run at most this many wells
+                         after their source well (None for all).
+    """
+    query = _carryover_filter(Session.query(CarryoverWell.host_datetime,
+                                             CarryoverWell.positives,
+                                             CarryoverWell.events),
+                               box2_id, start, end, channel_num, max_distance)
+    days = defaultdict(lambda: [0, 0, 0])
+    for host_datetime, positives, events in query:
+        day = days[host_datetime.date()]
+        day[0] += 1
+        day[1] += positives
+        day[2] += events
+    return [(day, wells, positives, events) for day, (wells, positives, events) in sorted(days.items())]
+
+def carryover_outliers(box2_id=None, start=None, end=None, channel_num=0, max_distance=1,
+                       mads=OUTLIER_MADS, min_positives=OUTLIER_MIN_POSITIVES):
+    """
+    Return the CarryoverWell records with an unusual number of positives
+    for their reader (more than the reader median plus `mads` scaled
+    median absolute deviations, and at least min_positives), most
+    recent first.
+    """
+    query = _carryover_filter(Session.query(CarryoverWell.id,
+                                             CarryoverWell.box2_id,
+                                             CarryoverWell.positives),
+                               box2_id, start, end, channel_num, max_distance)
+    reader_positives = defaultdict(list)
+    for id, reader_id, positives in query:
+        reader_positives[reader_id].append((id, positives))
+
+    outlier_ids = []
+    for reader_id, records in reader_positives.items():
+        ids = np.array([id for id, positives in records])
+        positives = np.array([positives for id, positives in records], dtype=float)
+        median = np.median(positives)
+        spread = MAD_SCALE*np.median(np.abs(positives-median))
+        outliers = (positives > median+mads*spread) & (positives >= min_positives)
+        outlier_ids.extend(ids[outliers].tolist())
+    if not outlier_ids:
+        return []
+
+    return Session.query(CarryoverWell).\
+                   filter(CarryoverWell.id.in_(outlier_ids)).\
+                   options(joinedload_all(CarryoverWell.well),
+                           joinedload_all(CarryoverWell.source_well),
+                           joinedload_all(CarryoverWell.plate)).\
+                   order_by(desc(CarryoverWell.host_datetime)).all()
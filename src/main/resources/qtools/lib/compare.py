@@ -2,6 +2,8 @@
 Methods that can be used as the argument to cmp=
 in sorted(sequence, **cmp) or sequence.sort(**cmp)
 """
+import numpy as np
+
 def pct_diff(attr):
     def cmp(tups):
         o1, o2 = tups
@@ -82,3 +84,51 @@ def compare_anydiff(attr):
         else:
             return 1
     return cmp
+
+# Vectorized counterparts of the methods above, over aligned arrays of
+# original and test values (missing values as NaN); these give the same
+# result as the matching method on every element.
+
+def pct_diff_values(a1, a2):
+    a1, a2 = np.asarray(a1, dtype=float), np.asarray(a2, dtype=float)
+    none1 = np.isnan(a1) | (a1 == 0)
+    none2 = np.isnan(a2) | (a2 == 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct = (a2-a1)/a1
+    return np.where(none1, np.where(none2, 0.0, 1.0),
+                    np.where(np.isnan(a2), -1.0, pct))
+
+def abs_diff_values(a1, a2):
+    a1, a2 = np.asarray(a1, dtype=float), np.asarray(a2, dtype=float)
+    nan1, nan2 = np.isnan(a1), np.isnan(a2)
+    return np.where(nan1, np.where(nan2, 0.0, a2),
+                    np.where(nan2, a1, a2-a1))
+
+def compare_closer_to_one_values(a1, a2):
+    a1, a2 = np.asarray(a1, dtype=float), np.asarray(a2, dtype=float)
+    missing = np.isnan(a1) | np.isnan(a2)
+    return np.where(missing, 0.0, np.abs(a2-1)-np.abs(a1-1))
+
+def compare_closer_to_zero_values(a1, a2):
+    a1, a2 = np.asarray(a1, dtype=float), np.asarray(a2, dtype=float)
+    missing = np.isnan(a1) | np.isnan(a2)
+    return np.where(missing, 0.0, np.abs(a2)-np.abs(a1))
+
+def compare_zero_nonzero_values(a1, a2):
+    a1, a2 = np.asarray(a1, dtype=float), np.asarray(a2, dtype=float)
+    missing = np.isnan(a1) | np.isnan(a2)
+    return np.where(missing | ((a1 != 0) & (a2 != 0)), 0,
+                    np.where(a1 == 0, 1, -1))
+
+def compare_anydiff_values(a1, a2):
+    a1, a2 = np.asarray(a1, dtype=float), np.asarray(a2, dtype=float)
+    same = (a1 == a2) | (np.isnan(a1) & np.isnan(a2))
+    return np.where(same, 0, 1)
+
+# method -> vectorized counterpart
+VALUES_FUNCS = {pct_diff: pct_diff_values,
+                abs_diff: abs_diff_values,
+                compare_closer_to_one: compare_closer_to_one_values,
+                compare_closer_to_zero: compare_closer_to_zero_values,
+                compare_zero_nonzero: compare_zero_nonzero_values,
+                compare_anydiff: compare_anydiff_values}
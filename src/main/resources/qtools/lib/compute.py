@@ -0,0 +1,323 @@
+"""
+Persistent, pooled compute service for RPC requests from the Java
+side of the application.
+
+Requests arrive on an RPC queue (RabbitMQ `rpc_queue` in production)
+as JSON of the form {"command": "tm", "args": {...}}, and are dispatched
+to a pool of long-lived worker processes which have already imported
+NumPy and the QTools libraries.  Up to `prefetch` requests are in
+flight at once; each is answered with {"result": ...} or {"error": ...}.
+
+Messages without a "command" key are treated as the legacy
+{"name", "a", "b"} sum request, and answered with the plain string
+the original rpc_queue consumer returned.
+
+The transport is pluggable: PikaRPCTransport talks to RabbitMQ, and
+InProcessRPCTransport is an in-process stand-in for tests and local
+use that needs no broker.
+"""
+import json, logging, multiprocessing, Queue, time, uuid
+
+from qtools.lib.collection import AttrDict
+
+log = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_NAME = 'rpc_queue'
+DEFAULT_TIMEOUT = 60
+DEFAULT_PREFETCH_PER_PROCESS = 2
+LEGACY_COMMAND = 'sum'
+
+# modules the workers import on startup, so that requests do
+# not pay for the import.
+WARM_MODULES = ('numpy',
+                'qtools.lib.bio',
+                'qtools.lib.seqops',
+                'qtools.lib.dimer',
+                'qtools.lib.tm',
+                'qtools.lib.qlb')
+
+COMMANDS = dict()
+
+# config for commands that need app settings (e.g. the tm utility path);
+# set in each worker by the pool initializer.
+worker_config = dict()
+
+def rpc_command(name):
+    """
+    Decorator which registers a function as an RPC command.  Command
+    arguments are passed as keyword arguments from the request's "args".
+    """
+    def register(func):
+        COMMANDS[name] = func
+        return func
+    return register
+
+@rpc_command('sum')
+def getSum(name, a, b):
+    return '' + name + ', your sum is ' + str(a+b)
+
+@rpc_command('tm')
+def tm(sequence, concentration='2e-07', salt='0.1', mg=None):
+    from qtools.lib.tm import tm_call
+    return tm_call(worker_config, sequence, concentration, salt, mg=mg)
+
+@rpc_command('gc_content')
+def gc_content(sequence):
+    from qtools.lib.seqops import gc_content
+    return gc_content(sequence)
+
+@rpc_command('primer_dimer')
+def primer_dimer(oligos1, oligos2=None):
+    from qtools.lib.dimer import pool_maximal_binding
+    return pool_maximal_binding(oligos1, oligos2)
+
+@rpc_command('well_metrics')
+def well_metrics(qlp_path, well_name, override_thresholds=None):
+    from qtools.lib.qlb import stats_for_qlp_well_path
+    stats = stats_for_qlp_well_path(qlp_path, well_name, override_thresholds=override_thresholds)
+    if stats is None:
+        return None
+    statistics, clusters = stats
+    return statistics
+
+def warm_worker(config=None):
+    """
+    Pool initializer: store the config and import the heavy modules.
+    """
+    import importlib
+    worker_config.update(config or dict())
+    for module in WARM_MODULES:
+        try:
+            importlib.import_module(module)
+        except ImportError, e:
+            log.warning("Compute worker could not import %s: %s" % (module, e))
+
+def execute(command, args):
+    """
+    Run a command in a worker.  Returns ('result', value) or
+    ('error', message); exceptions never propagate into the pool.
+    """
+    func = COMMANDS.get(command)
+    if func is None:
+        return ('error', "Unknown command: %s" % command)
+    try:
+        return ('result', func(**(args or dict())))
+    except Exception, e:
+        log.exception("Compute command %s failed" % command)
+        return ('error', "%s: %s" % (e.__class__.__name__, e))
+
+def json_default(obj):
+    """
+    Serialize NumPy values (scalars and arrays) in results.
+    """
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    raise TypeError, "%r is not JSON serializable" % obj
+
+
+class InProcessRPCTransport(object):
+    """
+    Queue-based stand-in for the RabbitMQ RPC queue.  Honors the
+    prefetch count the same way the broker does: no more than prefetch
+    requests are delivered without being acked.
+    """
+    def __init__(self):
+        self.requests = Queue.Queue()
+        self.replies = dict()
+        self.prefetch = 1
+        self.on_request = None
+        self.unacked = set()
+        self.tag_seq = 0
+
+    def start(self, prefetch, on_request):
+        self.prefetch = prefetch
+        self.on_request = on_request
+
+    def call(self, body):
+        """
+        Client side: queue a request body.  Returns the correlation id
+        to look up the reply with.
+        """
+        correlation_id = str(uuid.uuid4())
+        self.requests.put((correlation_id, body))
+        return correlation_id
+
+    def reply_for(self, correlation_id):
+        """
+        Client side: return (and forget) the reply body for the request,
+        or None if it has not been answered yet.
+        """
+        return self.replies.pop(correlation_id, None)
+
+    def process(self, time_limit=0):
+        deadline = time.time() + time_limit
+        while len(self.unacked) < self.prefetch:
+            remaining = deadline - time.time()
+            try:
+                if remaining > 0:
+                    correlation_id, body = self.requests.get(timeout=remaining)
+                else:
+                    correlation_id, body = self.requests.get_nowait()
+            except Queue.Empty:
+                break
+            self.tag_seq += 1
+            self.unacked.add(self.tag_seq)
+            self.on_request(AttrDict(body=body, correlation_id=correlation_id,
+                                     reply_to=None, delivery_tag=self.tag_seq))
+
+    def reply(self, request, body):
+        self.replies[request.correlation_id] = body
+
+    def ack(self, request):
+        self.unacked.discard(request.delivery_tag)
+
+    def close(self):
+        pass
+
+
+class PikaRPCTransport(object):
+    """
+    RabbitMQ RPC queue transport.  All broker calls happen on the
+    thread that calls process(); pika connections are not thread-safe.
+    """
+    def __init__(self, host='localhost', queue=DEFAULT_QUEUE_NAME):
+        import pika
+        self.pika = pika
+        self.connection = pika.BlockingConnection(pika.ConnectionParameters(host=host))
+        self.channel = self.connection.channel()
+        self.queue = queue
+        self.channel.queue_declare(queue=queue)
+
+    def start(self, prefetch, on_request):
+        def callback(ch, method, props, body):
+            on_request(AttrDict(body=body,
+                                correlation_id=props.correlation_id,
+                                reply_to=props.reply_to,
+                                delivery_tag=method.delivery_tag))
+        self.channel.basic_qos(prefetch_count=prefetch)
+        self.channel.basic_consume(callback, queue=self.queue)
+
+    def process(self, time_limit=0):
+        self.connection.process_data_events(time_limit=time_limit)
+
+    def reply(self, request, body):
+        self.channel.basic_publish(exchange='',
+                                   routing_key=request.reply_to,
+                                   properties=self.pika.BasicProperties(correlation_id=request.correlation_id),
+                                   body=body)
+
+    def ack(self, request):
+        self.channel.basic_ack(delivery_tag=request.delivery_tag)
+
+    def close(self):
+        self.connection.close()
+
+
+class ComputeServer(object):
+    """
+    Serves RPC requests from a transport with a pool of warm worker
+    processes.
+    """
+    def __init__(self, transport, processes=None, prefetch=None, timeout=DEFAULT_TIMEOUT, config=None):
+        """
+        :param transport: The RPC transport (see PikaRPCTransport, InProcessRPCTransport)
+        :param processes: The number of worker processes (default: CPU count)
+        :param prefetch: The number of requests in flight at once (default: 2 per process)
+        :param timeout: Seconds after which a request is answered with a timeout error.
+        :param config: Settings dict passed to the workers (e.g. qtools.bin.tm_util)
+        """
+        self.transport = transport
+        self.processes = processes or multiprocessing.cpu_count()
+        self.prefetch = prefetch or self.processes*DEFAULT_PREFETCH_PER_PROCESS
+        self.timeout = timeout
+        self.config = config or dict()
+        self.pool = None
+        self.pending = []
+        self.orphans = []
+
+    def start(self):
+        self.pool = self.__make_pool()
+        self.transport.start(self.prefetch, self.on_request)
+
+    def stop(self):
+        if self.pool:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        self.transport.close()
+
+    def __make_pool(self):
+        return multiprocessing.Pool(processes=self.processes,
+                                    initializer=warm_worker,
+                                    initargs=(self.config,))
+
+    @staticmethod
+    def parse_request(body):
+        """
+        Return (command, args, legacy) for a request body.
+        """
+        struct = json.loads(body)
+        if 'command' in struct:
+            return struct['command'], struct.get('args') or dict(), False
+        else:
+            return LEGACY_COMMAND, struct, True
+
+    def on_request(self, request):
+        try:
+            command, args, legacy = self.parse_request(request.body)
+        except (ValueError, TypeError), e:
+            self.respond(request, False, ('error', "Invalid request: %s" % e))
+            return
+        result = self.pool.apply_async(execute, (command, args))
+        self.pending.append((request, legacy, result, time.time()+self.timeout))
+
+    def respond(self, request, legacy, outcome):
+        status, value = outcome
+        if legacy:
+            body = str(value)
+        else:
+            body = json.dumps({status: value}, default=json_default)
+        self.transport.reply(request, body)
+        self.transport.ack(request)
+
+    def collect(self):
+        """
+        Answer finished and timed-out requests.
+        """
+        now = time.time()
+        still_pending = []
+        for request, legacy, result, deadline in self.pending:
+            if result.ready():
+                self.respond(request, legacy, result.get())
+            elif now > deadline:
+                log.warning("Compute request timed out after %ss" % self.timeout)
+                self.respond(request, legacy, ('error', "Timed out after %s seconds" % self.timeout))
+                self.orphans.append(result)
+            else:
+                still_pending.append((request, legacy, result, deadline))
+        self.pending = still_pending
+
+        # timed-out tasks keep their worker busy; once they could be holding
+        # every worker, replace the pool.
+        self.orphans = [result for result in self.orphans if not result.ready()]
+        if len(self.orphans) >= self.processes:
+            log.warning("All compute workers stuck on timed-out requests; restarting pool")
+            for request, legacy, result, deadline in self.pending:
+                self.respond(request, legacy, ('error', "Compute pool restarted"))
+            self.pending = []
+            self.orphans = []
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = self.__make_pool()
+
+    def poll(self, time_limit=0.05):
+        """
+        Receive new requests (up to the prefetch count) and answer
+        any that are done.
+        """
+        self.transport.process(time_limit=time_limit)
+        self.collect()
+
+    def serve_forever(self, time_limit=0.05):
+        while True:
+            self.poll(time_limit=time_limit)
@@ -13,7 +13,16 @@ class SequenceSource(object):
         retrieved.
         """
         return NotImplementedError
-    
+
+    def sequences(self, ranges):
+        """
+        The bulk version of sequence: return the sequence of each
+        (chromosome, startpos, endpos) tuple (None where it could not be
+        retrieved).  Sources that can fetch many ranges in one request
+        should override this.
+        """
+        return [self.sequence(chromosome, startpos, endpos) for chromosome, startpos, endpos in ranges]
+
     def sequences_for_primers(self, primer_fwd, primer_rev, fwd_prefix_length=0, rev_suffix_length=0):
         """
         Return a list of SequenceGroups that match the specified forward and reverse
@@ -35,7 +44,15 @@ class SequenceSource(object):
         If no primers match, return an empty list.
         """
         return NotImplementedError
-    
+
+    def sequences_for_primer_pairs(self, primer_pairs, fwd_prefix_length=0, rev_suffix_length=0):
+        """
+        The bulk version of sequences_for_primers: return the list of
+        PCRSequences of each (forward primer, reverse primer) tuple.
+        """
+        return [self.sequences_for_primers(primer_fwd, primer_rev, fwd_prefix_length, rev_suffix_length)
+                    for primer_fwd, primer_rev in primer_pairs]
+
     def sequence_around_loc(self, chromosome, pos, amplicon_width, prefix_length=0, suffix_length=0):
         """
         Given a position (chromosome, position), return a sequence group that would
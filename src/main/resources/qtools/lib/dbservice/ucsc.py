@@ -11,54 +11,11 @@ from sqlalchemy.sql import select, and_, or_
 from qtools.lib.bio import reverse_complement, base_regexp_expand, TransformedGenomeSequence
 from qtools.lib.datasource import SNPDataSource, MutationTransformer, UnknownMutationError, UnhandledMutationWarning
 from qtools.lib.exception import ReturnWithCaveats
+from qtools.lib.intervals import bins, bin_ranges
 
 import operator
 
 
-def bins(chromNumber):
-    """
-    Return the hierarchical bin numbers that a feature at the specified
-    chromosome may be stored in.
-
-    Binning source: http://genome.cshlp.org/content/12/6/996.full.pdf+html
-    *except* Paper claims 1-based bins, bins appear to be 0-based.
-    """
-    # I could do bit shifting like the Ruby impl but whatever, this code is easier to read
-    kb = 1024
-    mb = kb**2
-
-    bin_levels_offsets = ((512*mb, 0),
-                          (64*mb, 1),
-                          (8*mb, 8+1),
-                          (1*mb, 64+8+1),
-                          (128*kb, 512+64+8+1))
-
-    if chromNumber > 512*mb:
-        raise ValueError, "Number too large for bin: %s" % chromNumber
-    elif chromNumber < 1:
-        raise ValueError, "Number too small for bin: %s" % chromNumber
-    
-    member_bins = []
-    for bin, offset in bin_levels_offsets:
-        divisor, rem = divmod(chromNumber, bin)
-        member_bins.append(divisor+offset)
-    
-    return member_bins
-
-def bin_ranges(chromStart, chromEnd):
-    if chromStart > chromEnd:
-        # just key off chromStart (likely a SNP deletion)
-        chromEnd = chromStart
-    
-    start_bins = bins(chromStart)
-    end_bins = bins(chromEnd)
-
-    range_bins = []
-    for start_bin, end_bin in zip(start_bins, end_bins):
-        range_bins.extend([i for i in range(start_bin, end_bin+1)])
-    
-    return sorted(list(set(range_bins)))
-
 class HG19Source(object):
     """
     Establishes a connection to query against the hg19 database on
@@ -0,0 +1,194 @@
+"""
+Vectorized primer-dimer (oligo complementarity) scoring.
+
+The scoring matches :func:`qtools.lib.bio.maximal_binding_seq`: for every
+pair of oligos, the second oligo is reverse-complemented and the longest
+run of identical consecutive bases (the longest common substring) is
+found, along with the offsets of the first occurrence of that run.
+
+Instead of scanning each pair in Python, the oligos of a pool are encoded
+into padded byte matrices, every pair's base comparison matrix is built
+with a single broadcast, and diagonal run lengths are accumulated one row
+at a time across all pairs at once.
+"""
+import numpy as np
+
+from qtools.lib.bio import reverse_complement
+
+# pad values for each side of the comparison; they must differ from
+# each other (and from any base) so padding never registers as binding.
+PAD1 = 0
+PAD2 = 255
+
+# bound on the size of a single comparison block (pairs * len1 * len2),
+# to keep memory flat on large pools.
+DEFAULT_BLOCK_CELLS = 4000000
+
+def encode_oligos(oligos, pad):
+    """
+    Encode a list of oligo strings into a (len(oligos), max_len) uint8
+    array, padding shorter oligos with the specified pad value.
+    """
+    max_len = max([len(o) for o in oligos]) if oligos else 0
+    encoded = np.empty((len(oligos), max_len), dtype=np.uint8)
+    encoded.fill(pad)
+    for idx, oligo in enumerate(oligos):
+        if oligo:
+            encoded[idx,:len(oligo)] = np.frombuffer(str(oligo), dtype=np.uint8)
+    return encoded
+
+def _longest_runs(equal):
+    """
+    Accumulate diagonal run lengths over base comparison matrices, and
+    return the longest run and the flat index of its first (row-major)
+    occurrence in each matrix.
+
+    :param equal: (..., L1, L2) boolean array of base comparisons.
+    :return: (longest, flat_index) arrays of shape equal.shape[:-2].
+    """
+    l1, l2 = equal.shape[-2:]
+    runs = np.zeros(equal.shape, dtype=np.int16)
+    runs[...,0,:] = equal[...,0,:]
+    for i in xrange(1, l1):
+        runs[...,i,0] = equal[...,i,0]
+        runs[...,i,1:] = equal[...,i,1:]*(runs[...,i-1,:-1]+1)
+
+    flat = runs.reshape(equal.shape[:-2]+(l1*l2,))
+    # argmax picks the first occurrence, which is the tiebreak
+    # maximal_binding_seq uses (first in oligo1, then oligo2 order)
+    flat_index = flat.argmax(axis=-1)
+    longest = flat.max(axis=-1)
+    return longest, flat_index
+
+def _binding_block(enc1, enc2):
+    """
+    Compute the longest binding run and the flat index of its first
+    (row-major) occurrence for every pair in the block.
+
+    :param enc1: (P1, L1) encoded oligo1 block.
+    :param enc2: (P2, L2) encoded reverse complement block.
+    :return: (longest, flat_index) arrays of shape (P1, P2).
+    """
+    return _longest_runs(enc1[:,None,:,None] == enc2[None,:,None,:])
+
+def pool_binding(oligos1, oligos2=None, block_cells=DEFAULT_BLOCK_CELLS):
+    """
+    Score every oligo in oligos1 against every oligo in oligos2 (or
+    against every other oligo in oligos1 if oligos2 is not specified).
+
+    :param oligos1: List of 5'->3' oligo sequences.
+    :param oligos2: List of 5'->3' oligo sequences.
+    :param block_cells: Maximum number of comparison cells to evaluate at once.
+    :return: (longest, offset1, offset2) arrays of shape (len(oligos1), len(oligos2)).
+             Offsets have the same meaning as in maximal_binding_seq.  Pairs
+             without a single complementary base have a longest value of 0
+             and offsets of -1.
+    """
+    if oligos2 is None:
+        oligos2 = oligos1
+
+    shape = (len(oligos1), len(oligos2))
+    longest = np.zeros(shape, dtype=np.int32)
+    offset1 = np.empty(shape, dtype=np.int32)
+    offset1.fill(-1)
+    offset2 = offset1.copy()
+    if not oligos1 or not oligos2:
+        return longest, offset1, offset2
+
+    enc1 = encode_oligos(oligos1, PAD1)
+    enc2 = encode_oligos([reverse_complement(o) for o in oligos2], PAD2)
+    l1, l2 = enc1.shape[1], enc2.shape[1]
+    if l1 == 0 or l2 == 0:
+        return longest, offset1, offset2
+
+    # block over rows of oligos1 so that a block of rows against all of
+    # oligos2 stays under the cell bound.
+    rows = max(1, block_cells // max(1, len(oligos2)*l1*l2))
+    for start in xrange(0, len(oligos1), rows):
+        end = min(start+rows, len(oligos1))
+        block_longest, block_index = _binding_block(enc1[start:end], enc2)
+        xs, ys = np.divmod(block_index, l2)
+        longest[start:end] = block_longest
+        offset1[start:end] = xs+1-block_longest
+        offset2[start:end] = ys+1-block_longest
+
+    unbound = longest == 0
+    offset1[unbound] = -1
+    offset2[unbound] = -1
+    return longest, offset1, offset2
+
+def pool_maximal_binding(oligos1, oligos2=None, **kwargs):
+    """
+    Return a nested list of maximal_binding_seq-style results for every
+    pair of oligos in the pool: result[i][j] is
+    (max_len, (oligo1-offset, oligo2-rc-offset)) for oligos1[i] against
+    oligos2[j], or None if the oligos have no binding bases (the case
+    where maximal_binding_seq itself raises an IndexError).
+    """
+    longest, offset1, offset2 = pool_binding(oligos1, oligos2, **kwargs)
+    results = []
+    for lrow, o1row, o2row in zip(longest.tolist(), offset1.tolist(), offset2.tolist()):
+        results.append([(l, (o1, o2)) if l > 0 else None for l, o1, o2 in zip(lrow, o1row, o2row)])
+    return results
+
+def max_pool_binding(oligos1, oligos2=None, **kwargs):
+    """
+    Return the pair indices and maximal_binding_seq-style result of the
+    strongest binding pair in the pool, or None if nothing binds.
+
+    Ties resolve to the first pair in oligos1/oligos2 order.
+    """
+    longest, offset1, offset2 = pool_binding(oligos1, oligos2, **kwargs)
+    if longest.size == 0 or longest.max() == 0:
+        return None
+    i, j = np.unravel_index(longest.argmax(), longest.shape)
+    return (i, j), (int(longest[i,j]), (int(offset1[i,j]), int(offset2[i,j])))
+
+def paired_binding(oligos1, oligos2, block_cells=DEFAULT_BLOCK_CELLS):
+    """
+    Score each oligo in oligos1 against the oligo at the same index in
+    oligos2, rather than against all of them, so that the pairs of many
+    small pools (say, the primers and probes of many assays) can be
+    scored in one pass.
+
+    :param oligos1: List of 5'->3' oligo sequences.
+    :param oligos2: List of 5'->3' oligo sequences, as long as oligos1.
+    :param block_cells: Maximum number of comparison cells to evaluate at once.
+    :return: (longest, offset1, offset2) arrays of shape (len(oligos1),), with
+             the same meaning as in pool_binding.
+    """
+    if len(oligos1) != len(oligos2):
+        raise ValueError, "Paired oligo lists must have the same length"
+
+    longest = np.zeros(len(oligos1), dtype=np.int32)
+    offset1 = np.empty(len(oligos1), dtype=np.int32)
+    offset1.fill(-1)
+    offset2 = offset1.copy()
+    if not oligos1:
+        return longest, offset1, offset2
+
+    enc1 = encode_oligos(oligos1, PAD1)
+    enc2 = encode_oligos([reverse_complement(o) for o in oligos2], PAD2)
+    l1, l2 = enc1.shape[1], enc2.shape[1]
+    if l1 == 0 or l2 == 0:
+        return longest, offset1, offset2
+
+    # score pairs of similar lengths together, and trim the padding of
+    # each block to its longest oligos
+    lengths1 = np.array([len(o) for o in oligos1])
+    lengths2 = np.array([len(o) for o in oligos2])
+    order = np.lexsort((lengths2, lengths1))
+    rows = max(1, block_cells // (l1*l2))
+    for start in xrange(0, len(oligos1), rows):
+        block = order[start:start+rows]
+        bl1, bl2 = max(1, lengths1[block].max()), max(1, lengths2[block].max())
+        block_longest, block_index = _longest_runs(enc1[block,:bl1,None] == enc2[block,None,:bl2])
+        xs, ys = np.divmod(block_index, bl2)
+        longest[block] = block_longest
+        offset1[block] = xs+1-block_longest
+        offset2[block] = ys+1-block_longest
+
+    unbound = longest == 0
+    offset1[unbound] = -1
+    offset2[unbound] = -1
+    return longest, offset1, offset2
@@ -3,8 +3,9 @@ Methods for accessing and reading droplet generator logs.
 """
 
 from qtools.lib.storage import QLBFileSource
-from qtools.model import DropletGeneratorRun
-import re, os
+from qtools.model import DropletGeneratorRun, DropletGeneratorLogFile, DropletGeneratorEvent
+from sqlalchemy import func
+import re, os, time
 from datetime import datetime
 
 KEYVAL_RE = re.compile(r'([\w\s]+)\:\:([\w\:\/\s]+)')
@@ -13,100 +14,165 @@ CSV_RE = re.compile(r',')
 NUMERIC_RE = re.compile(r'[\-\d\.(e\-)(e\+)]+')
 DG_FILE_RE = re.compile(r'\d{4}\-\d{2}\-\d{2}_\d{2}\-\d{2}\-\d{2}[\s\w]*\.csv')
 
+# a log that has not been written to in this long is considered finished,
+# and is no longer checked for new events.
+DG_LOG_SETTLE_SECONDS = 24*60*60
+
+class DGLogParser(object):
+    """
+    Line-by-line parser of a droplet generator log.  Reads the run
+    summary from the header section, and the events from the time
+    series section.
+
+    The parser is resumable: the section state (header_parsed,
+    in_event_section, in_event_lines) can be saved and restored, so
+    that once the header has been read, parsing can pick up at a
+    later offset of a growing log without rereading the file.
+    """
+    def __init__(self, header_parsed=False, in_event_section=False, in_event_lines=False):
+        self.header_parsed = header_parsed
+        self.in_event_section = in_event_section
+        self.in_event_lines = in_event_lines
+        self.dt = None
+        self.run_no = None
+        self.status = None
+        self.vacuum = None
+        self.pressure = None
+        self.spike = None
+        self.failures = []
+        self.droplet_generator_id = None
+        self.test_run = False
+    
+    def feed(self, line):
+        """
+        Parse the next line of the log.  Returns an event tuple
+        (sequence, label, value1, value2, value3) if the line is
+        a time series event; None otherwise.
+        """
+        line = line.strip()
+        if not self.header_parsed:
+            self.__parse_header_line(line)
+        
+        if not self.in_event_section:
+            if SECTION_RE.match(line):
+                self.in_event_section = True
+        elif not self.in_event_lines:
+            # read one addl line
+            self.in_event_lines = True
+        elif line:
+            event = line.split(',')
+            return (int(event[0]), event[1], float(event[2]), float(event[3]), float(event[4]))
+        return None
+    
+    def __parse_header_line(self, line):
+        # leave in as output weird (should be ::)
+        if line.startswith('Run No.'):
+            self.run_no = int(line[8:])
+            return
+        keyval = KEYVAL_RE.match(line)
+        if keyval:
+            key, val = keyval.group(1), keyval.group(2)
+            if key == "Start Time":
+                self.dt = datetime.strptime(val, '%Y/%m/%d %H:%M')
+            elif key == "Status":
+                self.status = val
+            elif key == "Unit Number" or key == "Unit number":
+                self.droplet_generator_id = int(val)
+            return # bust out
+        csv = CSV_RE.search(line)
+        if csv:
+            vals = [val.strip() for val in line.split(',')]
+            # patternize vals[0]->[3] null check & float?
+            if vals[1] == 'Failed':
+                self.failures.append(vals[0])
+            if vals[1] == 'ParamRepeatTestMode':
+                self.test_run = (vals[2] == '1')
+            if len(vals) < 4:
+                return
+            elif vals[0] == 'Vacuum':
+                vacuum_str = NUMERIC_RE.search(vals[3])
+                if vacuum_str:
+                    self.vacuum = float(vacuum_str.group(0))
+            elif vals[0] == 'Manifold Pressure Check':
+                pressure_str = NUMERIC_RE.search(vals[3])
+                if pressure_str:
+                    self.pressure = float(pressure_str.group(0))
+            elif vals[0] == 'Manifold Pressure Derivative Check':
+                spike_str = NUMERIC_RE.search(vals[3])
+                if spike_str:
+                    self.spike = float(spike_str.group(0))
+            return # end csv
+        
+        section = SECTION_RE.match(line)
+        if section:
+            if section.group(0) == "Time Series Data:":
+                self.header_parsed = True # stop reading
+    
+    def run(self):
+        """
+        Returns the DropletGeneratorRun described by the header, or
+        None if the log was a test run.
+        """
+        # TODO: enclosing logic has to ensure that the dg id actually exists
+        if not self.test_run:
+            return DropletGeneratorRun(datetime=self.dt,
+                                       run_number=self.run_no,
+                                       droplet_generator_id=self.droplet_generator_id,
+                                       failed=(self.status != 'OK'),
+                                       vacuum_time=self.vacuum,
+                                       vacuum_pressure=self.pressure,
+                                       spike=self.spike,
+                                       failure_reason=",".join(self.failures) if self.failures else None)
+        else:
+            return None
+
+
 def read_dg_log(path):
-    dt = None
-    run_no = None
-    status = None
-    vacuum = None
-    pressure = None
-    spike = None
-    failures = []
-    droplet_generator_id = None
-    test_run = False
+    """
+    Parse the run summary out of a log file.  Pages should read the
+    DropletGeneratorRun rows written by DGLogIndex instead.
+    """
+    parser = DGLogParser()
     with open(path) as f:
         # just read in-order for now: this might change if DG log is modified
         for line in f:
-            line = line.strip()
-            # leave in as output weird (should be ::)
-            if line.startswith('Run No.'):
-                run_no = int(line[8:])
-                continue
-            keyval = KEYVAL_RE.match(line)
-            if keyval:
-                key, val = keyval.group(1), keyval.group(2)
-                if key == "Start Time":
-                    dt = datetime.strptime(val, '%Y/%m/%d %H:%M')
-                elif key == "Status":
-                    status = val
-                elif key == "Unit Number" or key == "Unit number":
-                    droplet_generator_id = int(val)
-                continue # bust out
-            csv = CSV_RE.search(line)
-            if csv:
-                vals = [val.strip() for val in line.split(',')]
-                # patternize vals[0]->[3] null check & float?
-                if vals[1] == 'Failed':
-                    failures.append(vals[0])
-                if vals[1] == 'ParamRepeatTestMode':
-                    test_run = (vals[2] == '1')
-                if len(vals) < 4:
-                    continue
-                elif vals[0] == 'Vacuum':
-                    vacuum_str = NUMERIC_RE.search(vals[3])
-                    if vacuum_str:
-                        vacuum = float(vacuum_str.group(0))
-                elif vals[0] == 'Manifold Pressure Check':
-                    pressure_str = NUMERIC_RE.search(vals[3])
-                    if pressure_str:
-                        pressure = float(pressure_str.group(0))
-                elif vals[0] == 'Manifold Pressure Derivative Check':
-                    spike_str = NUMERIC_RE.search(vals[3])
-                    if spike_str:
-                        spike = float(spike_str.group(0))
-                continue # end csv
-            
-            section = SECTION_RE.match(line)
-            if section:
-                if section.group(0) == "Time Series Data:":
-                    break # stop reading
-    
-    # TODO: enclosing logic has to ensure that the dg id actually exists
-    if not test_run:
-        return DropletGeneratorRun(datetime=dt,
-                                   run_number=run_no,
-                                   droplet_generator_id=droplet_generator_id,
-                                   failed=(status != 'OK'),
-                                   vacuum_time=vacuum,
-                                   vacuum_pressure=pressure,
-                                   spike=spike,
-                                   failure_reason=",".join(failures) if failures else None)
-    else:
-        return None
+            parser.feed(line)
+            if parser.header_parsed:
+                break
+    return parser.run()
 
 
 def get_dg_event_trace(path):
+    """
+    Parse the time series events out of a log file.  Pages should use
+    dg_run_event_trace, which reads the events indexed by DGLogIndex.
+    """
+    parser = DGLogParser()
+    events = []
     with open(path) as f:
         # just read in-order for now: this might change if DG log is modified
-        in_event_section = False
-        in_event_lines = False
-        events = []
         for line in f:
-            line = line.strip()
-            if not in_event_section:
-                section = SECTION_RE.match(line)
-                if section:
-                    in_event_section = True
-            elif not in_event_lines:
-                # read one addl line
-                in_event_lines = True
-            else:
-                # already in events
-                event = line.split(',')
-                events.append((int(event[0]), event[1], float(event[2]), float(event[3]), float(event[4])))
-    
+            event = parser.feed(line)
+            if event:
+                events.append(event)
     return events
 
 
+def dg_run_event_trace(session, dg_run_id):
+    """
+    Return the events of a droplet generator run, as get_dg_event_trace
+    would, from the dg_event rows written by DGLogIndex.  Returns an
+    empty list if the run's log has not been indexed.
+    """
+    return [tuple(row) for row in session.query(DropletGeneratorEvent.sequence,
+                                                DropletGeneratorEvent.label,
+                                                DropletGeneratorEvent.value1,
+                                                DropletGeneratorEvent.value2,
+                                                DropletGeneratorEvent.value3)\
+                                         .join(DropletGeneratorLogFile)\
+                                         .filter(DropletGeneratorLogFile.dg_run_id == dg_run_id)\
+                                         .order_by(DropletGeneratorEvent.id).all()]
+
 
 class DGLogSource(QLBFileSource):
     """
@@ -131,3 +197,164 @@ class DGLogSource(QLBFileSource):
                         yield (folder, file)
 
 
+class DGLogIndex(object):
+    """
+    Incrementally ingests droplet generator logs into the database.
+
+    Each log's size, mtime and parsed offset are recorded in a
+    DropletGeneratorLogFile row; on subsequent passes, only logs that
+    are new or have changed are opened, and only the bytes written
+    since the last pass are parsed.  Events are appended to the
+    dg_event table, and the run summary becomes a DropletGeneratorRun,
+    so DG pages and trends can be served without touching the logs.
+    """
+    def __init__(self, source, session, droplet_generator_ids=None, settle_seconds=DG_LOG_SETTLE_SECONDS):
+        """
+        :param source: The DGLogSource to read logs from.
+        :param session: The SQLAlchemy session.
+        :param droplet_generator_ids: If specified, only create runs for these DG ids.
+        :param settle_seconds: How long after its last write a log is considered complete.
+        """
+        self.source = source
+        self.session = session
+        self.droplet_generator_ids = droplet_generator_ids
+        self.settle_seconds = settle_seconds
+    
+    def new_log_paths(self, min_file_name=''):
+        """
+        Yield the (dirname, basename) of logs that are not yet in the index.
+        Since log names are timestamps, only files named after the last
+        indexed file in each folder are considered.
+        """
+        min_file_dict = dict(self.session.query(DropletGeneratorLogFile.dirname,
+                                                func.max(DropletGeneratorLogFile.basename))\
+                                         .group_by(DropletGeneratorLogFile.dirname).all())
+        for dirname, basename in self.source.path_iter(min_file_name=min_file_name, min_file_dict=min_file_dict):
+            yield dirname, basename
+    
+    def open_logs(self):
+        """
+        Return the indexed logs that may still be written to.
+        """
+        return self.session.query(DropletGeneratorLogFile).filter(DropletGeneratorLogFile.complete == False).all()
+    
+    def update(self, min_file_name=''):
+        """
+        Ingest new logs and new events from open logs, committing after
+        each log.  Returns the number of logs that were read.
+        """
+        logs = self.open_logs()
+        for dirname, basename in self.new_log_paths(min_file_name=min_file_name):
+            logfile = DropletGeneratorLogFile(dirname=dirname, basename=basename,
+                                              size=0, parsed_offset=0)
+            self.session.add(logfile)
+            logs.append(logfile)
+        
+        read = 0
+        for logfile in logs:
+            if self.ingest(logfile):
+                read += 1
+            self.session.commit()
+        return read
+    
+    def ingest(self, logfile):
+        """
+        Read any unparsed content from the specified log.  Returns
+        whether the log was read.
+        """
+        path = self.source.full_path(logfile.dirname, logfile.basename)
+        if not os.path.exists(path):
+            logfile.complete = True
+            return False
+        
+        stat = os.stat(path)
+        # DATETIME columns drop fractional seconds
+        mtime = datetime.fromtimestamp(int(stat.st_mtime))
+        settled = (time.time() - stat.st_mtime) > self.settle_seconds
+        if stat.st_size == logfile.size and mtime == logfile.mtime:
+            logfile.complete = settled
+            return False
+        
+        if stat.st_size < logfile.parsed_offset:
+            # log was rewritten; start over
+            self.reset(logfile)
+        
+        if logfile.header_parsed:
+            parser = DGLogParser(header_parsed=True,
+                                 in_event_section=logfile.in_event_section,
+                                 in_event_lines=logfile.in_event_lines)
+            offset = logfile.parsed_offset
+        else:
+            parser = DGLogParser()
+            offset = 0
+        
+        events = []
+        with open(path) as f:
+            f.seek(offset)
+            while True:
+                line = f.readline()
+                # leave a partially written last line for the next pass
+                if not line or (not line.endswith('\n') and not settled):
+                    break
+                offset += len(line)
+                event = parser.feed(line)
+                if event:
+                    events.append(event)
+        
+        header_was_parsed = logfile.header_parsed
+        if parser.header_parsed:
+            logfile.header_parsed = True
+            logfile.in_event_section = parser.in_event_section
+            logfile.in_event_lines = parser.in_event_lines
+            logfile.parsed_offset = offset
+            if not header_was_parsed:
+                self.__add_run(logfile, parser.run())
+            self.__append_events(logfile, events)
+        
+        logfile.size = stat.st_size
+        logfile.mtime = mtime
+        logfile.complete = settled and offset == stat.st_size
+        return True
+    
+    def reset(self, logfile):
+        """
+        Clear the parsed state and events of a log.
+        """
+        if logfile.id:
+            self.session.query(DropletGeneratorEvent)\
+                        .filter(DropletGeneratorEvent.dg_log_file_id == logfile.id)\
+                        .delete(synchronize_session=False)
+        logfile.parsed_offset = 0
+        logfile.header_parsed = False
+        logfile.in_event_section = False
+        logfile.in_event_lines = False
+    
+    def __add_run(self, logfile, dg_run):
+        if not dg_run:
+            return
+        if self.droplet_generator_ids is not None \
+           and dg_run.droplet_generator_id not in self.droplet_generator_ids:
+            return
+        # logs read before the index existed already have their runs
+        existing = self.session.query(DropletGeneratorRun)\
+                               .filter_by(dirname=logfile.dirname, basename=logfile.basename).first()
+        if existing:
+            logfile.dg_run = existing
+            return
+        dg_run.dirname = logfile.dirname
+        dg_run.basename = logfile.basename
+        self.session.add(dg_run)
+        logfile.dg_run = dg_run
+    
+    def __append_events(self, logfile, events):
+        if not events:
+            return
+        if not logfile.id:
+            self.session.flush()
+        self.session.execute(DropletGeneratorEvent.__table__.insert(),
+                             [dict(dg_log_file_id=logfile.id,
+                                   sequence=sequence,
+                                   label=label,
+                                   value1=value1,
+                                   value2=value2,
+                                   value3=value3) for sequence, label, value1, value2, value3 in events])
@@ -0,0 +1,163 @@
+"""
+Per-well galaxy histogram tiles.
+
+A galaxy plot is a 2D histogram of droplet width against log amplitude
+on fixed bins, so the galaxy of a set of wells is the sum of the
+galaxies of each well.  When a plate is scanned, the histogram of each
+well (per channel, and per peak selection) is written next to the
+well thumbnails as a sparse tile; plate- and reader-level galaxies are
+then made by adding tiles, without reading the QLP and QLB files.
+"""
+import os
+
+import numpy as np
+
+# galaxy bins (see qtools.lib.mplot.multi_galaxy): droplet width rows by
+# log amplitude columns.
+GALAXY_HEIGHT = 420
+GALAXY_WIDTH = 560
+MIN_DROPLET_WIDTH = 5
+MAX_DROPLET_WIDTH = 20
+MIN_AMPLITUDE = 100
+MAX_AMPLITUDE = 32000
+
+# the peak selections tiles are kept for: (all peaks or only those above the
+# minimum amplitude, quality gated or not).
+TILE_PEAK_SELECTIONS = ((True, False), (True, True), (False, False), (False, True))
+
+def galaxy_histogram(amplitudes, widths):
+    """
+    Return the galaxy histogram (GALAXY_HEIGHT x GALAXY_WIDTH) of a set of
+    droplet amplitudes and widths.
+    """
+    H, xedges, yedges = np.histogram2d(widths, np.log10(amplitudes),
+                                       bins=[GALAXY_HEIGHT, GALAXY_WIDTH],
+                                       range=[[MIN_DROPLET_WIDTH, MAX_DROPLET_WIDTH],
+                                              [np.log10(MIN_AMPLITUDE), np.log10(MAX_AMPLITUDE)]])
+    return H
+
+def well_galaxy_peaks(well, channel=0, all_peaks=True, quality_gate=False):
+    """
+    Return the (amplitudes, widths) of the peaks of a QLWell that are
+    drawn on its galaxy.
+
+    :param all_peaks: Whether to include peaks below the minimum amplitude.
+    :param quality_gate: Whether to drop peaks below the quality gate.
+    """
+    from pyqlb.nstats.peaks import fam_widths, fam_amplitudes, vic_widths, vic_amplitudes, quality_gated
+    from pyqlb.nstats.well import above_min_amplitude_peaks
+
+    if all_peaks:
+        peaks = well.peaks
+    else:
+        peaks = above_min_amplitude_peaks(well)
+
+    if quality_gate:
+        peaks = quality_gated(peaks, min_quality_gate=well.channels[0].statistics.min_quality_gate)
+
+    if channel == 1:
+        return vic_amplitudes(peaks), vic_widths(peaks)
+    else:
+        return fam_amplitudes(peaks), fam_widths(peaks)
+
+def wells_galaxy_histogram(wells, channel=0, all_peaks=True, quality_gate=False):
+    """
+    Return the galaxy histogram of a set of QLWells, or None if they
+    have no peaks.
+    """
+    H = None
+    for well in wells:
+        amplitudes, widths = well_galaxy_peaks(well, channel, all_peaks, quality_gate)
+        if len(amplitudes) == 0:
+            continue
+        if H is None:
+            H = galaxy_histogram(amplitudes, widths)
+        else:
+            H += galaxy_histogram(amplitudes, widths)
+    return H
+
+def tile_key(channel, all_peaks, quality_gate):
+    return 'c%s_%s_%s' % (channel, 'all' if all_peaks else 'min', 'qg' if quality_gate else 'ng')
+
+def tile_path(qlbplate_id, well_name):
+    """
+    Return the path of a well's tiles, relative to the image store.
+    """
+    return '%s/%s_galaxy.npz' % (qlbplate_id, well_name)
+
+def sparse_tile(H):
+    """
+    Return the (bin index, count) arrays of the nonzero bins of a galaxy
+    histogram.
+    """
+    counts = np.asarray(H).ravel()
+    indices = np.flatnonzero(counts)
+    return indices.astype(np.int32), counts[indices].astype(np.int32)
+
+def well_tiles(well):
+    """
+    Return the sparse tiles of a QLWell, for each channel and peak
+    selection, as a dict of arrays keyed by tile_key.
+    """
+    tiles = {}
+    for channel in range(min(len(well.channels), 2)):
+        for all_peaks, quality_gate in TILE_PEAK_SELECTIONS:
+            amplitudes, widths = well_galaxy_peaks(well, channel, all_peaks, quality_gate)
+            indices, counts = sparse_tile(galaxy_histogram(amplitudes, widths))
+            key = tile_key(channel, all_peaks, quality_gate)
+            tiles['%s_bins' % key] = indices
+            tiles['%s_counts' % key] = counts
+    return tiles
+
+def write_well_tiles(image_source, qlbplate_id, well_name, well):
+    """
+    Write the tiles of a QLWell to the image store.
+    """
+    np.savez_compressed(image_source.get_path(tile_path(qlbplate_id, well_name)), **well_tiles(well))
+
+def write_plate_tiles(image_source, qlbplate_id, qlplate):
+    """
+    Write the tiles of every analyzed well of a QLPlate to the image store.
+    """
+    for well_name, qlwell in sorted(qlplate.analyzed_wells.items()):
+        write_well_tiles(image_source, qlbplate_id, well_name, qlwell)
+
+def read_well_tile(image_source, qlbplate_id, well_name, channel=0, all_peaks=True, quality_gate=False):
+    """
+    Return the sparse (bin index, count) tile of a well, or None if the
+    tile has not been written.
+    """
+    path = image_source.get_path(tile_path(qlbplate_id, well_name))
+    if not os.path.isfile(path):
+        return None
+
+    key = tile_key(channel, all_peaks, quality_gate)
+    tiles = np.load(path)
+    try:
+        if '%s_bins' % key not in tiles.files:
+            return None
+        return tiles['%s_bins' % key], tiles['%s_counts' % key]
+    finally:
+        tiles.close()
+
+def composite_galaxy_histogram(image_source, plate_wells, channel=0, all_peaks=True, quality_gate=False):
+    """
+    Add up the tiles of a set of wells into a galaxy histogram.
+
+    :param plate_wells: (qlbplate id, well name) tuples.
+    :return: The histogram, or None if a well has no tile (or there are
+             no wells).
+    """
+    indices = []
+    counts = []
+    for qlbplate_id, well_name in plate_wells:
+        tile = read_well_tile(image_source, qlbplate_id, well_name, channel, all_peaks, quality_gate)
+        if tile is None:
+            return None
+        indices.append(tile[0])
+        counts.append(tile[1])
+
+    if not indices:
+        return None
+    H = np.bincount(np.concatenate(indices), weights=np.concatenate(counts), minlength=GALAXY_HEIGHT*GALAXY_WIDTH)
+    return H.reshape((GALAXY_HEIGHT, GALAXY_WIDTH))
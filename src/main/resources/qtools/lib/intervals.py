@@ -0,0 +1,158 @@
+"""
+Genomic interval indexing, with the UCSC hierarchical binning scheme.
+
+Every interval is filed under the smallest bin that contains it
+(range_bin); an overlap query only has to look in the bins that can
+contain an interval touching the queried range (overlapping_bins), a
+handful per level.  The same bins are stored in the bin columns of the
+cached sequence and SNP tables, so that overlap queries there use the
+bin index (overlap_criterion), and IntervalIndex does the same for
+intervals held in memory.
+
+Binning source: http://genome.cshlp.org/content/12/6/996.full.pdf+html
+"""
+import bisect
+
+from sqlalchemy import and_, or_
+
+KB = 1024
+MB = KB**2
+
+# (bin size, bin number offset) of each level, from the coarsest down.
+BIN_LEVELS = ((512*MB, 0),
+              (64*MB, 1),
+              (8*MB, 8+1),
+              (1*MB, 64+8+1),
+              (128*KB, 512+64+8+1))
+
+def bins(chromNumber):
+    """
+    Return the hierarchical bin numbers that a feature at the specified
+    chromosome may be stored in.
+
+    *except* Paper claims 1-based bins, bins appear to be 0-based.
+    """
+    if chromNumber > 512*MB:
+        raise ValueError, "Number too large for bin: %s" % chromNumber
+    elif chromNumber < 1:
+        raise ValueError, "Number too small for bin: %s" % chromNumber
+
+    member_bins = []
+    for bin, offset in BIN_LEVELS:
+        divisor, rem = divmod(chromNumber, bin)
+        member_bins.append(divisor+offset)
+
+    return member_bins
+
+def bin_ranges(chromStart, chromEnd):
+    if chromStart > chromEnd:
+        # just key off chromStart (likely a SNP deletion)
+        chromEnd = chromStart
+
+    start_bins = bins(chromStart)
+    end_bins = bins(chromEnd)
+
+    range_bins = []
+    for start_bin, end_bin in zip(start_bins, end_bins):
+        range_bins.extend([i for i in range(start_bin, end_bin+1)])
+
+    return sorted(list(set(range_bins)))
+
+def range_bin(start, end):
+    """
+    Return the smallest bin that contains the range from start to end
+    (positions before the first base are counted as the first base).
+    """
+    start = max(start, 1)
+    end = max(end, start)
+    for size, offset in reversed(BIN_LEVELS):
+        if start // size == end // size:
+            return start // size + offset
+    raise ValueError, "Number too large for bin: %s" % end
+
+def overlapping_bins(start, end):
+    """
+    Return the bins of every interval that may overlap the range from
+    start to end.
+    """
+    start = max(start, 1)
+    return bin_ranges(start, max(end, start))
+
+def overlap_criterion(bin_col, start_col, end_col, start, end):
+    """
+    Return the SQL criterion for rows whose [start_col, end_col] overlaps
+    [start, end], using the bin column to narrow down the rows.  Rows
+    that have not been binned yet are checked on their coordinates only.
+    """
+    return and_(or_(bin_col.in_(overlapping_bins(start, end)), bin_col == None),
+                start_col <= end,
+                end_col >= start)
+
+def merge_ranges(ranges):
+    """
+    Merge (start, end) ranges (inclusive) that overlap or abut, and return
+    the merged ranges, ordered by start.
+    """
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]+1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+class IntervalIndex(object):
+    """
+    An in-memory index of intervals on chromosomes, for overlap queries.
+
+    The intervals of each bin are kept sorted by start, along with the
+    longest interval in the bin, so a query looks at the intervals of a
+    bin that start within that length of the queried range, found by
+    bisection.
+    """
+    def __init__(self, intervals=None):
+        """
+        :param intervals: (chromosome, start, end, value) tuples to add.
+        """
+        self._bins = {}
+        self._count = 0
+        for chromosome, start, end, value in (intervals or []):
+            self.add(chromosome, start, end, value)
+
+    def __len__(self):
+        return self._count
+
+    def add(self, chromosome, start, end, value):
+        """
+        Add the interval from start to end (inclusive) on a chromosome.
+        """
+        if end < start:
+            end = start
+        key = (chromosome, range_bin(start, end))
+        if key not in self._bins:
+            self._bins[key] = ([], [], [0])
+        starts, entries, longest = self._bins[key]
+        # insertion order breaks ties between equal starts
+        idx = bisect.bisect_right(starts, start)
+        starts.insert(idx, start)
+        entries.insert(idx, (start, end, self._count, value))
+        longest[0] = max(longest[0], end-start)
+        self._count += 1
+
+    def overlapping(self, chromosome, start, end):
+        """
+        Return the values of the intervals that overlap the range from
+        start to end (inclusive), ordered by start, then end.
+        """
+        if end < start:
+            end = start
+        matches = []
+        for bin in overlapping_bins(start, end):
+            if (chromosome, bin) not in self._bins:
+                continue
+            starts, entries, longest = self._bins[(chromosome, bin)]
+            lower = bisect.bisect_left(starts, start-longest[0])
+            upper = bisect.bisect_right(starts, end)
+            matches.extend([entry for entry in entries[lower:upper] if entry[1] >= start])
+        return [entry[3] for entry in sorted(matches)]
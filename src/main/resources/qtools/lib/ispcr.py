@@ -0,0 +1,545 @@
+"""
+In-silico PCR against a local genome (FASTA).
+
+Primer sites are found through a k-mer seed index: the k-mers of every
+position of the genome, sorted by their 2-bit code.  The 3' end of a
+primer (seed_length bases) must match the genome exactly, as with the
+UCSC isPCR tool; the rest of the primer may have up to max_mismatches
+mismatches.  Both primers are matched in both orientations, and a
+forward site followed by a reverse site on the same chromosome within
+the product size window makes a product -- on the + strand if the
+forward primer matches the + strand, and on the - strand if the reverse
+primer does.
+
+The seeds of all the primers in a batch are looked up together, so
+mapping many primer pairs costs little more than mapping one.
+
+The index of a whole genome is built offline (paster build-genome-index)
+and memory-mapped by the web and worker processes that use it.
+"""
+import gzip, logging, os, threading
+
+import numpy as np
+
+from qtools.lib.bio import SimpleGenomeSequence, PCRSequence, reverse_complement
+from qtools.lib.datasource import SequenceSource
+from qtools.model.ucsc import PCRPrimerMatchSequence
+
+log = logging.getLogger(__name__)
+
+# bases at the 3' end of a primer that must match the genome exactly;
+# the genome is indexed by k-mers of this length.
+SEED_LENGTH = 12
+
+# mismatches allowed in the rest of a primer.
+MAX_MISMATCHES = 1
+
+# product size window, in bases (primers included).  4000 is the UCSC isPCR default.
+MIN_PRODUCT_SIZE = 0
+MAX_PRODUCT_SIZE = 4000
+
+# 2-bit code of each base; anything else (N, ambiguity codes) is 4, and never
+# part of a seed.
+BASE_CODES = np.zeros(256, dtype=np.uint8)+4
+for code, base in enumerate('ACGT'):
+    BASE_CODES[ord(base)] = BASE_CODES[ord(base.lower())] = code
+
+BASE_LETTERS = np.frombuffer('ACGTN', dtype=np.uint8)
+
+PRODUCT_DTYPE = np.dtype([('pair', np.int64),
+                          ('chromosome', np.int64),
+                          ('start', np.int64),
+                          ('end', np.int64),
+                          ('strand', 'S1'),
+                          ('fwd_mismatches', np.int64),
+                          ('rev_mismatches', np.int64)])
+
+def encode_bases(sequence):
+    """
+    Return the BASE_CODES of a sequence string, as a uint8 array.
+    """
+    return BASE_CODES[np.frombuffer(sequence, dtype=np.uint8)]
+
+def decode_bases(codes):
+    """
+    Return the sequence string of an array of base codes.
+    """
+    return BASE_LETTERS[codes].tostring()
+
+def chromosome_name(name):
+    """
+    Return a FASTA record name as a chromosome, as used by
+    SimpleGenomeSequence (without the 'chr' prefix).
+    """
+    name = name.split()[0]
+    if name.lower().startswith('chr'):
+        return name[3:]
+    return name
+
+def iter_fasta(path):
+    """
+    Iterate over the records of a FASTA file (optionally gzipped), in
+    file order, as (chromosome, sequence) tuples.
+    """
+    if path.endswith('.gz'):
+        infile = gzip.open(path, 'rb')
+    else:
+        infile = open(path, 'r')
+
+    name = None
+    lines = []
+    try:
+        for line in infile:
+            if line.startswith('>'):
+                if name is not None:
+                    yield name, ''.join(lines)
+                name = chromosome_name(line[1:].strip())
+                lines = []
+            elif name is not None:
+                lines.append(line.strip())
+        if name is not None:
+            yield name, ''.join(lines)
+    finally:
+        infile.close()
+
+def read_fasta(path):
+    """
+    Read the records of a FASTA file (optionally gzipped).
+
+    :return: A list of (chromosome, sequence) tuples, in file order.
+    """
+    return list(iter_fasta(path))
+
+def kmer_dtype(k):
+    """
+    Return the smallest unsigned dtype that holds 2-bit k-mer codes.
+    """
+    return np.dtype(np.uint32) if k <= 16 else np.dtype(np.uint64)
+
+def kmer_codes(codes, k):
+    """
+    Return the 2-bit k-mer code starting at each position of an array of
+    base codes (see kmer_dtype), and whether each k-mer is made of A, C,
+    G and T only.
+    """
+    dtype = kmer_dtype(k)
+    num_kmers = max(len(codes)-k+1, 0)
+    kmers = np.zeros(num_kmers, dtype=dtype)
+    for i in range(k):
+        kmers <<= dtype.type(2)
+        kmers |= codes[i:i+num_kmers] & 3
+    unknown = np.concatenate(([0], np.cumsum(codes > 3)))
+    return kmers, (unknown[k:k+num_kmers]-unknown[:num_kmers]) == 0
+
+def _expand_ranges(starts, counts):
+    # the indices start[i] ... start[i]+count[i]-1 for each range, and the range of each
+    offsets = np.cumsum(counts)-counts
+    owners = np.repeat(np.arange(len(counts)), counts)
+    return np.arange(counts.sum())-offsets[owners]+starts[owners], owners
+
+def seed_index(codes, seed_length):
+    """
+    Index the k-mers of a chromosome's base codes.
+
+    :return: (k-mer codes, positions) arrays, sorted by k-mer code;
+             k-mers with bases other than A, C, G and T are left out.
+    """
+    kmers, known = kmer_codes(codes, seed_length)
+    positions = np.flatnonzero(known).astype(np.uint32)
+    kmers = kmers[known]
+    order = np.argsort(kmers, kind='mergesort')
+    return kmers[order], positions[order]
+
+# the file in an index directory listing its seed length and chromosomes
+# (see build_genome_index); written last, so a partly built index is not loaded.
+INDEX_MANIFEST = 'index.txt'
+
+def _index_array_path(index_dir, idx, name):
+    return os.path.join(index_dir, 'chr%s.%s.npy' % (idx, name))
+
+def build_genome_index(fasta_path, index_dir, seed_length=SEED_LENGTH):
+    """
+    Index the genome FASTA at fasta_path into index_dir, one chromosome
+    at a time, for GenomeIndex.load.  This takes minutes and several
+    times the genome size in memory for a human genome; it is meant to be
+    run offline (paster build-genome-index), not in a web request.
+
+    :return: The names of the indexed chromosomes.
+    """
+    if not os.path.isdir(index_dir):
+        os.makedirs(index_dir)
+    manifest_path = os.path.join(index_dir, INDEX_MANIFEST)
+    if os.path.isfile(manifest_path):
+        os.unlink(manifest_path)
+
+    chromosomes = []
+    for idx, (name, sequence) in enumerate(iter_fasta(fasta_path)):
+        codes = encode_bases(sequence)
+        kmers, positions = seed_index(codes, seed_length)
+        np.save(_index_array_path(index_dir, idx, 'bases'), codes)
+        np.save(_index_array_path(index_dir, idx, 'kmers'), kmers)
+        np.save(_index_array_path(index_dir, idx, 'positions'), positions)
+        chromosomes.append(name)
+
+    tmp_path = manifest_path+'.tmp'
+    manifest = open(tmp_path, 'w')
+    try:
+        manifest.write('%s\n' % seed_length)
+        for name in chromosomes:
+            manifest.write('%s\n' % name)
+    finally:
+        manifest.close()
+    os.rename(tmp_path, manifest_path)
+    return chromosomes
+
+class GenomeIndex(object):
+    """
+    A genome held as base code arrays, with a k-mer seed index of each
+    chromosome.
+    """
+    def __init__(self, records, seed_length=SEED_LENGTH):
+        """
+        :param records: (chromosome, sequence) tuples (see read_fasta).
+        :param seed_length: The length of the indexed k-mers (at most 32;
+                            at most 16 keeps the index at 4 bytes a base
+                            for the k-mers, and 4 for their positions).
+        """
+        self.seed_length = seed_length
+        self.chromosomes = []
+        self._bases = []
+        self._kmers = []
+        self._positions = []
+        for name, sequence in records:
+            codes = encode_bases(sequence)
+            kmers, positions = seed_index(codes, seed_length)
+            self.chromosomes.append(name)
+            self._bases.append(codes)
+            self._kmers.append(kmers)
+            self._positions.append(positions)
+        self._chromosome_idx = dict([(name, idx) for idx, name in enumerate(self.chromosomes)])
+
+    @classmethod
+    def from_fasta(cls, path, seed_length=SEED_LENGTH):
+        return cls(read_fasta(path), seed_length)
+
+    @classmethod
+    def load(cls, index_dir, mmap_mode='r'):
+        """
+        Load an index written by build_genome_index.  The arrays are
+        memory-mapped by default, so loading is quick, and processes
+        that load the same index share its pages.
+
+        :raise IOError: if index_dir does not hold a complete index.
+        """
+        manifest = open(os.path.join(index_dir, INDEX_MANIFEST), 'r')
+        try:
+            lines = [line.strip() for line in manifest if line.strip()]
+        finally:
+            manifest.close()
+
+        genome = cls([], int(lines[0]))
+        for idx, name in enumerate(lines[1:]):
+            genome.chromosomes.append(name)
+            genome._bases.append(np.load(_index_array_path(index_dir, idx, 'bases'), mmap_mode=mmap_mode))
+            genome._kmers.append(np.load(_index_array_path(index_dir, idx, 'kmers'), mmap_mode=mmap_mode))
+            genome._positions.append(np.load(_index_array_path(index_dir, idx, 'positions'), mmap_mode=mmap_mode))
+        genome._chromosome_idx = dict([(name, idx) for idx, name in enumerate(genome.chromosomes)])
+        return genome
+
+    def chromosome_length(self, chromosome):
+        idx = self._chromosome_idx.get(chromosome_name(str(chromosome)))
+        if idx is None:
+            return None
+        return len(self._bases[idx])
+
+    def bases(self, chromosome, startpos, endpos):
+        """
+        Return the + strand sequence between startpos and endpos (1-based,
+        inclusive), or None if the chromosome is not in the genome.
+        """
+        idx = self._chromosome_idx.get(chromosome_name(str(chromosome)))
+        if idx is None:
+            return None
+        return decode_bases(self._bases[idx][max(startpos-1, 0):max(endpos, 0)])
+
+    def seed_hits(self, seeds):
+        """
+        Find every occurrence of each seed.
+
+        :param seeds: An array of k-mer codes.
+        :return: (seed index, chromosome index, position) arrays, one
+                 entry per occurrence; positions are 0-based k-mer starts.
+        """
+        seeds = np.asarray(seeds, dtype=kmer_dtype(self.seed_length))
+        seed_idx, chrom_idx, positions = [], [], []
+        for idx, (kmers, kmer_positions) in enumerate(zip(self._kmers, self._positions)):
+            lower = np.searchsorted(kmers, seeds, 'left')
+            upper = np.searchsorted(kmers, seeds, 'right')
+            hits, owners = _expand_ranges(lower, upper-lower)
+            seed_idx.append(owners)
+            chrom_idx.append(np.zeros(len(owners), dtype=np.int64)+idx)
+            positions.append(kmer_positions[hits].astype(np.int64))
+
+        if not seed_idx:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.concatenate(seed_idx), np.concatenate(chrom_idx), np.concatenate(positions)
+
+    def primer_sites(self, oligos, seed_offsets, max_mismatches=MAX_MISMATCHES):
+        """
+        Find where each oligo matches the + strand of the genome.
+
+        :param oligos: The sequences to match, as they would read on the
+                       + strand.
+        :param seed_offsets: The offset of the seed (the primer's 3' end)
+                             within each oligo.
+        :param max_mismatches: Mismatches allowed outside the seed.
+        :return: (oligo index, chromosome index, start, mismatches) arrays;
+                 starts are 0-based.  Bases other than A, C, G and T always
+                 count as mismatches.
+        """
+        k = self.seed_length
+        lengths = np.array([len(oligo) for oligo in oligos], dtype=np.int64)
+        seed_offsets = np.asarray(seed_offsets, dtype=np.int64)
+        if np.any(lengths < k):
+            raise ValueError("Primers must be at least %s bases long" % k)
+
+        padded = np.zeros((len(oligos), lengths.max() if len(oligos) else 0), dtype=np.uint8)+4
+        seeds = np.zeros(len(oligos), dtype=kmer_dtype(k))
+        valid = np.ones(len(oligos), dtype=bool)
+        for idx, oligo in enumerate(oligos):
+            padded[idx,:len(oligo)] = encode_bases(oligo)
+            oligo_kmers, known = kmer_codes(padded[idx, seed_offsets[idx]:seed_offsets[idx]+k], k)
+            seeds[idx] = oligo_kmers[0]
+            valid[idx] = known[0]
+
+        oligo_idx, chrom_idx, positions = self.seed_hits(seeds)
+        keep = valid[oligo_idx]
+        oligo_idx, chrom_idx = oligo_idx[keep], chrom_idx[keep]
+        starts = positions[keep]-seed_offsets[oligo_idx]
+
+        chrom_lengths = np.array([len(bases) for bases in self._bases], dtype=np.int64)
+        keep = (starts >= 0) & (starts+lengths[oligo_idx] <= chrom_lengths[chrom_idx])
+        oligo_idx, chrom_idx, starts = oligo_idx[keep], chrom_idx[keep], starts[keep]
+
+        mismatches = np.zeros(len(starts), dtype=np.int64)
+        columns = np.arange(padded.shape[1])
+        for idx, bases in enumerate(self._bases):
+            on_chrom = chrom_idx == idx
+            if not on_chrom.any():
+                continue
+            oligo_bases = padded[oligo_idx[on_chrom]]
+            window = bases[np.minimum(starts[on_chrom][:,np.newaxis]+columns, len(bases)-1)]
+            in_oligo = columns < lengths[oligo_idx[on_chrom]][:,np.newaxis]
+            mismatches[on_chrom] = (in_oligo & ((window != oligo_bases) | (oligo_bases > 3))).sum(axis=1)
+
+        keep = mismatches <= max_mismatches
+        return oligo_idx[keep], chrom_idx[keep], starts[keep], mismatches[keep]
+
+    def pcr_products(self, primer_pairs, max_mismatches=MAX_MISMATCHES,
+                     min_product_size=MIN_PRODUCT_SIZE, max_product_size=MAX_PRODUCT_SIZE):
+        """
+        Find the products of a batch of primer pairs.
+
+        :param primer_pairs: (forward primer, reverse primer) tuples, 5' -> 3'.
+        :return: A PRODUCT_DTYPE record per product, ordered by pair.  start
+                 and end are 1-based and inclusive; strand is the strand
+                 the forward primer reads on.
+        """
+        primer_pairs = [(fwd.upper(), rev.upper()) for fwd, rev in primer_pairs]
+        num_pairs = len(primer_pairs)
+        k = self.seed_length
+
+        # oligos, in blocks of num_pairs: forward and reverse primers as they
+        # read on the + strand (seed at the 3' end), then their reverse
+        # complements (seed at the 5' end)
+        fwd_lengths = np.array([len(fwd) for fwd, rev in primer_pairs], dtype=np.int64)
+        rev_lengths = np.array([len(rev) for fwd, rev in primer_pairs], dtype=np.int64)
+        oligos = [fwd for fwd, rev in primer_pairs]+[rev for fwd, rev in primer_pairs]+\
+                 [reverse_complement(fwd) for fwd, rev in primer_pairs]+[reverse_complement(rev) for fwd, rev in primer_pairs]
+        seed_offsets = np.concatenate((fwd_lengths-k, rev_lengths-k, np.zeros(2*num_pairs, dtype=np.int64)))
+        oligo_idx, chrom_idx, starts, mismatches = self.primer_sites(oligos, seed_offsets, max_mismatches)
+
+        blocks, pairs = oligo_idx // max(num_pairs, 1), oligo_idx % max(num_pairs, 1)
+        products = []
+        # + strand: forward primer, then reverse complement of the reverse primer.
+        # - strand: reverse primer, then reverse complement of the forward primer.
+        for strand, left_block, right_block, left_lengths, right_lengths in \
+                (('+', 0, 3, fwd_lengths, rev_lengths), ('-', 1, 2, rev_lengths, fwd_lengths)):
+            left = blocks == left_block
+            right = blocks == right_block
+            if not (left.any() and right.any()):
+                continue
+
+            # sort the right sites by (pair, chromosome, start), and find the
+            # run of right sites in the size window of each left site
+            right_keys = (pairs[right]*len(self.chromosomes)+chrom_idx[right])*2**33+starts[right]
+            order = np.argsort(right_keys, kind='mergesort')
+            right_keys = right_keys[order]
+            right_sites = np.flatnonzero(right)[order]
+
+            left_sites = np.flatnonzero(left)
+            left_pairs = pairs[left_sites]
+            left_starts = starts[left_sites]
+            key_base = (left_pairs*len(self.chromosomes)+chrom_idx[left_sites])*2**33
+            lowest = left_starts+np.maximum(min_product_size, left_lengths[left_pairs])-right_lengths[left_pairs]
+            highest = left_starts+max_product_size-right_lengths[left_pairs]
+            lower = np.searchsorted(right_keys, key_base+np.maximum(lowest, 0), 'left')
+            upper = np.searchsorted(right_keys, key_base+np.maximum(highest+1, 0), 'left')
+            matches, owners = _expand_ranges(lower, np.maximum(upper-lower, 0))
+
+            left_matches = left_sites[owners]
+            right_matches = right_sites[matches]
+            records = np.zeros(len(matches), dtype=PRODUCT_DTYPE)
+            records['pair'] = pairs[left_matches]
+            records['chromosome'] = chrom_idx[left_matches]
+            records['start'] = starts[left_matches]+1
+            records['end'] = starts[right_matches]+right_lengths[pairs[left_matches]]
+            records['strand'] = strand
+            if strand == '+':
+                records['fwd_mismatches'] = mismatches[left_matches]
+                records['rev_mismatches'] = mismatches[right_matches]
+            else:
+                records['fwd_mismatches'] = mismatches[right_matches]
+                records['rev_mismatches'] = mismatches[left_matches]
+            products.append(records)
+
+        if not products:
+            return np.zeros(0, dtype=PRODUCT_DTYPE)
+        products = np.concatenate(products)
+        return products[np.lexsort((products['start'], products['chromosome'], products['pair']))]
+
+
+def primer_match_sequence(primer_fwd, primer_rev, chromosome, start, end, strand, product):
+    """
+    Return a PCRPrimerMatchSequence for a product, given its sequence
+    (5' -> 3' from the forward primer).  As in the isPCR output, the
+    primer bases that match are uppercase and the rest lowercase.
+    """
+    primer_fwd, primer_rev = primer_fwd.upper(), primer_rev.upper()
+    rev_site = reverse_complement(primer_rev)
+    product = product.lower()
+    fwd_part = ''.join([base.upper() if base.upper() == primer else base for base, primer in zip(product, primer_fwd)])
+    rev_part = ''.join([base.upper() if base.upper() == primer else base for base, primer in zip(product[-len(rev_site):], rev_site)])
+    full_sequence = fwd_part+product[len(primer_fwd):-len(rev_site)]+rev_part
+    return PCRPrimerMatchSequence(primer_fwd, primer_rev, chromosome, start, end, strand, full_sequence)
+
+
+class LocalPCRSequenceSource(SequenceSource):
+    """
+    Gets sequences and primer matches from a local genome, in place of
+    UCSCSequenceSource.
+    """
+    def __init__(self, genome, max_mismatches=MAX_MISMATCHES,
+                 min_product_size=MIN_PRODUCT_SIZE, max_product_size=MAX_PRODUCT_SIZE):
+        """
+        :param genome: A GenomeIndex.
+        """
+        self.genome = genome
+        self.max_mismatches = max_mismatches
+        self.min_product_size = min_product_size
+        self.max_product_size = max_product_size
+
+    def sequence(self, chromosome, startpos, endpos):
+        length = self.genome.chromosome_length(chromosome)
+        if length is None:
+            return None
+        startpos = max(1, startpos)
+        endpos = min(length, endpos)
+        return SimpleGenomeSequence(chromosome_name(str(chromosome)), startpos, endpos, '+',
+                                    self.genome.bases(chromosome, startpos, endpos))
+
+    def sequences_for_primers(self, primer_fwd, primer_rev, fwd_prefix_length=0, rev_suffix_length=0):
+        return self.sequences_for_primer_pairs([(primer_fwd, primer_rev)], fwd_prefix_length, rev_suffix_length)[0]
+
+    def sequences_for_primer_pairs(self, primer_pairs, fwd_prefix_length=0, rev_suffix_length=0):
+        """
+        The bulk version of sequences_for_primers: return the list of
+        PCRSequences of each (forward primer, reverse primer) tuple.
+        """
+        products = self.genome.pcr_products(primer_pairs, self.max_mismatches,
+                                            self.min_product_size, self.max_product_size)
+        pcr_sequences = [[] for pair in primer_pairs]
+        for product in products:
+            primer_fwd, primer_rev = primer_pairs[product['pair']]
+            ch = self.genome.chromosomes[product['chromosome']]
+            start, end, strand = int(product['start']), int(product['end']), product['strand']
+            region = self.sequence(ch, start-fwd_prefix_length, end+rev_suffix_length)
+
+            product_sequence = region[start:end]
+            if strand == '-':
+                product_sequence = reverse_complement(product_sequence)
+            amplicon = primer_match_sequence(primer_fwd, primer_rev, ch, start, end, strand, product_sequence)
+
+            actual_fwd_prefix_length = start - region.start
+            actual_rev_suffix_length = region.end - end
+            if actual_fwd_prefix_length > 0:
+                prefix = SimpleGenomeSequence(ch, region.start, start-1, region.strand, region.sequence[:actual_fwd_prefix_length])
+            else:
+                prefix = None
+
+            if actual_rev_suffix_length > 0:
+                suffix = SimpleGenomeSequence(ch, end+1, region.end, region.strand, region.sequence[-actual_rev_suffix_length:])
+            else:
+                suffix = None
+
+            pcr_sequences[product['pair']].append(PCRSequence(amplicon, prefix, suffix))
+        return pcr_sequences
+
+    def sequence_around_loc(self, chromosome, pos, amplicon_width, prefix_length=0, suffix_length=0):
+        return self.sequence_around_region(chromosome, pos, pos, amplicon_width, prefix_length, suffix_length)
+
+    def sequence_around_region(self, chromosome, startpos, endpos, amplicon_width, prefix_length=0, suffix_length=0):
+        base_len = endpos-startpos+1
+        if base_len > amplicon_width:
+            raise ValueError("region width must be >= amplicon_width")
+
+        amplicon = self.sequence(chromosome, endpos-(amplicon_width-1), startpos+amplicon_width-1)
+        if amplicon is None:
+            return None
+        region = self.sequence(chromosome, amplicon.start-prefix_length, amplicon.end+suffix_length)
+
+        actual_prefix_length = amplicon.start - region.start
+        actual_suffix_length = region.end - amplicon.end
+        if actual_prefix_length > 0:
+            prefix = SimpleGenomeSequence(amplicon.chromosome, region.start, amplicon.start-1, region.strand, region.sequence[:actual_prefix_length])
+        else:
+            prefix = None
+
+        if actual_suffix_length > 0:
+            suffix = SimpleGenomeSequence(amplicon.chromosome, amplicon.end+1, region.end, region.strand, region.sequence[-actual_suffix_length:])
+        else:
+            suffix = None
+
+        return PCRSequence(amplicon, prefix, suffix)
+
+
+# genome indexes loaded by genome_sequence_source, by directory
+_genome_indexes = {}
+_genome_index_lock = threading.Lock()
+
+def genome_sequence_source(index_dir, **kwargs):
+    """
+    Return a LocalPCRSequenceSource over the genome index in index_dir
+    (see build_genome_index).  The index is memory-mapped on first use
+    and kept for the life of the process.
+
+    :raise IOError: if the index has not been built.
+    """
+    with _genome_index_lock:
+        if index_dir not in _genome_indexes:
+            _genome_indexes[index_dir] = GenomeIndex.load(index_dir)
+    return LocalPCRSequenceSource(_genome_indexes[index_dir], **kwargs)
+
+def configured_sequence_source(config, default_source):
+    """
+    Return the sequence source to use under config: the local genome if
+    a built index is configured (qtools.genome_index), otherwise
+    default_source().
+    """
+    index_dir = config.get('qtools.genome_index', None)
+    if index_dir:
+        try:
+            return genome_sequence_source(index_dir)
+        except IOError:
+            log.exception("Could not load the genome index at %s; run paster build-genome-index" % index_dir)
+    return default_source()
@@ -402,7 +402,7 @@ class CarryoverPlateMetric(PlateMetricCalculator):
         :param channel_num: The channel number to measure carryover on (default 0/FAM)
         """
         if not empty_sample_names:
-            empty_sample_names = ('Stealth','Stealth well','stealth')
+            empty_sample_names = CARRYOVER_EMPTY_SAMPLE_NAMES
         
         self.empty_sample_names = empty_sample_names
         self.channel_num = channel_num
@@ -549,7 +549,7 @@ class ColorCompCarryoverPlateMetric(CarryoverPlateMetric):
         
         return contamination_peaks, gated_contamination_peaks, carryover_peaks, num_wells, carryover_well_peak_dict
 
-DEFAULT_CARRYOVER_CALC = CarryoverPlateMetric(empty_sample_names=('Stealth','stealth','Stealth well'),channel_num=0)
+DEFAULT_CARRYOVER_CALC = CarryoverPlateMetric(empty_sample_names=CARRYOVER_EMPTY_SAMPLE_NAMES,channel_num=0)
 COLORCOMP_CARRYOVER_CALC = ColorCompCarryoverPlateMetric()
 
 
@@ -0,0 +1,217 @@
+"""
+Set-based comparison of the metrics of two analysis algorithms.
+
+Comparing the original metrics of an analysis group against those of a
+reprocess config (or two reprocess configs against each other) used to
+load the full metric tree of the group twice, pair plates/wells/channels
+through dicts, and compare one pair at a time.  Here, the two sets of
+metric rows are joined in SQL on the plate, well or well channel they
+describe, only the compared columns are read into aligned arrays, and
+the methods in qtools.lib.compare are computed over whole arrays
+(see qtools.lib.compare.VALUES_FUNCS).  Metric objects are then loaded
+for just the rows that are displayed.
+"""
+import numpy as np
+
+from sqlalchemy import and_, not_, select, types
+from sqlalchemy.orm import aliased, joinedload, joinedload_all
+from sqlalchemy.sql import exists
+
+from qtools.lib.compare import VALUES_FUNCS, pct_diff
+from qtools.model import Session, Plate, PlateMetric, WellMetric, WellChannelMetric, QLBWell
+from qtools.model import analysis_group_plate_table
+
+__all__ = ['MetricComparison',
+           'analysis_group_comparison']
+
+# decision tree flag set on channels that were gated
+GATED_FLAG = 4096
+
+# the eager loads for displaying compared metric objects
+DISPLAY_LOAD_OPTIONS = {
+    PlateMetric: lambda: [joinedload_all(PlateMetric.plate, Plate.box2),
+                          joinedload_all(PlateMetric.plate, Plate.plate_type)],
+    WellMetric: lambda: [joinedload_all(WellMetric.plate_metric, PlateMetric.plate, Plate.box2),
+                         joinedload_all(WellMetric.plate_metric, PlateMetric.plate, Plate.plate_type),
+                         joinedload(WellMetric.well),
+                         joinedload_all(WellMetric.well_channel_metrics, WellChannelMetric.well_channel)],
+    WellChannelMetric: lambda: [joinedload_all(WellChannelMetric.well_metric, WellMetric.plate_metric, PlateMetric.plate, Plate.box2),
+                                joinedload_all(WellChannelMetric.well_metric, WellMetric.plate_metric, PlateMetric.plate, Plate.plate_type),
+                                joinedload_all(WellChannelMetric.well_metric, WellMetric.well),
+                                joinedload(WellChannelMetric.well_channel)]
+}
+
+class MetricComparison(object):
+    """
+    The values of a set of metric columns, for the original (left) and
+    test (right) metrics of the same plates, wells or well channels,
+    aligned row by row.
+
+    left_values and right_values are (num rows, num attrs) arrays, with
+    missing values as NaN.
+    """
+    def __init__(self, metric_class, attrs, keys, left_ids, right_ids, left_values, right_values):
+        self.metric_class = metric_class
+        self.attrs = list(attrs)
+        self.keys = keys
+        self.left_ids = left_ids
+        self.right_ids = right_ids
+        self.left_values = left_values
+        self.right_values = right_values
+
+    def __len__(self):
+        return len(self.keys)
+
+    def compare(self, method, attr=None):
+        """
+        Compare the left and right values with a method from
+        qtools.lib.compare (such as abs_diff).
+
+        :param attr: The column to compare.  If None, every column is
+                     compared, and a (num rows, num attrs) array returned.
+        :return: The compare values of each row.  For a single integer
+                 column, differences (not percentages) are integers,
+                 as they are when compared one pair at a time.
+        """
+        values_func = VALUES_FUNCS[method]
+        if attr is None:
+            return values_func(self.left_values, self.right_values)
+
+        idx = self.attrs.index(attr)
+        values = values_func(self.left_values[:,idx], self.right_values[:,idx])
+        col = self.metric_class.__mapper__.columns[attr]
+        if method is not pct_diff and isinstance(col.type, types.Integer):
+            values = values.astype(np.int64)
+        return values
+
+    def pairs(self, indices):
+        """
+        Return the (left, right) metric objects of a set of rows.
+        """
+        indices = np.asarray(indices, dtype=int)
+        ids = set(self.left_ids[indices].tolist()) | set(self.right_ids[indices].tolist())
+        if not ids:
+            return []
+
+        objects = dict([(obj.id, obj) for obj in Session.query(self.metric_class)\
+                                                       .filter(self.metric_class.id.in_(ids))\
+                                                       .options(*DISPLAY_LOAD_OPTIONS[self.metric_class]())])
+        return [(objects[int(self.left_ids[i])], objects[int(self.right_ids[i])]) for i in indices]
+
+
+def _gated_criterion(well_metric):
+    """
+    Return the SQL criterion for a well metric having a gated channel
+    (see MetricsController.__get_analysis_group_form_kwargs)
+    """
+    return exists().where(and_(WellChannelMetric.well_metric_id == well_metric.id,
+                               WellChannelMetric.auto_threshold_expected == True,
+                               WellChannelMetric.decision_tree_flags.op('&')(GATED_FLAG) == GATED_FLAG))
+
+def _well_metric_criteria(well_metric, gated_filter):
+    if gated_filter == 'gated_only':
+        return [_gated_criterion(well_metric)]
+    elif gated_filter == 'not_gated':
+        return [not_(_gated_criterion(well_metric))]
+    else:
+        return []
+
+def analysis_group_comparison(analysis_group_id, metric_type, attrs,
+                              left_config_id=None, right_config_id=None, channel_num=0,
+                              plate_criteria=None, well_criteria=None, well_name_filter=None,
+                              gated_filter=None):
+    """
+    Pair the left and right metrics of an analysis group, and read the
+    values of a set of metric columns.
+
+    A plate, well or channel with more than one metric row for a config
+    is compared on its latest row.
+
+    :param metric_type: 'plate', 'well' or 'channel'.
+    :param attrs: The names of the columns to read.
+    :param left_config_id: The ReprocessConfig id of the original metrics (None for the original analysis).
+    :param right_config_id: The ReprocessConfig id of the test metrics.
+    :param channel_num: The channel compared, for channel metrics.
+    :param plate_criteria: SQL criteria on Plate.
+    :param well_criteria: SQL criteria on QLBWell (well and channel metrics).
+    :param well_name_filter: A function on the well name that returns whether to compare
+                             the well (well and channel metrics).
+    :param gated_filter: 'gated_only' or 'not_gated', to compare only wells whose left
+                         and right metrics have (or do not have) gated channels (well
+                         and channel metrics).
+    :rtype: MetricComparison
+    """
+    group_plates = select([analysis_group_plate_table.c.plate_id])\
+                       .where(analysis_group_plate_table.c.analysis_group_id == analysis_group_id)
+    left_pm = aliased(PlateMetric)
+    right_pm = aliased(PlateMetric)
+
+    if metric_type == 'plate':
+        metric_class = PlateMetric
+        left, right = left_pm, right_pm
+        key = left.plate_id
+        query = Session.query(key, left.id, right.id, *([getattr(left, attr) for attr in attrs]+[getattr(right, attr) for attr in attrs]))\
+                       .join((right, and_(right.plate_id == left.plate_id,
+                                          right.reprocess_config_id == (right_config_id or None))))
+        well = None
+    else:
+        left_wm = aliased(WellMetric)
+        right_wm = aliased(WellMetric)
+        if metric_type == 'well':
+            metric_class = WellMetric
+            left, right = left_wm, right_wm
+            key = left.well_id
+            query = Session.query(key, left.id, right.id, *([getattr(left, attr) for attr in attrs]+[getattr(right, attr) for attr in attrs]))\
+                           .join((right, right.well_id == left.well_id))
+        else:
+            metric_class = WellChannelMetric
+            left = aliased(WellChannelMetric)
+            right = aliased(WellChannelMetric)
+            key = left.well_channel_id
+            query = Session.query(key, left.id, right.id, *([getattr(left, attr) for attr in attrs]+[getattr(right, attr) for attr in attrs]))\
+                           .join((left_wm, left_wm.id == left.well_metric_id))\
+                           .join((right, right.well_channel_id == left.well_channel_id))\
+                           .join((right_wm, right_wm.id == right.well_metric_id))\
+                           .filter(left.channel_num == channel_num)
+
+        query = query.join((left_pm, left_pm.id == left_wm.plate_metric_id))\
+                     .join((right_pm, and_(right_pm.id == right_wm.plate_metric_id,
+                                           right_pm.reprocess_config_id == (right_config_id or None))))\
+                     .join((QLBWell, QLBWell.id == left_wm.well_id))
+        for criterion in (well_criteria or [])+_well_metric_criteria(left_wm, gated_filter)+_well_metric_criteria(right_wm, gated_filter):
+            query = query.filter(criterion)
+        well = QLBWell
+
+    query = query.join((Plate, and_(Plate.id == left_pm.plate_id, Plate.box2_id != None)))\
+                 .filter(left_pm.reprocess_config_id == (left_config_id or None))\
+                 .filter(left_pm.plate_id.in_(group_plates))
+    for criterion in (plate_criteria or []):
+        query = query.filter(criterion)
+
+    if well_name_filter and well is not None:
+        query = query.add_column(well.well_name)
+        rows = [row for row in query.all() if well_name_filter(row[-1])]
+    else:
+        rows = query.all()
+
+    num_attrs = len(attrs)
+    if rows:
+        columns = zip(*rows)
+        keys = np.array(columns[0], dtype=np.int64)
+        left_ids = np.array(columns[1], dtype=np.int64)
+        right_ids = np.array(columns[2], dtype=np.int64)
+        # None -> NaN
+        values = np.array(columns[3:3+2*num_attrs], dtype=float).T.reshape((len(rows), 2*num_attrs))
+    else:
+        keys = left_ids = right_ids = np.zeros(0, dtype=np.int64)
+        values = np.zeros((0, 2*num_attrs))
+
+    # keep the latest left and right rows of each key
+    order = np.lexsort((right_ids, left_ids, keys))
+    keys = keys[order]
+    last = np.ones(len(keys), dtype=bool)
+    last[:-1] = keys[1:] != keys[:-1]
+    order = order[last]
+
+    return MetricComparison(metric_class, attrs, keys[last], left_ids[order], right_ids[order],
+                            values[order,:num_attrs], values[order,num_attrs:])
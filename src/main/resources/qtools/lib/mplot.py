@@ -527,38 +527,40 @@ def multi_galaxy(title, wells, channel=0,
                  draw_threshold=False, draw_width_gates=False,
                  custom_thresholds=None,
                  quality_gate=False,
-                 draw_min_amplitude_peaks=True):
+                 draw_min_amplitude_peaks=True,
+                 histogram=None,
+                 custom_width_gates=None):
+    """
+    Draw the galaxy of a set of wells.  The histogram of each well is
+    added up, unless a precomputed histogram (such as a sum of tiles from
+    qtools.lib.galaxytile) is supplied; the thresholds and width gates
+    can likewise be supplied instead of read from the wells.
+    """
     if not deps_loaded:
         return None
     
     fig = plt.figure()
     from pyqlb.constants import FLT_MIN, FLT_MAX
-    from pyqlb.nstats.peaks import fam_widths, fam_amplitudes, width_gated, vic_widths, vic_amplitudes, cluster_1d, quality_gated
-    from pyqlb.nstats.well import well_static_width_gates, above_min_amplitude_peaks
-    xs = None
-    ys = None
-    for well in wells:
-        if draw_min_amplitude_peaks:
-            peaks = well.peaks
-        else:
-            peaks = above_min_amplitude_peaks(well)
-        
-        if quality_gate:
-            peaks = quality_gated(peaks, min_quality_gate=well.channels[0].statistics.min_quality_gate)
-        if xs is None:
-            xs = vic_amplitudes(peaks) if channel == 1 else fam_amplitudes(peaks)
-            ys = vic_widths(peaks) if channel == 1 else fam_widths(peaks)
-        else:
-            xs = np.hstack((xs, vic_amplitudes(peaks) if channel == 1 else fam_amplitudes(peaks)))
-            ys = np.hstack((ys, vic_widths(peaks) if channel == 1 else fam_widths(peaks)))
+    from pyqlb.nstats.well import well_static_width_gates
+    from qtools.lib.galaxytile import well_galaxy_peaks
     
     max_width = 20
     min_width = 5
     min_amp_log = np.log10(min_amplitude)
     max_amp_log = np.log10(max_amplitude)
-    if xs is not None and ys is not None and len(xs) > 0 and len(ys) > 0:
-        H, xedges, yedges = np.histogram2d(ys, np.log10(xs), bins=[height,width], range=[[min_droplet_width,max_droplet_width],[min_amp_log,max_amp_log]])
-        plt.imshow(H, origin='lower', cmap=get_plate_cmap(H), interpolation='nearest')
+    if histogram is None:
+        for well in wells:
+            xs, ys = well_galaxy_peaks(well, channel, all_peaks=draw_min_amplitude_peaks, quality_gate=quality_gate)
+            if len(xs) == 0 or len(ys) == 0:
+                continue
+            H, xedges, yedges = np.histogram2d(ys, np.log10(xs), bins=[height,width], range=[[min_droplet_width,max_droplet_width],[min_amp_log,max_amp_log]])
+            if histogram is None:
+                histogram = H
+            else:
+                histogram += H
+    
+    if histogram is not None:
+        plt.imshow(histogram, origin='lower', cmap=get_plate_cmap(histogram), interpolation='nearest')
     
     plt.title(title)
     plt.xlabel('%s Amplitude (log scale)' % ('VIC' if channel == 1 else 'FAM'))
@@ -581,7 +583,10 @@ def multi_galaxy(title, wells, channel=0,
             plt.text(histx+5, 5, "Average threshold: %.01f" % avg_thresh, color='#0000ff')
     
     if draw_width_gates:
-        width_gates = [well_static_width_gates(w) for w in wells]
+        if custom_width_gates:
+            width_gates = custom_width_gates
+        else:
+            width_gates = [well_static_width_gates(w) for w in wells]
         min_width_gates = [ming for ming, maxg in width_gates if ming and ming != FLT_MIN]
         max_width_gates = [maxg for ming, maxg in width_gates if maxg and maxg != FLT_MAX]
         if min_width_gates and max_width_gates:
@@ -625,7 +630,8 @@ def galaxy_carryover(title, wells,
                      min_amplitude=100, max_amplitude=32000,
                      draw_threshold=False, draw_width_gates=False,
                      quality_gate=False,
-                     draw_min_amplitude_peaks=False):
+                     draw_min_amplitude_peaks=False,
+                     histogram=None):
     underlay = multi_galaxy(title, wells, channel=channel,
                             width=width, height=height,
                             min_droplet_width=min_droplet_width, max_droplet_width=max_droplet_width,
@@ -633,7 +639,8 @@ def galaxy_carryover(title, wells,
                             draw_threshold=draw_threshold, draw_width_gates=draw_width_gates,
                             custom_thresholds=False,
                             quality_gate=quality_gate,
-                            draw_min_amplitude_peaks=draw_min_amplitude_peaks)
+                            draw_min_amplitude_peaks=draw_min_amplitude_peaks,
+                            histogram=histogram)
     
     # do histogram overlay
     def width_xform(w):
@@ -1849,7 +1856,13 @@ def dg_spike_time(subtitle, dg_runs, thumbnail=False):
     timeseries(fig, title, tuples, ylabel="Pressure Spike Derivative (PSI/s)")
     return fig
 
-def svilen(title, raw_data, ranges, widths):
+def svilen(title, windows, ranges, widths):
+    """
+    Draw the droplet traces of a set of sample ranges.
+
+    :param windows: The (num samples, 2) raw samples of each (begin, end) range
+                    (see qtools.lib.rawtrace.RawTrace.windows).
+    """
     fig = plt.figure()
     plt.title(title)
     if len(ranges) == 0:
@@ -1863,15 +1876,15 @@ def svilen(title, raw_data, ranges, widths):
     fig.set_figheight(2*rows)
     
     for i, (begin, end) in enumerate(ranges):
-        samples = raw_data[begin:end+1]
+        samples = windows[i]
         row, col = divmod(i, 4)
         ax = plt.subplot(rows, min(len(ranges), 4), i+1)
         ys = ranges
         ax.set_xlabel("%.02f" % widths[i])
         ax.set_xticks([])
-        ax.set_yticks([0,np.max([s[0] for s in samples]), np.max([s[1] for s in samples])])
-        ax.plot(range(begin, end+1), [s[0] for s in samples], color='blue')
-        ax.plot(range(begin, end+1), [s[1] for s in samples], color='red')
+        ax.set_yticks([0,np.max(samples[:,0]), np.max(samples[:,1])])
+        ax.plot(range(max(begin, 0), max(begin, 0)+len(samples)), samples[:,0], color='blue')
+        ax.plot(range(max(begin, 0), max(begin, 0)+len(samples)), samples[:,1], color='red')
     return fig
 
 
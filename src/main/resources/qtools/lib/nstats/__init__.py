@@ -4,16 +4,28 @@ import math
 # TODO put in utils, from StackOverflow originally, key=lambda x:x excluded,
 # elements sorted
 def percentile(N, percent, key=lambda x:x):
+    """
+    Return the linearly interpolated percentile (0-1) of the key values
+    of N.  Only the two ranks around the percentile are selected, instead
+    of sorting all of N.
+    """
     if N is None or len(N) == 0:
         return None
     k = (len(N)-1) * percent
     f = math.floor(k)
     c = math.ceil(k)
-    Np = sorted(N, key=key)
+    keys = [key(n) for n in N]
+    if None in keys:
+        # None does not order in numpy; fall back to a sort
+        Np = sorted(keys)
+        lower, upper = Np[int(f)], Np[int(c)]
+    else:
+        order = np.argpartition(np.array(keys), sorted(set([int(f), int(c)])))
+        lower, upper = keys[order[int(f)]], keys[order[int(c)]]
     if f == c:
-        return key(Np[int(k)])
-    d0 = key(Np[int(f)]) * (c-k)
-    d1 = key(Np[int(c)]) * (k-f)
+        return lower
+    d0 = lower * (c-k)
+    d1 = upper * (k-f)
     return d0+d1
 
 def moving_average(array, count, hfill=True):
@@ -37,41 +49,73 @@ def moving_average_by_interval(array, interval_array, interval_width, count):
     return zip(bins, moving_interval_avgs)
     
 
-def interval_averages(array, interval_array, interval_width, fill_blanks=True, blank_val=None):
-    lowest_interval = min(interval_array)
-    highest_interval = max(interval_array)
+def interval_bins(interval_array, interval_width):
+    """
+    Divide the span of interval_array into bins of interval_width,
+    aligned to multiples of the width.
+
+    Returns (bin starts, bin index of each value).  The index of a value
+    is the index of the last bin start at or below it, so a value on the
+    last bin start falls in the last bin.
+    """
+    interval_array = np.asarray(interval_array)
+    lowest_interval = interval_array.min()
+    highest_interval = interval_array.max()
     low_start, rem = divmod(lowest_interval, interval_width)
     high_start, high_rem = divmod(highest_interval, interval_width)
 
     if high_rem:
         high_start = high_start+1
-    bin_count = (high_start-low_start)+1
+    bin_count = int(high_start-low_start)+1
     bins = np.linspace(low_start*interval_width, high_start*interval_width, bin_count)
-    digitized = np.digitize(interval_array, bins)
+    return bins, np.searchsorted(bins, interval_array, side='right')-1
+
+def binned_counts(bin_indices, bin_count):
+    """
+    Return the number of values in each bin.
+    """
+    return np.bincount(bin_indices, minlength=bin_count)
 
-    indexable_array = np.array(array)
-    interval_avgs = [indexable_array[digitized==i].mean() for i in range(1, len(bins)+1)]
-    interval_avgs = []
-    for i in range(1, len(bins)+1):
-        interval_vals = indexable_array[digitized==i]
-        if len(interval_vals) > 0:
-            interval_avgs.append(interval_vals.mean())
-        else:
-            interval_avgs.append(blank_val)
+def binned_means(array, bin_indices, bin_count):
+    """
+    Return (means, counts) of the values in each bin; empty bins have NaN means.
+    """
+    counts = binned_counts(bin_indices, bin_count)
+    sums = np.bincount(bin_indices, weights=np.asarray(array, dtype=float), minlength=bin_count)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums/counts, counts
 
-    if fill_blanks:
-        for i, val in enumerate(interval_avgs):
-            if val is None and i > 0:
-                interval_avgs[i] = interval_avgs[i-1]
+def fill_blank_bins(values, filled):
+    """
+    Fill each unfilled bin with the value of the closest filled bin
+    before it, or, for the bins before the first filled bin, the value
+    of the first filled bin.
+    """
+    values = np.asarray(values)
+    if not filled.any():
+        return values
+    last_filled = np.maximum.accumulate(np.where(filled, np.arange(len(values)), -1))
+    last_filled[last_filled < 0] = np.flatnonzero(filled)[0]
+    return values[last_filled]
 
-        # now clean up the reverse
-        lowest_filled_index = 0
-        for i, val in enumerate(interval_avgs):
-            if val is not None:
-                lowest_filled_index = i
-                break
+def interval_averages(array, interval_array, interval_width, fill_blanks=True, blank_val=None):
+    """
+    Average the values of array in intervals of interval_width, by the
+    corresponding values of interval_array.
+
+    Returns (interval start, average) for each interval between the
+    min/max of interval_array.  Intervals without values average to
+    blank_val; if blank_val is None and fill_blanks is True, they take
+    the average of the closest interval before them instead (or, before
+    the first interval with values, the first average).
+    """
+    bins, bin_indices = interval_bins(interval_array, interval_width)
+    means, counts = binned_means(array, bin_indices, len(bins))
+    filled = counts > 0
 
-        if lowest_filled_index > 0:
-            interval_avgs[:lowest_filled_index] = [interval_avgs[lowest_filled_index]]*lowest_filled_index
+    if fill_blanks and blank_val is None:
+        means = fill_blank_bins(means, filled)
+        filled = np.ones(len(bins), dtype=bool)
 
-    return zip(bins, interval_avgs)
\ No newline at end of file
+    interval_avgs = [mean if is_filled else blank_val for mean, is_filled in zip(means.tolist(), filled)]
+    return zip(bins, interval_avgs)
@@ -0,0 +1,148 @@
+"""
+Amplitude drift and multimodality analysis for many wells at once.
+
+The amplitude histograms of a batch of wells (or well halves) are
+computed together: every histogram has the same bin width, centered on
+its own mean (see qtools.lib.nstats.fam_drift.amp_bins), so all the
+amplitudes are binned with a single pass and counted with one bincount
+into a (histograms x bins) matrix.  Local maxima and moments are then
+found across all the rows of the matrix at once.
+"""
+import numpy as np
+
+MAX_DYNAMIC_RANGE = 32767
+
+# histogram bin edges used for split-run drift analysis.
+DRIFT_BINS = 257
+
+# wells whose mean amplitude moves by more than this fraction of the overall
+# mean between the first and second halves of the run are flagged.
+MAX_DRIFT = 0.05
+
+DRIFT_DTYPE = np.dtype([('events', np.int64),
+                        ('mean', np.float64),
+                        ('sigma', np.float64),
+                        ('first_mean', np.float64),
+                        ('second_mean', np.float64),
+                        ('first_sigma', np.float64),
+                        ('second_sigma', np.float64),
+                        ('drift', np.float64),
+                        ('first_peaks', np.int64),
+                        ('second_peaks', np.int64)])
+
+def centered_bin_edges(means, num_bins=129, max_dynamic_range=MAX_DYNAMIC_RANGE):
+    """
+    Return the (len(means), num_bins) bin edges of histograms centered
+    on each mean, with bins (max_dynamic_range*2/num_bins) wide.
+    """
+    offsets = np.arange(num_bins)*((max_dynamic_range*2.0)/num_bins)
+    return offsets[np.newaxis,:]-(max_dynamic_range-np.asarray(means, dtype=float)[:,np.newaxis])
+
+def bin_centers(edges):
+    """
+    Return the centers of the bins between edges (along the last axis).
+    """
+    edges = np.asarray(edges, dtype=float)
+    return (edges[...,1:]+edges[...,:-1])/2.0
+
+def batch_histograms(amp_arrays, num_bins=129, max_dynamic_range=MAX_DYNAMIC_RANGE):
+    """
+    Histogram each array of amplitudes into num_bins-1 bins centered on
+    its mean.  Bins are closed on the left, and the last bin on the right
+    as well, as with np.histogram; amplitudes outside the edges are not
+    counted.
+
+    :return: (counts, edges, means): a (arrays, num_bins-1) int array,
+             the (arrays, num_bins) edges and the mean of each array
+             (NaN if empty).
+    """
+    lengths = np.array([len(amps) for amps in amp_arrays], dtype=int)
+    rows = np.repeat(np.arange(len(amp_arrays)), lengths)
+    amps = np.concatenate([np.asarray(amps, dtype=float) for amps in amp_arrays]) if lengths.sum() else np.zeros(0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.bincount(rows, weights=amps, minlength=len(amp_arrays))/lengths
+
+    edges = centered_bin_edges(means, num_bins, max_dynamic_range)
+    num_hist_bins = num_bins-1
+    if len(amps) == 0:
+        return np.zeros((len(amp_arrays), num_hist_bins), dtype=int), edges, means
+
+    # edges[row, i] == offsets[i]-(max_dynamic_range-means[row]); estimate each bin from the
+    # width, then settle values on an edge against the exact edges
+    offsets = np.arange(num_bins)*((max_dynamic_range*2.0)/num_bins)
+    value_shifts = (max_dynamic_range-means)[rows]
+    idx = np.clip(np.floor((amps+value_shifts)/offsets[1]).astype(int), 0, num_hist_bins-1)
+    idx[amps < offsets[idx]-value_shifts] -= 1
+    idx[(idx < num_hist_bins-1) & (amps >= offsets[np.minimum(idx+1, num_bins-1)]-value_shifts)] += 1
+
+    counted = (amps >= offsets[0]-value_shifts) & (amps <= offsets[-1]-value_shifts)
+    idx = np.clip(idx, 0, num_hist_bins-1)
+    counts = np.bincount(rows[counted]*num_hist_bins+idx[counted], minlength=len(amp_arrays)*num_hist_bins)
+    return counts.reshape((len(amp_arrays), num_hist_bins)), edges, means
+
+def local_maxima_counts(hists, min_peak_vals=0):
+    """
+    Count the local maxima of each histogram row that are at least
+    min_peak_val (a scalar, or one value per row).  A local maximum is
+    a bin where the slope turns from rising to falling; flat tops are
+    not counted (see qtools.lib.nstats.fam_drift.peak_count).
+    """
+    hists = np.atleast_2d(hists)
+    slopes = np.diff(hists, axis=1)
+    turns = (slopes[:,1:]*slopes[:,:-1]) < 0
+    maxima = turns & (slopes[:,1:] < 0)
+    min_peak_vals = np.asarray(min_peak_vals)
+    if min_peak_vals.ndim:
+        min_peak_vals = min_peak_vals[:,np.newaxis]
+    return (maxima & (hists[:,1:-1] >= min_peak_vals)).sum(axis=1)
+
+def histogram_moments(hists, centers):
+    """
+    Return the (mean, standard deviation) of the bin centers of each
+    histogram row, weighted by count; NaN for empty rows.
+    """
+    hists = np.asarray(hists, dtype=float)
+    totals = hists.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = (hists*centers).sum(axis=1)/totals
+        variances = (hists*(centers-means[:,np.newaxis])**2).sum(axis=1)/totals
+    return means, np.sqrt(variances)
+
+def split_drift(amp_arrays, num_bins=DRIFT_BINS, max_dynamic_range=MAX_DYNAMIC_RANGE):
+    """
+    Compare the first and second halves of the run of each array of
+    amplitudes (in event order), for all the arrays at once.
+
+    :return: A DRIFT_DTYPE record per array.  drift is the change in
+             mean amplitude from the first half to the second, as a
+             fraction of the overall mean; the peaks fields count the
+             histogram maxima of each half that are at least a third of
+             the tallest bin.
+    """
+    num_arrays = len(amp_arrays)
+    halves = [amps[:len(amps)/2] for amps in amp_arrays]+[amps[len(amps)/2:] for amps in amp_arrays]
+    counts, edges, means = batch_histograms(list(amp_arrays)+halves, num_bins, max_dynamic_range)
+    sigmas = histogram_moments(counts, bin_centers(edges))[1]
+    peaks = local_maxima_counts(counts, counts.max(axis=1)/3)
+
+    records = np.zeros(num_arrays, dtype=DRIFT_DTYPE)
+    records['events'] = [len(amps) for amps in amp_arrays]
+    records['mean'] = means[:num_arrays]
+    records['sigma'] = sigmas[:num_arrays]
+    records['first_mean'] = means[num_arrays:2*num_arrays]
+    records['second_mean'] = means[2*num_arrays:]
+    records['first_sigma'] = sigmas[num_arrays:2*num_arrays]
+    records['second_sigma'] = sigmas[2*num_arrays:]
+    records['first_peaks'] = peaks[num_arrays:2*num_arrays]
+    records['second_peaks'] = peaks[2*num_arrays:]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        records['drift'] = (records['second_mean']-records['first_mean'])/records['mean']
+    return records
+
+def drift_flags(records, max_drift=MAX_DRIFT):
+    """
+    Return whether each drift record shows drift beyond max_drift, or a
+    multimodal amplitude distribution in either half of the run.
+    """
+    return (np.abs(np.nan_to_num(records['drift'])) > max_drift) | \
+           (records['first_peaks'] > 1) | (records['second_peaks'] > 1)
@@ -2,8 +2,9 @@ import numpy as np
 import operator
 
 from pyqlb.factory import QLNumpyObjectFactory
-from pyqlb.nstats.peaks import fam_amplitudes, cluster_1d
+from pyqlb.nstats.peaks import fam_amplitudes, channel_amplitudes, cluster_1d
 from scipy.optimize import curve_fit
+from qtools.lib.nstats.drift import centered_bin_edges, bin_centers, batch_histograms, local_maxima_counts, split_drift
 #from qtools.lib.ext.gaussfitter import onedgaussfit
 
 def gauss(x, *p):
@@ -18,14 +19,7 @@ def amp_bins(amps, num_bins=129, max_dynamic_range=32767):
     the dynamic range are captured, even if the mean is
     zero.
     """
-    mean = np.mean(amps)
-    bins = np.arange(num_bins)*((max_dynamic_range*2.0)/num_bins)
-    bins = [b-(max_dynamic_range-mean) for b in bins]
-    return bins
-
-# does this exist in numpy?
-def bin_centers(bins):
-    return [(bins[i]+bins[i+1])/2.0 for i in range(len(bins)-1)]
+    return centered_bin_edges([np.mean(amps)], num_bins, max_dynamic_range)[0]
 
 def fam_variation(well):
     amps = fam_amplitudes(well.peaks)
@@ -48,20 +42,29 @@ def peak_count(bins, min_peak_val=0):
     Determine whether a distribution has more than one peak. Really rough.
     TODO: add dip size, figure out flat tops.  Sucks.
     """
-    db = [bins[i+1]-bins[i] for i in range(len(bins)-1)]
-    dbp = [db[i+1]*db[i] for i in range(len(db)-1)]
-
     # ignore flat top valleys, known bug but I'm counting on it for a histogram
-    minmax_idx = [idx+1 for idx, db2 in enumerate(dbp) if db2 < 0]
-    local_maxima = [(idx, bins[idx]) for idx in minmax_idx if db[idx] < 0]
-    local_minima = [(idx, bins[idx]) for idx in minmax_idx if db[idx] > 0]
-    
     # ignore dipsize for now
-    return len([lmax for lmax in local_maxima if lmax[1] >= min_peak_val])
-    
+    return int(local_maxima_counts(np.asarray(bins), min_peak_val)[0])
 
 
+def plate_fam_drift(qlplate, channel_num=0, threshold=None):
+    """
+    Computes the split-run amplitude drift of every analyzed well
+    on the plate in one batch.
 
+    :param qlplate: The plate.
+    :param channel_num: The channel whose amplitudes to analyze.
+    :param threshold: If specified, only analyze the peaks above this amplitude.
+    :return: (well names, DRIFT_DTYPE records) in well name order.
+    """
+    names = sorted(qlplate.analyzed_wells.keys())
+    amp_arrays = []
+    for name in names:
+        peaks = qlplate.analyzed_wells[name].peaks
+        if threshold is not None:
+            peaks, negatives = cluster_1d(peaks, channel_num, threshold)
+        amp_arrays.append(channel_amplitudes(peaks, channel_num))
+    return names, split_drift(amp_arrays)
 
 def fam_variation_splits(well, threshold=None):
     """
@@ -82,17 +85,8 @@ def fam_variation_splits(well, threshold=None):
     first_half = amps[:len(amps)/2]
     second_half = amps[len(amps)/2:]
 
-    fbins = amp_bins(first_half, num_bins=257)
-    fvals, fpos = np.histogram(first_half, bins=fbins)
-    fcenters = bin_centers(fpos)
-
-    sbins = amp_bins(second_half, num_bins=257)
-    svals, spos = np.histogram(second_half, bins=sbins)
-    scenters = bin_centers(spos)
-
-    abins = amp_bins(amps, num_bins=257)
-    avals, apos = np.histogram(amps, bins=abins)
-    acenters = bin_centers(apos)
+    (fvals, svals, avals), (fpos, spos, apos), means = batch_histograms([first_half, second_half, amps], num_bins=257)
+    fcenters, scenters, acenters = bin_centers(np.array([fpos, spos, apos]))
 
     (gamp1, gmean1, gsigma1), covar = curve_fit(gauss, fcenters, fvals, p0=[max(fvals), np.mean(first_half), fpos[1]-fpos[0]])
     (gamp2, gmean2, gsigma2), covar = curve_fit(gauss, scenters, svals, p0=[max(svals), np.mean(second_half), spos[1]-spos[0]])
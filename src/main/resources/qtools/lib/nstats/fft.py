@@ -19,3 +19,67 @@ def find_peak_indices(data, window_size):
 	outer_peak_indices = peak_indices.take(np.argsort(peaks))[::-1]
 	return outer_peak_indices
 
+
+
+def downsampled_blocks(blocks, downsample):
+	"""
+	Given an iterable of consecutive sample blocks, yield the blocks
+	taking every downsample-th sample of the concatenated stream (the
+	same samples as stream[::downsample]), without concatenating.
+	"""
+	offset = 0
+	for block in blocks:
+		yield block[offset::downsample]
+		offset = (offset - len(block)) % downsample
+
+def welch_amplitude_spectrum(blocks, sample_rate, segment_size):
+	"""
+	Compute a Welch-averaged, Hann-windowed single-sided amplitude spectrum
+	over a stream of consecutive sample blocks, using real-input FFTs over
+	half-overlapping segments.  Only one segment's worth of samples is
+	held at a time.
+
+	Amplitudes are scaled so that a sinusoid of amplitude A registers
+	as A/2, the same as abs(fft(x))/len(x) on the full trace.  If the
+	stream is shorter than segment_size, the whole stream is used as
+	a single segment.
+
+	Returns (frequencies, amplitudes, max_sample), where max_sample is
+	the maximum sample value seen (for normalization).
+	"""
+	step = segment_size // 2
+	buf = np.zeros(0)
+	power = None
+	segments = 0
+	max_sample = None
+	window = np.hanning(segment_size)
+	scale = window.sum()
+
+	for block in blocks:
+		if len(block) == 0:
+			continue
+		block_max = block.max()
+		if max_sample is None or block_max > max_sample:
+			max_sample = block_max
+		buf = np.concatenate((buf, block))
+		start = 0
+		while start + segment_size <= len(buf):
+			spec = np.abs(np.fft.rfft(window*buf[start:start+segment_size])/scale)**2
+			if power is None:
+				power = spec
+			else:
+				power += spec
+			segments += 1
+			start += step
+		buf = buf[start:]
+
+	if segments == 0:
+		if len(buf) < 2:
+			return np.zeros(0), np.zeros(0), max_sample
+		window = np.hanning(len(buf))
+		power = np.abs(np.fft.rfft(window*buf)/window.sum())**2
+		segments = 1
+		segment_size = len(buf)
+
+	freqs = np.fft.rfftfreq(segment_size, d=1.0/sample_rate)
+	return freqs, np.sqrt(power/segments), max_sample
@@ -52,59 +52,73 @@ def cnv_conf_interval(y, x, ny, nx):
     return r, r_low, r_high
     
     
-def prob_of_frag(fampos_vicneg, fampos_vicpos,
-                 famneg_vicneg, famneg_vicpos,
-                 total_events):
+# number of steps in the linked-concentration grid search.
+FRAG_GRID_STEPS = 1000
+
+# number of wells to evaluate the grid for at once, to bound memory.
+FRAG_BATCH_ROWS = 512
+
+def _frag_rank_deficient(fampos_vicneg, fampos_vicpos, famneg_vicneg, famneg_vicpos):
     # if rank of matrix < 2
-    if((fampos_vicneg == 0 and fampos_vicpos == 0) \
-       or (fampos_vicneg == 0 and famneg_vicneg == 0) \
-       or (fampos_vicpos == 0 and famneg_vicpos == 0) \
-       or (famneg_vicneg == 0 and famneg_vicpos == 0)):
-       return None
-        
-    H = np.array([[fampos_vicneg*1., fampos_vicpos*1.],
-                  [famneg_vicneg*1., famneg_vicpos*1.]])
-     
-    # Compute Probabilities
-    estN = np.sum(H.flatten())
-    i_p = H/estN
-    
+    return (fampos_vicneg == 0 and fampos_vicpos == 0) \
+           or (fampos_vicneg == 0 and famneg_vicneg == 0) \
+           or (fampos_vicpos == 0 and famneg_vicpos == 0) \
+           or (famneg_vicneg == 0 and famneg_vicpos == 0)
+
+def _frag_estimates(H):
+    """
+    Least-squares estimate of the linked concentration for a batch of
+    2x2 cluster count matrices.
+
+    The error of every candidate gcAB on each well's grid (the same
+    arange(0, maxVal, maxVal/FRAG_GRID_STEPS) the per-step search used)
+    is computed as one (wells, steps) array, so the estimate is
+    identical to the step search, without the Python loop.
+
+    :param H: (N, 4) array of [fampos_vicneg, fampos_vicpos, famneg_vicneg, famneg_vicpos]
+              counts for each well; none may be rank deficient.
+    :return: (estN, i_cAorAB, i_cBorAB, estAB) arrays of length N.
+    """
+    H = np.asarray(H, dtype=np.float64)
+    estN = H.sum(axis=1)
+    i_p = H/estN[:,None]
+
     # A is X and B is Y in cross plot
-    i_pAorAB = i_p[0,1] + i_p[1,1]
-    i_pBorAB = i_p[0,0] + i_p[0,1]
+    i_pAorAB = i_p[:,1] + i_p[:,3]
+    i_pBorAB = i_p[:,0] + i_p[:,1]
     i_cAorAB = -np.log(1 - i_pAorAB)
     i_cBorAB = -np.log(1 - i_pBorAB)
-    
-    maxVal = min(i_cAorAB, i_cBorAB)
-    delta = maxVal/1000.0;
-    
-    errArr = []
-    gcABArr = []
-    
-    gp = np.zeros((2, 2))
-    
-    for gcAB in np.arange(0, maxVal, delta):
-        gcA = i_cAorAB - gcAB
-        gcB = i_cBorAB - gcAB
-        
-        gpA = 1 - np.exp(-gcA)
-        gpB = 1 - np.exp(-gcB)
-        gpAB = 1 - np.exp(-gcAB)
-        
-        gp[1,0] = (1 - gpA) * (1 - gpB) * (1 - gpAB)
-        gp[1,1] = gpA * (1 - gpB) * (1 - gpAB)
-        gp[0,0] = (1 - gpA) * gpB * (1 - gpAB)
-        gp[0,1] = 1 - gp[1,0] - gp[1,1] - gp[0,0]
-        
-        gH = gp * estN
-        
-        err = np.sqrt(np.sum((H.flatten() - gH.flatten())**2))
-        
-        errArr.append(err)
-        gcABArr.append(gcAB)
-    
-    minidx = np.argmin(errArr)
-    estAB = gcABArr[minidx]
+
+    maxVal = np.minimum(i_cAorAB, i_cBorAB)
+    delta = maxVal/float(FRAG_GRID_STEPS)
+    # arange's length; usually FRAG_GRID_STEPS, sometimes one more
+    # depending on rounding.
+    steps = np.ceil(maxVal/delta).astype(np.int64)
+
+    grid = np.arange(steps.max(), dtype=np.float64)
+    gcAB = grid[None,:]*delta[:,None]
+    gcA = i_cAorAB[:,None] - gcAB
+    gcB = i_cBorAB[:,None] - gcAB
+
+    gpA = 1 - np.exp(-gcA)
+    gpB = 1 - np.exp(-gcB)
+    gpAB = 1 - np.exp(-gcAB)
+
+    gp10 = (1 - gpA) * (1 - gpB) * (1 - gpAB)
+    gp11 = gpA * (1 - gpB) * (1 - gpAB)
+    gp00 = (1 - gpA) * gpB * (1 - gpAB)
+    gp01 = 1 - gp10 - gp11 - gp00
+
+    N = estN[:,None]
+    err = np.sqrt((H[:,0,None] - gp00*N)**2 + (H[:,1,None] - gp01*N)**2 + \
+                  (H[:,2,None] - gp10*N)**2 + (H[:,3,None] - gp11*N)**2)
+    err[grid[None,:] >= steps[:,None]] = np.inf
+
+    minidx = np.argmin(err, axis=1)
+    estAB = gcAB[np.arange(len(H)), minidx]
+    return estN, i_cAorAB, i_cBorAB, estAB
+
+def _frag_intervals(estN, i_cAorAB, i_cBorAB, estAB, total_events):
     estA = i_cAorAB - estAB
     estB = i_cBorAB - estAB
     
@@ -138,3 +152,32 @@ def prob_of_frag(fampos_vicneg, fampos_vicpos,
         retarr[i].extend([nL_ratio*val for val in retarr[i]])
     
     return retarr
+
+def prob_of_frag_batch(counts, total_events=None):
+    """
+    Compute prob_of_frag for many wells at once.
+
+    :param counts: Sequence of (fampos_vicneg, fampos_vicpos, famneg_vicneg, famneg_vicpos)
+                   cluster counts, one per well.
+    :param total_events: Sequence of total event counts, one per well (or None).
+    :return: A list of prob_of_frag results (None for rank-deficient wells).
+    """
+    if total_events is None:
+        total_events = [None]*len(counts)
+
+    results = [None]*len(counts)
+    valid = [idx for idx, c in enumerate(counts) if not _frag_rank_deficient(*c)]
+    for start in xrange(0, len(valid), FRAG_BATCH_ROWS):
+        rows = valid[start:start+FRAG_BATCH_ROWS]
+        estimates = _frag_estimates([counts[idx] for idx in rows])
+        for idx, estN, i_cAorAB, i_cBorAB, estAB in zip(rows, *[e.tolist() for e in estimates]):
+            results[idx] = _frag_intervals(np.float64(estN), np.float64(i_cAorAB),
+                                           np.float64(i_cBorAB), np.float64(estAB),
+                                           total_events[idx])
+    return results
+
+def prob_of_frag(fampos_vicneg, fampos_vicpos,
+                 famneg_vicneg, famneg_vicpos,
+                 total_events):
+    return prob_of_frag_batch([(fampos_vicneg, fampos_vicpos, famneg_vicneg, famneg_vicpos)],
+                              [total_events])[0]
@@ -6,6 +6,7 @@ from pyqlb.nstats.peaks import cluster_1d, cluster_2d, peak_times, fam_widths, r
 from pyqlb.nstats.peaks import channel_widths, channel_amplitudes, fam_amplitudes, vic_amplitudes, cluster_angle_ccw
 from pyqlb.nstats import concentration
 from pyqlb.nstats.well import well_static_width_gates, above_min_amplitude_peaks, accepted_peaks as well_accepted_peaks
+from qtools.lib.nstats.regions import PeakRegions, amplitude_bin_indices, REGION_NEGATIVE_SMALL
 
 # for backwards compatibility
 def accepted_peaks(well):
@@ -16,6 +17,50 @@ def total_events_amplitude_vals(well,ch):
     peaks = well.peaks
     return (np.mean(channel_amplitudes(peaks, ch)), np.std(channel_amplitudes(peaks, ch))) 
 
+def _rain_gated_peaks(well, channel_num, threshold, pct_boundary, exclude_min_amplitude_peaks):
+    """
+    Return the peaks to classify and the (pos, middle_high, middle_low, neg)
+    rain gates for the channel.
+    """
+    if not threshold:
+        threshold = well.channels[channel_num].statistics.threshold
+    if not threshold:
+        threshold = None
+    
+    # filter out min_amplitude_peaks
+    if exclude_min_amplitude_peaks:
+        peaks = above_min_amplitude_peaks(well)
+    else:
+        peaks = well.peaks
+
+    p_plus, p, p_minus, pos, middle_high, middle_low, neg = \
+            rain_pvalues_thresholds(peaks,
+                                    channel_num=channel_num,
+                                    threshold=threshold,
+                                    pct_boundary=pct_boundary)
+    return peaks, (pos, middle_high, middle_low, neg)
+
+def peak_regions(peaks, channel_num, rain_gates, width_gates=None, amplitude_bins=None):
+    """
+    Classify the peaks in a single pass (see qtools.lib.nstats.regions).
+    If amplitude bins are specified, the width gates of each peak's sum
+    amplitude bin are used; otherwise, the width_gates (min, max) are.
+    """
+    widths = channel_widths(peaks, channel_num)
+    amplitudes = channel_amplitudes(peaks, channel_num)
+    if amplitude_bins is None:
+        return PeakRegions(widths, amplitudes, rain_gates, width_gates=width_gates)
+    return PeakRegions(widths, amplitudes, rain_gates,
+                       bin_indices=peak_amplitude_bin_indices(peaks, amplitude_bins),
+                       bin_width_gates=[(min_gate, max_gate) for min_gate, max_gate, boundary in amplitude_bins])
+
+def peak_amplitude_bin_indices(peaks, amplitude_bins):
+    """
+    Return the index of the sum amplitude bin each peak is in (-1 if none).
+    """
+    amplitude_sums = fam_amplitudes(peaks) + vic_amplitudes(peaks)
+    return amplitude_bin_indices(amplitude_sums, [bin[2] for bin in amplitude_bins])
+
 # TODO move into PyQLB?
 def polydisperse_peaks(well, channel_num, threshold=None, pct_boundary=0.3, exclude_min_amplitude_peaks=True):
     """
@@ -40,60 +85,14 @@ def polydisperse_peaks(well, channel_num, threshold=None, pct_boundary=0.3, excl
 
     Positives & negatives are computed on the specified channel number.
     """
-    if not threshold:
-        threshold = well.channels[channel_num].statistics.threshold
-    if not threshold:
-        threshold = None
-    
-    # filter out min_amplitude_peaks
-    if exclude_min_amplitude_peaks:
-        peaks = above_min_amplitude_peaks(well)
-    else:
-        peaks = well.peaks
-
-    p_plus, p, p_minus, pos, middle_high, middle_low, neg = \
-            rain_pvalues_thresholds(peaks,
-                                    channel_num=channel_num,
-                                    threshold=threshold,
-                                    pct_boundary=pct_boundary)
-    
+    peaks, rain_gates = _rain_gated_peaks(well, channel_num, threshold, pct_boundary, exclude_min_amplitude_peaks)
     min_gate, max_gate = well_static_width_gates(well)
+    width_gates = (min_gate, max_gate)
+    regions = peak_regions(peaks, channel_num, rain_gates, width_gates=width_gates)
 
-    pos_peaks = np.extract(
-        reduce(np.logical_and,
-               (channel_widths(peaks, channel_num) > max_gate,
-                channel_amplitudes(peaks, channel_num) > pos)),
-        peaks)
-    
-    
-    if middle_high and middle_low:
-        midhigh_peaks = np.extract(
-            reduce(np.logical_and,
-                   (channel_widths(peaks, channel_num) > max_gate,
-                    reduce(np.logical_and,
-                           (channel_amplitudes(peaks, channel_num) < middle_high,
-                            channel_amplitudes(peaks, channel_num) > middle_low)))),
-            peaks)
-        midlow_peaks = np.extract(
-            reduce(np.logical_and,
-                   (channel_widths(peaks, channel_num) < min_gate,
-                    reduce(np.logical_and,
-                           (channel_amplitudes(peaks, channel_num) < middle_high,
-                            channel_amplitudes(peaks, channel_num) > middle_low)))),
-            peaks)
-    else:
-        midhigh_peaks = np.ndarray([0],dtype=peak_dtype(2))
-        midlow_peaks = np.ndarray([0],dtype=peak_dtype(2))
-    
-    neg_peaks = np.extract(
-        reduce(np.logical_and,
-               (channel_widths(peaks, channel_num) < min_gate,
-                channel_amplitudes(peaks, channel_num) < neg)),
-        peaks)
-    
-    return ((pos_peaks, midhigh_peaks, midlow_peaks, neg_peaks),
-            (pos, middle_high, middle_low, neg),
-            (min_gate, max_gate))
+    return (tuple([peaks.take(indices) for indices in regions.polydisperse_indices()]),
+            rain_gates,
+            width_gates)
 
 def revb_polydisperse_peaks(well, channel_num, threshold=None, pct_boundary=0.3, exclude_min_amplitude_peaks=True):
     """
@@ -127,61 +126,11 @@ def revb_polydisperse_peaks(well, channel_num, threshold=None, pct_boundary=0.3,
     if not hasattr(well, 'sum_amplitude_bins') or len(well.sum_amplitude_bins) == 0:
         raise ValueError("No amplitude bins for this well.")
     
-    if not threshold:
-        threshold = well.channels[channel_num].statistics.threshold
-    if not threshold:
-        threshold = None
-    
-    if exclude_min_amplitude_peaks:
-        peaks = above_min_amplitude_peaks(well)
-    else:
-        peaks = well.peaks
-    
-    p_plus, p, p_minus, pos, middle_high, middle_low, neg = \
-            rain_pvalues_thresholds(peaks,
-                                    channel_num=channel_num,
-                                    threshold=threshold,
-                                    pct_boundary=pct_boundary)
-    
-    binned_peaks         = bin_peaks_by_amplitude(peaks, well.sum_amplitude_bins)
-    
-    pos_peaks     = np.ndarray([0], dtype=peak_dtype(2))
-    midhigh_peaks = np.ndarray([0], dtype=peak_dtype(2))
-    midlow_peaks  = np.ndarray([0], dtype=peak_dtype(2))
-    neg_peaks     = np.ndarray([0], dtype=peak_dtype(2))
-
-    for bin, (min_gate, max_gate, boundary) in zip(binned_peaks, well.sum_amplitude_bins):
-        pos_peaks = np.hstack([pos_peaks, np.extract(
-            reduce(np.logical_and,
-                   (channel_widths(bin, channel_num) > max_gate,
-                    channel_amplitudes(bin, channel_num) > pos)),
-            bin)])
-    
-        if middle_high and middle_low:
-            midhigh_peaks = np.hstack([midhigh_peaks, np.extract(
-                reduce(np.logical_and,
-                       (channel_widths(bin, channel_num) > max_gate,
-                        reduce(np.logical_and,
-                               (channel_amplitudes(bin, channel_num) < middle_high,
-                                channel_amplitudes(bin, channel_num) > middle_low)))),
-                bin)])
-            
-            midlow_peaks = np.hstack([midlow_peaks, np.extract(
-                reduce(np.logical_and,
-                       (channel_widths(bin, channel_num) < min_gate,
-                        reduce(np.logical_and,
-                               (channel_amplitudes(bin, channel_num) < middle_high,
-                                channel_amplitudes(bin, channel_num) > middle_low)))),
-                bin)])
-        
-        neg_peaks = np.hstack([neg_peaks, np.extract(
-            reduce(np.logical_and,
-                   (channel_widths(bin, channel_num) < min_gate,
-                    channel_amplitudes(bin, channel_num) < neg)),
-            bin)])
-    
-    return ((pos_peaks, midhigh_peaks, midlow_peaks, neg_peaks),
-            (pos, middle_high, middle_low, neg),
+    peaks, rain_gates = _rain_gated_peaks(well, channel_num, threshold, pct_boundary, exclude_min_amplitude_peaks)
+    regions = peak_regions(peaks, channel_num, rain_gates, amplitude_bins=well.sum_amplitude_bins)
+
+    return (tuple([peaks.take(indices) for indices in regions.polydisperse_indices()]),
+            rain_gates,
             (np.mean(fam_amplitudes(peaks)), np.mean(vic_amplitudes(peaks))))
 
 
@@ -193,53 +142,14 @@ def extracluster_peaks(well, channel_num, threshold=None, pct_boundary=0.3, excl
 
     Returns a 3-tuple: peaks, rain gates, width gates
     """
-    if not threshold:
-        threshold = well.channels[channel_num].statistics.threshold
-    if not threshold:
-        threshold = None
-    
-    if exclude_min_amplitude_peaks:
-        peaks = above_min_amplitude_peaks(well)
-    else:
-        peaks = well.peaks
-    
-    # get rain_pvalues
-    p_plus, p, p_minus, pos, middle_high, middle_low, neg = \
-            rain_pvalues_thresholds(peaks,
-                                    channel_num=channel_num,
-                                    threshold=threshold,
-                                    pct_boundary=pct_boundary)
-    
+    peaks, rain_gates = _rain_gated_peaks(well, channel_num, threshold, pct_boundary, exclude_min_amplitude_peaks)
     min_gate, max_gate = well_static_width_gates(well)
+    width_gates = (min_gate, max_gate)
+    regions = peak_regions(peaks, channel_num, rain_gates, width_gates=width_gates)
 
-    if middle_high and middle_low:
-        extracluster_peaks = np.extract(np.logical_not(
-            np.logical_or(
-                   reduce(np.logical_and,
-                          (channel_widths(peaks, channel_num) > min_gate,
-                           channel_widths(peaks, channel_num) < max_gate,
-                           channel_amplitudes(peaks, channel_num) > middle_high,
-                           channel_amplitudes(peaks, channel_num) < pos)),
-                   reduce(np.logical_and,
-                          (channel_widths(peaks, channel_num) > min_gate,
-                           channel_widths(peaks, channel_num) < max_gate,
-                           channel_amplitudes(peaks, channel_num) > neg,
-                           channel_amplitudes(peaks, channel_num) < middle_low))
-            )
-        ), peaks)
-    else:
-        extracluster_peaks = np.extract(np.logical_not(
-            reduce(np.logical_and,
-                   (channel_widths(peaks, channel_num) > min_gate,
-                    channel_widths(peaks, channel_num) < max_gate,
-                    channel_amplitudes(peaks, channel_num) > neg,
-                    channel_amplitudes(peaks, channel_num) < pos)
-            )
-        ), peaks)
-    
-    return (extracluster_peaks,
-            (pos, middle_high, middle_low, neg),
-            (min_gate, max_gate))
+    return (peaks.take(regions.extracluster_indices()),
+            rain_gates,
+            width_gates)
 
 
 def revb_extracluster_peaks(well, channel_num, threshold=None, pct_boundary=0.3, exclude_min_amplitude_peaks=True):
@@ -250,54 +160,11 @@ def revb_extracluster_peaks(well, channel_num, threshold=None, pct_boundary=0.3,
 
     Returns a 3-tuple: peaks, rain gates, width gates
     """
-    if not threshold:
-        threshold = well.channels[channel_num].statistics.threshold
-    if not threshold:
-        threshold = None
-    
-    if exclude_min_amplitude_peaks:
-        peaks = above_min_amplitude_peaks(well)
-    else:
-        peaks = well.peaks
-    
-    # get rain_pvalues
-    p_plus, p, p_minus, pos, middle_high, middle_low, neg = \
-            rain_pvalues_thresholds(peaks,
-                                    channel_num=channel_num,
-                                    threshold=threshold,
-                                    pct_boundary=pct_boundary)
-    
-    binned_peaks = bin_peaks_by_amplitude(peaks, well.sum_amplitude_bins)
-
-    extra_peaks = np.ndarray([0], dtype=peak_dtype(2))
-    for bin, (min_gate, max_gate, boundary) in zip(binned_peaks, well.sum_amplitude_bins):
-        if middle_high and middle_low:
-            extra_peaks = np.hstack([extra_peaks, np.extract(np.logical_not(
-                np.logical_or(
-                       reduce(np.logical_and,
-                              (channel_widths(bin, channel_num) > min_gate,
-                               channel_widths(bin, channel_num) < max_gate,
-                               channel_amplitudes(bin, channel_num) > middle_high,
-                               channel_amplitudes(bin, channel_num) < pos)),
-                       reduce(np.logical_and,
-                              (channel_widths(bin, channel_num) > min_gate,
-                               channel_widths(bin, channel_num) < max_gate,
-                               channel_amplitudes(bin, channel_num) > neg,
-                               channel_amplitudes(bin, channel_num) < middle_low))
-                )
-            ), bin)])
-        else:
-            extra_peaks = np.hstack([extra_peaks, np.extract(np.logical_not(
-                reduce(np.logical_and,
-                       (channel_widths(bin, channel_num) > min_gate,
-                        channel_widths(bin, channel_num) < max_gate,
-                        channel_amplitudes(bin, channel_num) > neg,
-                        channel_amplitudes(bin, channel_num) < pos)
-                )
-            ), bin)])
-    
-    return (extra_peaks,
-            (pos, middle_high, middle_low, neg),
+    peaks, rain_gates = _rain_gated_peaks(well, channel_num, threshold, pct_boundary, exclude_min_amplitude_peaks)
+    regions = peak_regions(peaks, channel_num, rain_gates, amplitude_bins=well.sum_amplitude_bins)
+
+    return (peaks.take(regions.extracluster_indices()),
+            rain_gates,
             (np.mean(fam_amplitudes(peaks)), np.mean(vic_amplitudes(peaks))))
 
 def revb_extracluster_peaks_by_region(well, channel_num, threshold=None, pct_boundary=0.3, exclude_min_amplitude_peaks=True):
@@ -321,151 +188,24 @@ def revb_extracluster_peaks_by_region(well, channel_num, threshold=None, pct_bou
 
     Returns this 9-tuple, then rain gates, then mean of FAM and VIC.
     """
-    extra_peaks, rain_gates, means = \
-        revb_extracluster_peaks(well, channel_num,
-                                threshold=threshold,
-                                pct_boundary=pct_boundary,
-                                exclude_min_amplitude_peaks=exclude_min_amplitude_peaks)
-
-    pos_gate, midhigh_gate, midlow_gate, neg_gate = rain_gates
-    binned_peaks = bin_peaks_by_amplitude(extra_peaks, well.sum_amplitude_bins)
-    plpeaks = np.ndarray([0], dtype=peak_dtype(2))
-    prpeaks = np.ndarray([0], dtype=peak_dtype(2))
-    pspeaks = np.ndarray([0], dtype=peak_dtype(2))
-    pwpeaks = np.ndarray([0], dtype=peak_dtype(2))
-    pnpeaks = np.ndarray([0], dtype=peak_dtype(2))
-    mlpeaks = np.ndarray([0], dtype=peak_dtype(2))
-    mrpeaks = np.ndarray([0], dtype=peak_dtype(2))
-    mspeaks = np.ndarray([0], dtype=peak_dtype(2))
-    nlpeaks = np.ndarray([0], dtype=peak_dtype(2))
-    nrpeaks = np.ndarray([0], dtype=peak_dtype(2))
-    nspeaks = np.ndarray([0], dtype=peak_dtype(2))
-    nwpeaks = np.ndarray([0], dtype=peak_dtype(2))
-    nnpeaks = np.ndarray([0], dtype=peak_dtype(2))
-
-    for bin, (min_gate, max_gate, boundary) in zip(binned_peaks, well.sum_amplitude_bins):
-        plpeaks = np.hstack([plpeaks, np.extract(
-            reduce(np.logical_and,
-                   (channel_widths(bin, channel_num) > max_gate,
-                    channel_amplitudes(bin, channel_num) > pos_gate)
-            ), bin)])
-        prpeaks = np.hstack([prpeaks, np.extract(
-            reduce(np.logical_and,
-                   (channel_widths(bin, channel_num) >= min_gate,
-                    channel_widths(bin, channel_num) <= max_gate,
-                    channel_amplitudes(bin, channel_num) > pos_gate)
-            ), bin)])
-        pspeaks = np.hstack([pspeaks, np.extract(
-            reduce(np.logical_and,
-                   (channel_widths(bin, channel_num) < min_gate,
-                    channel_amplitudes(bin, channel_num) > pos_gate)
-            ), bin)])
-        if midhigh_gate and midlow_gate:
-            mlpeaks = np.hstack([mlpeaks, np.extract(
-            reduce(np.logical_and,
-                   (channel_widths(bin, channel_num) > max_gate,
-                    channel_amplitudes(bin, channel_num) < midhigh_gate,
-                    channel_amplitudes(bin, channel_num) > midlow_gate)
-            ), bin)])
-            mrpeaks = np.hstack([mrpeaks, np.extract(
-                reduce(np.logical_and,
-                       (channel_widths(bin, channel_num) >= min_gate,
-                        channel_widths(bin, channel_num) <= max_gate,
-                        channel_amplitudes(bin, channel_num) < midhigh_gate,
-                        channel_amplitudes(bin, channel_num) > midlow_gate)
-                ), bin)])
-            mspeaks = np.hstack([mspeaks, np.extract(
-                reduce(np.logical_and,
-                       (channel_widths(bin, channel_num) < min_gate,
-                        channel_amplitudes(bin, channel_num) < midhigh_gate,
-                        channel_amplitudes(bin, channel_num) > midlow_gate)
-                ), bin)])
-            # this means there are positives
-            pwpeaks = np.hstack([pwpeaks, np.extract(
-                reduce(np.logical_and,
-                       (channel_widths(bin, channel_num) > max_gate,
-                        channel_amplitudes(bin, channel_num) >= midhigh_gate,
-                        channel_amplitudes(bin, channel_num) <= pos_gate)
-                ), bin)])
-            pnpeaks = np.hstack([pnpeaks, np.extract(
-                reduce(np.logical_and,
-                       (channel_widths(bin, channel_num) < min_gate,
-                        channel_amplitudes(bin, channel_num) >= midhigh_gate,
-                        channel_amplitudes(bin, channel_num) <= pos_gate)
-                ), bin)])
-            nwpeaks = np.hstack([nwpeaks, np.extract(
-                reduce(np.logical_and,
-                       (channel_widths(bin, channel_num) > max_gate,
-                        channel_amplitudes(bin, channel_num) >= neg_gate,
-                        channel_amplitudes(bin, channel_num) <= midlow_gate)
-                ), bin)])
-            nnpeaks = np.hstack([nnpeaks, np.extract(
-                reduce(np.logical_and,
-                       (channel_widths(bin, channel_num) < min_gate,
-                        channel_amplitudes(bin, channel_num) >= neg_gate,
-                        channel_amplitudes(bin, channel_num) <= midlow_gate)
-                ), bin)])
-        else:
-            nwpeaks = np.hstack([nwpeaks, np.extract(
-                reduce(np.logical_and,
-                       (channel_widths(bin, channel_num) > max_gate,
-                        channel_amplitudes(bin, channel_num) >= neg_gate,
-                        channel_amplitudes(bin, channel_num) <= pos_gate)
-                ), bin)])
-            nnpeaks = np.hstack([nnpeaks, np.extract(
-                reduce(np.logical_and,
-                       (channel_widths(bin, channel_num) < min_gate,
-                        channel_amplitudes(bin, channel_num) >= neg_gate,
-                        channel_amplitudes(bin, channel_num) <= pos_gate)
-                ), bin)])
-
-        nlpeaks = np.hstack([nlpeaks, np.extract(
-            reduce(np.logical_and,
-                   (channel_widths(bin, channel_num) > max_gate,
-                    channel_amplitudes(bin, channel_num) < neg_gate)
-            ), bin)])
-        nrpeaks = np.hstack([nrpeaks, np.extract(
-            reduce(np.logical_and,
-                   (channel_widths(bin, channel_num) >= min_gate,
-                    channel_widths(bin, channel_num) <= max_gate,
-                    channel_amplitudes(bin, channel_num) < neg_gate)
-            ), bin)])
-        
-        pbpeaks = np.hstack([pspeaks, np.extract(
-            reduce(np.logical_and,
-                   (channel_widths(bin, channel_num) < min_gate,
-                    channel_amplitudes(bin, channel_num) >= midhigh_gate,
-                    channel_amplitudes(bin, channel_num) <= pos_gate)
-            ), bin)])
-
-    return ((plpeaks, prpeaks, pspeaks,
-             pwpeaks, pnpeaks,
-             mlpeaks, mrpeaks, mspeaks,
-             nlpeaks, nrpeaks, nspeaks,
-             nwpeaks, nnpeaks),
+    peaks, rain_gates = _rain_gated_peaks(well, channel_num, threshold, pct_boundary, exclude_min_amplitude_peaks)
+    regions = peak_regions(peaks, channel_num, rain_gates, amplitude_bins=well.sum_amplitude_bins)
+
+    peaks_by_region = [peaks.take(indices) for indices in regions.region_indices()]
+    # the negative small region has never been populated here; the plot
+    # totals (and its legend) are built around that.
+    peaks_by_region[REGION_NEGATIVE_SMALL] = peaks[0:0]
+
+    return (tuple(peaks_by_region),
             rain_gates,
-            means)
+            (np.mean(fam_amplitudes(peaks)), np.mean(vic_amplitudes(peaks))))
 
 def bin_peaks_by_amplitude(peaks, amplitude_bins):
     """
     Given a set of peaks and bins, bin the peaks into the bins by sum channel.
     """
-    amplitude_sums = fam_amplitudes(peaks) + vic_amplitudes(peaks)
-    amplitude_boundaries = [bin[2] for bin in amplitude_bins]
-    MAX_AMPLITUDE        = 32768
-
-    amplitude_regions    = zip(amplitude_boundaries[:-1],amplitude_boundaries[1:]) \
-                           + [(amplitude_boundaries[-1], MAX_AMPLITUDE)]
-    binned_peaks         = []
-
-    for region in amplitude_regions:
-        binned_peaks.append(np.extract(
-            reduce(np.logical_and,
-                   (amplitude_sums >= region[0],
-                    amplitude_sums < region[1])),
-            peaks))
-
-    return binned_peaks
+    bin_indices = peak_amplitude_bin_indices(peaks, amplitude_bins)
+    return [peaks.take(np.flatnonzero(bin_indices == idx)) for idx in range(len(amplitude_bins))]
 
 def well_fragmentation_probability(well):
     """
@@ -0,0 +1,256 @@
+"""
+Single-pass region classification of droplet peaks.
+
+Each peak is given one integer cell label from its position relative to
+the width gates and the rain (amplitude) gates:
+
+    cell = amplitude_class * NUM_WIDTH_CLASSES + width_class
+
+where the width class is one of below/at the min gate, between the gates,
+at/above the max gate, and the amplitude class is the analogous position
+relative to the ascending rain gates (neg, [middle_low, middle_high,] pos).
+Exact gate values get their own classes, so that both the strict and the
+inclusive gate comparisons the polydispersity and extracluster definitions
+use are unions of cells.
+
+The polydispersity, extracluster and region outputs are then lookups of
+the cell labels into small boolean/region tables, instead of re-evaluating
+the gate masks (per amplitude bin) for each output.
+
+Gates are expected to be in order (neg <= middle_low <= middle_high <= pos,
+min <= max), as the rain thresholds and width gates are.  (If the middle
+gates coincide, a peak exactly on them is in the negative band only; the
+old per-region masks counted it in both the positive and negative bands.)
+"""
+import numpy as np
+
+# width classes, relative to the min and max width gates
+WIDTH_SMALL, WIDTH_AT_MIN, WIDTH_NORMAL, WIDTH_AT_MAX, WIDTH_LARGE = range(5)
+NUM_WIDTH_CLASSES = 5
+
+# amplitude classes relative to (neg, middle_low, middle_high, pos); without
+# middle gates, the classes of the middle gates are never assigned and
+# AMP_NEG_RAIN covers everything strictly between neg and pos.
+AMP_NEG, AMP_AT_NEG, AMP_NEG_RAIN, AMP_AT_MIDLOW, AMP_MIDDLE, \
+    AMP_AT_MIDHIGH, AMP_POS_RAIN, AMP_AT_POS, AMP_POS = range(9)
+NUM_AMPLITUDE_CLASSES = 9
+NUM_CELLS = NUM_AMPLITUDE_CLASSES*NUM_WIDTH_CLASSES
+
+# the cell of peaks outside every amplitude bin, which are never selected.
+EXCLUDED_CELL = NUM_CELLS
+
+# the peaks bin amplitude range tops out here.
+MAX_AMPLITUDE = 32768
+
+# extracluster regions, in the order revb_extracluster_peaks_by_region
+# has always returned them.
+REGION_NONE = -1
+REGION_POSITIVE_LARGE, REGION_POSITIVE_RAIN, REGION_POSITIVE_SMALL, \
+    REGION_POSITIVE_WIDE, REGION_POSITIVE_NARROW, \
+    REGION_MIDDLE_LARGE, REGION_MIDDLE_RAIN, REGION_MIDDLE_SMALL, \
+    REGION_NEGATIVE_LARGE, REGION_NEGATIVE_RAIN, REGION_NEGATIVE_SMALL, \
+    REGION_NEGATIVE_WIDE, REGION_NEGATIVE_NARROW = range(13)
+NUM_REGIONS = 13
+
+# polydispersity outputs, in order
+POLY_POSITIVE, POLY_MIDDLE_HIGH, POLY_MIDDLE_LOW, POLY_NEGATIVE = range(4)
+NUM_POLY_REGIONS = 4
+
+WIDTH_INSIDE = (WIDTH_AT_MIN, WIDTH_NORMAL, WIDTH_AT_MAX)
+AMP_NEG_BAND = (AMP_AT_NEG, AMP_NEG_RAIN, AMP_AT_MIDLOW)
+AMP_POS_BAND = (AMP_AT_MIDHIGH, AMP_POS_RAIN, AMP_AT_POS)
+
+def _cell_table(entries, fill, dtype):
+    table = np.empty(NUM_CELLS+1, dtype=dtype)
+    table.fill(fill)
+    for value, amplitude_classes, width_classes in entries:
+        for amp in amplitude_classes:
+            for width in width_classes:
+                table[amp*NUM_WIDTH_CLASSES+width] = value
+    return table
+
+def _region_table(has_middle):
+    entries = [(REGION_POSITIVE_LARGE, (AMP_POS,), (WIDTH_LARGE,)),
+               (REGION_POSITIVE_RAIN, (AMP_POS,), WIDTH_INSIDE),
+               (REGION_POSITIVE_SMALL, (AMP_POS,), (WIDTH_SMALL,)),
+               (REGION_NEGATIVE_LARGE, (AMP_NEG,), (WIDTH_LARGE,)),
+               (REGION_NEGATIVE_RAIN, (AMP_NEG,), WIDTH_INSIDE),
+               (REGION_NEGATIVE_SMALL, (AMP_NEG,), (WIDTH_SMALL,))]
+    if has_middle:
+        entries.extend([(REGION_POSITIVE_WIDE, AMP_POS_BAND, (WIDTH_LARGE,)),
+                        (REGION_POSITIVE_NARROW, AMP_POS_BAND, (WIDTH_SMALL,)),
+                        (REGION_MIDDLE_LARGE, (AMP_MIDDLE,), (WIDTH_LARGE,)),
+                        (REGION_MIDDLE_RAIN, (AMP_MIDDLE,), WIDTH_INSIDE),
+                        (REGION_MIDDLE_SMALL, (AMP_MIDDLE,), (WIDTH_SMALL,)),
+                        (REGION_NEGATIVE_WIDE, AMP_NEG_BAND, (WIDTH_LARGE,)),
+                        (REGION_NEGATIVE_NARROW, AMP_NEG_BAND, (WIDTH_SMALL,))])
+    else:
+        entries.extend([(REGION_NEGATIVE_WIDE, (AMP_AT_NEG, AMP_NEG_RAIN, AMP_AT_POS), (WIDTH_LARGE,)),
+                        (REGION_NEGATIVE_NARROW, (AMP_AT_NEG, AMP_NEG_RAIN, AMP_AT_POS), (WIDTH_SMALL,))])
+    return _cell_table(entries, REGION_NONE, np.int8)
+
+def _poly_table(has_middle):
+    entries = [(POLY_POSITIVE, (AMP_POS,), (WIDTH_LARGE,)),
+               (POLY_NEGATIVE, (AMP_NEG,), (WIDTH_SMALL,))]
+    if has_middle:
+        entries.extend([(POLY_MIDDLE_HIGH, (AMP_MIDDLE,), (WIDTH_LARGE,)),
+                        (POLY_MIDDLE_LOW, (AMP_MIDDLE,), (WIDTH_SMALL,))])
+    return _cell_table(entries, REGION_NONE, np.int8)
+
+def _cluster_table(has_middle):
+    # the cluster cores: strictly inside the width gates, and strictly
+    # inside the positive or negative rain band.
+    if has_middle:
+        entries = [(True, (AMP_POS_RAIN, AMP_NEG_RAIN), (WIDTH_NORMAL,))]
+    else:
+        entries = [(True, (AMP_NEG_RAIN,), (WIDTH_NORMAL,))]
+    return _cell_table(entries, False, np.bool_)
+
+def _extracluster_tables(has_middle):
+    """
+    Return the (extracluster, region) tables: extracluster cells are
+    labeled 0 (others REGION_NONE), and the extracluster cells in a
+    region are labeled with it.
+    """
+    cluster = _cluster_table(has_middle)
+    cluster[EXCLUDED_CELL] = True
+    extracluster = np.where(cluster, REGION_NONE, 0).astype(np.int8)
+    regions = np.where(cluster, REGION_NONE, _region_table(has_middle)).astype(np.int8)
+    return extracluster, regions
+
+POLY_TABLES = dict([(has_middle, _poly_table(has_middle)) for has_middle in (True, False)])
+EXTRACLUSTER_TABLES = dict([(has_middle, _extracluster_tables(has_middle)) for has_middle in (True, False)])
+
+def width_classes(widths, min_gate, max_gate):
+    """
+    Return the width class of each peak.  The gates may be scalars or
+    per-peak arrays.
+    """
+    at_min = widths == min_gate
+    classes = (widths > min_gate).view(np.int8) + (widths > max_gate).view(np.int8)
+    classes *= 2
+    classes += at_min.view(np.int8)
+    classes += ((widths == max_gate) & ~at_min).view(np.int8)
+    return classes
+
+def amplitude_classes(amplitudes, pos, middle_high, middle_low, neg):
+    """
+    Return the amplitude class of each peak relative to the rain gates.
+    The middle gates are used only if both are set.
+    """
+    if middle_high and middle_low:
+        gates = (neg, middle_low, middle_high, pos)
+        classes = [AMP_NEG, AMP_AT_NEG, AMP_NEG_RAIN, AMP_AT_MIDLOW, AMP_MIDDLE,
+                   AMP_AT_MIDHIGH, AMP_POS_RAIN, AMP_AT_POS, AMP_POS]
+    else:
+        gates = (neg, pos)
+        classes = [AMP_NEG, AMP_AT_NEG, AMP_NEG_RAIN, AMP_AT_POS, AMP_POS]
+
+    # with ordered gates, the number of gates below the amplitude is the
+    # position of the first gate at or above it, and the amplitude is on
+    # that gate if it is on any of them.
+    codes = np.zeros(len(amplitudes), dtype=np.int8)
+    at_gate = np.zeros(len(amplitudes), dtype=np.bool_)
+    for gate in gates:
+        codes += (amplitudes > gate).view(np.int8)
+        at_gate |= amplitudes == gate
+    codes *= 2
+    codes += at_gate.view(np.int8)
+    return np.array(classes, dtype=np.int8).take(codes)
+
+def amplitude_bin_indices(amplitude_sums, boundaries, max_amplitude=MAX_AMPLITUDE):
+    """
+    Return the index of the sum amplitude bin each peak falls in, or -1
+    if it is below the first boundary or at/above max_amplitude.
+    Bin i covers [boundaries[i], boundaries[i+1]); the boundaries must
+    be ascending.
+    """
+    boundaries = np.asarray(boundaries, dtype=np.float64)
+    indices = np.searchsorted(boundaries, amplitude_sums, side='right')-1
+    indices[amplitude_sums >= max_amplitude] = -1
+    return indices
+
+class PeakRegions(object):
+    """
+    The cell labels of a set of peaks for one channel, with the
+    polydispersity, extracluster and region selections as index arrays
+    into the original peaks.
+
+    If per-bin width gates are given (the rev B amplitude bin definition),
+    peaks outside every bin are excluded, and selections are ordered by
+    bin, then original order.
+    """
+    def __init__(self, widths, amplitudes, rain_gates, width_gates=None,
+                 bin_indices=None, bin_width_gates=None):
+        """
+        :param widths: Array of peak widths in the channel.
+        :param amplitudes: Array of peak amplitudes in the channel.
+        :param rain_gates: (pos, middle_high, middle_low, neg).
+        :param width_gates: (min_gate, max_gate) for all peaks (ignored if binned).
+        :param bin_indices: Sum amplitude bin of each peak (see amplitude_bin_indices).
+        :param bin_width_gates: List of (min_gate, max_gate) for each bin.
+        """
+        pos, middle_high, middle_low, neg = rain_gates
+        # peak fields are strided; the comparisons are faster on copies
+        widths = np.ascontiguousarray(widths)
+        amplitudes = np.ascontiguousarray(amplitudes)
+        self.has_middle = bool(middle_high and middle_low)
+        self.bin_indices = bin_indices
+
+        if bin_indices is not None:
+            gates = np.array(list(bin_width_gates)+[(0, 0)], dtype=np.float64)
+            # out-of-bin peaks (-1) pick up the dummy last row
+            min_gate = gates[:,0].take(bin_indices)
+            max_gate = gates[:,1].take(bin_indices)
+        else:
+            min_gate, max_gate = width_gates
+
+        self.cells = amplitude_classes(amplitudes, pos, middle_high, middle_low, neg)
+        self.cells *= NUM_WIDTH_CLASSES
+        self.cells += width_classes(widths, min_gate, max_gate)
+        if bin_indices is not None:
+            self.cells[bin_indices < 0] = EXCLUDED_CELL
+
+    def group(self, labels, count):
+        """
+        Return the indices of the peaks with each label in range(count)
+        (negative labels are not selected), in output order.
+        """
+        if self.bin_indices is None:
+            return [np.flatnonzero(labels == idx) for idx in range(count)]
+
+        selected = np.flatnonzero(labels >= 0)
+        selected_labels = labels.take(selected)
+        key = selected_labels*np.int64(self.bin_indices.max()+1) + self.bin_indices.take(selected)
+        # only the selected (extracluster/rain) peaks are sorted
+        sort = np.argsort(key, kind='mergesort')
+        selected = selected.take(sort)
+        bounds = np.searchsorted(selected_labels.take(sort), np.arange(count+1))
+        return [selected[bounds[idx]:bounds[idx+1]] for idx in range(count)]
+
+    @property
+    def region_labels(self):
+        """
+        The extracluster region (REGION_*, or REGION_NONE) of each peak.
+        """
+        return EXTRACLUSTER_TABLES[self.has_middle][1].take(self.cells)
+
+    def polydisperse_indices(self):
+        """
+        Return index arrays of the positive, middle high, middle low and
+        negative polydisperse peaks.
+        """
+        return self.group(POLY_TABLES[self.has_middle].take(self.cells), NUM_POLY_REGIONS)
+
+    def extracluster_indices(self):
+        """
+        Return an index array of the peaks outside the clusters.
+        """
+        return self.group(EXTRACLUSTER_TABLES[self.has_middle][0].take(self.cells), 1)[0]
+
+    def region_indices(self):
+        """
+        Return index arrays of the extracluster peaks in each region, in
+        REGION_* order.
+        """
+        return self.group(self.region_labels, NUM_REGIONS)
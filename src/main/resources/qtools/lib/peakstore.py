@@ -0,0 +1,223 @@
+"""
+A host-wide store of parsed plate peaks, shared between web workers.
+
+Every paster worker used to parse a QLP (get_plate) each time it drew a
+plot of one of its wells, and held its own copy of the peak arrays.
+Here, the first worker to ask for a plate parses it once and publishes
+it as a named segment in a shared memory directory (/dev/shm by
+default): the peaks of all its wells, as one .npy array, and the rest
+of the plate (metadata, channel statistics) as a small pickle, written
+last.  Workers that ask for the plate afterwards memory-map the peaks
+(copy-on-write, so the pages are shared between processes until a
+worker writes to them) and only unpickle the metadata.
+
+Segments are keyed by the QLP path and modification time.  The segment
+files are the registry: attaching to a segment marks it as used, and
+once the store holds more than its size limit, the least recently used
+segments are removed.  (Workers that have a removed segment mapped keep
+their mapping until they are done with it; a worker that finds a segment
+removed as it attaches parses and publishes the plate again.)
+"""
+import cPickle, fcntl, hashlib, os, tempfile, time
+
+import numpy as np
+
+from qtools.lib.qlb_factory import get_plate
+
+# default size limit of the store, in MB.
+PEAK_STORE_SIZE = 2048
+
+# seconds after which a segment temp file is taken to be left over from
+# a failed publish, and removed.
+STALE_TEMP_AGE = 3600
+
+class SharedPeakStore(object):
+    """
+    Publishes parsed plates into, and attaches them from, segments in a
+    shared directory.
+    """
+    def __init__(self, root, max_size=PEAK_STORE_SIZE*1024*1024, plate_reader=get_plate):
+        """
+        :param root: The directory to keep the segments in.
+        :param max_size: The most bytes to keep in segments.
+        :param plate_reader: Parses the QLP at a path to a QLPlate, when
+                             there is no segment for it.
+        """
+        self.root = root
+        self.max_size = max_size
+        self.plate_reader = plate_reader
+
+    def segment_key(self, path):
+        path = os.path.abspath(path)
+        return hashlib.sha1("%s:%s" % (path, os.stat(path).st_mtime)).hexdigest()
+
+    def segment_paths(self, key):
+        """
+        Return the (peaks, plate, lock) paths of a segment.
+        """
+        base = os.path.join(self.root, key)
+        return '%s.peaks.npy' % base, '%s.plate.pkl' % base, '%s.lock' % base
+
+    def plate(self, path):
+        """
+        Return the QLPlate at path, attached from its segment; parse and
+        publish it if there is no segment for it yet.  Only one process
+        parses a plate at a time; the others wait for it to be published.
+        """
+        key = self.segment_key(path)
+        peaks_path, plate_path, lock_path = self.segment_paths(key)
+        if os.path.isfile(plate_path):
+            try:
+                return self.attach(key)
+            except (IOError, OSError):
+                # evicted by another worker since the check
+                pass
+
+        if not os.path.isdir(self.root):
+            try:
+                os.makedirs(self.root)
+            except OSError:
+                # made by another worker
+                pass
+
+        plate = None
+        try:
+            with open(lock_path, 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    if os.path.isfile(plate_path):
+                        try:
+                            plate = self.attach(key)
+                        except (IOError, OSError):
+                            pass
+                    if plate is None:
+                        plate = self.plate_reader(path)
+                        self.publish(key, plate)
+                        self.evict(keep=key)
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        finally:
+            try:
+                os.unlink(lock_path)
+            except OSError:
+                # removed by another worker done with the same plate
+                pass
+        return plate
+
+    def publish(self, key, plate):
+        """
+        Write a plate to a segment.  The plate pickle is written last, so
+        a segment that has one is complete.
+        """
+        peaks_path, plate_path, lock_path = self.segment_paths(key)
+        wells = [(name, well) for name, well in sorted(plate.wells.items()) if well.peaks is not None]
+        offsets = []
+        start = 0
+        for name, well in wells:
+            offsets.append((name, start, start+len(well.peaks)))
+            start += len(well.peaks)
+
+        # write to temp files and rename, so that concurrent readers never
+        # see a partial segment
+        if wells:
+            peaks = np.concatenate([well.peaks for name, well in wells])
+        else:
+            from pyqlb.factory import peak_dtype
+            peaks = np.zeros(0, dtype=peak_dtype(2))
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.root)
+        with os.fdopen(fd, 'wb') as tmp_file:
+            np.save(tmp_file, peaks)
+        os.rename(tmp_path, peaks_path)
+
+        # pickle the plate without its peaks
+        well_peaks = [well.peaks for name, well in wells]
+        try:
+            for name, well in wells:
+                well.peaks = None
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.root)
+            with os.fdopen(fd, 'wb') as tmp_file:
+                cPickle.dump((plate, offsets), tmp_file, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            for (name, well), peaks in zip(wells, well_peaks):
+                well.peaks = peaks
+        os.rename(tmp_path, plate_path)
+
+    def attach(self, key):
+        """
+        Return the plate in a segment, with the peaks of each well mapped
+        from the segment, and mark the segment as used.
+        """
+        peaks_path, plate_path, lock_path = self.segment_paths(key)
+        with open(plate_path, 'rb') as plate_file:
+            plate, offsets = cPickle.load(plate_file)
+        if offsets and offsets[-1][2] > 0:
+            peaks = np.load(peaks_path, mmap_mode='c')
+        else:
+            # mmap cannot map an empty array
+            peaks = np.load(peaks_path)
+        for name, start, end in offsets:
+            plate.wells[name].peaks = peaks[start:end]
+
+        try:
+            os.utime(plate_path, None)
+        except OSError:
+            # evicted meanwhile; the mapping stays valid
+            pass
+        return plate
+
+    def segments(self):
+        """
+        Return the (last used, size, key) of each segment in the store,
+        removing temp files left over from failed publishes along the way.
+        """
+        segments = []
+        now = time.time()
+        for filename in os.listdir(self.root):
+            if filename.endswith('.tmp'):
+                tmp_path = os.path.join(self.root, filename)
+                try:
+                    if now - os.path.getmtime(tmp_path) > STALE_TEMP_AGE:
+                        os.unlink(tmp_path)
+                except OSError:
+                    pass
+                continue
+            if not filename.endswith('.plate.pkl'):
+                continue
+            key = filename[:-len('.plate.pkl')]
+            peaks_path, plate_path, lock_path = self.segment_paths(key)
+            try:
+                size = os.path.getsize(peaks_path) + os.path.getsize(plate_path)
+                used = os.path.getmtime(plate_path)
+            except OSError:
+                continue
+            segments.append((used, size, key))
+        return segments
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used segments (except keep) until the
+        store fits in its size limit.
+        """
+        segments = sorted(self.segments())
+        total = sum([size for used, size, key in segments])
+        for used, size, key in segments:
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+            peaks_path, plate_path, lock_path = self.segment_paths(key)
+            for segment_path in (plate_path, peaks_path):
+                try:
+                    os.unlink(segment_path)
+                except OSError:
+                    pass
+            total -= size
+
+
+def config_peak_store(config):
+    """
+    Return the SharedPeakStore for an app config; segments are kept in
+    qlb.peak_store (default /dev/shm/qtools_peaks), up to qlb.peak_store_size MB.
+    """
+    return SharedPeakStore(config.get('qlb.peak_store', None) or '/dev/shm/qtools_peaks',
+                           max_size=int(config.get('qlb.peak_store_size', PEAK_STORE_SIZE))*1024*1024)
@@ -4,6 +4,7 @@ Plate-level operations, usually concerning naming and metrics.
 
 from qtools.model import Session, QLBPlate, Plate, Project, Person, Box2, PlateTemplate, PlateSetup, PlateType
 from qtools.model.reagents import ValidationTestLayout, ProductValidationPlate, ProductValidationPlateLotTest, ProductPart, ProductLot
+from qtools.lib.prefix import template_resolver, setup_resolver
 import simplejson as json
 import formencode
 from datetime import datetime
@@ -153,23 +154,20 @@ def apply_template_to_plate(qlplate, dbplate):
     # new-style: if plate file has plate_template_id in it,
     # just bind
     if qlplate.plate_template_id:
-        template = Session.query(PlateTemplate).get(int(qlplate.plate_template_id))
+        template = template_resolver.get(int(qlplate.plate_template_id))
         if template:
             inherit_template_attributes(dbplate, template)
             return True
     
     # otherwise, check the name
-    dirname = dbplate.qlbplate.file.dirname
     basename = dbplate.qlbplate.file.basename
     complete_name = basename[:-4] # -- .qlp
 
-    # duplicate prefixes are possible; use most recent
-    templates = Session.query(PlateTemplate).order_by('prefix desc, id desc').all()
-    
-    for template in templates:
-        if complete_name.startswith(template.prefix):
-            inherit_template_attributes(dbplate, template)
-            return True
+    # longest prefix wins; duplicate prefixes are possible, use most recent
+    template = template_resolver.resolve(complete_name)
+    if template:
+        inherit_template_attributes(dbplate, template)
+        return True
     
     return False
 
@@ -182,21 +180,18 @@ def apply_setup_to_plate(qlplate, dbplate):
     :param dbplate: The DB plate to update
     """
     if qlplate.plate_setup_id:
-        setup = Session.query(PlateSetup).get(int(qlplate.plate_setup_id))
+        setup = setup_resolver.get(int(qlplate.plate_setup_id))
         if setup:
             inherit_setup_attributes(dbplate, setup)
             return True
     
-    dirname = dbplate.qlbplate.file.dirname
     basename = dbplate.qlbplate.file.basename
     complete_name = basename[:-4] # -- .qlp
 
-    setups = Session.query(PlateSetup).order_by('prefix desc').all()
-
-    for setup in setups:
-        if complete_name.startswith(setup.prefix):
-            inherit_setup_attributes(dbplate, setup)
-            return True
+    setup = setup_resolver.resolve(complete_name)
+    if setup:
+        inherit_setup_attributes(dbplate, setup)
+        return True
     
     return False
     
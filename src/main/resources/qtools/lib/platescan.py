@@ -21,8 +21,11 @@ from pyqlb.objects import QLWell
 from qtools.constants.plot import *
 from qtools.lib.metrics.db import dbplate_tree, process_plate, get_beta_plate_metrics
 from qtools.lib.metrics.beta import beta_plate_types
+from qtools.lib.galaxytile import write_well_tiles
 from qtools.lib.mplot import plot_fam_peaks, plot_vic_peaks, plot_cluster_2d, render as plt_render, cleanup as plt_cleanup
 from qtools.lib.plate import plate_from_qlp, apply_template_to_plate, apply_setup_to_plate, get_product_validation_plate
+from qtools.lib.prefix import invalidate_prefix_indexes
+from qtools.lib.statsrollup import update_plate_run_stats
 from qtools.lib.qlb_factory import get_plate, get_well
 
 from qtools.model import Session, QLBFile, QLBPlate, QLBWell, QLBWellChannel, Plate, Box2
@@ -103,6 +106,9 @@ def scan_plates(plate_source, image_source):
     count = 0
 
     file_lists = defaultdict(list)
+
+    # pick up templates and setups saved by other processes since the last scan
+    invalidate_prefix_indexes()
     
         # get QLPs -- needs read status filter?
     mtime_dict = dict([("%s/%s" % (dirname, basename),
@@ -258,6 +264,8 @@ def __scan_plate(file_source, image_source, path_id, path, mtime_dict, plate_typ
                 Session.commit()
                 qlbplate.plate.score = Plate.compute_score(qlbplate.plate)
                 Session.commit()
+                update_plate_run_stats(qlbplate)
+                Session.commit()
                 if validation_test:
                     validation_test.plate_id = qlbplate.plate.id
                     Session.add(validation_test)
@@ -366,6 +374,8 @@ def __scan_plate(file_source, image_source, path_id, path, mtime_dict, plate_typ
                 Session.commit()
                 qlbplate.plate.score = Plate.compute_score(qlbplate.plate)
                 Session.commit()
+                update_plate_run_stats(qlbplate)
+                Session.commit()
                 file_lists['updated_plates'].append(path)
                 return qlbplate.plate
             except Exception, e:
@@ -730,8 +740,8 @@ def set_qlb_well_record_attrs(dbwell, well_name, proc_qlwell, raw_qlwell):
 
 def write_images_stats_for_plate(dbplate, qlplate, image_source, overwrite=False, override_plate_type=None):
     """
-    Write plate metrics to the database and thumbnails to local storage,
-    as dictated by image_source.
+    Write plate metrics to the database, and thumbnails and galaxy tiles
+    (see qtools.lib.galaxytile) to local storage, as dictated by image_source.
 
     Metrics will be related to the supplied dbplate (Plate model)
     qlplate is a QLPlate object derived from reading the QLP file.
@@ -774,6 +784,8 @@ def write_images_stats_for_plate(dbplate, qlplate, image_source, overwrite=False
             fig.savefig(image_source.get_path('%s/%s_%s.png' % (dbplate.id, well_name, 1)), format='png', dpi=72)
             plt_cleanup(fig)
 
+            write_well_tiles(image_source, dbplate.id, well_name, qlwell)
+
             if qlwell.clusters_defined:
                 threshold_fallback = qlwell.clustering_method == QLWell.CLUSTERING_TYPE_THRESHOLD
                 fig = plot_cluster_2d(qlwell.peaks,
@@ -0,0 +1,173 @@
+"""
+Compact plot data for drawing well and plate plots in the browser.
+
+The PNG plots in qtools.lib.mplot are drawn (and torn down) on the
+server for every view.  The functions here return the data behind the
+same plots, reduced to what a client-side plot needs:
+
+- histograms, as the counts of uniform bins between two edges;
+- density grids, as the nonzero cells of a 2D histogram;
+- scatters, decimated to at most a fixed number of points.
+
+All payloads are dicts of lists and numbers, ready for @jsonify.
+"""
+import numpy as np
+
+from qtools.lib.galaxytile import galaxy_histogram, MIN_DROPLET_WIDTH, MAX_DROPLET_WIDTH, MIN_AMPLITUDE, MAX_AMPLITUDE
+
+# the most points returned for a scatter plot.
+SCATTER_MAX_POINTS = 5000
+
+# bins of the amplitude histogram (see mplot.plot_amp_hist).
+AMPLITUDE_HISTOGRAM_BINS = 300
+
+# cells per side of the 2D cluster density grid (see mplot.plot_cluster_2d).
+CLUSTER_GRID_SIZE = 300
+
+# width histogram bins, per sample (see mplot.plot_widths).
+WIDTH_HISTOGRAM_MAX = 20
+WIDTH_BINS_PER_SAMPLE = 4
+
+# see mplot.TEMPORAL_MAX
+TEMPORAL_MAX = 2250000
+
+CLUSTER_NAMES = ('fpvp', 'fpvn', 'fnvp', 'fnvn', 'unclassified', 'undefined')
+
+def histogram_data(values, bins, value_range=None):
+    """
+    Return the histogram of values on uniform bins.
+
+    :return: A dict with the outer edges ('edges') and the per-bin 'counts'.
+    """
+    counts, edges = np.histogram(values, bins=bins, range=value_range)
+    return {'edges': [float(edges[0]), float(edges[-1])],
+            'counts': counts.tolist()}
+
+def grid_data(H, extent, log_x=False):
+    """
+    Return a 2D histogram (rows y, columns x) as a sparse density grid.
+
+    :param extent: The (min x, max x, min y, max y) covered by the grid.
+    :param log_x: Whether the x bins are uniform in log10(x).
+    :return: A dict with 'extent', 'shape' (rows, columns), 'log_x', and the
+             row-major 'cells' and 'counts' of the nonzero cells.
+    """
+    counts = np.asarray(H).ravel()
+    cells = np.flatnonzero(counts)
+    return {'extent': [float(e) for e in extent],
+            'shape': list(np.shape(H)),
+            'log_x': log_x,
+            'cells': cells.tolist(),
+            'counts': counts[cells].astype(np.int64).tolist()}
+
+def density_data(xs, ys, shape, extent, log_x=False):
+    """
+    Return the sparse density grid (see grid_data) of points on a
+    (rows, columns) grid over extent.
+    """
+    if log_x:
+        xs = np.log10(np.clip(xs, extent[0], None))
+        x_range = [np.log10(extent[0]), np.log10(extent[1])]
+    else:
+        x_range = [extent[0], extent[1]]
+    H, yedges, xedges = np.histogram2d(ys, xs, bins=shape, range=[[extent[2], extent[3]], x_range])
+    return grid_data(H, extent, log_x=log_x)
+
+def scatter_data(columns, max_points=SCATTER_MAX_POINTS):
+    """
+    Return a set of equal-length columns, decimated by taking every
+    Nth point, so that at most max_points remain.  Decimating by stride
+    keeps the time ordering (and distribution) of droplets intact.
+
+    :return: A dict with the 'total' number of points, the 'stride', and
+             the decimated 'columns'.
+    """
+    total = len(columns[0]) if columns else 0
+    stride = max(1, int(np.ceil(total/float(max_points))))
+    return {'total': total,
+            'stride': stride,
+            'columns': [np.asarray(column)[::stride].tolist() for column in columns]}
+
+def amphist_data(peaks, channel, threshold=None):
+    """
+    Return the amplitude histogram of a channel.
+    """
+    from pyqlb.nstats.peaks import channel_amplitudes
+    data = histogram_data(channel_amplitudes(peaks, channel), AMPLITUDE_HISTOGRAM_BINS)
+    data['threshold'] = threshold
+    return data
+
+def width_data(peaks, min_width_gate, max_width_gate):
+    """
+    Return the droplet width histograms of both channels.
+    """
+    from pyqlb.nstats.peaks import channel_widths
+    bins = WIDTH_HISTOGRAM_MAX*WIDTH_BINS_PER_SAMPLE
+    return {'channels': [histogram_data(channel_widths(peaks, channel), bins, (0, WIDTH_HISTOGRAM_MAX))
+                         for channel in (0, 1)],
+            'width_gates': [min_width_gate, max_width_gate]}
+
+def galaxy_data(peaks, channel, threshold, min_width_gate, max_width_gate):
+    """
+    Return the width x log amplitude density grid of a channel, on the
+    galaxy tile bins (see qtools.lib.galaxytile).
+    """
+    from pyqlb.nstats.peaks import channel_amplitudes, channel_widths
+    return galaxy_grid_data(galaxy_histogram(channel_amplitudes(peaks, channel), channel_widths(peaks, channel)),
+                            threshold=threshold, width_gates=[min_width_gate, max_width_gate])
+
+def galaxy_grid_data(H, **extra):
+    """
+    Return a galaxy histogram (such as a sum of galaxy tiles) as a
+    density grid, with any extra fields added.
+    """
+    data = grid_data(H, (MIN_AMPLITUDE, MAX_AMPLITUDE, MIN_DROPLET_WIDTH, MAX_DROPLET_WIDTH), log_x=True)
+    data.update(extra)
+    return data
+
+def cluster2d_data(peaks, thresholds, boundaries, use_manual_clusters=False):
+    """
+    Return the VIC x FAM amplitude density grid of each droplet cluster.
+
+    :param boundaries: (min VIC, min FAM, max VIC, max FAM), as for mplot.plot_cluster_2d.
+    """
+    from pyqlb.nstats.peaks import cluster_2d_auto, cluster_2d_user, vic_amplitudes, fam_amplitudes
+    if use_manual_clusters:
+        clusters = cluster_2d_auto(peaks)
+    else:
+        clusters = cluster_2d_user(peaks)
+
+    extent = (boundaries[0], boundaries[2], boundaries[1], boundaries[3])
+    shape = (CLUSTER_GRID_SIZE, CLUSTER_GRID_SIZE)
+    return {'clusters': dict([(name, density_data(vic_amplitudes(cluster), fam_amplitudes(cluster), shape, extent))
+                              for name, cluster in zip(CLUSTER_NAMES, clusters)]),
+            'thresholds': list(thresholds)}
+
+def amptime_data(peaks, channel, threshold):
+    """
+    Return the (time, amplitude) scatter of a channel.
+    """
+    from pyqlb.nstats.peaks import channel_amplitudes, peak_times
+    times = peak_times(peaks)
+    data = scatter_data([times, channel_amplitudes(peaks, channel)])
+    data['max_time'] = max(TEMPORAL_MAX, (int(np.max(times))+200000 if len(times) > 0 else 0))
+    data['threshold'] = threshold
+    return data
+
+def temporal_data(peaks, channel, min_width_gate, max_width_gate):
+    """
+    Return the (time, width) scatter of a channel, with the droplets that
+    were adaptively width gated, and those in vertical streaks, apart
+    (see mplot.temporal).
+    """
+    from pyqlb.nstats.peaks import channel_widths, peak_times, vic_quality
+    times = peak_times(peaks)
+    widths = channel_widths(peaks, channel)
+    qualities = vic_quality(peaks)
+    adaptive = (qualities > 0.399) & (qualities < 0.401)
+    streaks = (qualities > 0.449) & (qualities < 0.451)
+    return {'all': scatter_data([times, widths]),
+            'adaptive_width_gated': scatter_data([times[adaptive], widths[adaptive]]),
+            'vertical_streaks': scatter_data([times[streaks], widths[streaks]]),
+            'max_time': max(TEMPORAL_MAX, (int(np.max(times))+200000 if len(times) > 0 else 0)),
+            'width_gates': [min_width_gate, max_width_gate]}
@@ -0,0 +1,131 @@
+"""
+In-memory prefix resolution for plate templates and plate setups.
+
+Scanned plates inherit their metadata from the template (or setup) whose
+prefix is the longest prefix of the plate name, the most recent one
+winning among duplicate prefixes.  Rather than loading and scanning
+every template for every plate, the prefixes are kept in a trie, so a
+lookup costs the length of the plate name, plus a primary key load of
+the matching record.
+
+Each index is rebuilt lazily: after a template or setup is inserted,
+updated or deleted in this process, after PREFIX_INDEX_TTL seconds (to
+pick up changes written by other processes), or when invalidated
+explicitly, as scan_plates does at the start of each scan.
+"""
+import time
+
+from sqlalchemy import event
+
+from qtools.model import Session, PlateTemplate, PlateSetup
+
+# seconds after which an index is reloaded from the database.
+PREFIX_INDEX_TTL = 300
+
+# trie node key for the value of the prefix ending at that node.
+_VALUE = None
+
+class PrefixTrie(object):
+    """
+    Maps string prefixes to values.  Each prefix holds a single value;
+    when a prefix is added more than once, the value with the highest
+    rank is kept.
+    """
+    def __init__(self):
+        self.root = dict()
+
+    def add(self, prefix, value, rank=0):
+        node = self.root
+        for char in prefix:
+            node = node.setdefault(char, dict())
+        current = node.get(_VALUE)
+        if current is None or rank >= current[0]:
+            node[_VALUE] = (rank, value)
+
+    def longest_prefix_value(self, name):
+        """
+        Return the value of the longest prefix of name in the trie,
+        or None if there is none.
+        """
+        node = self.root
+        found = node.get(_VALUE)
+        for char in name:
+            node = node.get(char)
+            if node is None:
+                break
+            found = node.get(_VALUE, found)
+        return found[1] if found else None
+
+
+class PrefixResolver(object):
+    """
+    Resolves plate names to the records (templates or setups) of a
+    prefixed model.
+
+    The trie holds only the id of each prefixed record (not the whole
+    row; setups carry their layout JSON), so resolving a name costs no
+    queries; the matching record itself is then loaded by primary key,
+    from the session's identity map if it is already there.  Callers
+    get the real ORM row, so changes to it (such as locking a setup)
+    are saved with the session.
+    """
+    def __init__(self, model, ttl=PREFIX_INDEX_TTL):
+        self.model = model
+        self.ttl = ttl
+        self.trie = None
+        self.loaded_at = None
+
+    def invalidate(self, *args):
+        # also usable directly as a mapper event listener
+        self.trie = None
+
+    def __load(self):
+        trie = PrefixTrie()
+        for id, prefix in Session.query(self.model.id, self.model.prefix)\
+                                 .filter(self.model.prefix != None).all():
+            # most recent wins on duplicate prefixes
+            trie.add(prefix, id, rank=id)
+        self.trie = trie
+        self.loaded_at = time.time()
+
+    def __index(self):
+        if self.trie is None or (self.ttl is not None and time.time() - self.loaded_at > self.ttl):
+            self.__load()
+
+    def get(self, id):
+        """
+        Return the record with the specified id, or None.
+        """
+        return Session.query(self.model).get(id)
+
+    def resolve_id(self, name):
+        """
+        Return the id of the record with the longest prefix of name,
+        or None.
+        """
+        self.__index()
+        return self.trie.longest_prefix_value(name)
+
+    def resolve(self, name):
+        """
+        Return the record with the longest prefix of name, or None.
+        """
+        id = self.resolve_id(name)
+        if id is None:
+            return None
+        return self.get(id)
+
+
+template_resolver = PrefixResolver(PlateTemplate)
+setup_resolver = PrefixResolver(PlateSetup)
+
+for resolver in (template_resolver, setup_resolver):
+    for event_name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(resolver.model, event_name, resolver.invalidate)
+
+def invalidate_prefix_indexes():
+    """
+    Force the template and setup prefix indexes to reload on next use.
+    """
+    template_resolver.invalidate()
+    setup_resolver.invalidate()
@@ -0,0 +1,271 @@
+"""
+Windowed, memory-mapped access to the raw sample traces of wells (QLBs).
+
+Decoding a QLB with pyqlb reads and converts the whole sample trace,
+which is a lot for a view that shows a few droplets.  The first time a
+QLB's trace is asked for, it is decoded once and its samples written to
+a sidecar .npy file, with a small JSON index (sample rate, sample count,
+channel count, data offset) next to it; every later read memory-maps the
+sidecar, so only the pages of the requested sample windows are read.
+
+Sidecars are keyed by the QLB path and modification time, so a
+rewritten QLB gets a new sidecar (and its old one is removed).  Reading
+a sidecar marks it as used; once the sidecars take more than their size
+limit, the least recently used are removed.
+"""
+import hashlib, json, os, tempfile, time
+
+import numpy as np
+
+from qtools.lib.qlb_factory import get_well
+
+# number of raw samples per window when iterating over a whole trace.
+TRACE_WINDOW_SIZE = 2**18
+
+# default size limit of the sidecars, in MB.
+TRACE_CACHE_SIZE = 10240
+
+# seconds after which a sidecar temp file is taken to be left over from
+# a failed write, and removed.
+STALE_TEMP_AGE = 3600
+
+class RawTrace(object):
+    """
+    The memory-mapped sample trace of a raw well.
+
+    samples is a (num samples, num channels) array; slicing it only reads
+    the slice from disk.
+    """
+    def __init__(self, samples, sample_rate):
+        self.samples = samples
+        self.sample_rate = sample_rate
+
+    def __len__(self):
+        return len(self.samples)
+
+    @property
+    def num_channels(self):
+        return self.samples.shape[1]
+
+    def window(self, start, end):
+        """
+        Return the samples from start up to and including end, clipped to
+        the trace, as an in-memory array.
+        """
+        return np.array(self.samples[max(start, 0):max(end+1, 0)])
+
+    def windows(self, ranges):
+        """
+        Return the windows (see window()) for a list of (start, end) ranges.
+        """
+        return [self.window(start, end) for start, end in ranges]
+
+    def sample_windows(self, window_size=TRACE_WINDOW_SIZE):
+        """
+        Return a callable returning an iterator over consecutive
+        (window_size, num_channels) windows of the trace.
+        """
+        samples = self.samples
+        def windows():
+            for start in xrange(0, len(samples), window_size):
+                yield samples[start:start+window_size]
+        return windows
+
+
+class RawTraceSource(object):
+    """
+    Reads the sample traces of raw wells through sidecar files kept under
+    a cache directory.
+    """
+    def __init__(self, root, max_size=TRACE_CACHE_SIZE*1024*1024, well_reader=get_well):
+        """
+        :param root: The directory to keep the sidecars in.
+        :param max_size: The most bytes to keep in sidecars.
+        :param well_reader: Decodes the QLB at a path to a QLWell, on a
+                            sidecar miss.
+        """
+        self.root = root
+        self.max_size = max_size
+        self.well_reader = well_reader
+
+    def sidecar_key(self, path):
+        """
+        Return the sidecar key of the QLB at path: a hash of the path,
+        then its modification time.
+        """
+        path = os.path.abspath(path)
+        return "%s-%x" % (hashlib.sha1(path).hexdigest(), int(os.stat(path).st_mtime*1000000))
+
+    def key_paths(self, key):
+        """
+        Return the (samples, index) sidecar paths of a key.
+        """
+        base = os.path.join(self.root, key[:2], key)
+        return '%s.npy' % base, '%s.json' % base
+
+    def sidecar_paths(self, path):
+        """
+        Return the (samples, index) sidecar paths for the QLB at path.
+        """
+        return self.key_paths(self.sidecar_key(path))
+
+    def trace(self, path):
+        """
+        Return the RawTrace of the QLB at path, writing its sidecar if
+        there is none yet.
+        """
+        key = self.sidecar_key(path)
+        samples_path, index_path = self.key_paths(key)
+        if os.path.isfile(index_path):
+            try:
+                return self.open_sidecar(samples_path, index_path)
+            except (IOError, OSError):
+                # evicted by another process since the check
+                pass
+
+        self.write_sidecar(path, samples_path, index_path)
+        self.remove_old_sidecars(key)
+        self.evict(keep=key)
+        return self.open_sidecar(samples_path, index_path)
+
+    def open_sidecar(self, samples_path, index_path):
+        """
+        Map a sidecar as a RawTrace, and mark it as used.
+        """
+        with open(index_path) as index_file:
+            index = json.load(index_file)
+        dtype = np.dtype(str(index['dtype']))
+        if index['num_samples'] == 0:
+            # mmap cannot map an empty array
+            samples = np.zeros((0, index['num_channels']), dtype=dtype)
+        else:
+            samples = np.memmap(samples_path, dtype=dtype, mode='r',
+                                offset=index['offset'], shape=(index['num_samples'], index['num_channels']))
+        try:
+            os.utime(index_path, None)
+        except OSError:
+            # evicted meanwhile; the mapping stays valid
+            pass
+        return RawTrace(samples, index['sample_rate'])
+
+    def write_sidecar(self, path, samples_path, index_path):
+        """
+        Decode the QLB at path and write its samples and index sidecars.
+        The index is written last, so a sidecar that has an index is complete.
+        """
+        well = self.well_reader(path)
+        samples = np.ascontiguousarray(well.samples)
+        if samples.ndim == 1:
+            samples = samples.reshape((len(samples), 1))
+
+        dirname = os.path.dirname(samples_path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+        # write to temp files and rename, so that concurrent readers never
+        # see a partial sidecar
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=dirname)
+        with os.fdopen(fd, 'wb') as tmp_file:
+            np.save(tmp_file, samples)
+            offset = tmp_file.tell() - samples.nbytes
+        os.rename(tmp_path, samples_path)
+
+        index = {'path': os.path.abspath(path),
+                 'sample_rate': well.data_acquisition_params.sample_rate,
+                 'num_samples': samples.shape[0],
+                 'num_channels': samples.shape[1],
+                 'dtype': samples.dtype.str,
+                 'offset': offset}
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=dirname)
+        with os.fdopen(fd, 'w') as tmp_file:
+            json.dump(index, tmp_file)
+        os.rename(tmp_path, index_path)
+
+    def remove_sidecar(self, key):
+        """
+        Remove the sidecar files of a key, index first.
+        """
+        samples_path, index_path = self.key_paths(key)
+        for sidecar_path in (index_path, samples_path):
+            try:
+                os.unlink(sidecar_path)
+            except OSError:
+                pass
+
+    def remove_old_sidecars(self, key):
+        """
+        Remove the sidecars of earlier versions of the QLB of a key.
+        """
+        path_key = key.split('-')[0]
+        dirname = os.path.dirname(self.key_paths(key)[0])
+        for filename in os.listdir(dirname):
+            if filename.startswith('%s-' % path_key) and filename.endswith('.json') \
+                    and filename != '%s.json' % key:
+                self.remove_sidecar(filename[:-len('.json')])
+
+    def sidecars(self):
+        """
+        Return the (last used, size, key) of each sidecar, removing
+        temp files left over from failed writes along the way.
+        """
+        sidecars = []
+        now = time.time()
+        if not os.path.isdir(self.root):
+            return sidecars
+        for dirname in os.listdir(self.root):
+            dirpath = os.path.join(self.root, dirname)
+            if not os.path.isdir(dirpath):
+                continue
+            for filename in os.listdir(dirpath):
+                if filename.endswith('.tmp'):
+                    tmp_path = os.path.join(dirpath, filename)
+                    try:
+                        if now - os.path.getmtime(tmp_path) > STALE_TEMP_AGE:
+                            os.unlink(tmp_path)
+                    except OSError:
+                        pass
+                    continue
+                if not filename.endswith('.json'):
+                    continue
+                key = filename[:-len('.json')]
+                samples_path, index_path = self.key_paths(key)
+                try:
+                    size = os.path.getsize(samples_path) + os.path.getsize(index_path)
+                    used = os.path.getmtime(index_path)
+                except OSError:
+                    continue
+                sidecars.append((used, size, key))
+        return sidecars
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used sidecars (except keep) until they
+        fit in the size limit.
+        """
+        sidecars = sorted(self.sidecars())
+        total = sum([size for used, size, key in sidecars])
+        for used, size, key in sidecars:
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+            self.remove_sidecar(key)
+            total -= size
+
+    def sample_windows(self, path, window_size=TRACE_WINDOW_SIZE):
+        """
+        Return (sample_rate, num_channels, window_iter) for the QLB at path;
+        a drop-in window_source for qtools.lib.spectrum.WellSpectrumSource.
+        """
+        trace = self.trace(path)
+        return trace.sample_rate, trace.num_channels, trace.sample_windows(window_size)
+
+
+def config_trace_source(config):
+    """
+    Return the RawTraceSource for an app config; sidecars are kept in
+    qlb.trace_cache, or the traces directory of the image store, up to
+    qlb.trace_cache_size MB.
+    """
+    return RawTraceSource(config.get('qlb.trace_cache', None) or os.path.join(config['qlb.image_store'], 'traces'),
+                          max_size=int(config.get('qlb.trace_cache_size', TRACE_CACHE_SIZE))*1024*1024)
@@ -0,0 +1,116 @@
+"""
+Replicate statistics over a plate's well and channel metrics.
+
+The metric values of every well on the plate are loaded into a single
+(wells x columns) array once, and the mean, standard deviation and CV
+of every replicate group and column are computed together with matrix
+products over a (groups x wells) membership matrix, rather than by
+collecting attribute lists per group and column.
+"""
+import numpy as np
+
+def metric_multiplier(col):
+    """
+    Return the display multiplier of a metric column (100 for
+    percentage columns, 1 otherwise).
+    """
+    return 100 if getattr(col, 'info', {}).get('percent', False) else 1
+
+def grouped_statistics(values, present, membership):
+    """
+    Compute the mean and (population) standard deviation of each column
+    over each group of rows.
+
+    :param values: (rows, columns) array of values.
+    :param present: (rows, columns) boolean array; False values are left out.
+    :param membership: (groups, rows) boolean array of the rows in each group.
+    :return: (counts, means, stds), each of shape (groups, columns).  Groups
+             without values in a column have NaN statistics for it.
+    """
+    weights = np.asarray(membership, dtype=float)
+    mask = np.asarray(present, dtype=float)
+    values = np.asarray(values, dtype=float)*mask
+
+    counts = weights.dot(mask)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = weights.dot(values)/counts
+        # deviations about each group's own mean, for precision
+        deviations = (values[np.newaxis,:,:]-means[:,np.newaxis,:])*mask[np.newaxis,:,:]
+        variances = np.einsum('gr,grc->gc', weights, deviations*deviations)/counts
+    return counts, means, np.sqrt(variances)
+
+def coefficients_of_variation(means, stds):
+    """
+    Return std/mean, NaN where the mean is zero.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(means != 0, stds/means, np.nan)
+
+
+class ReplicateMetricTable(object):
+    """
+    The selected well and channel metric columns of a plate's wells,
+    as one array.  Columns are the well metric columns followed by the
+    channel metric columns; values are scaled for display (percentages
+    x100), and missing (None) values count as 0.
+    """
+    def __init__(self, well_metrics, well_metric_cols, channel_metric_cols, channel_num=None):
+        """
+        :param well_metrics: The WellMetric records of the plate.
+        :param well_metric_cols: (attribute name, column) pairs of well metrics.
+        :param channel_metric_cols: (attribute name, column) pairs of well channel metrics.
+        :param channel_num: The channel of the channel metrics.  Wells without
+                            a metric for the channel are left out of the channel
+                            metric statistics.
+        """
+        self.well_names = [wm.well_name for wm in well_metrics]
+        self.well_index = dict([(name, idx) for idx, name in enumerate(self.well_names)])
+        self.num_well_cols = len(well_metric_cols)
+        num_cols = len(well_metric_cols)+len(channel_metric_cols)
+
+        self.values = np.zeros((len(well_metrics), num_cols), dtype=float)
+        self.present = np.ones((len(well_metrics), num_cols), dtype=bool)
+        for idx, wm in enumerate(well_metrics):
+            row = [getattr(wm, name) for name, col in well_metric_cols]
+            channel_metrics = [wcm for wcm in wm.well_channel_metrics if wcm.channel_num == channel_num]
+            if channel_metrics:
+                row.extend([getattr(channel_metrics[0], name) for name, col in channel_metric_cols])
+            else:
+                row.extend([0]*len(channel_metric_cols))
+                self.present[idx, self.num_well_cols:] = False
+            self.values[idx] = [float(val or 0) for val in row]
+
+        multipliers = [metric_multiplier(col) for name, col in well_metric_cols+channel_metric_cols]
+        self.values *= np.array(multipliers, dtype=float)
+
+    def membership(self, groups, ignored_wells=()):
+        """
+        Return the (groups, wells) membership matrix for lists of well
+        names, leaving out ignored wells and wells without metrics.
+        """
+        membership = np.zeros((len(groups), len(self.well_names)), dtype=bool)
+        ignored = set(ignored_wells)
+        for group_idx, well_names in enumerate(groups):
+            rows = [self.well_index[name] for name in well_names \
+                    if name not in ignored and name in self.well_index]
+            membership[group_idx, rows] = True
+        return membership
+
+    def statistics(self, groups, ignored_wells=()):
+        """
+        Compute the statistics of each group of well names.
+
+        Returns (well counts, means, stds, cvs); well counts has one
+        entry per group, and the rest are (groups, columns) arrays.
+        """
+        membership = self.membership(groups, ignored_wells)
+        counts, means, stds = grouped_statistics(self.values, self.present, membership)
+        return membership.sum(axis=1), means, stds, coefficients_of_variation(means, stds)
+
+    def replicate_rows(self, groups, ignored_wells=()):
+        """
+        Return, for each group of well names, [well count, [(mean, std) per column]].
+        """
+        well_counts, means, stds, cvs = self.statistics(groups, ignored_wells)
+        return [[int(well_counts[idx]), zip(means[idx].tolist(), stds[idx].tolist())] \
+                for idx in range(len(groups))]
@@ -0,0 +1,168 @@
+"""
+Bulk sequence primitives for genome-scale strings.
+
+Complementing and base counting are done with 256-entry translate tables
+(for strings) and lookup arrays (for NumPy byte arrays), so that each
+operation is a single linear pass in C, without a Python callback per
+base.  All IUPAC ambiguity codes are supported, and case is preserved.
+"""
+import string
+
+import numpy as np
+
+IUPAC_COMPLEMENTS = {'A': 'T',
+                     'C': 'G',
+                     'G': 'C',
+                     'T': 'A',
+                     'U': 'A',
+                     'R': 'Y',
+                     'Y': 'R',
+                     'S': 'S',
+                     'W': 'W',
+                     'K': 'M',
+                     'M': 'K',
+                     'B': 'V',
+                     'V': 'B',
+                     'D': 'H',
+                     'H': 'D',
+                     'N': 'N',
+                     '?': '?',
+                     '-': '-'}
+
+IUPAC_BASES = ''.join(sorted(set([b for b in IUPAC_COMPLEMENTS if b.isalpha()])))
+
+def _complement_pairs(complements):
+    pairs = []
+    for base, comp in complements.items():
+        pairs.append((base, comp))
+        if base.isalpha():
+            pairs.append((base.lower(), comp.lower()))
+    return pairs
+
+def _translate_table(pairs):
+    src = ''.join([s for s, d in pairs])
+    dst = ''.join([d for s, d in pairs])
+    return string.maketrans(src, dst)
+
+COMPLEMENT_TABLE = _translate_table(_complement_pairs(IUPAC_COMPLEMENTS))
+COMPLEMENT_UNICODE_TABLE = dict([(ord(s), unicode(d)) for s, d in _complement_pairs(IUPAC_COMPLEMENTS)])
+COMPLEMENT_LOOKUP = np.frombuffer(COMPLEMENT_TABLE, dtype=np.uint8).copy()
+
+# mirrors the original regex complement in qtools.lib.bio: only the
+# unambiguous bases (and '?') are complemented, once uppercased.
+UNAMBIGUOUS_COMPLEMENT_TABLE = _translate_table([(b, IUPAC_COMPLEMENTS[b]) for b in 'ACGTU?'])
+UNAMBIGUOUS_COMPLEMENT_UNICODE_TABLE = dict([(ord(b), unicode(IUPAC_COMPLEMENTS[b])) for b in 'ACGTU?'])
+
+def translate(sequence, table, unicode_table):
+    """
+    Translate a str or unicode sequence with the matching table.
+    """
+    if isinstance(sequence, unicode):
+        return sequence.translate(unicode_table)
+    return sequence.translate(table)
+
+def complement(sequence):
+    """
+    Return the IUPAC complement of the sequence, preserving case.
+    Characters that are not bases pass through unchanged.
+
+    In: CGTAry
+    Out: GCATyr
+    """
+    if not sequence:
+        return sequence
+    return translate(sequence, COMPLEMENT_TABLE, COMPLEMENT_UNICODE_TABLE)
+
+def reverse_complement(sequence):
+    """
+    Return the IUPAC reverse complement of the sequence, preserving case.
+
+    In: CGTAry
+    Out: ryTACG
+    """
+    if not sequence:
+        return sequence
+    return complement(sequence)[::-1]
+
+def as_bytes(sequence):
+    """
+    Return a read-only uint8 view of a str sequence without copying, or
+    the array itself if already a NumPy array.
+    """
+    if isinstance(sequence, np.ndarray):
+        return sequence
+    if isinstance(sequence, unicode):
+        sequence = sequence.encode('ascii')
+    return np.frombuffer(sequence, dtype=np.uint8)
+
+def complement_array(array, out=None):
+    """
+    Complement a uint8 sequence array.  If out is specified (which
+    may be the input array itself), the complement is written there
+    instead of a new array.
+    """
+    return np.take(COMPLEMENT_LOOKUP, array, out=out)
+
+def reverse_complement_array(array):
+    """
+    Return the reverse complement of a uint8 sequence array.
+    """
+    return complement_array(array[::-1])
+
+def base_counts(sequence):
+    """
+    Return a 256-length array of the number of times each byte appears
+    in the sequence.
+    """
+    return np.bincount(as_bytes(sequence), minlength=256)
+
+def count_bases(sequence, bases):
+    """
+    Return the number of bases in the sequence that are one of the
+    specified characters (case sensitive).
+    """
+    counts = base_counts(sequence)
+    return int(sum([counts[ord(b)] for b in bases]))
+
+def gc_count(sequence):
+    """
+    Return the number of G and C bases (either case) in the sequence.
+    S (strong) is not counted; only confirmed bases are.
+    """
+    return sum([sequence.count(b) for b in 'CGcg'])
+
+def gc_content(sequence):
+    """
+    Return the fraction of the sequence which is Gs and Cs.  Leading
+    and trailing whitespace is ignored.
+    """
+    stripped = sequence.strip()
+    return float(gc_count(stripped))/len(stripped)
+
+GC_LOOKUP = np.zeros(256, dtype=np.uint8)
+GC_LOOKUP[[ord(b) for b in 'CGcg']] = 1
+
+def windowed_gc_content(sequence, window, step=None):
+    """
+    Return the GC fraction of each complete window of the sequence,
+    advancing by step bases (defaults to the window size).
+
+    Computed from a single cumulative sum, so the cost is linear in
+    the sequence length regardless of the window size.
+    """
+    step = step or window
+    is_gc = GC_LOOKUP[as_bytes(sequence)]
+    if len(is_gc) < window:
+        return np.zeros(0)
+    cumulative = np.concatenate(([0], np.cumsum(is_gc, dtype=np.int64)))
+    starts = np.arange(0, len(is_gc)-window+1, step)
+    return (cumulative[starts+window]-cumulative[starts])/float(window)
+
+def invalid_bases(sequence, valid=IUPAC_BASES+IUPAC_BASES.lower()):
+    """
+    Return the characters in the sequence that are not valid bases
+    (IUPAC codes in either case, by default), in order.
+    """
+    if isinstance(sequence, unicode):
+        return u''.join([c for c in sequence if c not in valid])
+    return sequence.translate(None, valid)
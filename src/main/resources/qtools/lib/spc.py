@@ -0,0 +1,225 @@
+"""
+Statistical process control for QC chart metrics.
+
+The control limits of a chart are drawn from a ControlLimitBaseline:
+the count, mean and sum of squared deviations of the metric over every
+plate run for the chart's query.  Baselines are updated incrementally --
+only points run since the last update are merged into the running
+statistics -- by the update-control-limits job, so drawing a chart
+neither rescans the metric's history nor writes to the database.
+
+Points on a chart are checked against the Western Electric rules with
+windowed counts over the whole series, rather than point by point.
+"""
+import hashlib, json
+from datetime import date, datetime
+
+import numpy as np
+from sqlalchemy.exc import IntegrityError
+
+from qtools.model import Session, ControlLimitBaseline
+
+# number of standard deviations from the center line to the control limits.
+CONTROL_LIMIT_SIGMAS = 3
+
+# baselines with fewer points than this are not used for control limits.
+MIN_BASELINE_POINTS = 20
+
+# chart query parameters that only select or decorate the displayed window,
+# and are left out of the baseline key.
+DISPLAY_PARAMS = ('start_date', 'end_date', 'upper_spec', 'lower_spec', 'upper_yaxis', 'lower_yaxis')
+
+# Western Electric rule flags.
+RULE_BEYOND_3_SIGMA = 1
+RULE_2_OF_3_BEYOND_2_SIGMA = 2
+RULE_4_OF_5_BEYOND_1_SIGMA = 4
+RULE_8_SAME_SIDE = 8
+
+RULE_DESCRIPTIONS = ((RULE_BEYOND_3_SIGMA, 'beyond 3 std'),
+                     (RULE_2_OF_3_BEYOND_2_SIGMA, '2 of 3 beyond 2 std'),
+                     (RULE_4_OF_5_BEYOND_1_SIGMA, '4 of 5 beyond 1 std'),
+                     (RULE_8_SAME_SIDE, '8 on one side'))
+
+def merge_moments(count, mean, sum_squares, values):
+    """
+    Merge a batch of values into running statistics.
+
+    :param count: The number of values counted so far.
+    :param mean: Their mean.
+    :param sum_squares: Their sum of squared deviations from the mean.
+    :param values: The values to add.
+    :return: The updated (count, mean, sum_squares).
+    """
+    values = np.asarray(values, dtype=float)
+    if len(values) == 0:
+        return count, mean, sum_squares
+
+    batch_count = len(values)
+    batch_mean = values.mean()
+    batch_sum_squares = ((values-batch_mean)**2).sum()
+
+    total = count+batch_count
+    delta = batch_mean-mean
+    mean = mean+delta*batch_count/total
+    sum_squares = sum_squares+batch_sum_squares+delta*delta*count*batch_count/total
+    return total, float(mean), float(sum_squares)
+
+def control_limits(center, sigma, sigmas=CONTROL_LIMIT_SIGMAS):
+    """
+    Return the (lower, upper) control limits about a center line.
+    """
+    return center-sigmas*sigma, center+sigmas*sigma
+
+def __window_counts(flags, window):
+    # number of flagged points in the window ending at each point
+    sums = np.concatenate(([0], np.cumsum(flags)))
+    ends = np.arange(1, len(flags)+1)
+    return sums[ends]-sums[np.maximum(ends-window, 0)]
+
+def western_electric_violations(values, center, sigma):
+    """
+    Check a series of points against the Western Electric rules:
+
+    1. A point beyond 3 std of the center line.
+    2. Two of three consecutive points beyond 2 std, on the same side.
+    3. Four of five consecutive points beyond 1 std, on the same side.
+    4. Eight consecutive points on the same side of the center line.
+
+    A violation is flagged at the points that complete the pattern.
+
+    :param values: The points, in run order.
+    :param center: The center line.
+    :param sigma: The standard deviation.
+    :return: An array of the RULE_* flags violated at each point.
+    """
+    values = np.asarray(values, dtype=float)
+    violations = np.zeros(len(values), dtype=int)
+    if len(values) == 0 or not sigma > 0:
+        return violations
+
+    zscores = (values-center)/sigma
+    violations[np.abs(zscores) > 3] |= RULE_BEYOND_3_SIGMA
+    for side in (zscores, -zscores):
+        beyond_2 = side > 2
+        violations[beyond_2 & (__window_counts(beyond_2, 3) >= 2)] |= RULE_2_OF_3_BEYOND_2_SIGMA
+        beyond_1 = side > 1
+        violations[beyond_1 & (__window_counts(beyond_1, 5) >= 4)] |= RULE_4_OF_5_BEYOND_1_SIGMA
+        violations[__window_counts(side > 0, 8) >= 8] |= RULE_8_SAME_SIDE
+    return violations
+
+def describe_violations(flags):
+    """
+    Return the descriptions of the rules in a violation flag value.
+    """
+    return [description for rule, description in RULE_DESCRIPTIONS if flags & rule]
+
+def _query_param_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    elif isinstance(value, (list, tuple)):
+        return [_query_param_value(val) for val in value]
+    return value
+
+def canonical_query_params(form_result, ignore=()):
+    """
+    Return the canonical form of chart query parameters: the same query
+    always has the same canonical parameters, however its form was
+    filled in.  The ignored keys and blank values are left out, the
+    order of exclusions does not matter, and dates become strings.
+    """
+    params = dict()
+    for key, val in form_result.items():
+        if key in ignore or val is None or val == '' or val == []:
+            continue
+        if key == 'exclude':
+            val = sorted(val)
+        params[key] = _query_param_value(val)
+    return params
+
+def baseline_params(form_result):
+    """
+    Return the chart query parameters that identify a baseline.
+    """
+    return dict([(key, val) for key, val in form_result.items() if key not in DISPLAY_PARAMS])
+
+def baseline_key(chart_type, params):
+    """
+    Return the key of the baseline of a chart query; equivalent
+    queries share a key (see canonical_query_params).
+    """
+    return hashlib.sha1(json.dumps([chart_type, canonical_query_params(params, DISPLAY_PARAMS)], sort_keys=True)).hexdigest()
+
+def find_baseline(chart_type, form_result):
+    """
+    Return the ControlLimitBaseline of a chart query, or None if
+    the query does not have one yet.
+
+    :param chart_type: The kind of chart query (category, reader, search).
+    :param form_result: The chart query form values.
+    """
+    key = baseline_key(chart_type, baseline_params(form_result))
+    return Session.query(ControlLimitBaseline).filter_by(chart_key=key).first()
+
+def get_baseline(chart_type, form_result):
+    """
+    Return the ControlLimitBaseline of a chart query, creating it (empty)
+    if necessary.  The caller is responsible for committing.
+
+    If another request creates the baseline first, and it is not yet
+    visible to this transaction, an unsaved empty baseline is returned.
+
+    :param chart_type: The kind of chart query (category, reader, search).
+    :param form_result: The chart query form values.
+    """
+    params = baseline_params(form_result)
+    key = baseline_key(chart_type, params)
+    baseline = find_baseline(chart_type, form_result)
+    if baseline:
+        return baseline
+
+    # another request may be creating the same baseline
+    Session.begin_nested()
+    try:
+        baseline = ControlLimitBaseline(chart_key=key,
+                                        chart_type=chart_type,
+                                        metric='.'.join(params['metric']),
+                                        query_params=unicode(json.dumps(params, sort_keys=True)),
+                                        num_points=0,
+                                        mean=0.0,
+                                        sum_squares=0.0)
+        Session.add(baseline)
+        Session.commit()
+    except IntegrityError:
+        # the rollback expunges the new baseline; under repeatable read,
+        # the other request's row may not be visible until the outer
+        # transaction ends, so fall back to the (empty) unsaved one
+        Session.rollback()
+        baseline = Session.query(ControlLimitBaseline).filter_by(chart_key=key).first() or baseline
+    return baseline
+
+def baseline_form_result(baseline):
+    """
+    Return chart query form values for the points not yet counted in
+    a baseline.
+    """
+    form_result = dict([(str(key), val) for key, val in json.loads(baseline.query_params).items()])
+    for key in DISPLAY_PARAMS:
+        form_result[key] = None
+    form_result['start_date'] = baseline.last_run_time
+    return form_result
+
+def update_baseline(baseline, values, run_times):
+    """
+    Merge new points into a baseline.  The caller is responsible for
+    committing.
+
+    :param values: The metric values of the new points.
+    :param run_times: The run times of the new points, including any
+                      points excluded from the values.
+    """
+    baseline.num_points, baseline.mean, baseline.sum_squares = \
+        merge_moments(baseline.num_points, baseline.mean, baseline.sum_squares, values)
+    if run_times:
+        baseline.last_run_time = max([baseline.last_run_time or run_times[0]]+list(run_times))
+    baseline.updated = datetime.now()
+    return baseline
@@ -0,0 +1,142 @@
+"""
+Spectral analysis of raw well (QLB) sample traces.
+
+Spectra are computed from windows of the raw sample stream with
+real-input FFTs (Welch averaging), so only a window of samples is
+converted and transformed at a time, and the results are cached
+by QLB path and modification time so repeat views are free.  Only
+the plotted band (and the peaks found over the full spectrum) are
+kept, so a cached spectrum is a few dozen KB rather than a megabyte.
+"""
+import os
+
+import numpy as np
+
+from qtools.lib.collection import AttrDict
+from qtools.lib.nstats.fft import downsampled_blocks, welch_amplitude_spectrum, find_peak_indices
+from qtools.lib.qlb_factory import get_well
+
+# every Nth raw sample is used; plenty of bandwidth for the <150Hz range
+# that is of interest.
+SPECTRUM_DOWNSAMPLE = 23
+
+# size of each Welch segment after downsampling; at typical sample
+# rates this gives sub-0.1Hz resolution.
+SPECTRUM_SEGMENT_SIZE = 2**16
+
+# number of raw samples to read from the trace at a time.
+SAMPLE_WINDOW_SIZE = 2**18
+
+# the number of top peaks to report per channel, and the peak grouping width.
+SPECTRUM_PEAK_COUNT = 10
+SPECTRUM_PEAK_WINDOW_HZ = 2
+
+# the upper bound of the band that is kept (and plotted).
+SPECTRUM_MAX_FREQ = 150
+
+def well_sample_windows(path, window_size=SAMPLE_WINDOW_SIZE):
+    """
+    Return (sample_rate, num_channels, window_iter) for the raw QLB at
+    the specified path, where window_iter yields consecutive
+    (window_size, num_channels) views of the sample trace.
+
+    This decodes the whole QLB; RawTraceSource.sample_windows in
+    qtools.lib.rawtrace reads the windows from a memory-mapped sidecar.
+    """
+    qlwell = get_well(path)
+    samples = qlwell.samples
+    def windows():
+        for start in xrange(0, len(samples), window_size):
+            yield samples[start:start+window_size]
+    return qlwell.data_acquisition_params.sample_rate, samples.shape[1], windows
+
+def channel_spectrum(windows, channel, sample_rate,
+                     downsample=SPECTRUM_DOWNSAMPLE,
+                     segment_size=SPECTRUM_SEGMENT_SIZE):
+    """
+    Compute the normalized amplitude spectrum of a single channel from
+    a callable that returns an iterator of sample windows.
+
+    Samples are normalized to a 0->1 range by the maximum (downsampled)
+    sample, as the plot has always done; since the FFT is linear, that
+    is applied to the spectrum after the fact.
+    """
+    blocks = downsampled_blocks((w[:,channel] for w in windows()), downsample)
+    freqs, amplitudes, max_sample = welch_amplitude_spectrum(blocks, float(sample_rate)/downsample, segment_size)
+    if max_sample:
+        amplitudes = amplitudes/max_sample
+    return freqs, amplitudes
+
+def spectrum_peaks(freqs, amplitudes, count=SPECTRUM_PEAK_COUNT, width_hz=SPECTRUM_PEAK_WINDOW_HZ):
+    """
+    Return the frequencies of the top peaks of the spectrum, finding
+    the largest amplitude in each width_hz-wide window.
+    """
+    if len(freqs) < 2:
+        return []
+    bins_per_hz = max(1, int(round(1.0/(freqs[1]-freqs[0]))))
+    indices = find_peak_indices(amplitudes, bins_per_hz*width_hz)
+    return list(freqs.take(indices)[:count])
+
+def spectrum_band(freqs, amplitudes, max_freq=SPECTRUM_MAX_FREQ):
+    """
+    Return the (freqs, amplitudes) of the spectrum up to and including
+    max_freq.
+    """
+    end = np.searchsorted(freqs, max_freq, side='right')
+    return freqs[:end].copy(), amplitudes[:end].copy()
+
+class WellSpectrumSource(object):
+    """
+    Computes and caches the spectra of raw wells.
+
+    The cache is expected to be a Beaker cache (or anything with a
+    get(key, createfunc=) method); results are keyed by the QLB path,
+    its modification time and the spectrum parameters, so a rewritten
+    QLB is never served a stale spectrum.  Only the band up to max_freq
+    is kept.
+    """
+    def __init__(self, cache=None, downsample=SPECTRUM_DOWNSAMPLE,
+                 segment_size=SPECTRUM_SEGMENT_SIZE,
+                 window_source=well_sample_windows,
+                 max_freq=SPECTRUM_MAX_FREQ):
+        self.cache = cache
+        self.downsample = downsample
+        self.segment_size = segment_size
+        self.window_source = window_source
+        self.max_freq = max_freq
+
+    def cache_key(self, path):
+        mtime = os.stat(path).st_mtime
+        return "%s:%s:%s:%s:%s" % (path, mtime, self.downsample, self.segment_size, self.max_freq)
+
+    def compute(self, path):
+        """
+        Compute the spectrum for each channel of the QLB at path,
+        bypassing the cache.
+
+        Returns an AttrDict with sample_rate, and a channels list,
+        each item of which has freqs and amplitudes (up to max_freq),
+        and the peaks of the full spectrum.
+        """
+        sample_rate, num_channels, windows = self.window_source(path)
+        channels = []
+        for channel in range(num_channels):
+            freqs, amplitudes = channel_spectrum(windows, channel, sample_rate,
+                                                 downsample=self.downsample,
+                                                 segment_size=self.segment_size)
+            peaks = spectrum_peaks(freqs, amplitudes)
+            freqs, amplitudes = spectrum_band(freqs, amplitudes, self.max_freq)
+            channels.append(AttrDict(freqs=freqs,
+                                     amplitudes=amplitudes,
+                                     peaks=peaks))
+        return AttrDict(sample_rate=sample_rate, channels=channels)
+
+    def spectrum(self, path):
+        """
+        Return the (possibly cached) spectrum for the QLB at path.
+        See compute() for the structure.
+        """
+        if self.cache is None:
+            return self.compute(path)
+        return self.cache.get(self.cache_key(path), createfunc=lambda: self.compute(path))
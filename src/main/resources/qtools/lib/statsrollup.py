@@ -0,0 +1,176 @@
+"""
+Rolled-up plate run statistics for the reader utilization pages.
+
+Event, well and runtime totals are kept per scanned plate (PlateRunStats)
+and per day, reader and operator (ReaderDayStats), so that the stats
+pages read a few hundred pre-aggregated rows instead of grouping every
+well in the history at request time.  Plates without a host datetime
+fall in no day, so lifetime totals are summed from PlateRunStats.
+
+Plate totals are refreshed as plates are scanned or edited, and the day
+rows they fall in are rebuilt from the plate totals.  The rollups for
+plates scanned before the tables existed are built by the
+backfill-run-stats command.
+
+The totals come from the QLB wells, and the reader/operator/run time of
+the plate, and are refreshed on every path that changes those:
+
+- update-plates and plate upload (scan_plate), for new plates, and for
+  plates rescanned after their QLP file changed, or after the plate
+  editor triggered a rescan (trigger_plate_rescan);
+- the plate editor, which can change the operator;
+- plate deletion, from the plate controller and from delete-plates
+  (delete_plate_recursive).
+
+Reprocessing a plate only adds PlateMetric records, and does not change
+the totals.  Anything else that edits wells or plates directly in the
+database (a one-off script or SQL fix) should be followed by
+backfill-run-stats, which rebuilds both tables.
+"""
+from sqlalchemy import case, func
+
+from qtools.model import Session, QLBPlate, QLBWell, Plate, PlateRunStats, ReaderDayStats
+
+# wells with at least this many events count as data wells.
+DATA_WELL_MIN_EVENTS = 1000
+
+# plate stats rows inserted per statement on backfill.
+BACKFILL_BATCH_SIZE = 1000
+
+def plate_totals_query():
+    """
+    Query for (qlbplate_id, wells, data_wells, events, start_time, end_time)
+    per scanned plate, over the wells with a QLB file.
+    """
+    return Session.query(QLBWell.plate_id,
+                         func.count(QLBWell.id),
+                         func.sum(case([(QLBWell.event_count >= DATA_WELL_MIN_EVENTS, 1)], else_=0)),
+                         func.sum(QLBWell.event_count),
+                         func.min(QLBWell.host_datetime),
+                         func.max(QLBWell.host_datetime)).\
+                   filter(QLBWell.file_id != None).\
+                   group_by(QLBWell.plate_id)
+
+def plate_run_stats_values(host_datetime, box2_id, operator_id, totals):
+    """
+    Return the PlateRunStats column values for a plate with the given
+    run attributes and (wells, data_wells, events, start_time, end_time)
+    well totals.
+    """
+    wells, data_wells, events, start_time, end_time = totals
+    if start_time and end_time:
+        runtime_seconds = int((end_time-start_time).total_seconds())
+    else:
+        runtime_seconds = 0
+    return dict(host_datetime=host_datetime,
+                day=host_datetime.date() if host_datetime else None,
+                box2_id=box2_id,
+                operator_id=operator_id,
+                start_time=start_time,
+                end_time=end_time,
+                runtime_seconds=runtime_seconds,
+                wells=wells or 0,
+                data_wells=int(data_wells or 0),
+                events=int(events or 0))
+
+def rebuild_reader_days(days=None):
+    """
+    Rebuild the ReaderDayStats rows for the specified days (all days,
+    if None) from the plate totals.
+    """
+    delete_query = Session.query(ReaderDayStats)
+    group_query = Session.query(PlateRunStats.day,
+                                PlateRunStats.box2_id,
+                                PlateRunStats.operator_id,
+                                func.count(PlateRunStats.id),
+                                func.sum(PlateRunStats.wells),
+                                func.sum(PlateRunStats.data_wells),
+                                func.sum(PlateRunStats.events),
+                                func.sum(PlateRunStats.runtime_seconds)).\
+                          filter(PlateRunStats.day != None)
+    if days is not None:
+        days = [day for day in set(days) if day is not None]
+        if not days:
+            return
+        delete_query = delete_query.filter(ReaderDayStats.day.in_(days))
+        group_query = group_query.filter(PlateRunStats.day.in_(days))
+
+    delete_query.delete(synchronize_session=False)
+    rows = [dict(day=day, box2_id=box2_id, operator_id=operator_id,
+                 plates=plates, wells=int(wells or 0), data_wells=int(data_wells or 0),
+                 events=int(events or 0), runtime_seconds=int(runtime_seconds or 0))
+            for day, box2_id, operator_id, plates, wells, data_wells, events, runtime_seconds \
+            in group_query.group_by(PlateRunStats.day, PlateRunStats.box2_id, PlateRunStats.operator_id)]
+    if rows:
+        Session.execute(ReaderDayStats.__table__.insert(), rows)
+
+def update_plate_run_stats(qlbplate):
+    """
+    Recompute the rolled-up totals of a scanned plate from its wells,
+    and rebuild the day rows the plate was and is now counted in.
+    Plates without a Plate record are not counted.  The caller is
+    responsible for committing.
+
+    Returns the PlateRunStats record, or None if the plate is not counted.
+    """
+    stats = Session.query(PlateRunStats).filter_by(qlbplate_id=qlbplate.id).first()
+    days = set()
+    if stats:
+        days.add(stats.day)
+
+    plate = qlbplate.plate
+    if plate is None:
+        if stats:
+            Session.delete(stats)
+            stats = None
+    else:
+        totals = plate_totals_query().filter(QLBWell.plate_id == qlbplate.id).first()
+        totals = totals[1:] if totals else (0, 0, 0, None, None)
+        if stats is None:
+            stats = PlateRunStats(qlbplate_id=qlbplate.id)
+            Session.add(stats)
+        for key, val in plate_run_stats_values(qlbplate.host_datetime, plate.box2_id, plate.operator_id, totals).items():
+            setattr(stats, key, val)
+        days.add(stats.day)
+
+    Session.flush()
+    rebuild_reader_days(days)
+    return stats
+
+def remove_plate_run_stats(qlbplate):
+    """
+    Stop counting a plate (before it is deleted).  The caller is
+    responsible for committing.
+    """
+    stats = Session.query(PlateRunStats).filter_by(qlbplate_id=qlbplate.id).first()
+    if stats:
+        Session.delete(stats)
+        Session.flush()
+        rebuild_reader_days([stats.day])
+
+def backfill_run_stats():
+    """
+    Rebuild all the rollups from the scanned wells, with one grouped
+    query over the wells.  The caller is responsible for committing.
+
+    Returns the number of plates counted.
+    """
+    plates = Session.query(QLBPlate.id,
+                           QLBPlate.host_datetime,
+                           Plate.box2_id,
+                           Plate.operator_id).\
+                     join(QLBPlate.plate).all()
+    totals = dict([(row[0], row[1:]) for row in plate_totals_query()])
+
+    rows = []
+    for qlbplate_id, host_datetime, box2_id, operator_id in plates:
+        values = plate_run_stats_values(host_datetime, box2_id, operator_id,
+                                        totals.get(qlbplate_id, (0, 0, 0, None, None)))
+        values['qlbplate_id'] = qlbplate_id
+        rows.append(values)
+
+    Session.query(PlateRunStats).delete(synchronize_session=False)
+    for start in range(0, len(rows), BACKFILL_BATCH_SIZE):
+        Session.execute(PlateRunStats.__table__.insert(), rows[start:start+BACKFILL_BATCH_SIZE])
+    rebuild_reader_days()
+    return len(rows)
@@ -0,0 +1,655 @@
+"""
+Trend and QC chart queries.
+
+Chart forms (see controllers.trend and controllers.qc_chart) are turned
+into a query by build_category_query, build_reader_query or
+build_search_query, and executed by execute_built_query.
+
+query_results runs a chart query once per canonical query signature --
+the chart type, the query's form values, and the newest plate metric --
+and caches the result rows.  A new plate (or reprocessing) adds a plate
+metric, which changes the signature; writes to plates and metrics in
+this process clear the cache outright, and cached results expire after
+QUERY_CACHE_TTL for writes made elsewhere.
+"""
+import hashlib, json, math, threading, time
+from collections import OrderedDict
+
+from sqlalchemy import event, func
+
+from qtools.lib.collection import groupinto
+from qtools.lib.spc import baseline_form_result, canonical_query_params, update_baseline
+from qtools.model import Session, WellChannelMetric, WellMetric, PlateMetric, Plate, QLBWell, QLBWellChannel, Box2, PlateType, SystemVersion
+
+# TODO: should be a mixin, separated from PVSI
+from qtools.model.reagents import ProductValidationSpecItem
+
+# seconds before a cached result is recomputed regardless.
+QUERY_CACHE_TTL = 10*60
+
+# the most query results kept.
+QUERY_CACHE_SIZE = 200
+
+# chart form values that only decorate the chart, and do not change the query.
+DISPLAY_PARAMS = ('upper_spec', 'lower_spec', 'upper_yaxis', 'lower_yaxis')
+
+SAMPLE_NTC = 'NTC'
+SAMPLE_STEALTH = 'Stealth'
+SAMPLE_FAM_HI = 'FAM HI'
+SAMPLE_FAM_LO = 'FAM LO'
+SAMPLE_VIC_HI = 'VIC HI'
+SAMPLE_VIC_LO = 'VIC LO'
+SAMPLE_CC_FAMVIC = 'FAM/VIC'
+SAMPLE_CC_FAMHEX = 'FAM/HEX'
+SAMPLE_CODS = 'S.a. 1cpd'
+
+ASSAY_STAPH = 'QL_S_aureus'
+ASSAY_EGFR = 'EGFR L858R WT'
+ASSAY_RPP = 'QL_RPP30_1'
+ASSAY_MRG = 'MRGPRX1 CNV'
+
+READER_PRODUCTION = 'prod'
+READER_GROOVE = 'groove'
+READER_LAB = 'lab'
+READER_GOLDEN_DR = 'golden'
+READER_FLUIDICS_MODULES = 'fluidics'
+READER_DETECTOR_MODULES = 'detector'
+READER_QX100 = 'qx100'
+READER_QX150 = 'qx150'
+READER_QX200 = 'qx200'
+READER_QX201 = 'qx201'
+
+EXCLUDE_OUTLIER = 'outlier'
+EXCLUDE_LOW_EVENTS = 'low'
+EXCLUDE_NO_CALL = 'nocall'
+
+# TODO: break this logic out into separate groups?
+def sample_category_field(selected=None):
+    field = {'value': selected or '',
+             'options': [('','All'),
+                         (SAMPLE_NTC, 'NTC'),
+                         (SAMPLE_STEALTH, 'Stealth'),
+                         (SAMPLE_FAM_HI, 'FAM HI'),
+                         (SAMPLE_FAM_LO, 'FAM LO'),
+                         (SAMPLE_VIC_HI, 'VIC HI'),
+                         (SAMPLE_VIC_LO, 'VIC LO'),
+                         (SAMPLE_CC_FAMVIC, 'FAM/VIC Single-Well ColorCal'),
+                         (SAMPLE_CC_FAMHEX, 'FAM/HEX Single-Well ColorCal'),
+                         (SAMPLE_CODS, '1cpd Staph or Dye Equivalent')]}
+    return field
+
+def assay_category_field(selected=None):
+    field = {'value': selected or '',
+             'options': [('', 'All'),
+                         (ASSAY_STAPH, 'S. aureus'),
+                         (ASSAY_EGFR, 'EGFR WT'),
+                         (ASSAY_RPP, 'RPP30'),
+                         (ASSAY_MRG, 'MRGPRX1')]}
+    return field
+
+def reader_category_field(selected=None):
+    field = {'value': selected or '',
+             'options': [('','All'),
+                         (READER_PRODUCTION, 'Production Readers'),
+                         #(READER_GROOVE, 'Groove Readers'),
+                         (READER_LAB, 'Lab Readers'),
+                         (READER_GOLDEN_DR, 'Golden DR'),
+                         (READER_FLUIDICS_MODULES, 'Fluidics Modules'),
+                         (READER_DETECTOR_MODULES, 'Detector Modules'),
+                         (READER_QX100, 'QX100 Readers'),
+                         (READER_QX150, 'QX150 Readers'),
+                         (READER_QX200, 'QX200 Readers'),
+                         (READER_QX201, 'QX201 Readers')
+                         ]}
+    return field
+
+def exclusion_field(selected=None):
+    field = {'value': selected or '',
+             'options': [('None', 'None'),
+                         (EXCLUDE_LOW_EVENTS, 'Exclude Wells < 1000 Events'),
+                         (EXCLUDE_NO_CALL, 'Exclude No Calls')]}
+    return field
+
+def col_from_form_results(form_result):
+    """
+    Return which entity column the user wants to query.
+    """
+    if form_result['metric'][0] == 'channel':
+        return getattr(WellChannelMetric, form_result['metric'][1])
+    elif form_result['metric'][0] == 'well':
+        return getattr(WellMetric, form_result['metric'][1])
+    else:
+        return None
+
+# todo: move this out into query filters?
+def build_base_query(form_result):
+    """
+    Builds the base SQLAlchemy query object needed to execute a
+    trend query, from the values in the form submitted.
+
+    The return from the query will take the form (desired stat/object,
+    time, object id, [object display information]).  The ID could be
+    the ID of the plate or well, depending on whether the user desired
+    to group results by plate, or view well IDs independently.
+
+    :param form_result: self.form_result, computed by Pylons.
+    :return: A 3-tuple (query, joined_entities, return_objects)
+
+             The ``query`` is the SQLAlchemy query that can be executed.
+
+             ``joined_entities`` are the list of entity class (e.g., Plate)
+             that have been joined to the query already.  Use this
+             to determine downstream whether additional joins are necessary.
+
+             ``return_objects`` is a boolean about whether to expect that the
+            primary (first) return value of the query is going to be a
+            SQLAlchemy object, as opposed to a column value.  This will be
+            true if the desired statistic from the form values is not a
+            native column in the database, but a derived model column.
+            (TODO: I bet SQLAlchemy has a better way of doing this..)
+    """
+    joined_entities = []
+    return_objects = False
+    col = col_from_form_results(form_result)
+
+    # desired metric is a per-channel metric
+    if form_result['metric'][0] == 'channel':
+        # metric is a virtual property, not a DB column -- query will need to return objects
+        # group-by will need to be done downstream in logic
+        if isinstance(col, property):
+            base_q = Session.query(WellChannelMetric, Plate.run_time, Plate.id, Plate.name, Box2.name, WellMetric.well_name)
+            base_q = base_q.join(WellMetric).join(PlateMetric).join(Plate).join(Box2)
+            joined_entities.extend([WellChannelMetric, WellMetric, PlateMetric, Plate, Box2])
+            return_objects = True
+        # average metric by plate; metric is a db column; you can use db group by function
+        elif form_result['group_by_plate']:
+            base_q = Session.query(func.avg(col), Plate.run_time, Plate.id, Plate.name, Box2.name)
+            base_q = base_q.join(WellMetric).join(PlateMetric).join(Plate).join(Box2)
+            joined_entities.extend([WellChannelMetric, WellMetric, PlateMetric, Plate, Box2])
+        # metric is a db column, per-well OK
+        else:
+            base_q = Session.query(col, Plate.run_time, WellMetric.well_id, Plate.name, WellMetric.well_name)
+            base_q = base_q.join(WellMetric).join(PlateMetric).join(Plate)
+            joined_entities.extend([WellChannelMetric, WellMetric, PlateMetric, Plate])
+        # filter by channel if specified
+        if form_result['channel_num'] is not None:
+            base_q = base_q.filter(WellChannelMetric.channel_num == form_result['channel_num'])
+    # desired metric is a per-well metric
+    elif form_result['metric'][0] == 'well':
+        # metric is a virtual property, not a DB column -- query will need to return objects
+        # group-by will need to be done downstream in logic
+        if isinstance(col, property):
+            base_q = Session.query(WellMetric, Plate.run_time, Plate.id, Plate.name, Box2.name, WellMetric.well_name)
+            base_q = base_q.join(PlateMetric).join(Plate).join(Box2)
+            joined_entities.extend([WellMetric, PlateMetric, Plate,Box2])
+            return_objects = True
+        # average metric by plate; metric is a db column; you can use db group by function
+        elif form_result['group_by_plate']:
+            base_q = Session.query(func.avg(col), Plate.run_time, Plate.id, Plate.name, Box2.name)
+            base_q = base_q.join(PlateMetric).join(Plate).join(Box2)
+            joined_entities.extend([WellMetric, PlateMetric, Plate, Box2])
+        # metric is a db-column, per-well OK
+        else:
+            base_q = Session.query(col, Plate.run_time, WellMetric.well_id, Plate.name, WellMetric.well_name)
+            base_q = base_q.join(PlateMetric).join(Plate)
+            joined_entities.extend([WellMetric, PlateMetric, Plate])
+
+    # specify the right (non-reprocessed) plate metric id
+    if PlateMetric not in joined_entities:
+        base_q = base_q.join(PlateMetric)
+        joined_entities.append(PlateMetric)
+    base_q = base_q.filter(PlateMetric.reprocess_config_id == None)
+
+    # filter by date
+    if form_result['start_date'] or form_result['end_date']:
+        if Plate not in joined_entities:
+            base_q = base_q.join(Plate)
+            joined_entities.append(Plate)
+
+        if form_result['start_date']:
+            base_q = base_q.filter(Plate.run_time > form_result['start_date'])
+        if form_result['end_date']:
+            base_q = base_q.filter(Plate.run_time < form_result['end_date'])
+
+    # filter by plate_type
+    if form_result.get('plate_type'):
+        if PlateType not in joined_entities:
+            base_q = base_q.join(PlateType)
+            joined_entities.append(PlateType)
+
+        base_q = base_q.filter(PlateType.id == form_result.get('plate_type'))
+
+    # derived metrics are filtered downstream, by create_exclude_function
+    if not return_objects:
+        base_q = add_outlier_filter(base_q, form_result, col)
+
+    return base_q, joined_entities, return_objects
+
+def add_outlier_filter(query, form_result, col):
+    """
+    Modifies query to leave out outlier statistics, as specified by the
+    outlier_operator and outlier_value form fields.  When grouping by
+    plate, the plate average is compared.
+
+    :param query: The query to further filter.
+    :param form_result: The form values.
+    :param col: The metric column.
+    :return: query (side-effected)
+    """
+    op = form_result['outlier_operator']
+    threshold = form_result['outlier_value']
+    if not op or threshold is None:
+        return query
+
+    stat = func.avg(col) if form_result['group_by_plate'] else col
+    if op == ProductValidationSpecItem.EQUAL:
+        criterion = stat != threshold
+    elif op == ProductValidationSpecItem.LESS_THAN:
+        criterion = stat >= threshold
+    elif op == ProductValidationSpecItem.GREATER_THAN:
+        criterion = stat <= threshold
+    else:
+        return query
+
+    if form_result['group_by_plate']:
+        return query.having(criterion)
+    else:
+        return query.filter(criterion)
+
+def build_exclude_query(query, exclusions, joined_entities):
+    """
+    Exclude certain well types from aggregate or individual metrics.
+
+    :param query: The existing query to further filter.
+    :param exclusions: List of well types to exclude.
+    :param joined_entities: The list of already joined entities.  This method
+                            may add an additional join to the query.
+    :return: Side-effects query.
+    """
+    if EXCLUDE_LOW_EVENTS in exclusions:
+        if WellMetric not in joined_entities:
+            query = query.join(WellMetric).filter(WellMetric.accepted_event_count > 1000)
+
+    if EXCLUDE_NO_CALL in exclusions:
+        # assume a channel has been selected
+        if WellChannelMetric not in joined_entities:
+            query = query.join(WellChannelMetric)
+        query = query.filter(WellChannelMetric.concentration > 0)
+
+    return query
+
+def build_category_query(form_result):
+    """
+    Return a query to analyze wells in a certain category by a specified metric.
+
+    All filtering instructions should be on form values in the form_result object,
+    which Pylons creates from the request.
+
+    The query, when executed, will return a tuple per record, of the form:
+    (stat or record, run time, object ID, plate name, [well name])  For queries
+    against derived attributes on the entity model (properties of the model not
+    stored in a DB Column), the first member of the tuple will be a model object.
+    If this is the case, the second return value of this function will be True.
+
+    :param form_result:
+    :return: (query, postprocess_objects):
+             ``query`` is the query to execute.
+             ``postprocess_objects``: A boolean indicating whether the first
+             member of a query row is expected to be a model object.
+    """
+    cat_q, joined_entities, postprocess_objects = build_base_query(form_result)
+    if form_result['reader_category']:
+        if Plate not in joined_entities:
+            cat_q = cat_q.join(Plate)
+            joined_entities.append(Plate)
+        if Box2 not in joined_entities:
+            cat_q = cat_q.join(Box2)
+            joined_entities.append(Box2)
+    if form_result['reader_category']:
+        cat_q = add_reader_category_filter(cat_q, form_result['reader_category'], joined_entities)
+    if form_result['sample_category']:
+        cat_q = add_sample_category_filter(cat_q, form_result['sample_category'], joined_entities)
+    if form_result['assay_category']:
+        cat_q = add_assay_category_filter(cat_q, form_result['assay_category'], joined_entities)
+
+    cat_q = build_exclude_query(cat_q, form_result, joined_entities)
+    return cat_q, postprocess_objects
+
+def build_reader_query(form_result):
+    """
+    Return a query to analyze wells/plates by reader only.
+
+    See :func:`build_category_query` for an explanation of return values.
+    """
+    cat_q, joined_entities, postprocess_objects = build_base_query(form_result)
+    box2_id = form_result['reader']
+    if Plate not in joined_entities:
+        cat_q = cat_q.join(Plate)
+        joined_entities.append(Plate)
+    if Box2 not in joined_entities:
+        cat_q = cat_q.join(Box2)
+        joined_entities.append(Box2)
+
+    cat_q = cat_q.filter(Box2.id == box2_id)
+
+    cat_q = build_exclude_query(cat_q, form_result, joined_entities)
+    return cat_q, postprocess_objects
+
+def build_search_query(form_result):
+    cat_q, joined_entities, postprocess_objects = build_base_query(form_result)
+    if form_result['plate_name']:
+        cat_q = add_plate_like_filter(cat_q, form_result['plate_name'], joined_entities)
+    if form_result['sample_name']:
+        cat_q = add_sample_like_filter(cat_q, form_result['sample_name'], joined_entities)
+    if form_result['assay_name']:
+        cat_q = add_assay_like_filter(cat_q, form_result['assay_name'], joined_entities)
+
+    cat_q = build_exclude_query(cat_q, form_result, joined_entities)
+    return cat_q, postprocess_objects
+
+def add_reader_category_filter(query, category, joined_entities):
+    """
+    Modifies query to filter by reader type.
+
+    :param query: The query to further filter.
+    :param category: The category type.
+    :param joined_entities: Which entities have already been joined in the query.
+                            Reader filters may require additional joins.  This
+                            list will be modified if an additional join is made.
+    :return: query (side-effected)
+    """
+    if Box2 not in joined_entities:
+        query = query.join(Box2)
+
+    if SystemVersion not in joined_entities:
+        if QLBWell not in joined_entities:
+            query = query.join(QLBWell)
+        query = query.join(SystemVersion)
+
+    if category == READER_PRODUCTION:
+        query = query.filter(Box2.prod_query()).filter(Box2.reference != True)
+    #elif category == READER_GROOVE:
+    #    query = query.filteR(Box2.code.in_())
+    elif category == READER_LAB:
+        query = query.filter(Box2.lab_query())
+    elif category == READER_GOLDEN_DR:
+        query = query.filter(Box2.reference == True)
+    elif category == READER_FLUIDICS_MODULES:
+        query = query.filter(Box2.fluidics_module_query())
+    elif category == READER_DETECTOR_MODULES:
+        query = query.filter(Box2.detector_module_query())
+    elif category == READER_QX100:
+        query = query.filter(SystemVersion.type == 'QX100')
+    elif category == READER_QX150:
+        query = query.filter(SystemVersion.type == 'QX150')
+    elif category == READER_QX200:
+        query = query.filter(SystemVersion.type == 'QX200')
+    elif category == READER_QX201:
+        query = query.filter(SystemVersion.type == 'QX201')
+    return query
+
+def add_sample_category_filter(query, category, joined_entities):
+    """
+    Modifies query to filter by sample type.
+
+    :param query: The query to further filter.
+    :param category: The category type.
+    :param joined_entities: Which entities have already been joined in the query.
+                            Sample filters may require additional joins.  This
+                            list will be modified if an additional join is made.
+    :return: query (side-effected)
+    """
+    if QLBWell not in joined_entities:
+        query = query.join(QLBWell)
+        joined_entities.append(QLBWell)
+    if category == SAMPLE_NTC:
+        return query.filter(QLBWell.sample_name.like('NTC%'))
+    else:
+        return query.filter(QLBWell.sample_name == category)
+
+def add_assay_category_filter(query, category, joined_entities):
+    """
+    Modifies query to filter by assay type.
+
+    :param query: The query to further filter.
+    :param category: The category type.
+    :param joined_entities: Which entities have already been joined in the query.
+                            Assay filters may require additional joins.  This
+                            list will be modified if an additional join is made.
+    :return: query (side-effected)
+    """
+    if WellChannelMetric not in joined_entities:
+        query = query.join(WellChannelMetric)
+        joined_entities.append(WellChannelMetric)
+    if QLBWellChannel not in joined_entities:
+        query = query.join((QLBWellChannel, WellChannelMetric.well_channel_id == QLBWellChannel.id))
+        joined_entities.append(QLBWellChannel)
+
+    if category == ASSAY_RPP:
+        return query.filter(QLBWellChannel.target.in_(('RPP30','QL_RPP30_1','QLRPP30_#1','QLRPP30','QL_RPP30','RPP30_1')))
+    elif category == ASSAY_STAPH:
+        return query.filter(QLBWellChannel.target.in_(('Sa822','QL_S_aureus','s. aureus','S.Aureus','SA','Sa 1 cpd','S_aureus_822')))
+    else:
+        return query.filter(QLBWellChannel.target == category)
+
+def add_sample_like_filter(query, sample_name, joined_entities):
+    """
+    Modifies query to filter by sample LIKE.
+    :param query: The query to modify
+    :param category: The sample name to query against.
+    :param joined_entities: Which entities have already been joined in the query.
+    :return: query (side-effected)
+    """
+    if not sample_name:
+        return query
+
+    if QLBWell not in joined_entities:
+        query = query.join(QLBWell)
+        joined_entities.append(QLBWell)
+    return query.filter(QLBWell.sample_name.like("%%%s%%" % sample_name))
+
+def add_plate_like_filter(query, plate_name, joined_entities):
+    """
+    Modifies query to filter by plate name
+    :param query: The query to modify
+    :param plate_name: The plate name to query against
+    :param joined_entities: Which entities have already been joined in the query
+    :return: query (side-effected)
+    """
+    if not plate_name:
+        return query
+
+    if Plate not in joined_entities:
+        query = query.join(Plate)
+        joined_entities.append(Plate)
+
+    return query.filter(Plate.name.like("%%%s%%" % plate_name))
+
+def add_assay_like_filter(query, assay_name, joined_entities):
+    """
+    Modifies query to filter by assay LIKE
+    :param query: The query to modify
+    :param assay_name: The assay name to query against.
+    :param joined_entities: Which entities have already been joined in the query.
+    :return: query (side-effected)
+    """
+    if not assay_name:
+        return query
+
+    if WellChannelMetric not in joined_entities:
+        query = query.join(WellChannelMetric)
+        joined_entities.append(WellChannelMetric)
+    if QLBWellChannel not in joined_entities:
+        query = query.join((QLBWellChannel, WellChannelMetric.well_channel_id == QLBWellChannel.id))
+        joined_entities.append(QLBWellChannel)
+
+    return query.filter(QLBWellChannel.target.like("%%%s%%" % assay_name))
+
+def execute_built_query(base_q, group_by_plate, objects_expected=False, derived_metric=None):
+    """
+    Executes the query built by one of the build_*_query functions.  The result
+    will be a 5-tuple: [statistic, timepoint, object id, object display string,
+    DR name (plates) or plate name (wells)]
+
+    :param base_q: The query to execute.
+    :param group_by_plate: Whether to group the results by plate.
+    :param objects_expected: Whether the first member of the result set is expected to be a model object.
+    :param derived_metric: If the metric is a property derived from database columns, the name of this property.
+    :return: A result set of (stat, run_time, object id, name, DR or plate name)
+    """
+    if group_by_plate and not objects_expected:
+        base_q = base_q.group_by(Plate.id).order_by(Plate.run_time)
+    else:
+        base_q = base_q.order_by(Plate.run_time, WellMetric.well_name)
+
+    records = base_q.all()
+
+    if group_by_plate and objects_expected:
+        records = [(obj, dt, id, plate_name, DR) for obj, dt, id, plate_name, DR, well_name in records]
+    elif not group_by_plate:
+        # object queries also return the DR name
+        records = [(row[0], row[1], row[2], "%s - %s" % (row[3], row[-1]), row[3]) for row in records]
+
+    if objects_expected:
+        import numpy as np
+        # have to decorate & unwind groups if property derived
+        # TODO: could there be a nicer way to define virtual props in SQLAlchemy
+        records = [(getattr(obj, derived_metric), dt, id, name, DR) for obj, dt, id, name, DR in records]
+        if group_by_plate:
+            grouped_records = groupinto(records, lambda tup: tup[2])
+            records = [(np.mean([r[0] for r in recs if r[0] is not None]), recs[0][1], group_id, recs[0][3],recs[0][4]) for group_id, recs in grouped_records]
+            records = [(avg, dt, id, name,DR) for avg, dt, id, name,DR in records if not math.isnan(avg)]
+    
+    return records
+
+def create_exclude_function(form_result):
+    """
+    From the form, create a function that filters out statistics,
+    most likely from showing up in the chart.
+    """
+    op = form_result['outlier_operator']
+    threshold = form_result['outlier_value']
+    if op and threshold is not None:
+        # TODO: take logic from value_passes and make it more general
+        if op == ProductValidationSpecItem.EQUAL:
+            include_func = lambda v: v != form_result['outlier_value']
+        elif op == ProductValidationSpecItem.LESS_THAN:
+            include_func = lambda v: v >= form_result['outlier_value']
+        elif op == ProductValidationSpecItem.GREATER_THAN:
+            include_func = lambda v: v <= form_result['outlier_value']
+    else:
+        include_func = lambda v: True
+
+    return include_func
+
+QUERY_BUILDERS = {'category': build_category_query,
+                  'reader': build_reader_query,
+                  'search': build_search_query}
+
+def query_signature(chart_type, form_result):
+    """
+    Return the canonical signature of a chart query: the same query
+    always has the same signature, however its form was filled in.
+    Display-only values and blank values are left out, and the order of
+    exclusions does not matter.
+    """
+    params = canonical_query_params(form_result, DISPLAY_PARAMS)
+    latest_metric_id = Session.query(func.max(PlateMetric.id)).scalar()
+    return hashlib.sha1(json.dumps([chart_type, params, latest_metric_id], sort_keys=True, default=str)).hexdigest()
+
+
+class QueryResultCache(object):
+    """
+    A bounded cache of query results, evicting the least recently used,
+    whose entries expire after a time-to-live.
+    """
+    def __init__(self, ttl=QUERY_CACHE_TTL, size=QUERY_CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self.results = OrderedDict()
+        self.lock = threading.Lock()
+
+    def invalidate(self, *args):
+        # also usable directly as a mapper event listener
+        with self.lock:
+            self.results.clear()
+
+    def get(self, key, createfunc):
+        """
+        Return the cached value for key, or cache and return createfunc().
+        """
+        now = time.time()
+        with self.lock:
+            if key in self.results:
+                created, value = self.results.pop(key)
+                if now - created <= self.ttl:
+                    self.results[key] = (created, value)
+                    return value
+
+        value = createfunc()
+        with self.lock:
+            self.results[key] = (now, value)
+            while len(self.results) > self.size:
+                self.results.popitem(last=False)
+        return value
+
+query_cache = QueryResultCache()
+
+for model in (Plate, PlateMetric, WellMetric, WellChannelMetric, QLBWell, QLBWellChannel):
+    for event_name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(model, event_name, query_cache.invalidate)
+
+def execute_chart_query(chart_type, form_result):
+    """
+    Build and execute a chart query, bypassing the cache.
+
+    :return: (records, objects_expected); see execute_built_query.
+    """
+    query, objects_expected = QUERY_BUILDERS[chart_type](form_result)
+    if objects_expected:
+        records = execute_built_query(query, form_result['group_by_plate'], True, form_result['metric'][1])
+    else:
+        records = execute_built_query(query, form_result['group_by_plate'], False)
+    return records, objects_expected
+
+def query_results(chart_type, form_result):
+    """
+    Return the (possibly cached) records of a chart query.  The records
+    are shared between callers, and should not be modified.
+
+    :param chart_type: The kind of chart query (category, reader, search).
+    :param form_result: The chart query form values.
+    :return: (records, objects_expected); see execute_built_query.
+    """
+    return query_cache.get(query_signature(chart_type, form_result),
+                           lambda: execute_chart_query(chart_type, form_result))
+
+def chart_points(chart_type, form_result):
+    """
+    Runs a chart query, and returns the points to chart, as a list of
+    (stat, run_time, object id, name, DR name or plate name) tuples, in
+    run order.  Statistics that are None or excluded as outliers are
+    left out.
+
+    :return: (points, run times of all the records returned)
+    """
+    results, objects_expected = query_results(chart_type, form_result)
+
+    points = [(float(stat), dt, id, name, DR) for stat, dt, id, name, DR in results if stat is not None]
+    # column metrics have been filtered in the query
+    if objects_expected:
+        exclude_func = create_exclude_function(form_result)
+        points = [tup for tup in points if exclude_func(tup[0])]
+
+    return points, [dt for stat, dt, id, name, DR in results]
+
+def update_chart_baseline(baseline):
+    """
+    Merge the points run since the last update into the control limit
+    baseline of a chart query.  The caller is responsible for committing.
+
+    :return: The new points.
+    """
+    points, run_times = chart_points(baseline.chart_type, baseline_form_result(baseline))
+    update_baseline(baseline, [tup[0] for tup in points], run_times)
+    return points
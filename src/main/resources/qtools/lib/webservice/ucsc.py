@@ -125,6 +125,34 @@ hg19_chromosome_maxes = {
 
 CHROMOSOME_MAXES = {HG19: hg19_chromosome_maxes}
 
+# ranges fetched per custom track by UCSCSequenceSource.sequences
+SEQUENCE_BATCH_SIZE = 200
+
+def padded_pcr_sequence(amplicon, region):
+    """
+    Return the PCRSequence of an amplicon, padded with the rest of a
+    region fetched around it (None if the region is None).  The prefix
+    and suffix are cut from the region, but the original amplicon is
+    embedded, because it may have additional information.
+    """
+    if region is None:
+        return None
+    ch = amplicon.chromosome
+    actual_fwd_prefix_length = amplicon.start - region.start
+    actual_rev_suffix_length = region.end - amplicon.end
+    
+    if actual_fwd_prefix_length > 0:
+        prefix = SimpleGenomeSequence(ch, region.start, amplicon.start-1, region.strand, region.sequence[:actual_fwd_prefix_length])
+    else:
+        prefix = None
+    
+    if actual_rev_suffix_length > 0:
+        suffix = SimpleGenomeSequence(ch, amplicon.end+1, region.end, region.strand, region.sequence[-actual_rev_suffix_length:])
+    else:
+        suffix = None
+    
+    return PCRSequence(amplicon, prefix, suffix)
+
 class UCSCSequenceSource(SequenceSource):
     """
     Gets sequence information from UCSC.
@@ -151,33 +179,76 @@ class UCSCSequenceSource(SequenceSource):
             print "Could not connect to UCSC genome server."
             return None
     
+    def sequences(self, ranges):
+        """
+        Fetch the ranges through one custom track per SEQUENCE_BATCH_SIZE
+        ranges (see get_sequence_ranges), rather than two requests each.
+        """
+        sequences = []
+        for idx in range(0, len(ranges), SEQUENCE_BATCH_SIZE):
+            batch = ranges[idx:idx+SEQUENCE_BATCH_SIZE]
+            try:
+                sequences.extend(get_sequence_ranges(batch, session=self.session))
+            except urllib2.HTTPError:
+                print "Got a bad response from the UCSC genome server."
+                sequences.extend([None]*len(batch))
+            except urllib2.URLError:
+                print "Could not connect to UCSC genome server."
+                sequences.extend([None]*len(batch))
+        return sequences
+
+    def sequences_for_primer_pairs(self, primer_pairs, fwd_prefix_length=0, rev_suffix_length=0):
+        """
+        The bulk version of sequences_for_primers.  isPCR takes one primer
+        pair per request, so the pairs are still matched one at a time, but
+        the padded regions of all the matches are fetched together (see
+        sequences).  A pair that could not be matched or padded gets None.
+        """
+        matches = []
+        for primer_fwd, primer_rev in primer_pairs:
+            try:
+                matches.append(pcr_match(primer_fwd, primer_rev, session=self.session))
+            except urllib2.HTTPError:
+                print "Got a bad response from the UCSC genome server."
+                matches.append(None)
+            except urllib2.URLError:
+                print "Could not connect to UCSC genome server."
+                matches.append(None)
+
+        if not (fwd_prefix_length or rev_suffix_length):
+            # the matches have the amplicon sequences already
+            return [[PCRSequence(amplicon) for amplicon in amplicons] if amplicons is not None else None
+                        for amplicons in matches]
+
+        ranges = [(amplicon.chromosome, max(1, amplicon.start-fwd_prefix_length), amplicon.end+rev_suffix_length)
+                    for amplicons in matches if amplicons for amplicon in amplicons]
+        regions = iter(self.sequences(ranges))
+        pcr_sequences = []
+        for amplicons in matches:
+            if amplicons is None:
+                pcr_sequences.append(None)
+                continue
+            padded = [padded_pcr_sequence(amplicon, regions.next()) for amplicon in amplicons]
+            pcr_sequences.append(padded if None not in padded else None)
+        return pcr_sequences
+
     def sequences_for_primers(self, primer_fwd, primer_rev, fwd_prefix_length=0, rev_suffix_length=0):
         try:
             amplicons = pcr_match(primer_fwd, primer_rev, session=self.session)
             pcr_sequences = []
             for amplicon in amplicons:
+                if not (fwd_prefix_length or rev_suffix_length):
+                    # the match has the amplicon sequence already
+                    pcr_sequences.append(PCRSequence(amplicon))
+                    continue
+
                 ch = amplicon.chromosome
                 startpos = max(1, amplicon.start - fwd_prefix_length) # do padding here since padding on req doesn't really work
                 endpos = amplicon.end+rev_suffix_length # do padding here since padding on req doesn't really work
                 region = self.sequence(ch, startpos, endpos)
-                
-                # from this, make the prefix and suffix ranges but embed the original
-                # amplicon, because the amplicon may have additional information.
-                actual_fwd_prefix_length = amplicon.start - region.start
-                actual_rev_suffix_length = region.end - amplicon.end
-                
-                # todo: helper function (see sequence_around_loc)
-                if actual_fwd_prefix_length > 0:
-                    prefix = SimpleGenomeSequence(ch, region.start, amplicon.start-1, region.strand, region.sequence[:actual_fwd_prefix_length])
-                else:
-                    prefix = None
-                
-                if actual_rev_suffix_length > 0:
-                    suffix = SimpleGenomeSequence(ch, amplicon.end+1, region.end, region.strand, region.sequence[-actual_rev_suffix_length:])
-                else:
-                    suffix = None
-                                
-                pcr_sequences.append(PCRSequence(amplicon, prefix, suffix))
+                if region is None:
+                    return None
+                pcr_sequences.append(padded_pcr_sequence(amplicon, region))
             return pcr_sequences
             
         # todo: common error handler
@@ -406,6 +477,36 @@ def get_sequence_range(chromosome, startpos, endpos, *args, **request_kwargs):
     seqdata = table_sequence_request(chromosome, startpos, endpos, session, **request_kwargs)
     return table_sequence_request_process(seqdata)
 
+def get_sequence_ranges(ranges, *args, **request_kwargs):
+    """
+    The bulk version of get_sequence_range: return the SimpleGenomeSequence
+    of each (chromosome, startpos, endpos) range, all fetched through one
+    custom track (None for ranges on chromosomes not in hg19, or that
+    did not come back).
+    """
+    session = request_kwargs.get('session')
+    if not session:
+        session = get_ucsc_session()
+    
+    # the ranges as UCSC will report them, clipped to the chromosome
+    keys = []
+    for chromosome, startpos, endpos in ranges:
+        chromosome_max = CHROMOSOME_MAXES[HG19].get('chr%s' % chromosome)
+        if chromosome_max is None:
+            keys.append(None)
+        else:
+            keys.append((str(chromosome), max(1, startpos), min(chromosome_max, endpos)))
+    
+    requested = sorted(set([key for key in keys if key is not None]))
+    if not requested:
+        return [None for key in keys]
+    
+    custom_track_ranges_request(requested, session, **request_kwargs)
+    seqdata = table_track_sequences_request(session, **request_kwargs)
+    sequences = dict([((seq.chromosome, seq.start, seq.end), seq)
+                        for seq in table_sequences_request_process(seqdata)])
+    return [sequences.get(key) if key is not None else None for key in keys]
+
 
 def parse_sequence_identifier(seq):
     """
@@ -475,6 +576,13 @@ def custom_track_request(chromosome, startpos, endpos, request_proxy=None, *args
     startpos computed by the hgPcr tool (and referenced in sequence lookup) minus 1.
     I dunno.  Will write unit test to check if this ever changes.
     """
+    return custom_track_ranges_request([(chromosome, startpos, endpos)], request_proxy, *args, **kwargs)
+
+def custom_track_ranges_request(ranges, request_proxy=None, *args, **kwargs):
+    """
+    Like custom_track_request, but makes a custom track with an item for
+    each (chromosome, startpos, endpos) range.
+    """
     if request_proxy:
         if not request_proxy.hgsid:
             raise ValueError, "Cannot make custom track request without hgsid in session"
@@ -486,13 +594,16 @@ def custom_track_request(chromosome, startpos, endpos, request_proxy=None, *args
         else:
             hgsid = kwargs.get('hgsid')
     
-    if 'chr%s' % chromosome not in CHROMOSOME_MAXES[HG19]:
-        raise ValueError, "Invalid chromosome: %s" % chromosome
-    
-    if startpos < 1:
-        startpos = 1
-    if endpos > CHROMOSOME_MAXES[HG19]['chr%s' % chromosome]:
-        endpos = CHROMOSOME_MAXES[HG19]['chr%s' % chromosome]
+    lines = []
+    for chromosome, startpos, endpos in ranges:
+        if 'chr%s' % chromosome not in CHROMOSOME_MAXES[HG19]:
+            raise ValueError, "Invalid chromosome: %s" % chromosome
+        
+        if startpos < 1:
+            startpos = 1
+        if endpos > CHROMOSOME_MAXES[HG19]['chr%s' % chromosome]:
+            endpos = CHROMOSOME_MAXES[HG19]['chr%s' % chromosome]
+        lines.append("chr%s %s %s" % (chromosome, startpos-1, endpos))
     
     uri = 'hgCustom'
     defaults = {'hgsid': hgsid,
@@ -500,7 +611,7 @@ def custom_track_request(chromosome, startpos, endpos, request_proxy=None, *args
                 'org': HUMAN,
                 'db': HG19,
                 'hgct_customText': """track name='%s'
-chr%s %s %s""" % (hgsid, chromosome, startpos-1, endpos)}
+%s""" % (hgsid, '\n'.join(lines))}
     req = make_request_params(defaults, **kwargs)
     
     datagen, headers = poster_multipart_encode_patch(req)
@@ -516,7 +627,7 @@ chr%s %s %s""" % (hgsid, chromosome, startpos-1, endpos)}
     # hack hack hack
     if "Unrecognized format line" in response or "Error line" in response or "Add Custom Tracks" in response:
         # TODO: parse the error as well?
-        raise ValueError, "Invalid custom track specification: chr%s %s %s" % (chromosome, startpos, endpos)
+        raise ValueError, "Invalid custom track specification: %s" % '; '.join(lines)
     return response
 
 
@@ -529,6 +640,28 @@ def table_sequence_request(chromosome, startpos, endpos, request_proxy=None, *ar
     Requires a request proxy with hgsid and hgct_table set *or* hgsid and track_id
     kwargs set.
     """
+    if 'chr%s' % chromosome not in CHROMOSOME_MAXES[HG19]:
+        raise ValueError, "Invalid chromosome: %s" % chromosome
+        
+    # zero based request
+    if startpos < 0:
+        startpos = 0
+    
+    if endpos > CHROMOSOME_MAXES[HG19]["chr%s" % chromosome]:
+        endpos = CHROMOSOME_MAXES[HG19]["chr%s" % chromosome]
+    
+    return _table_sequence_request({"hgta_regionType": "range",
+                                    "position": "chr%s:%s-%s" % (chromosome, startpos, endpos)},
+                                   request_proxy, **kwargs)
+
+def table_track_sequences_request(request_proxy=None, *args, **kwargs):
+    """
+    Like table_sequence_request, but returns the sequences of every item
+    of the custom track (see custom_track_ranges_request), as FASTA.
+    """
+    return _table_sequence_request({"hgta_regionType": "genome"}, request_proxy, **kwargs)
+
+def _table_sequence_request(region, request_proxy=None, *args, **kwargs):
     if request_proxy:
         if not request_proxy.hgsid or not request_proxy.track_id:
             raise ValueError, "Required variables (hgsid, track_id) not set in session"
@@ -541,16 +674,6 @@ def table_sequence_request(chromosome, startpos, endpos, request_proxy=None, *ar
         hgsid = kwargs.get('hgsid')
         track_id = kwargs.get('track_id')
     
-    if 'chr%s' % chromosome not in CHROMOSOME_MAXES[HG19]:
-        raise ValueError, "Invalid chromosome: %s" % chromosome
-        
-    # zero based request
-    if startpos < 0:
-        startpos = 0
-    
-    if endpos > CHROMOSOME_MAXES[HG19]["chr%s" % chromosome]:
-        endpos = CHROMOSOME_MAXES[HG19]["chr%s" % chromosome]
-    
     uri = "hgTables"
     defaults = {'hgsid': hgsid,
                 'boolshad.sendToGalaxy': 0,
@@ -561,10 +684,9 @@ def table_sequence_request(chromosome, startpos, endpos, request_proxy=None, *ar
                 'hgta_doTopSubmit': "get output",
                 "hgta_outFileName": "",
                 "hgta_outputType": "sequence",
-                "hgta_regionType": "range",
                 "hgta_table": "ct_%s_%s" % (hgsid, track_id),
-                "hgta_track": "ct_%s_%s" % (hgsid, track_id),
-                "position": "chr%s:%s-%s" % (chromosome, startpos, endpos)}
+                "hgta_track": "ct_%s_%s" % (hgsid, track_id)}
+    defaults.update(region)
     req = make_request_params(defaults, **kwargs)
     
     datagen, headers = poster_multipart_encode_patch(req)
@@ -886,6 +1008,19 @@ def table_sequence_request_process(response):
     sequence = ''.join(lines[1:])
     return SimpleGenomeSequence(ch, int(startpos), int(endpos), strand, sequence)
 
+def table_sequences_request_process(response):
+    """
+    Like table_sequence_request_process, for a response with a FASTA
+    record per custom track item; returns a list of SimpleGenomeSequence
+    objects (records without a range are skipped).
+    """
+    sequences = []
+    for record in response.split('>')[1:]:
+        sequence = table_sequence_request_process('>%s' % record.strip())
+        if sequence is not None:
+            sequences.append(sequence)
+    return sequences
+
 
 def get_rebase_records():
     rebase_response = urllib2.urlopen(RE_TABLE_URL)
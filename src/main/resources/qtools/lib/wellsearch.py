@@ -0,0 +1,130 @@
+"""
+Column searches over plates and wells, for the Box 2 query pages.
+
+Searches grouped by plate directory run as a single query: the
+directories are ordered by the extreme value of the sort column over
+their matching wells (a grouped subquery joined back to the wells), and
+the rows are read in directory order and grouped as they are read,
+instead of running a query per directory.
+
+Results are read in keyset windows (windowed_results): each window is
+the next WINDOW_SIZE rows after the last row of the previous window, in
+the search order, so that only one window of rows is held at a time.
+(MySQLdb buffers whole result sets on the client, so a server-side
+cursor is not available for this.)
+"""
+import itertools
+
+from sqlalchemy import and_, or_, func
+
+from qtools.model import Session, QLBWell, QLBFile
+from qtools.lib.queryform import full_column_name
+
+# rows fetched per query when reading search results.
+WINDOW_SIZE = 500
+
+def search_criteria(form_result, col_display_names):
+    """
+    Build the filter and labeled result columns of a search from the
+    values of a QueryForm.
+
+    :param form_result: The validated form values (conditions, order_by,
+                        return_fields).
+    :param col_display_names: The display names of the form columns.
+    :return: (criterion, labeled columns, column display names).  The
+             labeled columns are the condition fields, then the order_by
+             field (if not a condition field), then the return fields.
+    """
+    criterion = and_(*[getattr(cond['field'], cond['compare'])(cond['value']) for cond in form_result['conditions']])
+
+    columns = [cond['field'] for cond in form_result['conditions']]
+    if form_result['order_by'].name not in [col.name for col in columns]:
+        columns.append(form_result['order_by'])
+    columns.extend(form_result['return_fields'])
+
+    labels = [col.label('field%s' % idx) for idx, col in enumerate(columns)]
+    label_names = [col_display_names.get(full_column_name(col), col.name) for col in columns]
+    return criterion, labels, label_names
+
+def _equal(column, value):
+    return column == None if value is None else column == value
+
+def _after(column, value, descending):
+    # NULLs sort first ascending and last descending (as in MySQL)
+    if descending:
+        return None if value is None else or_(column < value, column == None)
+    else:
+        return column != None if value is None else column > value
+
+def _after_key(ordering, key):
+    """
+    Return the criterion for rows after the row with the specified key
+    values, in the ordering.
+    """
+    clauses = []
+    for idx, (column, descending) in enumerate(ordering):
+        after = _after(column, key[idx], descending)
+        if after is not None:
+            clauses.append(and_(*([_equal(col, val) for (col, desc), val in zip(ordering[:idx], key[:idx])]+[after])))
+    return or_(*clauses)
+
+def windowed_results(query, ordering, window_size=WINDOW_SIZE):
+    """
+    Yield the rows of a query in order, window_size rows per query.
+
+    :param query: The query, without an order_by.
+    :param ordering: The (column, descending) pairs to order the rows by;
+                     the last column must be unique, such as a primary key.
+    :param window_size: The number of rows to read per query.
+    """
+    num_keys = len(ordering)
+    query = query.add_columns(*[column.label('window_key%s' % idx) for idx, (column, descending) in enumerate(ordering)]).\
+                  order_by(*[column.desc() if descending else column for column, descending in ordering])
+    key = None
+    while True:
+        window = query if key is None else query.filter(_after_key(ordering, key))
+        rows = window.limit(window_size).all()
+        for row in rows:
+            yield tuple(row[:-num_keys])
+        if len(rows) < window_size:
+            break
+        key = tuple(rows[-1][-num_keys:])
+
+def directory_ordered_well_query(query, criterion, order_by, descending=False):
+    """
+    Order a well search by plate directory, and by well name within each
+    directory.  Directories are ordered by the minimum (or maximum, if
+    descending) of order_by over their matching wells.
+
+    :param query: A query for QLBWell (and labeled columns), joined to QLBFile.
+    :param criterion: The search filter.
+    :param order_by: The column to order directories by.
+    :param descending: Whether to put directories with the latest values first.
+    :return: (query, ordering) to pass to windowed_results.
+    """
+    extreme = func.max(order_by) if descending else func.min(order_by)
+    directories = Session.query(QLBFile.dirname.label('dirname'), extreme.label('group_col')).\
+                          select_from(QLBWell).join(QLBWell.file).\
+                          filter(criterion).\
+                          group_by(QLBFile.dirname).subquery()
+
+    query = query.join((directories, directories.c.dirname == QLBFile.dirname)).filter(criterion)
+    return query, [(directories.c.group_col, descending),
+                   (QLBFile.dirname, False),
+                   (QLBWell.well_name, False),
+                   (QLBWell.id, False)]
+
+def group_by_directory(rows):
+    """
+    Group search rows, whose first member is a QLBWell, ordered by
+    directory.  Yields (dirname, rows) for each directory.
+    """
+    for dirname, group in itertools.groupby(rows, lambda row: row[0].file.dirname):
+        yield dirname, list(group)
+
+def distinct_values(column):
+    """
+    Return the sorted distinct non-null values of a column.
+    """
+    values = Session.query(column).filter(column != None).distinct()
+    return sorted([tup[0] for tup in windowed_results(values, [(column, False)])])
@@ -1161,6 +1161,118 @@ class QLBWellChannel(Base):
 
     well_channel_metrics = orm.relation('WellChannelMetric', backref='well_channel')
 
+class PlateRunStats(Base):
+    """
+    Event, well and runtime totals of a scanned plate, rolled up from
+    its wells.  Maintained by qtools.lib.statsrollup.
+    """
+    __tablename__ = "plate_run_stats"
+    __table_args__ = {"mysql_engine": 'InnoDB', 'mysql_charset': 'utf8'}
+
+    id = schema.Column(types.Integer, schema.Sequence('plate_run_stats_seq_id', optional=True), primary_key=True)
+    qlbplate_id = schema.Column(types.Integer, schema.ForeignKey('qlbplate.id'), nullable=False, unique=True)
+    box2_id = schema.Column(types.Integer, schema.ForeignKey('box2.id'), nullable=True)
+    operator_id = schema.Column(types.Integer, schema.ForeignKey('person.id'), nullable=True)
+    host_datetime = schema.Column(types.DateTime(), nullable=True, index=True)
+    day = schema.Column(types.Date(), nullable=True, index=True)
+    start_time = schema.Column(types.DateTime(), nullable=True)
+    end_time = schema.Column(types.DateTime(), nullable=True)
+    runtime_seconds = schema.Column(types.Integer, nullable=False, default=0)
+    wells = schema.Column(types.Integer, nullable=False, default=0)
+    data_wells = schema.Column(types.Integer, nullable=False, default=0)
+    events = schema.Column(BigInt, nullable=False, default=0)
+
+    qlbplate = orm.relation('QLBPlate', backref=orm.backref('run_stats', uselist=False, cascade='all, delete-orphan'))
+    box2 = orm.relation('Box2')
+
+class ReaderDayStats(Base):
+    """
+    Plate run totals per day, reader and operator, rolled up from
+    PlateRunStats.  Maintained by qtools.lib.statsrollup.
+    """
+    __tablename__ = "reader_day_stats"
+    __table_args__ = {"mysql_engine": 'InnoDB', 'mysql_charset': 'utf8'}
+
+    id = schema.Column(types.Integer, schema.Sequence('reader_day_stats_seq_id', optional=True), primary_key=True)
+    day = schema.Column(types.Date(), nullable=False, index=True)
+    box2_id = schema.Column(types.Integer, schema.ForeignKey('box2.id'), nullable=True)
+    operator_id = schema.Column(types.Integer, schema.ForeignKey('person.id'), nullable=True)
+    plates = schema.Column(types.Integer, nullable=False, default=0)
+    wells = schema.Column(types.Integer, nullable=False, default=0)
+    data_wells = schema.Column(types.Integer, nullable=False, default=0)
+    events = schema.Column(BigInt, nullable=False, default=0)
+    runtime_seconds = schema.Column(types.Integer, nullable=False, default=0)
+
+    box2 = orm.relation('Box2')
+    operator = orm.relation('Person')
+
+class CarryoverWell(Base):
+    """
+    An NTC well run on a reader after a high-concentration well, and
+    the positives found in it.  Computed by qtools.lib.carryover.
+    """
+    __tablename__ = "carryover_well"
+    __table_args__ = {"mysql_engine": 'InnoDB', 'mysql_charset': 'utf8'}
+
+    id = schema.Column(types.Integer, schema.Sequence('carryover_well_seq_id', optional=True), primary_key=True)
+    well_id = schema.Column(types.Integer, schema.ForeignKey('qlbwell.id'), nullable=False, unique=True)
+    source_well_id = schema.Column(types.Integer, schema.ForeignKey('qlbwell.id'), nullable=False)
+    box2_id = schema.Column(types.Integer, schema.ForeignKey('box2.id'), nullable=False, index=True)
+    plate_id = schema.Column(types.Integer, schema.ForeignKey('plate.id'), nullable=True)
+    channel_num = schema.Column(types.Integer, nullable=False, default=0)
+    host_datetime = schema.Column(types.DateTime(), nullable=True, index=True)
+    source_concentration = schema.Column(types.Float, nullable=True)
+    distance = schema.Column(types.Integer, nullable=False, default=1, doc="Number of wells since the source well")
+    positives = schema.Column(types.Integer, nullable=False, default=0)
+    events = schema.Column(types.Integer, nullable=False, default=0)
+
+    well = orm.relation('QLBWell', primaryjoin=well_id == QLBWell.id)
+    source_well = orm.relation('QLBWell', primaryjoin=source_well_id == QLBWell.id)
+    box2 = orm.relation('Box2')
+    plate = orm.relation('Plate')
+
+class CarryoverWatermark(Base):
+    """
+    How far the carryover analysis of a reader has read its run
+    history (see qtools.lib.carryover.update_carryover).
+    """
+    __tablename__ = "carryover_watermark"
+    __table_args__ = {"mysql_engine": 'InnoDB', 'mysql_charset': 'utf8'}
+
+    id = schema.Column(types.Integer, schema.Sequence('carryover_watermark_seq_id', optional=True), primary_key=True)
+    box2_id = schema.Column(types.Integer, schema.ForeignKey('box2.id'), nullable=False, index=True)
+    channel_num = schema.Column(types.Integer, nullable=False, default=0)
+    analyzed_through = schema.Column(types.DateTime(), nullable=False, doc="Run time of the last well analyzed")
+
+class ControlLimitBaseline(Base):
+    """
+    Running statistics of a QC chart metric over all the plates run
+    for a chart query, from which its control limits are drawn.
+    Maintained by qtools.lib.spc.
+    """
+    __tablename__ = "control_limit_baseline"
+    __table_args__ = {"mysql_engine": 'InnoDB', 'mysql_charset': 'utf8'}
+
+    id = schema.Column(types.Integer, schema.Sequence('control_limit_baseline_seq_id', optional=True), primary_key=True)
+    chart_key = schema.Column(types.String(40), nullable=False, unique=True, doc="Hash of the chart query parameters")
+    chart_type = schema.Column(types.String(20), nullable=False)
+    metric = schema.Column(types.String(100), nullable=False)
+    query_params = schema.Column(types.UnicodeText(), nullable=False, doc="JSON chart query parameters")
+    num_points = schema.Column(types.Integer, nullable=False, default=0)
+    mean = schema.Column(types.Float, nullable=False, default=0)
+    sum_squares = schema.Column(types.Float, nullable=False, default=0, doc="Sum of squared deviations from the mean")
+    last_run_time = schema.Column(types.DateTime(), nullable=True, doc="Run time of the last plate counted")
+    updated = schema.Column(types.DateTime(), nullable=True)
+
+    @property
+    def std(self):
+        """
+        The (population) standard deviation of the points counted.
+        """
+        if not self.num_points:
+            return 0.0
+        return (self.sum_squares/self.num_points)**0.5
+
 
 class AlgorithmWell(Base):
     __tablename__ = "algwell"
@@ -1354,6 +1466,60 @@ class DropletGeneratorRun(Base):
                          foreign_keys=[QLBWell.droplet_generator_id, QLBWell.dg_run_number],
                          viewonly=True)
 
+class DropletGeneratorLogFile(Base):
+    """
+    Ingestion state of a droplet generator log file.  Tracks how far
+    into the file has been parsed, so that only newly written events
+    are read on the next pass.
+    """
+    __tablename__ = "dg_log_file"
+    __table_args__ = {"mysql_engine": 'InnoDB', 'mysql_charset': 'utf8'}
+
+    id = schema.Column(types.Integer, schema.Sequence('dg_log_file_seq_id', optional=True), primary_key=True)
+    dirname = schema.Column(types.String(255), nullable=False)
+    basename = schema.Column(types.String(255), nullable=False)
+    size = schema.Column(types.Integer, nullable=False, default=0)
+    mtime = schema.Column(types.DateTime(), nullable=True)
+    parsed_offset = schema.Column(types.Integer, nullable=False, default=0)
+    header_parsed = schema.Column(types.Boolean, nullable=False, default=False)
+    in_event_section = schema.Column(types.Boolean, nullable=False, default=False)
+    in_event_lines = schema.Column(types.Boolean, nullable=False, default=False)
+    complete = schema.Column(types.Boolean, nullable=False, default=False)
+    dg_run_id = schema.Column(types.Integer, schema.ForeignKey('dg_run.id'), nullable=True)
+
+    dg_run = orm.relation('DropletGeneratorRun', backref=orm.backref('log_file', uselist=False))
+    events = orm.relation('DropletGeneratorEvent', backref='log_file', cascade='all, delete-orphan',
+                          order_by='DropletGeneratorEvent.id')
+
+    @property
+    def path(self):
+        return os.path.join(self.dirname, self.basename)
+
+    @property
+    def event_trace(self):
+        """
+        The events in the same form as qtools.lib.dropletgen.get_dg_event_trace.
+        """
+        return [event.as_tuple() for event in self.events]
+
+class DropletGeneratorEvent(Base):
+    """
+    A single line in the time series section of a droplet generator log.
+    """
+    __tablename__ = "dg_event"
+    __table_args__ = {"mysql_engine": 'InnoDB', 'mysql_charset': 'utf8'}
+
+    id = schema.Column(types.Integer, schema.Sequence('dg_event_seq_id', optional=True), primary_key=True)
+    dg_log_file_id = schema.Column(types.Integer, schema.ForeignKey('dg_log_file.id'), nullable=False, index=True)
+    sequence = schema.Column(types.Integer, nullable=False)
+    label = schema.Column(types.String(100), nullable=False)
+    value1 = schema.Column(types.Float, nullable=True)
+    value2 = schema.Column(types.Float, nullable=True)
+    value3 = schema.Column(types.Float, nullable=True)
+
+    def as_tuple(self):
+        return (self.sequence, self.label, self.value1, self.value2, self.value3)
+
 class ThermalCycler(Base):
     __tablename__ = "thermal_cycler"
     __table_args__ = {"mysql_engine": 'InnoDB', 'mysql_charset': 'utf8'}
@@ -1,13 +1,13 @@
 from qtools.lib.bio import reverse_complement, gc_content, maximal_binding_seq
+from qtools.lib.intervals import IntervalIndex
 from qtools.model import now, AssayCacheMixin
 from qtools.model.meta import Base
 
-from sqlalchemy import orm, Integer, Unicode, String, Text, SmallInteger, UnicodeText, DateTime, Float, Boolean
+from sqlalchemy import orm, event, Integer, Unicode, String, Text, SmallInteger, UnicodeText, DateTime, Float, Boolean
 from sqlalchemy.schema import Table, Column, Sequence as SchemaSequence, ForeignKey
 from sqlalchemy.dialects.mysql import LONGBLOB
 from sqlalchemy.dialects.mysql.base import MSEnum, MSSet
 
-from itertools import product
 
 import re
 
@@ -157,31 +157,47 @@ class SequenceGroup(Base):
     def status_display(self):
         return dict(self.__class__.status_display_options()).get(self.status, '')
 
+    @property
+    def oligo_interactions(self):
+        """
+        Returns the OligoInteractions (binding of every oligo against
+        every other) of the components of this sequence group; cached
+        for saved groups (see qtools.model.sequence.interaction)
+        """
+        from qtools.model.sequence.interaction import compute_oligo_interactions, sequence_group_interactions
+        if self.id is not None:
+            return sequence_group_interactions([self])[self.id]
+
+        oligos = [(id(c), c.role, c.sequence.sequence if c.sequence else None)
+                      for c in (self.forward_primers or [])+(self.reverse_primers or [])+(self.probes or [])]
+        return compute_oligo_interactions([oligos])[0]
+
+    def __oligo_components(self):
+        return dict([(c.id if self.id is not None else id(c), c)
+                         for c in (self.forward_primers or [])+(self.reverse_primers or [])+(self.probes or [])])
+
     @property
     def oligo_overlaps(self):
         """
-        Warning: may cause additional DB queries.
+        Warning: may cause additional DB queries (for the components).
 
         Returns overlap characteristics of all primer-probe
         combinations in the sequence.
 
         An overlap takes the form ((oligo1, oligo2): (maximal overlap, offsets))
         """
-        overlaps = []
-        combines = [(self.forward_primers, self.reverse_primers),
-                    (self.forward_primers, self.probes),
-                    (self.reverse_primers, self.probes)]
-        # TODO: track probe-probe interaction?
-        for oligos1, oligos2 in combines:
-            for o1, o2 in product(oligos1 or [], oligos2 or []):
-                overlap = self.__class__.maximal_overlap_seq(o1, o2)
-                if overlap:
-                    overlaps.append(((o1, o2), overlap))
-        return overlaps
+        components = self.__oligo_components()
+        return [((components[key1], components[key2]), overlap)
+                    for (key1, key2), overlap in self.oligo_interactions.overlaps
+                        if key1 in components and key2 in components]
 
     @property
     def max_oligo_overlap(self):
-        return sorted(self.oligo_overlaps, key=lambda tup: tup[1][0])[-1]
+        """
+        Returns the longest of the oligo_overlaps, or None.
+        """
+        overlaps = sorted(self.oligo_overlaps, key=lambda tup: tup[1][0])
+        return overlaps[-1] if overlaps else None
 
     @classmethod
     def maximal_overlap_seq(cls, component1, component2):
@@ -334,6 +350,8 @@ class Transcript(Base):
     # for locality within chromosome/compatibility with amplicon_sequence_cache
     start_pos = Column(Integer, nullable=True)
     end_pos = Column(Integer, nullable=True)
+    # UCSC bin of the start_pos/end_pos range (see qtools.lib.intervals)
+    bin = Column(Integer, nullable=True, index=True)
     # I don't have a good handle on how many exons this thing could span
     exon_regions = Column(Text, nullable=True)
 
@@ -366,6 +384,8 @@ class AmpliconSequenceCache(Base):
     chromosome = Column(String(32), nullable=False)
     start_pos = Column(Integer, nullable=False)
     end_pos = Column(Integer, nullable=False)
+    # UCSC bin of the amplicon (see qtools.lib.intervals)
+    bin = Column(Integer, nullable=True, index=True)
     seq_padding_pos5 = Column(Integer, nullable=False, default=0)
     seq_padding_pos3 = Column(Integer, nullable=False, default=0)
     positive_sequence = Column(Text)
@@ -432,8 +452,24 @@ class AmpliconSequenceCache(Base):
         if padding_pos3 > self.seq_padding_pos3:
             padding_pos3 = self.seq_padding_pos3
         
-        return [snp for snp in self.snps if (snp.chromStart >= self.start_pos-padding_pos5 and snp.chromStart <= self.end_pos+padding_pos3) or \
-                                            (snp.chromEnd >= self.start_pos-padding_pos5 and snp.chromEnd <= self.end_pos+padding_pos3)]
+        return self.snp_index.overlapping(self.chromosome, self.start_pos-padding_pos5, self.end_pos+padding_pos3)
+    
+    @property
+    def snp_index(self):
+        """
+        An IntervalIndex of the cached SNPs, built on first use.  It is
+        dropped when the SNPs (or their coordinates) change, or the cache
+        is expired or refreshed; see the listeners below.
+        """
+        index = self.__dict__.get('_snp_index')
+        if index is None:
+            index = IntervalIndex([(self.chromosome, snp.chromStart, snp.chromEnd, snp) for snp in self.snps])
+            self.__dict__['_snp_index'] = index
+        return index
+
+    def invalidate_snp_index(self, *args):
+        # also usable directly as an event listener
+        self.__dict__.pop('_snp_index', None)
 
 class SNPDBCache(Base):
     __tablename__ = "snp_db_cache"
@@ -477,3 +513,15 @@ class SNPDBCache(Base):
     bitfields = Column(MSSet("'clinically-assoc'", "'maf-5-some-pop'", "'maf-5-all-pops'", "'has-omim-omia'", "'microattr-tpa'",
                              "'submitted-by-lsdb'", "'genotype-conflict'", "'rs-cluster-nonoverlapping-alleles'", "'observed-mismatch'"), nullable=True)
 
+
+def _invalidate_sequence_snp_index(snp, *args):
+    if snp.sequence is not None:
+        snp.sequence.invalidate_snp_index()
+
+for event_name in ('append', 'remove'):
+    event.listen(AmpliconSequenceCache.snps, event_name, AmpliconSequenceCache.invalidate_snp_index)
+event.listen(AmpliconSequenceCache.chromosome, 'set', AmpliconSequenceCache.invalidate_snp_index)
+for event_name in ('expire', 'refresh'):
+    event.listen(AmpliconSequenceCache, event_name, AmpliconSequenceCache.invalidate_snp_index)
+for attr in (SNPDBCache.chromStart, SNPDBCache.chromEnd):
+    event.listen(attr, 'set', _invalidate_sequence_snp_index)
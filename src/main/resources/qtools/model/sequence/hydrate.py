@@ -0,0 +1,342 @@
+"""
+qtools.model.sequence.hydrate
+
+Bulk filling of the amplicon sequence cache.
+
+Creating the amplicons of a sequence group used to fetch the padded
+sequence of each amplicon from the sequence source on its own, and the
+SNPs of each cached sequence in a query of their own.  Here, the
+amplicons of a batch of sequence groups are located first (primer
+matches, or the arithmetic around a location); the padded windows
+around all of them are then merged per chromosome, the merged ranges
+fetched in one call to the source's sequences(), and the padded
+sequences cut out of the fetched ranges.  (The local genome source
+matches all the primer pairs in one pass and reads the ranges from
+memory; UCSC still needs an isPCR request per primer pair, but fetches
+the ranges through one custom track.)
+SNPs are fetched in one query per chromosome over the merged windows of
+all the cached sequences, and handed out to the cached sequences they
+fall in.
+"""
+import bisect, logging
+
+from qtools.constants.pcr import MAX_CACHE_PADDING
+from qtools.lib.bio import SimpleGenomeSequence, PCRSequence
+from qtools.lib.intervals import IntervalIndex, merge_ranges
+from qtools.model import Session
+from qtools.model.sequence import SequenceGroup
+from qtools.model.sequence.pcr import create_amplicons_from_pcr_sequences
+from qtools.model.sequence.util import snp_objects_from_extdb
+
+__all__ = ['AmpliconRequest',
+           'AmpliconCacheHydrator',
+           'hydrate_snps']
+
+log = logging.getLogger(__name__)
+
+class AmpliconRequest(object):
+    """
+    The amplicons to create for a sequence group: those of a primer pair,
+    or the amplicon around a location.  After the hydrator has run,
+    amplicons holds the created Amplicon objects, or error a message
+    if they could not be created.
+    """
+    def __init__(self, sequence_group, forward_primer=None, reverse_primer=None, probes=None,
+                 chromosome=None, startpos=None, endpos=None, amplicon_width=None):
+        self.sequence_group = sequence_group
+        self.forward_primer = forward_primer
+        self.reverse_primer = reverse_primer
+        self.probes = probes
+        self.chromosome = chromosome
+        self.startpos = startpos
+        self.endpos = endpos
+        self.amplicon_width = amplicon_width
+        self.amplicons = []
+        self.error = None
+
+    @property
+    def is_primer_pair(self):
+        return self.forward_primer is not None and self.reverse_primer is not None
+
+
+class FetchedWindows(object):
+    """
+    Merged genomic ranges fetched from a sequence source, that padded
+    sequences are cut out of.
+    """
+    def __init__(self, sequence_source):
+        self.sequence_source = sequence_source
+        self._windows = {}
+
+    def fetch(self, ranges):
+        """
+        Merge (chromosome, start, end) ranges, and fetch each merged range
+        in one call to the sequence source.
+        """
+        by_chromosome = {}
+        for chromosome, start, end in ranges:
+            by_chromosome.setdefault(chromosome, []).append((max(1, start), end))
+
+        merged = []
+        for chromosome, chromosome_ranges in sorted(by_chromosome.items()):
+            merged.extend([(chromosome, start, end) for start, end in merge_ranges(chromosome_ranges)])
+
+        sequences = self.sequence_source.sequences(merged)
+        for (chromosome, start, end), sequence in zip(merged, sequences):
+            starts, windows = self._windows.setdefault(chromosome, ([], []))
+            idx = bisect.bisect_right(starts, start)
+            starts.insert(idx, start)
+            windows.insert(idx, sequence)
+        return len(merged)
+
+    def window(self, chromosome, start, end):
+        """
+        Return the fetched sequence that holds the range from start to end,
+        or None if it was not fetched.  The sequence may be clipped to the
+        end of the chromosome.
+        """
+        if chromosome not in self._windows:
+            return None
+        start = max(1, start)
+        starts, windows = self._windows[chromosome]
+        idx = bisect.bisect_right(starts, start)-1
+        if idx < 0 or windows[idx] is None or windows[idx].end < start:
+            return None
+        return windows[idx]
+
+    def padded_sequence(self, chromosome, amplicon, prefix_length, suffix_length):
+        """
+        Return the PCRSequence of an amplicon (a genome sequence) on the
+        chromosome it was fetched under, with up to prefix_length and
+        suffix_length bases of padding from the fetched windows; None if
+        the amplicon was not fetched.
+        """
+        ch = amplicon.chromosome
+        region = self.window(chromosome, amplicon.start-prefix_length, amplicon.end+suffix_length)
+        if region is None or region.start > amplicon.start or region.end < amplicon.end:
+            return None
+
+        prefix_start = max(region.start, amplicon.start-prefix_length)
+        suffix_end = min(region.end, amplicon.end+suffix_length)
+        if prefix_start < amplicon.start:
+            prefix = SimpleGenomeSequence(ch, prefix_start, amplicon.start-1, region.strand, region[prefix_start:amplicon.start-1])
+        else:
+            prefix = None
+
+        if suffix_end > amplicon.end:
+            suffix = SimpleGenomeSequence(ch, amplicon.end+1, suffix_end, region.strand, region[amplicon.end+1:suffix_end])
+        else:
+            suffix = None
+
+        return PCRSequence(amplicon, prefix, suffix)
+
+
+class AmpliconCacheHydrator(object):
+    """
+    Creates the amplicons and cached sequences of a batch of
+    AmpliconRequests, fetching their sequences in bulk.
+    """
+    def __init__(self, sequence_source, padding=MAX_CACHE_PADDING):
+        """
+        :param sequence_source: A SequenceSource.
+        :param padding: The padding to cache on either side of each amplicon.
+        """
+        self.sequence_source = sequence_source
+        self.padding = padding
+        self.requests = []
+
+    def add_primer_pair(self, sequence_group, forward_primer, reverse_primer, probes=None):
+        """
+        Add a request for the amplicons of a primer pair (Sequence objects).
+        """
+        request = AmpliconRequest(sequence_group, forward_primer=forward_primer,
+                                  reverse_primer=reverse_primer, probes=probes)
+        self.requests.append(request)
+        return request
+
+    def add_location(self, sequence_group, chromosome, startpos, endpos, amplicon_width):
+        """
+        Add a request for the amplicon around a region (startpos and endpos
+        inclusive; see SequenceSource.sequence_around_region)
+        """
+        request = AmpliconRequest(sequence_group, chromosome=chromosome, startpos=startpos,
+                                  endpos=endpos, amplicon_width=amplicon_width)
+        self.requests.append(request)
+        return request
+
+    def add_sequence_group(self, sequence_group):
+        """
+        Add the requests for the amplicons of a designed or location
+        sequence group.  (The locations of SNP sequence groups are looked
+        up by rsid first; add those with add_location.)
+        """
+        if sequence_group.kit_type == SequenceGroup.TYPE_DESIGNED:
+            probe_seqs = [p.sequence for p in sequence_group.probes]
+            return [self.add_primer_pair(sequence_group, fp.sequence, rp.sequence, probe_seqs)
+                        for fp in sequence_group.forward_primers for rp in sequence_group.reverse_primers]
+        elif sequence_group.kit_type == SequenceGroup.TYPE_LOCATION:
+            return [self.add_location(sequence_group, sequence_group.location_chromosome,
+                                      sequence_group.location_base, sequence_group.location_base,
+                                      sequence_group.amplicon_length)]
+        else:
+            return []
+
+    def _locate(self):
+        """
+        Return a list of (request, amplicon genome sequences) for the
+        requests whose amplicons could be located.  If the primer pairs
+        cannot be matched together, they are matched one at a time, so
+        that only the requests whose pairs fail get an error.
+        """
+        located = []
+        pair_requests = [request for request in self.requests if request.is_primer_pair]
+        if pair_requests:
+            pairs = [(request.forward_primer.sequence, request.reverse_primer.sequence) for request in pair_requests]
+            try:
+                matches = self.sequence_source.sequences_for_primer_pairs(pairs)
+            except Exception:
+                log.exception("Could not match the primer pairs together; matching them one at a time")
+                matches = []
+                for request, (primer_fwd, primer_rev) in zip(pair_requests, pairs):
+                    try:
+                        matches.append(self.sequence_source.sequences_for_primers(primer_fwd, primer_rev))
+                    except Exception, e:
+                        log.exception("Could not match primer pair %s, %s" % (primer_fwd, primer_rev))
+                        request.error = 'Could not match the primers: %s' % e
+                        matches.append(False)
+            for request, pcr_sequences in zip(pair_requests, matches):
+                if pcr_sequences is False:
+                    continue
+                if pcr_sequences is None:
+                    request.error = 'Could not get response from server.'
+                else:
+                    located.append((request, [pseq.amplicon for pseq in pcr_sequences]))
+
+        for request in self.requests:
+            if request.is_primer_pair:
+                continue
+            if request.endpos-request.startpos+1 > request.amplicon_width:
+                request.error = 'Could not retrieve the sequence for the specified amplicon location.'
+                continue
+            # the range of every amplicon of the width that holds the region
+            located.append((request, [(request.chromosome,
+                                       max(1, request.endpos-(request.amplicon_width-1)),
+                                       request.startpos+request.amplicon_width-1)]))
+        return located
+
+    def hydrate(self):
+        """
+        Create the Amplicon and AmpliconSequenceCache objects of all the
+        requests, and add them to the session.  Does not commit.
+
+        :return: The created amplicons.
+        """
+        located = self._locate()
+        windows = FetchedWindows(self.sequence_source)
+        ranges = []
+        for request, amplicons in located:
+            for amplicon in amplicons:
+                if isinstance(amplicon, tuple):
+                    chromosome, start, end = amplicon
+                else:
+                    chromosome, start, end = amplicon.chromosome, amplicon.start, amplicon.end
+                ranges.append((chromosome, start-self.padding, end+self.padding))
+        try:
+            windows.fetch(ranges)
+        except Exception:
+            # every request is left without sequences, and gets an error below
+            log.exception("Could not fetch the amplicon windows")
+
+        db_amplicons = []
+        for request, amplicons in located:
+            try:
+                request.amplicons = self._create_amplicons(request, amplicons, windows)
+            except Exception, e:
+                log.exception("Could not create the amplicons of sequence group %s" % request.sequence_group.id)
+                request.error = 'Could not create the amplicons: %s' % e
+                continue
+            db_amplicons.extend(request.amplicons)
+
+        Session.add_all(db_amplicons)
+        return db_amplicons
+
+    def _create_amplicons(self, request, amplicons, windows):
+        pcr_sequences = []
+        for amplicon in amplicons:
+            if isinstance(amplicon, tuple):
+                chromosome = amplicon[0]
+                amplicon = self._location_amplicon(windows, *amplicon)
+            else:
+                chromosome = amplicon.chromosome
+            if amplicon is not None:
+                pcr_sequences.append(windows.padded_sequence(chromosome, amplicon, self.padding, self.padding))
+            else:
+                pcr_sequences.append(None)
+
+        if None in pcr_sequences:
+            if request.is_primer_pair:
+                request.error = 'Could not get response from server.'
+            else:
+                request.error = 'Could not retrieve the sequence for the specified amplicon location.'
+            return []
+
+        return create_amplicons_from_pcr_sequences(request.sequence_group,
+                                                   forward_primer=request.forward_primer,
+                                                   reverse_primer=request.reverse_primer,
+                                                   probes=request.probes,
+                                                   pcr_sequences=pcr_sequences)
+
+    def _location_amplicon(self, windows, chromosome, start, end):
+        region = windows.window(chromosome, start, end)
+        if region is None:
+            return None
+        # clipped to the end of the chromosome, as the source would
+        end = min(end, region.end)
+        return SimpleGenomeSequence(region.chromosome, start, end, '+', region[start:end])
+
+
+def hydrate_snps(cached_sequences, snp_source, snp_table):
+    """
+    Fetch the SNPs in the padded range of each of the cached sequences,
+    and add them to the cached sequences.  Does not commit.
+
+    The SNPs of each chromosome are fetched in one query over the merged
+    ranges (snps_in_chrom_ranges), if the source has it.  A SNP is in a
+    range if it starts or ends in it, as with snps_in_range.
+
+    :return: The created SNPDBCache objects.
+    """
+    by_chromosome = {}
+    index = IntervalIndex()
+    for cached_seq in cached_sequences:
+        start = cached_seq.start_pos-(cached_seq.seq_padding_pos5 or 0)
+        end = cached_seq.end_pos+(cached_seq.seq_padding_pos3 or 0)
+        by_chromosome.setdefault(cached_seq.chromosome, []).append((start, end))
+        index.add(cached_seq.chromosome, start, end, (start, end, cached_seq))
+
+    db_snps = []
+    for chromosome, ranges in sorted(by_chromosome.items()):
+        ranges = merge_ranges(ranges)
+        if hasattr(snp_source, 'snps_in_chrom_ranges'):
+            snps = snp_source.snps_in_chrom_ranges(chromosome, ranges)
+        else:
+            snps = []
+            seen = set()
+            for start, end in ranges:
+                for snp in snp_source.snps_in_range(chromosome, start, end):
+                    # a SNP may start in one range and end in the next
+                    key = (snp['name'], snp['chromStart'], snp['chromEnd'])
+                    if key not in seen:
+                        seen.add(key)
+                        snps.append(snp)
+
+        for snp in snps or []:
+            for start, end, cached_seq in index.overlapping(chromosome, snp['chromStart'], snp['chromEnd']):
+                if not (start <= snp['chromStart'] <= end or start <= snp['chromEnd'] <= end):
+                    continue
+                db_snp = snp_objects_from_extdb([snp], snp_table)[0]
+                if not cached_seq.snps:
+                    cached_seq.snps = []
+                cached_seq.snps.append(db_snp)
+                db_snps.append(db_snp)
+    return db_snps
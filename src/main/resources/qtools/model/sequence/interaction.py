@@ -0,0 +1,184 @@
+"""
+qtools.model.sequence.interaction
+
+Oligo interaction (primer-dimer) matrices of sequence groups.
+
+SequenceGroup.oligo_overlaps used to load the sequence of each
+component on its own, and score each primer/probe pair with
+maximal_binding_seq, every time it was asked for.  Here, the component
+sequences of many sequence groups are read in one query, every pair of
+oligos within each group is scored in one vectorized pass
+(qtools.lib.dimer.paired_binding), and the matrices are cached per
+group, so that assay lists can show the dimer risk of every assay.
+
+The cached matrices are kept with the oligos they were scored from.  The
+component sequences are read again (in one query) on every lookup, and a
+group is scored again only if its oligos differ, so changes committed by
+any process show up on the next lookup.
+"""
+import threading
+
+import numpy as np
+
+from qtools.lib.dimer import paired_binding
+from qtools.model import Session
+from qtools.model.sequence import Sequence, SequenceGroupComponent
+
+__all__ = ['OligoInteractions',
+           'compute_oligo_interactions',
+           'sequence_group_interactions',
+           'oligo_interaction_cache']
+
+# the role combinations that are reported as overlaps, as in
+# SequenceGroup.oligo_overlaps
+# TODO: track probe-probe interaction?
+OVERLAP_ROLES = ((SequenceGroupComponent.FORWARD_PRIMER, SequenceGroupComponent.REVERSE_PRIMER),
+                 (SequenceGroupComponent.FORWARD_PRIMER, SequenceGroupComponent.PROBE),
+                 (SequenceGroupComponent.REVERSE_PRIMER, SequenceGroupComponent.PROBE))
+
+class OligoInteractions(object):
+    """
+    The binding of every oligo of a sequence group against every oligo
+    (itself included).  Oligos are identified by key: the component id,
+    or any other hashable for oligos that are not saved.
+    """
+    def __init__(self, oligos, longest, offset1, offset2):
+        """
+        :param oligos: (key, role, sequence) tuples.
+        :param longest: (len(oligos), len(oligos)) array of the longest binding runs.
+        :param offset1: The offsets of the runs in the first oligo.
+        :param offset2: The offsets of the runs in the reverse complement of the second oligo.
+        """
+        self.oligos = oligos
+        self.index = dict([(key, idx) for idx, (key, role, sequence) in enumerate(oligos)])
+        self.longest = longest
+        self.offset1 = offset1
+        self.offset2 = offset2
+
+    def overlap(self, oligo1, oligo2):
+        """
+        Return the maximal_binding_seq-style overlap of two oligos (keys,
+        or components), or None if either sequence is unknown or they
+        do not bind.
+        """
+        idx1 = self.index.get(getattr(oligo1, 'id', oligo1))
+        idx2 = self.index.get(getattr(oligo2, 'id', oligo2))
+        if idx1 is None or idx2 is None or self.longest[idx1,idx2] == 0:
+            return None
+        return (int(self.longest[idx1,idx2]), (int(self.offset1[idx1,idx2]), int(self.offset2[idx1,idx2])))
+
+    @property
+    def overlaps(self):
+        """
+        Return the overlaps of all primer-primer and primer-probe
+        combinations, as ((key1, key2), overlap) tuples.
+        """
+        overlaps = []
+        for role1, role2 in OVERLAP_ROLES:
+            for key1, r1, seq1 in self.oligos:
+                if r1 != role1:
+                    continue
+                for key2, r2, seq2 in self.oligos:
+                    if r2 != role2:
+                        continue
+                    overlap = self.overlap(key1, key2)
+                    if overlap:
+                        overlaps.append(((key1, key2), overlap))
+        return overlaps
+
+    @property
+    def max_overlap(self):
+        """
+        Return the ((key1, key2), overlap) of the longest overlap, or None.
+        """
+        overlaps = sorted(self.overlaps, key=lambda tup: tup[1][0])
+        return overlaps[-1] if overlaps else None
+
+
+def compute_oligo_interactions(oligo_lists):
+    """
+    Compute the OligoInteractions of many groups of oligos, scoring the
+    pairs of all the groups together.
+
+    :param oligo_lists: A list of (key, role, sequence) lists, one per group.
+    :return: A list of OligoInteractions, in the same order.
+    """
+    pairs1, pairs2, cells = [], [], []
+    for group_idx, oligos in enumerate(oligo_lists):
+        for idx1, (key1, role1, seq1) in enumerate(oligos):
+            for idx2, (key2, role2, seq2) in enumerate(oligos):
+                if seq1 and seq2:
+                    pairs1.append(seq1)
+                    pairs2.append(seq2)
+                    cells.append((group_idx, idx1, idx2))
+
+    longest, offset1, offset2 = paired_binding(pairs1, pairs2)
+
+    matrices = []
+    for oligos in oligo_lists:
+        shape = (len(oligos), len(oligos))
+        matrices.append((np.zeros(shape, dtype=np.int32), -np.ones(shape, dtype=np.int32), -np.ones(shape, dtype=np.int32)))
+    for (group_idx, idx1, idx2), l, o1, o2 in zip(cells, longest.tolist(), offset1.tolist(), offset2.tolist()):
+        group_longest, group_offset1, group_offset2 = matrices[group_idx]
+        group_longest[idx1,idx2] = l
+        group_offset1[idx1,idx2] = o1
+        group_offset2[idx1,idx2] = o2
+
+    return [OligoInteractions(oligos, *matrix) for oligos, matrix in zip(oligo_lists, matrices)]
+
+
+class OligoInteractionCache(object):
+    """
+    Caches the OligoInteractions of saved sequence groups by id.
+    """
+    def __init__(self):
+        self.interactions = dict()
+        self.lock = threading.Lock()
+
+    def get_many(self, sequence_group_ids):
+        """
+        Return a dict of the OligoInteractions of each sequence group id.
+        The component sequences of the groups are read in one query; the
+        groups whose oligos are not cached as read are scored again.
+        """
+        sequence_group_ids = sorted(set(sequence_group_ids))
+        if not sequence_group_ids:
+            return dict()
+
+        oligos = dict([(id, []) for id in sequence_group_ids])
+        rows = Session.query(SequenceGroupComponent.sequence_group_id,
+                             SequenceGroupComponent.id,
+                             SequenceGroupComponent.role,
+                             Sequence.sequence)\
+                      .outerjoin((Sequence, Sequence.id == SequenceGroupComponent.sequence_id))\
+                      .filter(SequenceGroupComponent.sequence_group_id.in_(sequence_group_ids))\
+                      .order_by(SequenceGroupComponent.sequence_group_id,
+                                SequenceGroupComponent.role,
+                                SequenceGroupComponent.id).all()
+        for sequence_group_id, component_id, role, sequence in rows:
+            oligos[sequence_group_id].append((component_id, role, sequence))
+
+        found = dict()
+        with self.lock:
+            for id in sequence_group_ids:
+                interactions = self.interactions.get(id)
+                if interactions is not None and interactions.oligos == oligos[id]:
+                    found[id] = interactions
+
+        missing = [id for id in sequence_group_ids if id not in found]
+        if missing:
+            computed = compute_oligo_interactions([oligos[id] for id in missing])
+            with self.lock:
+                for id, interactions in zip(missing, computed):
+                    self.interactions[id] = interactions
+                    found[id] = interactions
+        return found
+
+oligo_interaction_cache = OligoInteractionCache()
+
+def sequence_group_interactions(sequence_groups):
+    """
+    Return a dict of the (cached) OligoInteractions of each of the
+    sequence groups, by sequence group id.
+    """
+    return oligo_interaction_cache.get_many([sg.id for sg in sequence_groups if sg.id is not None])
@@ -1,5 +1,6 @@
 from qtools.constants.pcr import MAX_CACHE_PADDING
 from qtools.lib.bio import SimpleGenomeSequence, PCRSequence
+from qtools.lib.intervals import range_bin
 from qtools.model.sequence import Amplicon, AmpliconSequenceCache, Transcript
 from qtools.model.ucsc import PCRGenePrimerMatchSequence
 
@@ -55,6 +56,7 @@ def create_amplicons_from_pcr_sequences(sequence_group,
             
             cached_seq = AmpliconSequenceCache(start_pos  = amplicon.start,
                                                end_pos    = amplicon.end,
+                                               bin        = range_bin(amplicon.start, amplicon.end),
                                                chromosome = amplicon.chromosome,
                                                seq_padding_pos5 = len(seq.left_padding) if seq.left_padding else 0,
                                                seq_padding_pos3 = len(seq.right_padding) if seq.right_padding else 0,
@@ -184,6 +186,7 @@ def create_db_transcripts_from_pcr_transcripts(sequence_group,
                                     chromosome=seq.chromosome,
                                     start_pos=seq.genomic_start,
                                     end_pos=seq.genomic_end,
+                                    bin=range_bin(seq.genomic_start, seq.genomic_end) if seq.genomic_start else None,
                                     exon_regions=seq.exon_span_string,
                                     positive_sequence=seq.positive_strand_sequence,
                                     negative_sequence=seq.negative_strand_sequence,
@@ -106,6 +106,7 @@ def delete_plate_recursive(plate_id):
     -- The plate and its wells (recursively).
     -- Any plate metrics associated with the plate.
     -- Any connection to analysis groups or reprocess configs.
+    -- The plate's run statistics rollup.
     -- 
 
     Keep in mind that if the QLP backing this file is present
@@ -156,6 +157,10 @@ def delete_plate_recursive(plate_id):
         Session.delete(pm)
     plate.metrics = []
     
+    # stop counting the plate in the reader stats
+    from qtools.lib.statsrollup import remove_plate_run_stats
+    remove_plate_run_stats(plate.qlbplate)
+
     from qtools.model.batchplate import ManufacturingPlate
     related_batches = Session.query(ManufacturingPlate).filter_by(plate_id=plate.id).all()
     for rb in related_batches:
@@ -0,0 +1,40 @@
+from qtools.lib.nstats.drift import *
+import numpy as np
+import unittest
+
+class TestDrift(unittest.TestCase):
+    def setUp(self):
+        rs = np.random.RandomState(7)
+        self.steady = rs.normal(8000, 300, 10000)
+        self.drifting = np.concatenate([rs.normal(8000, 300, 5000), rs.normal(9000, 300, 5000)])
+        self.bimodal = np.concatenate([rs.normal(6000, 200, 10000), rs.normal(10000, 200, 10000)])
+        rs.shuffle(self.bimodal)
+
+    def test_batch_histograms(self):
+        amp_arrays = [self.steady, self.drifting, np.zeros(0)]
+        counts, edges, means = batch_histograms(amp_arrays, num_bins=129)
+        assert counts.shape == (3, 128)
+        assert edges.shape == (3, 129)
+        for idx in range(2):
+            vals, pos = np.histogram(amp_arrays[idx], bins=edges[idx])
+            assert (vals == counts[idx]).all()
+            assert np.allclose(means[idx], np.mean(amp_arrays[idx]))
+        assert counts[2].sum() == 0
+        # bins are the same width, centered on the mean
+        assert np.allclose(np.diff(edges[0]), 2*32767.0/129)
+        assert np.allclose(edges[0,0]+32767, means[0])
+
+    def test_local_maxima_counts(self):
+        hists = np.array([[0,0,1,4,5,7,3,2,0],
+                          [0,0,2,5,3,6,2,1,0]])
+        assert local_maxima_counts(hists).tolist() == [1, 2]
+        assert local_maxima_counts(hists, [0, 6]).tolist() == [1, 1]
+
+    def test_split_drift(self):
+        records = split_drift([self.steady, self.drifting, self.bimodal])
+        assert records['events'].tolist() == [10000, 10000, 20000]
+        assert abs(records['drift'][0]) < 0.01
+        assert np.allclose(records['drift'][1], 1000.0/8500, atol=0.01)
+        assert np.allclose(records['sigma'][0], 300, rtol=0.1)
+        assert records['first_peaks'].tolist() == [1, 1, 2]
+        assert drift_flags(records).tolist() == [False, True, True]
@@ -0,0 +1,39 @@
+from qtools.lib.nstats.fft import downsampled_blocks, welch_amplitude_spectrum
+import numpy as np
+import unittest
+
+class TestSpectrum(unittest.TestCase):
+
+    def test_downsampled_blocks(self):
+        stream = np.arange(100)
+        blocks = [stream[0:7], stream[7:30], stream[30:31], stream[31:100]]
+        for downsample in (1, 3, 23):
+            joined = np.concatenate(list(downsampled_blocks(blocks, downsample)))
+            assert np.array_equal(joined, stream[::downsample])
+
+    def test_welch_amplitude_spectrum(self):
+        rate = 1000.0
+        t = np.arange(20000)/rate
+        signal = 2.0 + 0.5*np.sin(2*np.pi*60*t)
+        blocks = [signal[i:i+777] for i in range(0, len(signal), 777)]
+        freqs, amps, max_sample = welch_amplitude_spectrum(blocks, rate, 4000)
+        assert len(freqs) == len(amps) == 2001
+        assert abs(freqs[np.argmax(amps[10:])+10] - 60) < 0.5
+        # sinusoid of amplitude A shows up as A/2
+        assert abs(amps[10:].max() - 0.25) < 0.01
+        assert abs(max_sample - 2.5) < 0.01
+
+        # same spectrum regardless of how the stream is split
+        freqs2, amps2, max2 = welch_amplitude_spectrum([signal], rate, 4000)
+        assert np.allclose(amps, amps2)
+
+    def test_welch_short_stream(self):
+        rate = 100.0
+        t = np.arange(500)/rate
+        signal = np.sin(2*np.pi*10*t)
+        freqs, amps, max_sample = welch_amplitude_spectrum([signal], rate, 4096)
+        assert len(freqs) == 251
+        assert abs(freqs[np.argmax(amps)] - 10) < 0.5
+
+        freqs, amps, max_sample = welch_amplitude_spectrum([], rate, 4096)
+        assert len(freqs) == 0
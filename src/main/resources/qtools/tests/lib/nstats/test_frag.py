@@ -0,0 +1,29 @@
+from qtools.lib.nstats.frag import *
+from qtools.bench.frag import step_search_prob_of_frag, synthetic_plate
+import unittest
+
+class TestFrag(unittest.TestCase):
+
+    def test_rank_deficient(self):
+        assert prob_of_frag(0, 0, 100, 100, 200) is None
+        assert prob_of_frag(0, 100, 0, 100, 200) is None
+        assert prob_of_frag_batch([(0, 10, 0, 10), (10, 10, 10, 10)])[0] is None
+
+    def test_matches_step_search(self):
+        counts = synthetic_plate(48, seed=31) + [(1, 2, 3, 4), (5000, 5, 5, 5000), (3, 9000, 2, 4)]
+        events = [sum(c) for c in counts]
+        expected = [step_search_prob_of_frag(*(c+(e,))) for c, e in zip(counts, events)]
+        assert repr(prob_of_frag_batch(counts, events)) == repr(expected)
+        for c, e, exp in zip(counts, events, expected):
+            assert repr(prob_of_frag(*(c+(e,)))) == repr(exp)
+
+    def test_batch_chunks(self):
+        counts = synthetic_plate(20, seed=5)
+        expected = prob_of_frag_batch(counts)
+        import qtools.lib.nstats.frag as frag
+        rows = frag.FRAG_BATCH_ROWS
+        try:
+            frag.FRAG_BATCH_ROWS = 3
+            assert repr(prob_of_frag_batch(counts)) == repr(expected)
+        finally:
+            frag.FRAG_BATCH_ROWS = rows
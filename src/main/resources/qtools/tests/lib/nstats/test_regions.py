@@ -0,0 +1,108 @@
+from qtools.lib.nstats.regions import *
+import numpy as np
+import unittest
+
+# The mask-per-output (and per-bin) definitions the region labels replace,
+# over plain width/amplitude arrays; outputs are peak indices.
+
+def _binned(sums, boundaries):
+    regions = zip(boundaries[:-1], boundaries[1:]) + [(boundaries[-1], MAX_AMPLITUDE)]
+    return [np.flatnonzero((sums >= low) & (sums < high)) for low, high in regions]
+
+def _poly(idx, w, a, gates, min_gate, max_gate):
+    pos, mh, ml, neg = gates
+    out = [idx[(w > max_gate) & (a > pos)], idx[0:0], idx[0:0], idx[(w < min_gate) & (a < neg)]]
+    if mh and ml:
+        out[1] = idx[(w > max_gate) & (a < mh) & (a > ml)]
+        out[2] = idx[(w < min_gate) & (a < mh) & (a > ml)]
+    return out
+
+def _extra(idx, w, a, gates, min_gate, max_gate):
+    pos, mh, ml, neg = gates
+    inside = (w > min_gate) & (w < max_gate)
+    if mh and ml:
+        return idx[~((inside & (a > mh) & (a < pos)) | (inside & (a > neg) & (a < ml)))]
+    return idx[~(inside & (a > neg) & (a < pos))]
+
+def _regions(idx, w, a, gates, min_gate, max_gate):
+    pos, mh, ml, neg = gates
+    large, small = w > max_gate, w < min_gate
+    normal = (w >= min_gate) & (w <= max_gate)
+    empty = idx[0:0]
+    out = [idx[large & (a > pos)], idx[normal & (a > pos)], idx[small & (a > pos)],
+           empty, empty, empty, empty, empty,
+           idx[large & (a < neg)], idx[normal & (a < neg)], empty, empty, empty]
+    if mh and ml:
+        middle = (a < mh) & (a > ml)
+        out[5], out[6], out[7] = idx[large & middle], idx[normal & middle], idx[small & middle]
+        out[3] = idx[large & (a >= mh) & (a <= pos)]
+        out[4] = idx[small & (a >= mh) & (a <= pos)]
+        out[11] = idx[large & (a >= neg) & (a <= ml)]
+        out[12] = idx[small & (a >= neg) & (a <= ml)]
+    else:
+        out[11] = idx[large & (a >= neg) & (a <= pos)]
+        out[12] = idx[small & (a >= neg) & (a <= pos)]
+    return out
+
+def _per_bin(func, widths, amps, sums, gates, bins):
+    results = None
+    for idx, (min_gate, max_gate, boundary) in zip(_binned(sums, [b[2] for b in bins]), bins):
+        out = func(idx, widths[idx], amps[idx], gates, min_gate, max_gate)
+        if not isinstance(out, list):
+            out = [out]
+        results = out if results is None else [np.hstack([r, o]) for r, o in zip(results, out)]
+    return results
+
+class TestPeakRegions(unittest.TestCase):
+
+    def setUp(self):
+        rand = np.random.RandomState(32)
+        size = 20000
+        # integer-valued so that peaks land exactly on gates too
+        self.widths = rand.randint(0, 30, size).astype(np.float64)
+        self.amps = rand.randint(0, 30, size).astype(np.float64)*400
+        self.sums = self.amps + rand.randint(0, 30, size)*400
+        self.gate_sets = [(8000, 6000, 4000, 2000),
+                          (8000, None, None, 2000),
+                          (8000, 4400, 4000, 2000),
+                          (8000, 8000, 2000, 2000),
+                          (6000, 0, 4000, 6000)]
+        self.bins = [(8, 16, 0), (7, 17, 4000), (9, 9, 8000), (10, 12, 8000), (6, 20, 16000)]
+
+    def assert_index_lists(self, found, expected):
+        assert len(found) == len(expected)
+        for f, e in zip(found, expected):
+            assert np.array_equal(f, e)
+
+    def test_unbinned(self):
+        idx = np.arange(len(self.widths))
+        for gates in self.gate_sets:
+            for min_gate, max_gate in ((8, 16), (10, 10)):
+                regions = PeakRegions(self.widths, self.amps, gates, width_gates=(min_gate, max_gate))
+                self.assert_index_lists(regions.polydisperse_indices(),
+                                        _poly(idx, self.widths, self.amps, gates, min_gate, max_gate))
+                assert np.array_equal(regions.extracluster_indices(),
+                                      _extra(idx, self.widths, self.amps, gates, min_gate, max_gate))
+
+    def test_binned(self):
+        for gates in self.gate_sets:
+            regions = PeakRegions(self.widths, self.amps, gates,
+                                  bin_indices=amplitude_bin_indices(self.sums, [b[2] for b in self.bins]),
+                                  bin_width_gates=[b[:2] for b in self.bins])
+            self.assert_index_lists(regions.polydisperse_indices(),
+                                    _per_bin(_poly, self.widths, self.amps, self.sums, gates, self.bins))
+            extra = _per_bin(_extra, self.widths, self.amps, self.sums, gates, self.bins)[0]
+            assert np.array_equal(regions.extracluster_indices(), extra)
+
+            # regions are computed over the extracluster peaks
+            expected = _per_bin(_regions, self.widths[extra], self.amps[extra], self.sums[extra], gates, self.bins)
+            found = regions.region_indices()
+            found[REGION_NEGATIVE_SMALL] = found[REGION_NEGATIVE_SMALL][0:0]
+            self.assert_index_lists(found, [extra[e] for e in expected])
+
+    def test_amplitude_bin_indices(self):
+        boundaries = [b[2] for b in self.bins]
+        bin_indices = amplitude_bin_indices(self.sums, boundaries)
+        for idx, expected in enumerate(_binned(self.sums, boundaries)):
+            assert np.array_equal(np.flatnonzero(bin_indices == idx), expected)
+        assert amplitude_bin_indices(np.array([-1.0, 40000.0]), boundaries).tolist() == [-1, -1]
@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta
+from unittest import TestCase
+from qtools.lib.carryover import find_carryover, analyze_carryover, analyze_reader_carryover, update_carryover, carryover_trend, carryover_outliers
+from qtools.model import Session, Box2, Plate, QLBFile, QLBPlate, QLBWell, QLBWellChannel, CarryoverWell, CarryoverWatermark
+from qtools.tests import DatabaseTest
+import numpy as np
+
+class TestFindCarryover(TestCase):
+    def test_find_carryover(self):
+        box2_ids =       [1,    1,     1,     1,    1,     2,     2,     2]
+        is_empty =       [False, True, True,  False, True, True,  False, True]
+        concentrations = [5000, 0,     0,     10,   0,     0,     np.nan, 0]
+        indices, sources, distances = find_carryover(box2_ids, is_empty, concentrations, high_concentration=1000)
+        # the empty well after a low well, the first empty well on reader 2,
+        # and the empty well after an unknown concentration are not carryover wells
+        assert list(indices) == [1, 2]
+        assert list(sources) == [0, 0]
+        assert list(distances) == [1, 2]
+
+    def test_reader_boundary(self):
+        indices, sources, distances = find_carryover([1, 2], [False, True], [5000, 0])
+        assert len(indices) == 0
+
+    def test_empty(self):
+        indices, sources, distances = find_carryover([], [], [])
+        assert len(indices) == 0
+
+class TestCarryoverAnalysis(DatabaseTest):
+    def setUp(self):
+        self.run_time = datetime(2011, 6, 7, 10, 0, 0)
+        self.box2 = Box2(name=u'CarryoverTest', code=u'carryovertest')
+        self.plates = []
+        self.files = []
+        wells = [('Sample', 5000, 0), ('Stealth', 0, 2), ('Stealth', 0, 40),
+                 ('Sample', 5000, 0), ('NTC', 0, 1),
+                 ('Sample', 5000, 0), ('Stealth', 0, 2)]
+        for plate_idx in range(2):
+            plate = Plate(name=u'CarryoverTest %s' % plate_idx, box2=self.box2)
+            qlbfile = QLBFile(run_id='carryover_test_%s' % plate_idx, dirname='/tmp',
+                              basename='carryover_test_%s.qlp' % plate_idx,
+                              type='processed', mtime=self.run_time)
+            qlbplate = QLBPlate(file=qlbfile, plate=plate, host_datetime=self.run_time+timedelta(days=plate_idx))
+            for idx, (sample_name, concentration, positives) in enumerate(wells):
+                wellfile = QLBFile(run_id='carryover_test_%s_%s' % (plate_idx, idx), dirname='/tmp',
+                                   basename='carryover_test_%s_%s.qlb' % (plate_idx, idx),
+                                   type='raw', mtime=self.run_time)
+                well = QLBWell(file=wellfile, well_name='A0%s' % idx, sample_name=sample_name, event_count=15000,
+                               host_datetime=qlbplate.host_datetime+timedelta(minutes=5*idx))
+                well.channels.append(QLBWellChannel(channel_num=0, concentration=concentration, positive_peaks=positives))
+                qlbplate.wells.append(well)
+                self.files.append(wellfile)
+            self.files.append(qlbfile)
+            self.plates.append(plate)
+            Session.add(qlbplate)
+        Session.add(self.box2)
+        Session.commit()
+
+    def tearDown(self):
+        Session.rollback()
+        Session.query(CarryoverWell).filter_by(box2_id=self.box2.id).delete()
+        Session.query(CarryoverWatermark).filter_by(box2_id=self.box2.id).delete()
+        for plate in self.plates:
+            qlbplate = plate.qlbplate
+            for well in qlbplate.wells:
+                for channel in well.channels:
+                    Session.delete(channel)
+                Session.delete(well)
+            Session.delete(qlbplate)
+            Session.delete(plate)
+        for qlbfile in self.files:
+            Session.delete(qlbfile)
+        Session.delete(self.box2)
+        Session.commit()
+
+    def test_analyze(self):
+        assert analyze_carryover([self.box2.id]) == 8
+        Session.commit()
+        records = Session.query(CarryoverWell).filter_by(box2_id=self.box2.id).all()
+        assert sorted([record.distance for record in records]) == [1, 1, 1, 1, 1, 1, 2, 2]
+
+        trend = carryover_trend(self.box2.id)
+        assert [(wells, positives) for day, wells, positives, events in trend] == [(3, 5), (3, 5)]
+
+        outliers = carryover_outliers(self.box2.id, max_distance=None)
+        assert [record.positives for record in outliers] == [40, 40]
+
+    def test_batches(self):
+        # sources and distances carry across the windows of wells read
+        assert analyze_reader_carryover(self.box2.id, batch_size=2) == 8
+        Session.commit()
+        records = Session.query(CarryoverWell).filter_by(box2_id=self.box2.id).all()
+        assert sorted([record.distance for record in records]) == [1, 1, 1, 1, 1, 1, 2, 2]
+
+    def test_update(self):
+        assert update_carryover([self.box2.id]) == 8
+        Session.commit()
+        watermark = Session.query(CarryoverWatermark).filter_by(box2_id=self.box2.id).one()
+        assert watermark.analyzed_through == self.plates[1].qlbplate.wells[-1].host_datetime
+        # resumes from the last analyzed well, with the source before it
+        assert update_carryover([self.box2.id]) == 1
+        Session.commit()
+        assert Session.query(CarryoverWell).filter_by(box2_id=self.box2.id).count() == 8
+
+        # wells run after the last carryover well are read once
+        self.plates[1].qlbplate.wells[-1].sample_name = 'Sample'
+        Session.commit()
+        assert update_carryover([self.box2.id]) == 0
+        Session.commit()
+        assert Session.query(CarryoverWell).filter_by(box2_id=self.box2.id).count() == 7
+        assert update_carryover([self.box2.id]) == 0
@@ -0,0 +1,26 @@
+from unittest import TestCase
+from qtools.lib.compare import *
+import numpy as np
+
+class Metric(object):
+    def __init__(self, value):
+        self.value = value
+
+class TestValuesFuncs(TestCase):
+    def setUp(self):
+        values = [None, 0, 1, -1, 0.5, 2, 3]
+        self.pairs = [(a1, a2) for a1 in values for a2 in values]
+
+    def test_values_funcs(self):
+        a1 = np.array([v1 for v1, v2 in self.pairs], dtype=float)
+        a2 = np.array([v2 for v1, v2 in self.pairs], dtype=float)
+        for method, values_func in VALUES_FUNCS.items():
+            cmp = method('value')
+            expected = [cmp((Metric(v1), Metric(v2))) for v1, v2 in self.pairs]
+            assert np.allclose(values_func(a1, a2), expected), method.__name__
+
+    def test_columns(self):
+        a1 = np.array([[1, 2], [None, 4]], dtype=float)
+        a2 = np.array([[3, None], [5, 4]], dtype=float)
+        assert abs_diff_values(a1, a2).tolist() == [[2, 2], [5, 0]]
+        assert compare_anydiff_values(a1, a2).tolist() == [[1, 1], [1, 0]]
@@ -0,0 +1,62 @@
+from qtools.lib.compute import *
+import json, time, unittest
+
+@rpc_command('sleep')
+def sleep_command(seconds):
+    time.sleep(seconds)
+    return seconds
+
+class TestComputeServer(unittest.TestCase):
+    def setUp(self):
+        self.transport = InProcessRPCTransport()
+        self.server = ComputeServer(self.transport, processes=2, prefetch=4, timeout=5)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def wait_for(self, correlation_ids, limit=10):
+        replies = dict()
+        end = time.time() + limit
+        while len(replies) < len(correlation_ids) and time.time() < end:
+            self.server.poll(time_limit=0.01)
+            for cid in correlation_ids:
+                reply = self.transport.reply_for(cid)
+                if reply is not None:
+                    replies[cid] = reply
+        return [replies.get(cid) for cid in correlation_ids]
+
+    def test_legacy_sum(self):
+        reply, = self.wait_for([self.transport.call(json.dumps({'name': 'Vladimir', 'a': 5, 'b': 3}))])
+        assert reply == 'Vladimir, your sum is 8'
+
+    def test_commands(self):
+        cids = [self.transport.call(json.dumps({'command': 'gc_content', 'args': {'sequence': 'CGTA'}})),
+                self.transport.call(json.dumps({'command': 'primer_dimer', 'args': {'oligos1': ['TACGGAAAG'], 'oligos2': ['CTTTCCGTA']}})),
+                self.transport.call(json.dumps({'command': 'nonexistent'})),
+                self.transport.call('not json')]
+        replies = [json.loads(r) for r in self.wait_for(cids)]
+        assert replies[0] == {'result': 0.5}
+        assert replies[1] == {'result': [[[9, [0, 0]]]]}
+        assert 'error' in replies[2]
+        assert 'error' in replies[3]
+
+    def test_prefetch(self):
+        cids = [self.transport.call(json.dumps({'command': 'sleep', 'args': {'seconds': 0.5}})) for i in range(6)]
+        self.server.poll(time_limit=0.01)
+        assert len(self.server.pending) == 4
+        assert len(self.transport.unacked) == 4
+        replies = self.wait_for(cids)
+        assert all([json.loads(r) == {'result': 0.5} for r in replies])
+        assert len(self.transport.unacked) == 0
+
+    def test_timeout(self):
+        self.server.timeout = 0.2
+        cids = [self.transport.call(json.dumps({'command': 'sleep', 'args': {'seconds': 3}})) for i in range(2)]
+        replies = [json.loads(r) for r in self.wait_for(cids)]
+        assert all(['error' in r for r in replies])
+
+        # both workers were stuck, so the pool was replaced and still serves
+        self.server.timeout = 5
+        reply, = self.wait_for([self.transport.call(json.dumps({'command': 'gc_content', 'args': {'sequence': 'GG'}}))])
+        assert json.loads(reply) == {'result': 1.0}
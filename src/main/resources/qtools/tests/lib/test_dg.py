@@ -63,3 +63,37 @@ class TestDGReader(unittest.TestCase):
 		assert run.run_number is None
 		run = read_dg_log(local('runno.csv'))
 		assert run.run_number == 730
+
+DG_LOG_HEADER = """Run No. 731
+Start Time::2011/03/14 04:45
+Unit Number::10
+Status::OK
+Vacuum,Passed,0,6.5200e+001
+Manifold Pressure Check,Passed,0,-1.9690e+000
+Time Series Data:
+Index,Event,Time,Vacuum,Pressure
+"""
+
+DG_LOG_EVENTS = ["1,Start,0.0,-0.5,1.0\n",
+                 "2,Vacuum,1.5,-1.9,1.1\n",
+                 "3,Stop,3.0,-2.0,1.2\n"]
+
+class TestDGLogParser(unittest.TestCase):
+
+	def test_header_and_events(self):
+		parser = DGLogParser()
+		events = [parser.feed(line) for line in (DG_LOG_HEADER+''.join(DG_LOG_EVENTS)).splitlines(True)]
+		events = [e for e in events if e]
+		assert parser.header_parsed
+		assert events == [(1, 'Start', 0.0, -0.5, 1.0), (2, 'Vacuum', 1.5, -1.9, 1.1), (3, 'Stop', 3.0, -2.0, 1.2)]
+		run = parser.run()
+		assert run.run_number == 731
+		assert run.droplet_generator_id == 10
+		assert not run.failed
+		assert run.vacuum_time == 65.2
+		assert run.vacuum_pressure == -1.969
+	
+	def test_resume(self):
+		parser = DGLogParser(header_parsed=True, in_event_section=True, in_event_lines=True)
+		assert parser.feed(DG_LOG_EVENTS[1]) == (2, 'Vacuum', 1.5, -1.9, 1.1)
+		assert parser.feed('') is None
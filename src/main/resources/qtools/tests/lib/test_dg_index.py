@@ -0,0 +1,61 @@
+from qtools.lib.dropletgen import DGLogSource, DGLogIndex, get_dg_event_trace, dg_run_event_trace
+from qtools.model import Session, DropletGeneratorLogFile, DropletGeneratorRun
+from qtools.tests import DatabaseTest
+from qtools.tests.lib.test_dg import DG_LOG_HEADER, DG_LOG_EVENTS
+import os, shutil, tempfile
+
+class TestDGLogIndex(DatabaseTest):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.root, 'DG'))
+        self.basename = '2011-03-14_04-45-56.csv'
+        self.path = os.path.join(self.root, 'DG', self.basename)
+        self.source = DGLogSource(self.root, 'DG')
+        self.index = DGLogIndex(self.source, Session, droplet_generator_ids=[10], settle_seconds=3600)
+    
+    def tearDown(self):
+        logfile = Session.query(DropletGeneratorLogFile).filter_by(basename=self.basename).first()
+        if logfile:
+            if logfile.dg_run:
+                Session.delete(logfile.dg_run)
+            Session.delete(logfile)
+            Session.commit()
+        shutil.rmtree(self.root)
+    
+    def write(self, content, mode='a'):
+        with open(self.path, mode) as f:
+            f.write(content)
+    
+    def test_incremental(self):
+        # partial last line is left for later
+        self.write(DG_LOG_HEADER+DG_LOG_EVENTS[0]+DG_LOG_EVENTS[1][:4], mode='w')
+        assert self.index.update() == 1
+        logfile = Session.query(DropletGeneratorLogFile).filter_by(basename=self.basename).one()
+        assert logfile.header_parsed
+        assert not logfile.complete
+        assert logfile.dg_run.run_number == 731
+        assert logfile.event_trace == [(1, 'Start', 0.0, -0.5, 1.0)]
+        offset = logfile.parsed_offset
+
+        # nothing changed
+        assert self.index.update() == 0
+
+        self.write(DG_LOG_EVENTS[1][4:]+DG_LOG_EVENTS[2])
+        os.utime(self.path, (os.stat(self.path).st_atime, os.stat(self.path).st_mtime+1))
+        assert self.index.update() == 1
+        Session.refresh(logfile)
+        assert logfile.parsed_offset > offset
+        assert logfile.event_trace == get_dg_event_trace(self.path)
+        assert dg_run_event_trace(Session, logfile.dg_run.id) == logfile.event_trace
+        # stored to the second, as a DATETIME column would
+        assert logfile.mtime.microsecond == 0
+        assert Session.query(DropletGeneratorRun).filter_by(basename=self.basename).count() == 1
+    
+    def test_settled(self):
+        self.write(DG_LOG_HEADER+''.join(DG_LOG_EVENTS), mode='w')
+        os.utime(self.path, (0, 0))
+        self.index.update()
+        logfile = Session.query(DropletGeneratorLogFile).filter_by(basename=self.basename).one()
+        assert logfile.complete
+        assert len(logfile.event_trace) == 3
+        assert logfile not in self.index.open_logs()
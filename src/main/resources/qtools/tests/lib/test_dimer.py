@@ -0,0 +1,54 @@
+from qtools.lib.bio import maximal_binding_seq, reverse_complement
+from qtools.lib.dimer import *
+import random
+
+def _pairwise(oligos1, oligos2):
+    results = []
+    for o1 in oligos1:
+        row = []
+        for o2 in oligos2:
+            try:
+                row.append(maximal_binding_seq(o1, o2))
+            except IndexError:
+                row.append(None)
+        results.append(row)
+    return results
+
+def test_pool_maximal_binding():
+    oligos = ['TACGGAAAG', 'CTTATAAGG', 'TACGGAAGA', 'ACTTATAAG', 'CTTATAGTA']
+    assert pool_maximal_binding(oligos) == _pairwise(oligos, oligos)
+
+    results = pool_maximal_binding(['TACGGAAAG'], [reverse_complement('TACGGAAAG')])
+    assert results[0][0] == (9, (0, 0))
+
+def test_pool_maximal_binding_random():
+    rand = random.Random(26)
+    oligos1 = [''.join([rand.choice('ACGTacgt') for i in range(rand.randint(1, 40))]) for j in range(30)]
+    oligos2 = [''.join([rand.choice('ACGT') for i in range(rand.randint(1, 40))]) for j in range(20)]
+    assert pool_maximal_binding(oligos1, oligos2) == _pairwise(oligos1, oligos2)
+    # force multiple blocks
+    assert pool_maximal_binding(oligos1, oligos2, block_cells=1) == _pairwise(oligos1, oligos2)
+
+def test_pool_binding_unbound():
+    longest, offset1, offset2 = pool_binding(['AAAA'], ['AAAA'])
+    assert longest[0,0] == 0
+    assert offset1[0,0] == -1
+    assert offset2[0,0] == -1
+    assert pool_maximal_binding(['AAAA'], ['AAAA']) == [[None]]
+
+def test_max_pool_binding():
+    oligos = ['AAAA', 'TACGGAAAG', 'CTTTCCGTA']
+    (i, j), result = max_pool_binding(oligos)
+    assert (i, j) == (1, 2)
+    assert result == maximal_binding_seq(oligos[1], oligos[2]) == (9, (0, 0))
+    assert max_pool_binding(['AAAA']) is None
+
+def test_paired_binding():
+    rand = random.Random(50)
+    oligos1 = [''.join([rand.choice('ACGTacgt') for i in range(rand.randint(1, 40))]) for j in range(40)]
+    oligos2 = [''.join([rand.choice('ACGT') for i in range(rand.randint(1, 40))]) for j in range(40)]
+    expected = [_pairwise([o1], [o2])[0][0] for o1, o2 in zip(oligos1, oligos2)]
+    for block_cells in (DEFAULT_BLOCK_CELLS, 1):
+        longest, offset1, offset2 = paired_binding(oligos1, oligos2, block_cells=block_cells)
+        assert [(l, (o1, o2)) if l > 0 else None for l, o1, o2 in zip(longest.tolist(), offset1.tolist(), offset2.tolist())] == expected
+    assert len(paired_binding([], [])[0]) == 0
@@ -0,0 +1,55 @@
+from unittest import TestCase
+from qtools.lib.galaxytile import *
+import numpy as np
+import os, shutil, tempfile
+
+class TempImageSource(object):
+    def __init__(self, root):
+        self.root = root
+
+    def get_path(self, path):
+        full_path = os.path.join(self.root, path)
+        if not os.path.isdir(os.path.dirname(full_path)):
+            os.makedirs(os.path.dirname(full_path))
+        return full_path
+
+def random_peaks(size, seed):
+    rand = np.random.RandomState(seed)
+    return 10**rand.uniform(1.5, 4.7, size), rand.uniform(3, 22, size)
+
+class TestSparseTile(TestCase):
+    def test_round_trip(self):
+        H = galaxy_histogram(*random_peaks(5000, 0))
+        indices, counts = sparse_tile(H)
+        assert len(indices) == np.count_nonzero(H)
+        dense = np.zeros(GALAXY_HEIGHT*GALAXY_WIDTH)
+        dense[indices] = counts
+        assert (dense.reshape(H.shape) == H).all()
+
+class TestCompositeGalaxy(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.image_source = TempImageSource(self.root)
+        self.peaks = {}
+        for i, well_name in enumerate(('A01', 'A02', 'B05')):
+            self.peaks[well_name] = random_peaks(3000+i*500, i+1)
+            indices, counts = sparse_tile(galaxy_histogram(*self.peaks[well_name]))
+            key = tile_key(0, True, False)
+            np.savez_compressed(self.image_source.get_path(tile_path(7, well_name)),
+                                **{'%s_bins' % key: indices, '%s_counts' % key: counts})
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_composite(self):
+        H = composite_galaxy_histogram(self.image_source, [(7, 'A01'), (7, 'A02'), (7, 'B05')])
+        amplitudes = np.concatenate([self.peaks[name][0] for name in ('A01', 'A02', 'B05')])
+        widths = np.concatenate([self.peaks[name][1] for name in ('A01', 'A02', 'B05')])
+        assert H.shape == (GALAXY_HEIGHT, GALAXY_WIDTH)
+        assert (H == galaxy_histogram(amplitudes, widths)).all()
+
+    def test_missing(self):
+        assert composite_galaxy_histogram(self.image_source, [(7, 'A01'), (7, 'C01')]) is None
+        assert composite_galaxy_histogram(self.image_source, [(7, 'A01')], channel=1) is None
+        assert composite_galaxy_histogram(self.image_source, []) is None
+        assert read_well_tile(self.image_source, 8, 'A01') is None
@@ -0,0 +1,54 @@
+from unittest import TestCase
+from qtools.lib.intervals import *
+import numpy as np
+
+class TestBins(TestCase):
+    def test_range_bin(self):
+        assert range_bin(20000, 20000) == 585
+        assert range_bin(140450089, 140457041) == 1656
+        # spans two 128kb bins, inside one 1mb bin
+        assert range_bin(130000, 132000) == 73
+        assert range_bin(0, 10) == range_bin(1, 10)
+
+    def test_overlapping_bins(self):
+        rand = np.random.RandomState(0)
+        for i in range(500):
+            start = rand.randint(1, 200000000)
+            end = start+rand.randint(0, 3000000)
+            query_start = rand.randint(max(start-1000, 1), end+1)
+            query_end = max(query_start+rand.randint(0, 1000), start)
+            assert range_bin(start, end) in overlapping_bins(query_start, query_end)
+
+    def test_merge_ranges(self):
+        assert merge_ranges([(50, 60), (1, 10), (5, 20), (21, 30), (40, 45), (55, 58)]) == [(1, 30), (40, 45), (50, 60)]
+        assert merge_ranges([]) == []
+
+class TestIntervalIndex(TestCase):
+    def setUp(self):
+        rand = np.random.RandomState(1)
+        self.intervals = []
+        for i in range(2000):
+            start = int(rand.randint(1, 5000000))
+            # mostly SNP-sized, some long
+            length = int(rand.randint(0, 3)) if i % 10 else int(rand.randint(0, 400000))
+            self.intervals.append((rand.choice(['1', '2']), start, start+length, i))
+        self.index = IntervalIndex(self.intervals)
+
+    def test_len(self):
+        assert len(self.index) == 2000
+
+    def test_overlapping(self):
+        rand = np.random.RandomState(2)
+        for i in range(200):
+            chromosome = rand.choice(['1', '2'])
+            start = int(rand.randint(1, 5000000))
+            end = start+int(rand.randint(0, 20000))
+            expected = sorted([(s, e, value) for ch, s, e, value in self.intervals
+                               if ch == chromosome and s <= end and e >= start])
+            assert self.index.overlapping(chromosome, start, end) == [value for s, e, value in expected]
+
+    def test_point(self):
+        index = IntervalIndex([('7', 100, 100, 'a'), ('7', 90, 110, 'b'), ('7', 101, 101, 'c')])
+        assert index.overlapping('7', 100, 100) == ['b', 'a']
+        assert index.overlapping('7', 111, 200) == []
+        assert index.overlapping('8', 100, 100) == []
@@ -0,0 +1,134 @@
+import os, shutil, tempfile
+from unittest import TestCase
+from qtools.lib.bio import reverse_complement
+from qtools.lib.ispcr import *
+import numpy as np
+
+def random_sequence(length, seed):
+    return ''.join(np.random.RandomState(seed).choice(list('ACGT'), length))
+
+class TestReadFasta(TestCase):
+    def test_chromosome_name(self):
+        assert chromosome_name('chr7 some description') == '7'
+        assert chromosome_name('chrX') == 'X'
+        assert chromosome_name('scaffold_1') == 'scaffold_1'
+
+class TestKmerCodes(TestCase):
+    def test_codes(self):
+        kmers, known = kmer_codes(encode_bases('ACGTNAC'), 2)
+        assert kmers[:3].tolist() == [1, 6, 11]
+        assert known.tolist() == [True, True, True, False, False, True]
+
+class TestGenomeIndex(TestCase):
+    def setUp(self):
+        self.chr1 = random_sequence(5000, 1)
+        self.chr2 = random_sequence(3000, 2)
+        # the region 1000-1220 of chr1 again at 2000-2220 of chr2
+        self.chr2 = self.chr2[:2000]+self.chr1[1000:1220]+self.chr2[2220:]
+        self.genome = GenomeIndex([('1', self.chr1), ('2', self.chr2)])
+        self.fwd = self.chr1[1000:1020]
+        self.rev = reverse_complement(self.chr1[1200:1220])
+
+    def test_bases(self):
+        assert self.genome.bases('1', 1, 10) == self.chr1[:10]
+        assert self.genome.bases('chr2', 2001, 2220) == self.chr1[1000:1220]
+        assert self.genome.bases('3', 1, 10) is None
+
+    def test_products(self):
+        products = self.genome.pcr_products([(self.fwd, self.rev), (self.rev, self.fwd)])
+        assert products['pair'].tolist() == [0, 0, 1, 1]
+        assert products['chromosome'].tolist() == [0, 1, 0, 1]
+        assert products['start'].tolist() == [1001, 2001, 1001, 2001]
+        assert products['end'].tolist() == [1220, 2220, 1220, 2220]
+        assert products['strand'].tolist() == ['+', '+', '-', '-']
+
+    def test_product_size(self):
+        assert len(self.genome.pcr_products([(self.fwd, self.rev)], max_product_size=219)) == 0
+        assert len(self.genome.pcr_products([(self.fwd, self.rev)], min_product_size=221)) == 0
+        assert len(self.genome.pcr_products([(self.fwd, self.rev)], min_product_size=220, max_product_size=220)) == 2
+
+    def test_mismatches(self):
+        base = 'A' if self.fwd[0] != 'A' else 'C'
+        fwd = base+self.fwd[1:]
+        products = self.genome.pcr_products([(fwd, self.rev)], max_mismatches=1)
+        assert products['fwd_mismatches'].tolist() == [1, 1]
+        assert products['rev_mismatches'].tolist() == [0, 0]
+        assert len(self.genome.pcr_products([(fwd, self.rev)], max_mismatches=0)) == 0
+
+        # the 3' seed must match exactly
+        base = 'A' if self.fwd[-1] != 'A' else 'C'
+        assert len(self.genome.pcr_products([(self.fwd[:-1]+base, self.rev)], max_mismatches=2)) == 0
+
+    def test_short_primer(self):
+        self.assertRaises(ValueError, self.genome.pcr_products, [(self.fwd[:8], self.rev)])
+
+class TestBuiltGenomeIndex(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.chr1 = random_sequence(5000, 4)
+        self.chr2 = random_sequence(3000, 5)
+        fasta_path = os.path.join(self.root, 'genome.fa')
+        fasta = open(fasta_path, 'w')
+        fasta.write('>chr1\n%s\n%s\n>chr2 description\n%s\n' % (self.chr1[:2500], self.chr1[2500:], self.chr2))
+        fasta.close()
+        self.index_dir = os.path.join(self.root, 'index')
+        build_genome_index(fasta_path, self.index_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_load(self):
+        genome = GenomeIndex.load(self.index_dir)
+        assert genome.chromosomes == ['1', '2']
+        assert genome.bases('2', 11, 20) == self.chr2[10:20]
+        fwd, rev = self.chr1[2400:2420], reverse_complement(self.chr1[2600:2620])
+        products = genome.pcr_products([(fwd, rev)])
+        assert products['start'].tolist() == [2401]
+        assert products['end'].tolist() == [2620]
+
+    def test_incomplete(self):
+        os.unlink(os.path.join(self.index_dir, INDEX_MANIFEST))
+        self.assertRaises(IOError, GenomeIndex.load, self.index_dir)
+
+class TestLocalPCRSequenceSource(TestCase):
+    def setUp(self):
+        self.chr1 = random_sequence(5000, 3)
+        self.source = LocalPCRSequenceSource(GenomeIndex([('1', self.chr1)]))
+        self.fwd = self.chr1[1000:1020]
+        self.rev = reverse_complement(self.chr1[1200:1220])
+
+    def test_sequence(self):
+        seq = self.source.sequence('1', 4990, 5010)
+        assert (seq.start, seq.end, seq.strand) == (4990, 5000, '+')
+        assert seq.sequence == self.chr1[4989:]
+
+    def test_sequences_for_primers(self):
+        sequences = self.source.sequences_for_primers(self.fwd, self.rev, 100, 50)
+        assert len(sequences) == 1
+        pcr = sequences[0]
+        assert pcr.amplicon.perfect_primer_match
+        assert (pcr.amplicon.start, pcr.amplicon.end, pcr.amplicon.strand) == (1001, 1220, '+')
+        assert pcr.amplicon.sequence == self.chr1[1000:1220]
+        assert (pcr.left_padding.start, pcr.right_padding.end) == (901, 1270)
+        assert pcr.merged_positive_sequence.sequence == self.chr1[900:1270]
+
+        reverse = self.source.sequences_for_primers(self.rev, self.fwd)[0]
+        assert reverse.amplicon.strand == '-'
+        assert reverse.amplicon.sequence == reverse_complement(self.chr1[1000:1220])
+        assert reverse.left_padding is None
+
+    def test_no_match(self):
+        assert self.source.sequences_for_primers(self.fwd, self.fwd) == []
+
+    def test_primer_pairs(self):
+        other_fwd = self.chr1[3000:3022]
+        other_rev = reverse_complement(self.chr1[3400:3420])
+        sequences = self.source.sequences_for_primer_pairs([(self.fwd, self.rev), (self.fwd, other_rev), (other_fwd, other_rev)])
+        assert [len(seqs) for seqs in sequences] == [1, 1, 1]
+        assert (sequences[1][0].amplicon.start, sequences[1][0].amplicon.end) == (1001, 3420)
+        assert (sequences[2][0].amplicon.start, sequences[2][0].amplicon.end) == (3001, 3420)
+
+    def test_sequence_around_loc(self):
+        pcr = self.source.sequence_around_loc('1', 2000, 60, 10, 10)
+        assert (pcr.amplicon.start, pcr.amplicon.end) == (1941, 2059)
+        assert pcr.merged_positive_sequence.sequence == self.chr1[1930:2069]
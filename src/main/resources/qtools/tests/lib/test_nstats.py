@@ -1,5 +1,6 @@
-from qtools.lib.nstats import interval_averages, moving_average_by_interval
+from qtools.lib.nstats import interval_averages, moving_average_by_interval, percentile, interval_bins, fill_blank_bins
 import unittest
+import numpy as np
 
 class TestFunctions(unittest.TestCase):
 
@@ -38,4 +39,21 @@ class TestFunctions(unittest.TestCase):
 
         bins, vals = zip(*avgs)
         assert bins == (0.0, 100.0, 200.0, 300.0, 400.0, 500.0)
-        assert vals == (1.0, 2.75, 3.25, 2.0, 2.0, 4.0)
\ No newline at end of file
+        assert vals == (1.0, 2.75, 3.25, 2.0, 2.0, 4.0)
+
+    def test_interval_bins(self):
+        bins, bin_indices = interval_bins([90, 100, 150, 200, 300, 500], 100)
+        assert bins.tolist() == [0.0, 100.0, 200.0, 300.0, 400.0, 500.0]
+        assert bin_indices.tolist() == [0, 1, 1, 2, 3, 5]
+
+    def test_fill_blank_bins(self):
+        filled = np.array([False, True, False, False, True, False])
+        vals = fill_blank_bins(np.array([0, 2.0, 0, 0, 5.0, 0]), filled)
+        assert vals.tolist() == [2.0, 2.0, 2.0, 2.0, 5.0, 5.0]
+
+    def test_percentile(self):
+        assert percentile([], 0.5) is None
+        assert percentile([5, 1, 4, 2, 3], 0.5) == 3
+        assert percentile([5, 1, 4, 2], 0.5) == 3.0
+        assert percentile([4, 1, 3, 2], 0.25) == 1.75
+        assert percentile([('a', 2), ('b', 9), ('c', 4)], 1.0, key=lambda tup: tup[1]) == 9
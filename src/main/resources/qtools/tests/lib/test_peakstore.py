@@ -0,0 +1,99 @@
+from unittest import TestCase
+from qtools.lib.peakstore import *
+import numpy as np
+import os, shutil, tempfile, time
+
+PEAK_DTYPE = np.dtype([('fam', [('width', 'f8'), ('amplitude', 'f8')]), ('vic', [('width', 'f8'), ('amplitude', 'f8')])])
+
+class Well(object):
+    def __init__(self, name, num_peaks):
+        self.name = name
+        self.peaks = np.zeros(num_peaks, dtype=PEAK_DTYPE)
+        self.peaks['fam']['amplitude'] = np.arange(num_peaks)
+
+class Plate(object):
+    def __init__(self, sizes):
+        self.wells = dict([(name, Well(name, size)) for name, size in sizes.items()])
+        self.analyzed_wells = dict([(name, well) for name, well in self.wells.items() if len(well.peaks)])
+
+class TestSharedPeakStore(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.dir, 'peaks')
+        self.reads = []
+        self.qlp = os.path.join(self.dir, 'plate.qlp')
+        open(self.qlp, 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def read_plate(self, path):
+        self.reads.append(path)
+        return Plate({'A01': 100, 'A02': 0, 'B01': 250})
+
+    def store(self, **kwargs):
+        return SharedPeakStore(self.root, plate_reader=self.read_plate, **kwargs)
+
+    def test_publish_attach(self):
+        parsed = self.store().plate(self.qlp)
+        attached = self.store().plate(self.qlp)
+        assert len(self.reads) == 1
+        assert isinstance(attached.wells['B01'].peaks, np.memmap)
+        for name in ('A01', 'A02', 'B01'):
+            assert (attached.wells[name].peaks == parsed.wells[name].peaks).all()
+        # analyzed wells are the same objects as in wells
+        assert attached.analyzed_wells['A01'] is attached.wells['A01']
+        assert 'A02' not in attached.analyzed_wells
+
+        # writes stay in the worker
+        attached.wells['A01'].peaks['fam']['amplitude'] = -1
+        assert self.store().plate(self.qlp).wells['A01'].peaks['fam']['amplitude'][5] == 5
+
+    def test_modified(self):
+        self.store().plate(self.qlp)
+        os.utime(self.qlp, (time.time()+10, time.time()+10))
+        self.store().plate(self.qlp)
+        assert len(self.reads) == 2
+
+    def test_evict(self):
+        store = self.store()
+        paths = []
+        for i in range(3):
+            path = os.path.join(self.dir, 'plate%s.qlp' % i)
+            open(path, 'w').close()
+            paths.append(path)
+            store.plate(path)
+        size = max([size for used, size, key in store.segments()])
+        # use the first plate last
+        first = store.segment_paths(store.segment_key(paths[0]))[1]
+        os.utime(first, (time.time()+10, time.time()+10))
+
+        store.max_size = size*2
+        store.evict()
+        keys = [key for used, size, key in store.segments()]
+        assert len(keys) == 2
+        assert store.segment_key(paths[0]) in keys
+        assert store.segment_key(paths[2]) in keys
+
+    def test_evicted_while_attaching(self):
+        store = self.store()
+        store.plate(self.qlp)
+        # the peaks go between the check for the plate pickle and the load
+        peaks_path, plate_path, lock_path = store.segment_paths(store.segment_key(self.qlp))
+        os.unlink(peaks_path)
+        plate = store.plate(self.qlp)
+        assert len(self.reads) == 2
+        assert len(plate.wells['B01'].peaks) == 250
+        assert not os.path.exists(lock_path)
+
+    def test_stale_temp(self):
+        store = self.store()
+        store.plate(self.qlp)
+        stale = os.path.join(self.root, 'tmpabc.tmp')
+        fresh = os.path.join(self.root, 'tmpdef.tmp')
+        open(stale, 'w').close()
+        open(fresh, 'w').close()
+        os.utime(stale, (0, 0))
+        store.segments()
+        assert not os.path.exists(stale)
+        assert os.path.exists(fresh)
@@ -0,0 +1,39 @@
+from unittest import TestCase
+from qtools.lib.plotdata import *
+import numpy as np
+
+class TestPlotData(TestCase):
+    def test_histogram(self):
+        data = histogram_data([0.5, 1.5, 1.7, 3.9], 4, (0, 4))
+        assert data['edges'] == [0.0, 4.0]
+        assert data['counts'] == [1, 2, 0, 1]
+
+    def test_density(self):
+        rand = np.random.RandomState(0)
+        xs = rand.uniform(0, 100, 1000)
+        ys = rand.uniform(0, 50, 1000)
+        data = density_data(xs, ys, (10, 20), (0, 100, 0, 50))
+        assert data['shape'] == [10, 20]
+        assert sum(data['counts']) == 1000
+
+        dense = np.zeros(200)
+        dense[data['cells']] = data['counts']
+        H, yedges, xedges = np.histogram2d(ys, xs, bins=(10, 20), range=[[0, 50], [0, 100]])
+        assert (dense.reshape((10, 20)) == H).all()
+
+    def test_density_log(self):
+        data = density_data([100, 1000, 10000], [1, 1, 1], (1, 2), (100, 10000, 0, 2), log_x=True)
+        assert data['log_x']
+        assert data['cells'] == [0, 1]
+        assert data['counts'] == [1, 2]
+
+    def test_scatter(self):
+        data = scatter_data([np.arange(12000), np.arange(12000)*2], max_points=5000)
+        assert data['total'] == 12000
+        assert data['stride'] == 3
+        assert len(data['columns'][0]) == 4000
+        assert data['columns'][1][:3] == [0, 6, 12]
+
+        data = scatter_data([[1, 2], [3, 4]])
+        assert data['stride'] == 1
+        assert data['columns'] == [[1, 2], [3, 4]]
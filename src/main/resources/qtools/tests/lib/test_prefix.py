@@ -0,0 +1,64 @@
+from unittest import TestCase
+from qtools.lib.prefix import PrefixTrie, PrefixResolver
+from qtools.model import Session, PlateTemplate
+from qtools.tests import DatabaseTest
+
+class TestPrefixTrie(TestCase):
+    def test_longest_prefix_value(self):
+        trie = PrefixTrie()
+        trie.add('Proj_Op', 'short', rank=1)
+        trie.add('Proj_Op_Exp', 'long', rank=2)
+        trie.add('Proj_Op_Exp', 'older', rank=0)
+        assert trie.longest_prefix_value('Proj_Op_Exp 2') == 'long'
+        assert trie.longest_prefix_value('Proj_Op_Ex') == 'short'
+        assert trie.longest_prefix_value('Proj_Op') == 'short'
+        assert trie.longest_prefix_value('Proj') is None
+        assert trie.longest_prefix_value('') is None
+
+        trie.add('', 'any', rank=0)
+        assert trie.longest_prefix_value('Other') == 'any'
+
+class TestPrefixResolver(DatabaseTest):
+    def setUp(self):
+        self.resolver = PrefixResolver(PlateTemplate)
+        self.short = PlateTemplate(prefix='PrefixTest_Op', dg_oil=1)
+        self.long = PlateTemplate(prefix='PrefixTest_Op_Exp', dg_oil=2)
+        Session.add_all([self.short, self.long])
+        Session.commit()
+    
+    def tearDown(self):
+        Session.rollback()
+        for template in Session.query(PlateTemplate).filter(PlateTemplate.prefix.like('PrefixTest%')).all():
+            Session.delete(template)
+        Session.commit()
+    
+    def test_resolve(self):
+        assert self.resolver.resolve('PrefixTest_Op_Exp 2').dg_oil == 2
+        assert self.resolver.resolve('PrefixTest_Op_Other').dg_oil == 1
+        assert self.resolver.resolve('Unknown_Op_Exp') is None
+        assert self.resolver.get(self.short.id).prefix == 'PrefixTest_Op'
+        assert self.resolver.get(-1) is None
+        # the session's own rows, so changes to them are saved
+        assert self.resolver.resolve('PrefixTest_Op_Exp 2') is self.long
+        assert self.resolver.resolve_id('PrefixTest_Op_Other') == self.short.id
+    
+    def test_invalidate(self):
+        assert self.resolver.resolve('PrefixTest_Op_Exp_More').dg_oil == 2
+        self.long.prefix = 'PrefixTest_Op_Exp_More'
+        Session.commit()
+        # not yet seen without the mapper event hookup
+        assert self.resolver.resolve('PrefixTest_Op_Exp 2').dg_oil == 2
+        self.resolver.invalidate()
+        assert self.resolver.resolve('PrefixTest_Op_Exp 2').dg_oil == 1
+        assert self.resolver.resolve('PrefixTest_Op_Exp_More 2').dg_oil == 2
+    
+    def test_saved_templates(self):
+        from qtools.lib.prefix import template_resolver
+        assert template_resolver.resolve('PrefixTest_Op_Exp_Newer').dg_oil == 2
+        newer = PlateTemplate(prefix='PrefixTest_Op_Exp_Newer', dg_oil=3)
+        Session.add(newer)
+        Session.commit()
+        assert template_resolver.resolve('PrefixTest_Op_Exp_Newer').dg_oil == 3
+        Session.delete(newer)
+        Session.commit()
+        assert template_resolver.resolve('PrefixTest_Op_Exp_Newer').dg_oil == 2
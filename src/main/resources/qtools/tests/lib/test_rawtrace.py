@@ -0,0 +1,66 @@
+from qtools.lib.collection import AttrDict
+from qtools.lib.rawtrace import RawTraceSource
+import numpy as np
+import os, shutil, tempfile, unittest
+
+class TestRawTraceSource(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'A01.qlb')
+        open(self.path, 'w').close()
+        self.samples = np.random.RandomState(0).randint(0, 30000, size=(100000, 2)).astype(np.float32)
+        self.reads = 0
+        self.source = RawTraceSource(os.path.join(self.root, 'traces'), well_reader=self.read_well)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def read_well(self, path):
+        self.reads += 1
+        return AttrDict(samples=self.samples,
+                        data_acquisition_params=AttrDict(sample_rate=100000.0))
+
+    def test_trace(self):
+        trace = self.source.trace(self.path)
+        assert isinstance(trace.samples, np.memmap)
+        assert len(trace) == 100000
+        assert trace.num_channels == 2
+        assert trace.sample_rate == 100000.0
+        assert (trace.samples == self.samples).all()
+
+        again = self.source.trace(self.path)
+        assert (again.samples[500:600] == self.samples[500:600]).all()
+        assert self.reads == 1
+
+    def test_windows(self):
+        trace = self.source.trace(self.path)
+        windows = trace.windows([(10, 19), (-5, 4), (99990, 100020)])
+        assert (windows[0] == self.samples[10:20]).all()
+        assert (windows[1] == self.samples[:5]).all()
+        assert (windows[2] == self.samples[99990:]).all()
+
+    def test_sample_windows(self):
+        sample_rate, num_channels, windows = self.source.sample_windows(self.path, window_size=30000)
+        assert (sample_rate, num_channels) == (100000.0, 2)
+        assert [len(w) for w in windows()] == [30000, 30000, 30000, 10000]
+        assert (np.vstack(list(windows())) == self.samples).all()
+
+    def test_rewritten(self):
+        self.source.trace(self.path)
+        os.utime(self.path, (0, 0))
+        self.source.trace(self.path)
+        assert self.reads == 2
+        assert len(os.listdir(os.path.dirname(self.source.sidecar_paths(self.path)[0]))) == 2
+
+    def test_evict(self):
+        other = os.path.join(self.root, 'A02.qlb')
+        open(other, 'w').close()
+        self.source.max_size = 1000000
+        self.source.trace(self.path)
+        os.utime(self.source.sidecar_paths(self.path)[1], (0, 0))
+        self.source.trace(other)
+        assert [key for used, size, key in self.source.sidecars()] == [self.source.sidecar_key(other)]
+
+        # a sidecar evicted by another process is written again
+        self.source.trace(self.path)
+        assert self.reads == 3
@@ -0,0 +1,48 @@
+from unittest import TestCase
+from qtools.lib.collection import AttrDict
+from qtools.lib.replicates import grouped_statistics, ReplicateMetricTable
+import numpy as np
+
+class TestGroupedStatistics(TestCase):
+    def test_grouped_statistics(self):
+        values = np.array([[1.0, 10.0], [3.0, 20.0], [5.0, 30.0], [7.0, 0.0]])
+        present = np.array([[True, True], [True, True], [True, False], [True, True]])
+        membership = np.array([[True, True, False, False],
+                               [False, True, True, True],
+                               [False, False, False, False]])
+        counts, means, stds = grouped_statistics(values, present, membership)
+        assert counts.tolist()[:2] == [[2, 2], [3, 2]]
+        assert np.allclose(means[0], [2.0, 15.0])
+        assert np.allclose(stds[0], [1.0, 5.0])
+        assert np.allclose(means[1], [5.0, 10.0])
+        assert np.allclose(stds[1], [np.std([3, 5, 7]), np.std([20, 0])])
+        assert np.isnan(means[2]).all()
+
+class TestReplicateMetricTable(TestCase):
+    def setUp(self):
+        col = AttrDict(info={})
+        percent_col = AttrDict(info={'percent': True})
+        self.well_cols = [('accepted_event_count', col), ('air_droplets_pct', percent_col)]
+        self.channel_cols = [('concentration', col)]
+        def well_metric(name, events, air, concentration):
+            channels = [AttrDict(channel_num=0, concentration=concentration)] if concentration is not None else []
+            return AttrDict(well_name=name, accepted_event_count=events, air_droplets_pct=air,
+                            well_channel_metrics=channels)
+        self.well_metrics = [well_metric('A01', 10000, 0.01, 100.0),
+                             well_metric('A02', 12000, 0.03, 120.0),
+                             well_metric('A03', None, 0.02, None),
+                             well_metric('A04', 14000, 0.05, 80.0)]
+
+    def test_replicate_rows(self):
+        table = ReplicateMetricTable(self.well_metrics, self.well_cols, self.channel_cols, 0)
+        rows = table.replicate_rows([['A01', 'A02', 'A03'], ['A01', 'A04', 'H12']], ignored_wells=['A02'])
+        count, stats = rows[0]
+        assert count == 2
+        # missing values count as 0; wells without the channel are left out
+        assert np.allclose(stats[0], (5000, 5000))
+        assert np.allclose(stats[1], (1.5, 0.5))
+        assert np.allclose(stats[2], (100.0, 0.0))
+        # wells without metrics are skipped
+        count, stats = rows[1]
+        assert count == 2
+        assert np.allclose(stats[0], (12000, 2000))
@@ -0,0 +1,54 @@
+from qtools.lib.seqops import *
+import numpy as np
+
+def test_complement():
+    assert complement('') == ''
+    assert complement('CGTA') == 'GCAT'
+    assert complement('cgta') == 'gcat'
+    assert complement('ACGTUacgtu') == 'TGCAAtgcaa'
+    assert complement('RYSWKMBVDHN') == 'YRSWMKVBHDN'
+    assert complement('ryswkmbvdhn') == 'yrswmkvbhdn'
+    assert complement('AC-?GT') == 'TG-?CA'
+    assert complement(u'ACgt') == u'TGca'
+    assert isinstance(complement(u'ACgt'), unicode)
+
+def test_reverse_complement():
+    assert reverse_complement('CGTAry') == 'ryTACG'
+    assert reverse_complement(u'CGTAry') == u'ryTACG'
+    assert reverse_complement(reverse_complement('ACGTRYKMacgt')) == 'ACGTRYKMacgt'
+    assert reverse_complement(None) is None
+
+def test_arrays():
+    seq = 'ACGTRYacgtn'
+    arr = as_bytes(seq)
+    assert complement_array(arr).tostring() == complement(seq)
+    assert reverse_complement_array(arr).tostring() == reverse_complement(seq)
+
+    buf = np.frombuffer('ACGT', dtype=np.uint8).copy()
+    complement_array(buf, out=buf)
+    assert buf.tostring() == 'TGCA'
+
+def test_counts():
+    counts = base_counts('AACGa')
+    assert counts[ord('A')] == 2
+    assert counts[ord('a')] == 1
+    assert count_bases('AACGa', 'Aa') == 3
+    assert gc_count('ACGTcgS') == 4
+
+def test_gc_content():
+    assert gc_content('CG') == 1
+    assert gc_content('CGTA') == 0.5
+    assert gc_content('ATG') == 1.0/3.0
+    assert gc_content(' gcta ') == 0.5
+
+def test_windowed_gc_content():
+    gc = windowed_gc_content('GGCCAATTGA', 4)
+    assert list(gc) == [1.0, 0.0]
+    gc = windowed_gc_content('GGCCAATTGA', 4, step=2)
+    assert list(gc) == [1.0, 0.5, 0.0, 0.25]
+    assert len(windowed_gc_content('GC', 4)) == 0
+
+def test_invalid_bases():
+    assert invalid_bases('ACGTRYN') == ''
+    assert invalid_bases('ACXGT1') == 'X1'
+    assert invalid_bases(u'ACXgt') == u'X'
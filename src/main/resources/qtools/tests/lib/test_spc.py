@@ -0,0 +1,56 @@
+from unittest import TestCase
+from qtools.lib.spc import *
+import numpy as np
+
+class TestMergeMoments(TestCase):
+    def test_merge(self):
+        values = np.array([3.0, 5.0, 4.0, 10.0, 2.0, 7.5, 6.0])
+        count, mean, sum_squares = merge_moments(0, 0.0, 0.0, values[:3])
+        count, mean, sum_squares = merge_moments(count, mean, sum_squares, [])
+        count, mean, sum_squares = merge_moments(count, mean, sum_squares, values[3:])
+        assert count == 7
+        assert np.allclose(mean, values.mean())
+        assert np.allclose(np.sqrt(sum_squares/count), values.std())
+
+class TestWesternElectricViolations(TestCase):
+    def test_beyond_3_sigma(self):
+        violations = western_electric_violations([0, 3.5, -0.5, -3.1], 0, 1)
+        assert (violations & RULE_BEYOND_3_SIGMA).tolist() == [0, 1, 0, 1]
+
+    def test_2_of_3(self):
+        violations = western_electric_violations([2.5, 0, 2.2, -2.5, 0, -2.5], 0, 1)
+        flagged = (violations & RULE_2_OF_3_BEYOND_2_SIGMA) > 0
+        # opposite sides do not count together
+        assert flagged.tolist() == [False, False, True, False, False, True]
+
+    def test_4_of_5(self):
+        violations = western_electric_violations([1.5, 1.5, 0, 1.5, 1.5, 0], 0, 1)
+        flagged = (violations & RULE_4_OF_5_BEYOND_1_SIGMA) > 0
+        assert flagged.tolist() == [False, False, False, False, True, False]
+
+    def test_8_same_side(self):
+        violations = western_electric_violations([0.5]*9+[-0.5], 0, 1)
+        flagged = (violations & RULE_8_SAME_SIDE) > 0
+        assert flagged.tolist() == [False]*7+[True, True, False]
+        assert describe_violations(violations[8]) == ['8 on one side']
+
+    def test_no_spread(self):
+        assert western_electric_violations([1, 1, 1], 1, 0).tolist() == [0, 0, 0]
+        assert len(western_electric_violations([], 0, 1)) == 0
+
+class TestBaseline(TestCase):
+    def test_baseline_params(self):
+        form_result = {'metric': ['well', 'accepted_event_count'], 'start_date': 'a', 'upper_yaxis': 3,
+                       'group_by_plate': True}
+        params = baseline_params(form_result)
+        assert params == {'metric': ['well', 'accepted_event_count'], 'group_by_plate': True}
+        assert baseline_key('reader', params) == baseline_key('reader', dict(params))
+        assert baseline_key('reader', params) != baseline_key('category', params)
+
+    def test_baseline_key_canonical(self):
+        params = {'metric': ['well', 'accepted_event_count'], 'exclude': ['b', 'a'], 'reader': None,
+                  'plate_name': ''}
+        equivalent = {'metric': ('well', 'accepted_event_count'), 'exclude': ['a', 'b']}
+        assert baseline_key('search', params) == baseline_key('search', equivalent)
+        assert baseline_key('search', params) != baseline_key('search', dict(equivalent, reader=3))
+        assert canonical_query_params(params) == {'metric': ['well', 'accepted_event_count'], 'exclude': ['a', 'b']}
@@ -0,0 +1,57 @@
+from qtools.lib.spectrum import WellSpectrumSource
+import numpy as np
+import os, tempfile, unittest
+
+class DictCache(dict):
+    def get(self, key, createfunc=None):
+        if key not in self:
+            self[key] = createfunc()
+        return self[key]
+
+class TestWellSpectrumSource(unittest.TestCase):
+    def setUp(self):
+        self.reads = 0
+        rate = 10000.0
+        t = np.arange(200000)/rate
+        self.samples = np.column_stack((1000+200*np.sin(2*np.pi*40*t),
+                                        1000+200*np.sin(2*np.pi*90*t)))
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def window_source(self, path):
+        self.reads += 1
+        samples = self.samples
+        def windows():
+            for start in range(0, len(samples), 3001):
+                yield samples[start:start+3001]
+        return 10000.0, 2, windows
+
+    def test_spectrum(self):
+        source = WellSpectrumSource(cache=DictCache(), downsample=5, segment_size=2048,
+                                    window_source=self.window_source)
+        spectrum = source.spectrum(self.path)
+        assert len(spectrum.channels) == 2
+        assert abs(spectrum.channels[0].peaks[1] - 40) < 1
+        assert abs(spectrum.channels[1].peaks[1] - 90) < 1
+
+        again = source.spectrum(self.path)
+        assert again is spectrum
+        assert self.reads == 1
+
+        # touching the file invalidates
+        os.utime(self.path, (0, 0))
+        source.spectrum(self.path)
+        assert self.reads == 2
+
+    def test_band(self):
+        source = WellSpectrumSource(downsample=5, segment_size=2048,
+                                    window_source=self.window_source, max_freq=60)
+        spectrum = source.spectrum(self.path)
+        freqs = spectrum.channels[1].freqs
+        assert 59 < freqs[-1] <= 60
+        assert len(spectrum.channels[1].amplitudes) == len(freqs)
+        # peaks are still found over the full spectrum
+        assert abs(spectrum.channels[1].peaks[1] - 90) < 1
@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta
+from qtools.lib.statsrollup import update_plate_run_stats, remove_plate_run_stats, backfill_run_stats
+from qtools.model import Session, Box2, Plate, QLBFile, QLBPlate, QLBWell, PlateRunStats, ReaderDayStats
+from qtools.model.util import delete_plate_recursive
+from qtools.tests import DatabaseTest
+
+class TestStatsRollup(DatabaseTest):
+    def setUp(self):
+        self.run_time = datetime(2011, 6, 7, 10, 0, 0)
+        self.box2 = Box2(name=u'RollupTest', code=u'rolluptest')
+        self.plate = Plate(name=u'RollupTest plate', box2=self.box2)
+        qlbfile = QLBFile(run_id='rollup_test', dirname='/tmp', basename='rollup_test.qlp',
+                          type='processed', mtime=self.run_time)
+        self.qlbplate = QLBPlate(file=qlbfile, plate=self.plate, host_datetime=self.run_time)
+        for idx, event_count in enumerate((20000, 500, 15000)):
+            wellfile = QLBFile(run_id='rollup_test_%s' % idx, dirname='/tmp', basename='rollup_test_%s.qlb' % idx,
+                               type='raw', mtime=self.run_time)
+            self.qlbplate.wells.append(QLBWell(file=wellfile, well_name='A0%s' % idx, event_count=event_count,
+                                               host_datetime=self.run_time+timedelta(minutes=5*idx)))
+        # wells without a file are not counted
+        self.qlbplate.wells.append(QLBWell(well_name='B01', event_count=9000, host_datetime=self.run_time))
+        Session.add_all([self.box2, self.plate, self.qlbplate])
+        Session.commit()
+
+    def tearDown(self):
+        Session.rollback()
+        Session.query(ReaderDayStats).filter_by(box2_id=self.box2.id).delete()
+        if self.qlbplate is None:
+            # deleted by the test
+            Session.delete(self.box2)
+            Session.commit()
+            return
+        Session.query(PlateRunStats).filter_by(qlbplate_id=self.qlbplate.id).delete()
+        for well in self.qlbplate.wells:
+            if well.file:
+                Session.delete(well.file)
+            Session.delete(well)
+        Session.delete(self.qlbplate.file)
+        Session.delete(self.qlbplate)
+        Session.delete(self.plate)
+        Session.delete(self.box2)
+        Session.commit()
+
+    def day_stats(self):
+        return Session.query(ReaderDayStats).filter_by(box2_id=self.box2.id).all()
+
+    def test_update(self):
+        stats = update_plate_run_stats(self.qlbplate)
+        Session.commit()
+        assert stats.wells == 3
+        assert stats.data_wells == 2
+        assert stats.events == 35500
+        assert stats.runtime_seconds == 600
+        assert stats.day == self.run_time.date()
+
+        days = self.day_stats()
+        assert len(days) == 1
+        assert (days[0].plates, days[0].wells, days[0].events) == (1, 3, 35500)
+
+        # moving the plate moves its day row
+        self.qlbplate.host_datetime = self.run_time+timedelta(days=1)
+        update_plate_run_stats(self.qlbplate)
+        Session.commit()
+        days = self.day_stats()
+        assert [day.day for day in days] == [self.run_time.date()+timedelta(days=1)]
+
+        remove_plate_run_stats(self.qlbplate)
+        Session.commit()
+        assert self.day_stats() == []
+
+    def test_delete_plate(self):
+        # delete_plate_recursive expects scanned wells
+        for well in [well for well in self.qlbplate.wells if not well.file]:
+            self.qlbplate.wells.remove(well)
+            Session.delete(well)
+        update_plate_run_stats(self.qlbplate)
+        Session.commit()
+        plate_id, qlbplate_id = self.plate.id, self.qlbplate.id
+        delete_plate_recursive(plate_id)
+        Session.commit()
+        assert Session.query(PlateRunStats).filter_by(qlbplate_id=qlbplate_id).count() == 0
+        assert self.day_stats() == []
+        self.plate = self.qlbplate = None
+
+    def test_backfill(self):
+        assert backfill_run_stats() >= 1
+        Session.commit()
+        stats = Session.query(PlateRunStats).filter_by(qlbplate_id=self.qlbplate.id).one()
+        assert (stats.wells, stats.data_wells, stats.events) == (3, 2, 35500)
+        days = self.day_stats()
+        assert len(days) == 1
+        assert days[0].runtime_seconds == 600
@@ -0,0 +1,38 @@
+from unittest import TestCase
+from qtools.lib.trendquery import QueryResultCache
+import time
+
+class TestQueryResultCache(TestCase):
+    def setUp(self):
+        self.calls = 0
+
+    def compute(self, value):
+        def createfunc():
+            self.calls += 1
+            return value
+        return createfunc
+
+    def test_get(self):
+        cache = QueryResultCache()
+        assert cache.get('a', self.compute(1)) == 1
+        assert cache.get('a', self.compute(2)) == 1
+        assert self.calls == 1
+
+        cache.invalidate()
+        assert cache.get('a', self.compute(2)) == 2
+        assert self.calls == 2
+
+    def test_lru(self):
+        cache = QueryResultCache(size=2)
+        cache.get('a', self.compute(1))
+        cache.get('b', self.compute(2))
+        cache.get('a', self.compute(1))
+        cache.get('c', self.compute(3))
+        assert cache.get('a', self.compute(4)) == 1
+        assert cache.get('b', self.compute(5)) == 5
+
+    def test_ttl(self):
+        cache = QueryResultCache(ttl=0.01)
+        cache.get('a', self.compute(1))
+        time.sleep(0.02)
+        assert cache.get('a', self.compute(2)) == 2
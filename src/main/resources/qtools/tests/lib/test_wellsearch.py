@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+from qtools.lib.wellsearch import search_criteria, windowed_results, directory_ordered_well_query, group_by_directory, distinct_values
+from qtools.model import Session, QLBFile, QLBWell
+from qtools.tests import DatabaseTest
+from sqlalchemy.orm import contains_eager
+
+class TestWellSearch(DatabaseTest):
+    def setUp(self):
+        self.files = []
+        self.wells = []
+        for idx, (dirname, day) in enumerate((('wellsearch_a', 5), ('wellsearch_b', 1), ('wellsearch_c', 3))):
+            for well_idx, well_name in enumerate(('B01', 'A01', 'C01')):
+                qlbfile = QLBFile(run_id='wellsearch_%s_%s' % (idx, well_idx), dirname=dirname,
+                                  basename='%s.qlb' % well_name, type='raw', mtime=datetime.now())
+                well = QLBWell(file=qlbfile, well_name=well_name,
+                               sample_name=u'WellSearch' if well_name != 'C01' else u'WellSearch NTC',
+                               host_datetime=datetime(2012, 1, day, 10)+timedelta(minutes=well_idx))
+                self.files.append(qlbfile)
+                self.wells.append(well)
+                Session.add(well)
+        Session.commit()
+
+    def tearDown(self):
+        for well in self.wells:
+            Session.delete(well)
+        for qlbfile in self.files:
+            Session.delete(qlbfile)
+        Session.commit()
+
+    def __search(self, descending, window_size=500):
+        form_result = {'conditions': [{'field': QLBWell.__table__.c.sample_name, 'compare': '__eq__', 'value': u'WellSearch'}],
+                       'order_by': QLBWell.__table__.c.host_datetime,
+                       'return_fields': [QLBFile.__table__.c.basename]}
+        criterion, labels, label_names = search_criteria(form_result, {'qlbfile.basename': 'File Name'})
+        assert label_names == ['sample_name', 'host_datetime', 'File Name']
+        query, ordering = directory_ordered_well_query(Session.query(QLBWell, *labels).join(QLBFile),
+                                                       criterion, form_result['order_by'], descending=descending)
+        return list(group_by_directory(windowed_results(query.options(contains_eager(QLBWell.file)), ordering,
+                                                        window_size=window_size)))
+
+    def test_directory_order(self):
+        groups = self.__search(False)
+        assert [dirname for dirname, rows in groups] == ['wellsearch_b', 'wellsearch_c', 'wellsearch_a']
+        assert [row[0].well_name for row in groups[0][1]] == ['A01', 'B01']
+        assert [row[3] for row in groups[0][1]] == ['A01.qlb', 'B01.qlb']
+
+        groups = self.__search(True)
+        assert [dirname for dirname, rows in groups] == ['wellsearch_a', 'wellsearch_c', 'wellsearch_b']
+
+    def test_windows(self):
+        for descending in (False, True):
+            groups = self.__search(descending)
+            assert self.__search(descending, window_size=1) == groups
+            assert self.__search(descending, window_size=2) == groups
+
+    def test_null_keys(self):
+        # NULL sort values come first ascending, last descending
+        self.wells[0].host_datetime = None
+        Session.commit()
+        query = Session.query(QLBWell.id, QLBWell.host_datetime).filter(QLBWell.id.in_([well.id for well in self.wells]))
+        for descending in (False, True):
+            rows = list(windowed_results(query, [(QLBWell.host_datetime, descending), (QLBWell.id, False)], window_size=2))
+            assert sorted(rows) == sorted(query.all())
+            assert rows == list(windowed_results(query, [(QLBWell.host_datetime, descending), (QLBWell.id, False)]))
+
+    def test_distinct_values(self):
+        values = distinct_values(QLBWell.sample_name)
+        assert u'WellSearch' in values
+        assert None not in values
+        assert values == sorted(values)
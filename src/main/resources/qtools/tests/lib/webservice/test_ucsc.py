@@ -220,6 +220,22 @@ def test_get_sequence_range():
     seq = get_sequence_range('22', 34304505, 34304954)
     assert TEST_FWD_PRIMER[2:] in seq.sequence
 
+def test_get_sequence_ranges():
+    seqs = get_sequence_ranges([('22', 34304505, 34304954), ('M', 10499, 16594), ('22d', 1, 10)])
+    assert TEST_FWD_PRIMER[2:] in seqs[0].sequence
+    assert (seqs[1].start, seqs[1].end) == (10499, 16571)
+    assert seqs[2] is None
+
+def test_table_sequences_request_process():
+    response = """>hg19_ct_UserTrack_3545_1 range=chr22:11-20 5'pad=0 3'pad=0 strand=+ repeatMasking=none
+ACGTACGTAC
+>hg19_ct_UserTrack_3545_2 range=chrM:1-4 5'pad=0 3'pad=0 strand=+ repeatMasking=none
+GATC
+"""
+    seqs = table_sequences_request_process(response)
+    assert [(seq.chromosome, seq.start, seq.end, seq.sequence) for seq in seqs] == \
+        [('22', 11, 20, 'ACGTACGTAC'), ('M', 1, 4, 'GATC')]
+
 def test_table_snp_request():
     session = get_ucsc_session()
     snps = table_snp_request('22', 34304505, 34304954, session).strip()
@@ -330,6 +346,14 @@ def test_sequences_for_primers_padded():
     # overshoots end by 23 bases
     assert full_seq.sequence.find(reverse_complement(CHRM_OVERSHOOT_REV_PRIMER)) == 6073 - (3000 - 23) - len(CHRM_OVERSHOOT_REV_PRIMER)
 
+def test_sequences_for_primer_pairs_padded():
+    source = UCSCSequenceSource()
+    pairs = source.sequences_for_primer_pairs([(TEST_FWD_PRIMER, TEST_REV_PRIMER),
+                                               (CHRM_OVERSHOOT_FWD_PRIMER, CHRM_OVERSHOOT_REV_PRIMER)], 500, 500)
+    assert [len(pair) for pair in pairs] == [1, 1]
+    assert (pairs[0][0].start, pairs[0][0].end) == (34304005, 34305454)
+    assert (pairs[1][0].start, pairs[1][0].end) == (10499, 16571)
+
 def test_sequence_around_loc():
     source = UCSCSequenceSource()
     assert source.session.hgsid is not None
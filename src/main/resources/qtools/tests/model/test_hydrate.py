@@ -0,0 +1,105 @@
+from unittest import TestCase
+from qtools.lib.bio import reverse_complement
+from qtools.lib.ispcr import GenomeIndex, LocalPCRSequenceSource
+from qtools.model import Session
+from qtools.model.sequence import Sequence, SequenceGroup, AmpliconSequenceCache
+from qtools.model.sequence.hydrate import *
+import numpy as np
+
+def random_sequence(length, seed):
+    return ''.join(np.random.RandomState(seed).choice(list('ACGT'), length))
+
+class CountingSequenceSource(LocalPCRSequenceSource):
+    def __init__(self, *args, **kwargs):
+        super(CountingSequenceSource, self).__init__(*args, **kwargs)
+        self.fetches = []
+
+    def sequences(self, ranges):
+        self.fetches.append(ranges)
+        return super(CountingSequenceSource, self).sequences(ranges)
+
+class SNPSource(object):
+    def __init__(self, snps):
+        self.snps = snps
+        self.queries = []
+
+    def snps_in_chrom_ranges(self, chrom, ranges):
+        self.queries.append((chrom, ranges))
+        return [snp for snp in self.snps if snp['chrom'] == 'chr%s' % chrom]
+
+def snp(chrom, start, end, name):
+    return dict(bin=0, chrom='chr%s' % chrom, chromStart=start, chromEnd=end, name=name,
+                score=0, strand='+', refNCBI='A', refUCSC='A', observed='A/G', molType='genomic',
+                **{'class': 'single', 'valid': '', 'avHet': 0, 'avHetSE': 0, 'func': '', 'locType': 'exact', 'weight': 1})
+
+class TestAmpliconCacheHydrator(TestCase):
+    def setUp(self):
+        self.chr1 = random_sequence(20000, 4)
+        self.chr2 = random_sequence(5000, 5)
+        self.source = CountingSequenceSource(GenomeIndex([('1', self.chr1), ('2', self.chr2)]))
+        self.pairs = [(self.chr1[5000:5020], reverse_complement(self.chr1[5200:5220])),
+                      (self.chr1[5100:5120], reverse_complement(self.chr1[5400:5420])),
+                      (self.chr2[4700:4720], reverse_complement(self.chr2[4880:4900]))]
+
+    def tearDown(self):
+        Session.remove()
+
+    def test_hydrate(self):
+        hydrator = AmpliconCacheHydrator(self.source, padding=1000)
+        requests = [hydrator.add_primer_pair(SequenceGroup(kit_type=SequenceGroup.TYPE_DESIGNED),
+                                             Sequence(sequence=fwd), Sequence(sequence=rev))
+                        for fwd, rev in self.pairs]
+        location = hydrator.add_location(SequenceGroup(kit_type=SequenceGroup.TYPE_LOCATION), '1', 7000, 7000, 60)
+        amplicons = hydrator.hydrate()
+        assert len(amplicons) == 4
+        # the windows around the first two pairs and the location merge
+        assert self.source.fetches == [[('1', 4001, 8059), ('2', 3701, 5900)]]
+
+        for request, (fwd, rev) in zip(requests, self.pairs):
+            expected = self.source.sequences_for_primers(fwd, rev, 1000, 1000)
+            cached = request.amplicons[0].cached_sequences
+            assert [cs.positive_sequence for cs in cached] == [seq.merged_positive_sequence.sequence for seq in expected]
+            assert [(cs.start_pos, cs.end_pos, cs.seq_padding_pos5, cs.seq_padding_pos3) for cs in cached] == \
+                   [(seq.amplicon.start, seq.amplicon.end, len(seq.left_padding), len(seq.right_padding or '')) for seq in expected]
+
+        expected = self.source.sequence_around_loc('1', 7000, 60, 1000, 1000)
+        cached = location.amplicons[0].cached_sequences[0]
+        assert cached.positive_sequence == expected.merged_positive_sequence.sequence
+        assert (cached.start_pos, cached.end_pos) == (6941, 7059)
+
+    def test_errors(self):
+        hydrator = AmpliconCacheHydrator(self.source, padding=1000)
+        unknown = hydrator.add_location(SequenceGroup(kit_type=SequenceGroup.TYPE_LOCATION), '3', 7000, 7000, 60)
+        too_wide = hydrator.add_location(SequenceGroup(kit_type=SequenceGroup.TYPE_LOCATION), '1', 7000, 7100, 60)
+        known = hydrator.add_location(SequenceGroup(kit_type=SequenceGroup.TYPE_LOCATION), '1', 7000, 7000, 60)
+        hydrator.hydrate()
+        assert unknown.error and not unknown.amplicons
+        assert too_wide.error and not too_wide.amplicons
+        assert known.error is None and len(known.amplicons) == 1
+
+    def test_primer_error(self):
+        hydrator = AmpliconCacheHydrator(self.source, padding=1000)
+        fwd, rev = self.pairs[0]
+        # too short to seed: fails the bulk match, and then only its own request
+        short = hydrator.add_primer_pair(SequenceGroup(kit_type=SequenceGroup.TYPE_DESIGNED),
+                                         Sequence(sequence=fwd[:8]), Sequence(sequence=rev))
+        good = hydrator.add_primer_pair(SequenceGroup(kit_type=SequenceGroup.TYPE_DESIGNED),
+                                        Sequence(sequence=fwd), Sequence(sequence=rev))
+        hydrator.hydrate()
+        assert short.error and not short.amplicons
+        assert good.error is None and len(good.amplicons) == 1
+
+class TestHydrateSNPs(TestCase):
+    def tearDown(self):
+        Session.remove()
+
+    def test_hydrate_snps(self):
+        cached = [AmpliconSequenceCache(chromosome='1', start_pos=1000, end_pos=1100, seq_padding_pos5=100, seq_padding_pos3=100),
+                  AmpliconSequenceCache(chromosome='1', start_pos=1150, end_pos=1250, seq_padding_pos5=0, seq_padding_pos3=0),
+                  AmpliconSequenceCache(chromosome='2', start_pos=1000, end_pos=1100, seq_padding_pos5=0, seq_padding_pos3=0)]
+        source = SNPSource([snp('1', 899, 900, 'a'), snp('1', 1199, 1200, 'b'), snp('1', 1250, 1251, 'c'),
+                            snp('1', 1300, 1301, 'd'), snp('2', 1049, 1050, 'e'), snp('2', 1000, 1000, 'f')])
+        db_snps = hydrate_snps(cached, source, 'snp131')
+        assert len(db_snps) == 6
+        assert [[s.name for s in cs.snps] for cs in cached] == [['a', 'b'], ['b', 'c'], ['e', 'f']]
+        assert source.queries == [('1', [(900, 1250)]), ('2', [(1000, 1100)])]
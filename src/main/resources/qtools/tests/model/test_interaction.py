@@ -0,0 +1,83 @@
+from unittest import TestCase
+from qtools.tests import DatabaseTest
+from qtools.lib.bio import maximal_binding_seq
+from qtools.model import Session
+from qtools.model.sequence import Sequence, SequenceGroup, SequenceGroupComponent
+from qtools.model.sequence.interaction import *
+from qtools.model.sequence.interaction import OligoInteractionCache
+import random
+
+FP, RP, PROBE = SequenceGroupComponent.FORWARD_PRIMER, SequenceGroupComponent.REVERSE_PRIMER, SequenceGroupComponent.PROBE
+
+class TestComputeOligoInteractions(TestCase):
+    def setUp(self):
+        rand = random.Random(50)
+        self.groups = []
+        for i in range(20):
+            oligos = []
+            for role in (FP, FP, RP, PROBE):
+                length = rand.randint(15, 30)
+                oligos.append((len(oligos), role, ''.join([rand.choice('ACGT') for j in range(length)])))
+            self.groups.append(oligos)
+        # unknown sequence
+        self.groups[3][1] = (1, FP, None)
+
+    def test_matrix(self):
+        interactions = compute_oligo_interactions(self.groups)
+        for oligos, inter in zip(self.groups, interactions):
+            for key1, role1, seq1 in oligos:
+                for key2, role2, seq2 in oligos:
+                    if seq1 and seq2:
+                        assert inter.overlap(key1, key2) == maximal_binding_seq(seq1, seq2)
+                    else:
+                        assert inter.overlap(key1, key2) is None
+
+    def test_overlaps(self):
+        oligos = self.groups[0]
+        inter = compute_oligo_interactions([oligos])[0]
+        expected = [((0, 2), maximal_binding_seq(oligos[0][2], oligos[2][2])),
+                    ((1, 2), maximal_binding_seq(oligos[1][2], oligos[2][2])),
+                    ((0, 3), maximal_binding_seq(oligos[0][2], oligos[3][2])),
+                    ((1, 3), maximal_binding_seq(oligos[1][2], oligos[3][2])),
+                    ((2, 3), maximal_binding_seq(oligos[2][2], oligos[3][2]))]
+        assert inter.overlaps == expected
+        assert inter.max_overlap == sorted(expected, key=lambda tup: tup[1][0])[-1]
+        assert compute_oligo_interactions([[]])[0].max_overlap is None
+
+class TestSequenceGroupOverlaps(TestCase):
+    def test_unsaved(self):
+        fp = SequenceGroupComponent(role=FP, sequence=Sequence(sequence='TACGGAAAGCT'))
+        rp = SequenceGroupComponent(role=RP, sequence=Sequence(sequence='CTTTCCGTA'))
+        probe = SequenceGroupComponent(role=PROBE)
+        group = SequenceGroup(forward_primers=[fp], reverse_primers=[rp], probes=[probe])
+        assert group.oligo_overlaps == [((fp, rp), maximal_binding_seq('TACGGAAAGCT', 'CTTTCCGTA'))]
+        assert group.max_oligo_overlap == ((fp, rp), (9, (0, 0)))
+        assert group.oligo_interactions.overlap(fp, probe) is None
+
+class TestOligoInteractionCache(DatabaseTest):
+    def setUp(self):
+        self.group = SequenceGroup(name=u'dimer', forward_primers=[SequenceGroupComponent(role=FP, sequence=Sequence(sequence='TACGGAAAGCT'))],
+                                   reverse_primers=[SequenceGroupComponent(role=RP, sequence=Sequence(sequence='CTTTCCGTA'))])
+        Session.add(self.group)
+        Session.commit()
+        self.cache = OligoInteractionCache()
+
+    def tearDown(self):
+        for component in self.group.forward_primers+self.group.reverse_primers:
+            Session.delete(component.sequence)
+            Session.delete(component)
+        Session.delete(self.group)
+        Session.commit()
+
+    def test_get_many(self):
+        first = self.cache.get_many([self.group.id])[self.group.id]
+        assert first.max_overlap[1] == (9, (0, 0))
+        assert self.cache.get_many([self.group.id])[self.group.id] is first
+
+        # a change committed anywhere shows up on the next lookup
+        Session.execute(Sequence.__table__.update().where(Sequence.id == self.group.forward_primers[0].sequence_id)\
+                                          .values(sequence='AAAAAAAA'))
+        Session.commit()
+        changed = self.cache.get_many([self.group.id])[self.group.id]
+        assert changed is not first
+        assert changed.max_overlap[1] == maximal_binding_seq('AAAAAAAA', 'CTTTCCGTA')
@@ -11,4 +11,21 @@ def test_excise_well_name():
     assert f('i01') == 'i01'
     
     assert f('Gaming PlateA01') == 'Gaming Plate'
-    assert f('Super A01Gaming Plate') == 'Super Gaming Plate'
\ No newline at end of file
+    assert f('Super A01Gaming Plate') == 'Super Gaming Plate'
+def test_snp_index():
+    from qtools.model.sequence import AmpliconSequenceCache, SNPDBCache
+    seq = AmpliconSequenceCache(chromosome='1', start_pos=100, end_pos=200, seq_padding_pos5=0, seq_padding_pos3=0)
+    seq.snps.append(SNPDBCache(chromStart=150, chromEnd=151))
+    index = seq.snp_index
+    assert len(seq.snps_in_range()) == 1
+    assert seq.snp_index is index
+
+    seq.snps.append(SNPDBCache(chromStart=160, chromEnd=161))
+    assert len(seq.snps_in_range()) == 2
+
+    seq.snps[0].chromStart = 500
+    seq.snps[0].chromEnd = 501
+    assert len(seq.snps_in_range()) == 1
+
+    seq.snps.remove(seq.snps[1])
+    assert len(seq.snps_in_range()) == 0
@@ -6,9 +6,11 @@ from qtools.constants.job import *
 from qtools.constants.pcr import *
 from qtools.components.manager import get_manager
 from qtools.messages import JSONMessage, JSONErrorMessage
+from qtools.lib.ispcr import configured_sequence_source
 from qtools.messages.sequence import *
 from qtools.model.meta import Session
 from qtools.model.sequence import Sequence, SequenceGroup, SequenceGroupComponent, Amplicon, AmpliconSequenceCache
+from qtools.model.sequence.hydrate import AmpliconCacheHydrator
 from qtools.model.sequence.pcr import create_amplicons_from_pcr_sequences, create_db_transcripts_from_pcr_transcripts
 from qtools.workers import LogExcRepeatedThread, PasterLikeProcess, PasterDaemonContextProcess
 
@@ -97,12 +99,14 @@ def process_amplicon_job(job_queue, sequence_source, dg_calc):
                                               JOB_ID_PROCESS_LOCATION_AMPLICON,
                                               JOB_ID_PROCESS_SNP_AMPLICON,
                                               JOB_ID_PROCESS_GEX_TAQMAN_TRANSCRIPT))
+    # taqman and location amplicons are fetched together
+    batch = [job for job in remaining if job.type in (JOB_ID_PROCESS_TAQMAN_AMPLICON,
+                                                      JOB_ID_PROCESS_LOCATION_AMPLICON)]
+    if batch:
+        process_amplicon_batch(batch, job_queue, sequence_source, dg_calc)
+
     for job in remaining:
-        if job.type == JOB_ID_PROCESS_TAQMAN_AMPLICON:
-            process_taqman_job(job, job_queue, sequence_source, dg_calc)
-        elif job.type == JOB_ID_PROCESS_LOCATION_AMPLICON:
-            process_location_job(job, job_queue, sequence_source, dg_calc)
-        elif job.type == JOB_ID_PROCESS_SNP_AMPLICON:
+        if job.type == JOB_ID_PROCESS_SNP_AMPLICON:
             process_snp_job(job, job_queue, sequence_source, dg_calc)
         elif job.type == JOB_ID_PROCESS_GEX_TAQMAN_TRANSCRIPT:
             process_transcript_job(job, job_queue, sequence_source, dg_calc)
@@ -121,52 +125,73 @@ def populate_transcript_dgs(transcript, dg_calc):
     transcript.folding_dg = dg_calc.delta_g(transcript.positive_sequence)
 
 
-def process_taqman_job(job, job_queue, sequence_source, dg_calc):
+def process_amplicon_batch(jobs, job_queue, sequence_source, dg_calc):
+    """
+    Process a batch of taqman and location amplicon jobs, fetching
+    the padded sequences of all their amplicons in bulk (see
+    qtools.model.sequence.hydrate).  Each job whose amplicons could not
+    be created is aborted with its own error; the rest go ahead.
+    """
     logger = logging.getLogger(LOGGER_NAME)
 
-    struct            = JSONMessage.unserialize(job.input_message)
-    forward_primer_id = struct.forward_primer_id
-    reverse_primer_id = struct.reverse_primer_id
-    probe_ids         = struct.probe_ids
+    hydrator = AmpliconCacheHydrator(sequence_source, padding=MAX_CACHE_PADDING)
+    job_requests = []
+    for job in jobs:
+        try:
+            struct = JSONMessage.unserialize(job.input_message)
+            sequence_group = Session.query(SequenceGroup).get(struct.sequence_group_id)
+            if job.type == JOB_ID_PROCESS_TAQMAN_AMPLICON:
+                fp_sequence = Session.query(SequenceGroupComponent).get(struct.forward_primer_id).sequence
+                rp_sequence = Session.query(SequenceGroupComponent).get(struct.reverse_primer_id).sequence
+                probes      = Session.query(SequenceGroupComponent).filter(SequenceGroupComponent.id.in_(struct.probe_ids)).all()
+                request = hydrator.add_primer_pair(sequence_group, fp_sequence, rp_sequence,
+                                                   probes=[p.sequence for p in probes])
+            else:
+                request = hydrator.add_location(sequence_group, sequence_group.location_chromosome,
+                                                sequence_group.location_base, sequence_group.location_base,
+                                                sequence_group.amplicon_length)
+        except Exception:
+            logger.exception("Could not read amplicon job [job %s]: " % job.id)
+            job_queue.abort(job, JSONErrorMessage('Could not read the amplicon job.'))
+            continue
+        job_requests.append((job, request))
+
+    if not job_requests:
+        Session.commit()
+        return
+    jobs = [job for job, request in job_requests]
 
-    sequence_group    = Session.query(SequenceGroup).get(struct.sequence_group_id)
-    fp_sequence       = Session.query(SequenceGroupComponent).get(forward_primer_id).sequence
-    rp_sequence       = Session.query(SequenceGroupComponent).get(reverse_primer_id).sequence
-    probes            = Session.query(SequenceGroupComponent).filter(SequenceGroupComponent.id.in_(probe_ids)).all()
-    probe_seqs        = [p.sequence for p in probes]
-    
-    sequences = sequence_source.sequences_for_primers(fp_sequence.sequence, rp_sequence.sequence,
-                                                      fwd_prefix_length=MAX_CACHE_PADDING,
-                                                      rev_suffix_length=MAX_CACHE_PADDING)
-    
-    if sequences is None:
-        logger.error("Amplicon TaqMan: Could not get response from server [job %s]" % job.id)
-        job_queue.abort(job, JSONErrorMessage('Could not get response from server.'))
+    try:
+        hydrator.hydrate()
+    except Exception:
+        logger.exception("Could not retrieve amplicon sequences [jobs %s]: " % ', '.join([str(job.id) for job in jobs]))
+        Session.rollback()
+        for job in jobs:
+            job_queue.abort(job, JSONErrorMessage('Could not retrieve the sequences for the amplicons.'))
         Session.commit()
         return
-    
-    amplicons = create_amplicons_from_pcr_sequences(sequence_group,
-                                                    forward_primer=fp_sequence,
-                                                    reverse_primer=rp_sequence,
-                                                    probes=probe_seqs,
-                                                    pcr_sequences=sequences)
-    
-    for amp in amplicons:
-        populate_amplicon_dgs(amp, dg_calc)
-    
-    logger.info("Taqman job completed [job %s]" % job.id)
+
+    for job, request in job_requests:
+        if request.error:
+            logger.error("Amplicon: %s [job %s]" % (request.error, job.id))
+            job_queue.abort(job, JSONErrorMessage(request.error))
+        else:
+            for amp in request.amplicons:
+                populate_amplicon_dgs(amp, dg_calc)
     Session.commit()
-    
-    # TODO: add finish message
-    
-    # now add SNPs to cached sequences
-    for amp in amplicons:
-        for cseq in amp.cached_sequences:
-            job_queue.add(JOB_ID_PROCESS_SNPS, ProcessSNPMessage(cached_sequence_id=cseq.id),
-                          parent_job=job.parent)
-    
-    # avoid condition where job completed -- clear child job first
-    job_queue.finish(job, None)
+
+    for job, request in job_requests:
+        if request.error:
+            continue
+        logger.info("Amplicon job completed [job %s]" % job.id)
+        # now add SNPs to cached sequences
+        for amp in request.amplicons:
+            for cseq in amp.cached_sequences:
+                job_queue.add(JOB_ID_PROCESS_SNPS, ProcessSNPMessage(cached_sequence_id=cseq.id),
+                              parent_job=job.parent)
+
+        # avoid condition where job completed -- clear child job first
+        job_queue.finish(job, None)
 
 def process_transcript_job(job, job_queue, sequence_source, dg_calc):
     logger = logging.getLogger(LOGGER_NAME)
@@ -211,48 +236,6 @@ def process_transcript_job(job, job_queue, sequence_source, dg_calc):
     job_queue.finish(job, None)
 
 
-def process_location_job(job, job_queue, sequence_source, dg_calc):
-    logger = logging.getLogger(LOGGER_NAME)
-
-    struct         = JSONMessage.unserialize(job.input_message)
-    
-    sequence_group = Session.query(SequenceGroup).get(struct.sequence_group_id)
-    sequence = None
-    try:
-        sequence = sequence_source.sequence_around_loc(sequence_group.location_chromosome,
-                                                        sequence_group.location_base,
-                                                        sequence_group.amplicon_length,
-                                                        prefix_length=MAX_CACHE_PADDING,
-                                                        suffix_length=MAX_CACHE_PADDING)
-    except Exception:
-        logger.exception("Could not retrieve sequence for assay location [job %s]: " % job.id)
-        job_queue.abort(job, JSONErrorMessage('Could not retrieve the sequence for the specified amplicon location.'))
-        Session.commit()
-        return
-    
-    if sequence is None:
-        logger.error("Amplicon Location: could not get response from server [job %s]: " % job.id)
-        job_queue.abort(job, JSONErrorMessage('Could not get response from server.'))
-        Session.commit()
-        return
-    
-    amplicons = create_amplicons_from_pcr_sequences(sequence_group,
-                                                    pcr_sequences=[sequence])
-    
-    for amp in amplicons:
-        populate_amplicon_dgs(amp, dg_calc)
-    
-    logger.info("Location job completed [job %s]" % job.id)
-    Session.commit()
-
-    for amp in amplicons:
-        for cseq in amp.cached_sequences:
-            job_queue.add(JOB_ID_PROCESS_SNPS, ProcessSNPMessage(cached_sequence_id=cseq.id),
-                          parent_job=job.parent)
-    
-    job_queue.finish(job, None)
-
-
 def process_snp_job(job, job_queue, sequence_source, dg_calc):
     logger = logging.getLogger(LOGGER_NAME)
 
@@ -301,7 +284,7 @@ class AmpliconWorker(PasterDaemonContextProcess):
 
         mgr                  = get_manager(config_path)
         jobqueue             = mgr.jobqueue()
-        sequence_source      = mgr.sequence_source()
+        sequence_source      = configured_sequence_source(mgr.pylons_config, mgr.sequence_source)
         tm_calc = mgr.tm_calc(mgr)
         dg_calc = mgr.dg_calc(mgr)
 
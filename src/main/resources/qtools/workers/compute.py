@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+"""
+    This worker serves compute RPC requests (rpc_queue) from the Java side
+    of the application with a pool of warm Python worker processes.
+
+    See qtools.lib.compute for the request format and available commands.
+"""
+import logging
+from threading import Thread
+
+from qtools.components.manager import get_manager
+from qtools.lib.compute import ComputeServer, PikaRPCTransport, DEFAULT_QUEUE_NAME, DEFAULT_TIMEOUT
+from qtools.workers import PasterLikeProcess, PasterDaemonContextProcess
+
+LOGGER_NAME = 'worker.compute'
+
+def serve(config, logger):
+    processes = config.get('qtools.compute.processes', None)
+    prefetch = config.get('qtools.compute.prefetch', None)
+    transport = PikaRPCTransport(host=config.get('qtools.compute.amqp_host', 'localhost'),
+                                 queue=config.get('qtools.compute.queue', DEFAULT_QUEUE_NAME))
+    server = ComputeServer(transport,
+                           processes=int(processes) if processes else None,
+                           prefetch=int(prefetch) if prefetch else None,
+                           timeout=float(config.get('qtools.compute.timeout', DEFAULT_TIMEOUT)),
+                           config=dict([(k, v) for k, v in config.items() if k.startswith('qtools.')]))
+    server.start()
+    logger.info("Compute server started with %s processes, prefetch %s" % (server.processes, server.prefetch))
+    try:
+        server.serve_forever()
+    finally:
+        server.stop()
+
+
+class ComputeWorker(PasterDaemonContextProcess):
+    def run(self, config_path, as_daemon=False):
+        mgr    = get_manager(config_path)
+        logger = logging.getLogger(LOGGER_NAME)
+
+        # the pika connection is created and used entirely on this thread
+        server_thread = Thread(target=serve, args=(mgr.pylons_config, logger))
+        if as_daemon:
+            server_thread.daemon = True
+        server_thread.start()
+
+if __name__ == "__main__":
+    worker = PasterLikeProcess('compute.pid')
+    worker.run(ComputeWorker)
@@ -8,11 +8,48 @@ from qtools.messages import JSONMessage, JSONErrorMessage
 from qtools.messages.sequence import ProcessSNPAmpliconMessage
 from qtools.model.meta import Session
 from qtools.model.sequence import SNPDBCache, AmpliconSequenceCache, SequenceGroup, Transcript
+from qtools.model.sequence.hydrate import hydrate_snps
 from qtools.model.sequence.util import snp_objects_from_extdb
 from qtools.workers import LogExcRepeatedThread, PasterLikeProcess, PasterDaemonContextProcess
 
 LOGGER_NAME = 'worker.snp'
 
+def process_amplicon_snp_jobs(jobs, job_queue, snp_source, snp_table):
+    """
+    Add the SNPs of the cached sequences of a batch of amplicon SNP jobs,
+    with one SNP query per chromosome (see qtools.model.sequence.hydrate)
+    """
+    logger = logging.getLogger(LOGGER_NAME)
+
+    job_sequences = []
+    for job in jobs:
+        struct             = JSONMessage.unserialize(job.input_message)
+        cached_sequence_id = struct.cached_sequence_id
+        cached_seq         = Session.query(AmpliconSequenceCache).get(cached_sequence_id)
+        if not cached_seq:
+            logger.error("SNP job: Unknown amplicon sequence id: %s [job %s]" % (cached_sequence_id, job.id))
+            job_queue.abort(job, JSONErrorMessage("Unknown amplicon sequence id: %s" % cached_sequence_id))
+            continue
+        job_sequences.append((job, cached_seq))
+
+    if not job_sequences:
+        return
+
+    try:
+        hydrate_snps([cached_seq for job, cached_seq in job_sequences], snp_source, snp_table)
+    except Exception:
+        # DB timeout: abort jobs.
+        logger.exception("Error from SNP worker:")
+        Session.rollback()
+        for job, cached_seq in job_sequences:
+            job_queue.abort(job, JSONErrorMessage("Unable to connect to SNP database."))
+        return
+
+    Session.commit()
+    for job, cached_seq in job_sequences:
+        logger.info("SNP process job finished [job %s]" % job.id)
+        job_queue.finish(job, None)
+
 def process_snp_job(job_queue, snp_source, snp_table):
     logger = logging.getLogger(LOGGER_NAME)
 
@@ -21,37 +58,15 @@ def process_snp_job(job_queue, snp_source, snp_table):
         job_queue.finish_tree(job, None)
     
     remaining = job_queue.remaining(job_type=(JOB_ID_PROCESS_SNPS, JOB_ID_PROCESS_SNP_RSID, JOB_ID_PROCESS_GEX_SNPS))
+    amplicon_jobs = [job for job in remaining if job.type == JOB_ID_PROCESS_SNPS]
+    if amplicon_jobs:
+        process_amplicon_snp_jobs(amplicon_jobs, job_queue, snp_source, snp_table)
+
     for job in remaining:
         if job.type == JOB_ID_PROCESS_SNPS:
-            snps               = []
-            struct             = JSONMessage.unserialize(job.input_message)
-            cached_sequence_id = struct.cached_sequence_id
-            cached_seq         = Session.query(AmpliconSequenceCache).get(cached_sequence_id)
-            if not cached_seq:
-                logger.error("SNP job: Unknown amplicon sequence id: %s [job %s]" % (cached_sequence_id, job.id))
-                job_queue.abort(job, JSONErrorMessage("Unknown amplicon sequence id: %s" % cached_sequence_id))
-            
-            try:
-                snps = snp_source.snps_in_range(cached_seq.chromosome,
-                                                cached_seq.start_pos-cached_seq.seq_padding_pos5,
-                                                cached_seq.end_pos+cached_seq.seq_padding_pos3)
-            except Exception:
-                # DB timeout: abort job.
-                logger.exception("Error from SNP worker:")
-                job_queue.abort(job, JSONErrorMessage("Unable to connect to SNP database."))
-                continue
-            
-            if snps:
-                db_snps = snp_objects_from_extdb(snps, snp_table)
-                if not cached_seq.snps:
-                    cached_seq.snps = []
-                for snp in db_snps:
-                    cached_seq.snps.append(snp)
-            
-            logger.info("SNP process job finished [job %s]" % job.id)
-            Session.commit()
-            job_queue.finish(job, None)
-        
+            # done in bulk, above
+            continue
+
         elif job.type == JOB_ID_PROCESS_GEX_SNPS:
             snps = []
             struct = JSONMessage.unserialize(job.input_message)